@@ -5,6 +5,7 @@ from markupsafe import Markup, escape
 from database import init_database, get_notes, get_note_count, get_sources, verify_user, update_password, get_note_by_id, update_note, delete_note, DATA_DIR
 from config import load_webdav_config, load_viewer_config, save_viewer_config
 from bot.storage.webdav_client import WebDAVClient, StorageManager
+from bot.utils.magnet import iter_magnets, parse_magnet
 import math
 import requests
 
@@ -91,14 +92,7 @@ def extract_all_magnets_from_text(message_text):
     Returns:
         list: 包含所有磁力链接的列表
     """
-    if not message_text:
-        return []
-
-    # 正则匹配所有magnet链接
-    magnet_pattern = r'magnet:\?xt=urn:btih:[a-zA-Z0-9]+(?:[&?][^\s\n]*)?'
-    magnets = re.findall(magnet_pattern, message_text, re.IGNORECASE)
-
-    return magnets
+    return [magnet.link for magnet in iter_magnets(message_text)]
 
 def extract_dn_from_magnet(magnet_link, message_text=None, filename=None):
     """从磁力链接中提取dn参数（文件名），如果没有则从笔记文本提取
@@ -113,10 +107,10 @@ def extract_dn_from_magnet(magnet_link, message_text=None, filename=None):
         return None
 
     # 其次尝试从磁力链接中提取 dn= 参数
-    match = re.search(r'[&?]dn=([^&]+)', magnet_link)
-    if match:
+    magnet = parse_magnet(magnet_link)
+    if magnet and magnet.dn:
         from urllib.parse import unquote
-        return unquote(match.group(1))
+        return unquote(magnet.dn)
 
     # 如果磁力链接没有dn参数，从笔记文本中提取
     if message_text:
@@ -168,22 +162,19 @@ def extract_all_dns_from_note(note):
     message_text = note.get('message_text', '')
     filename = note.get('filename')  # 获取校准后的完整文件名
 
-    # 从笔记文本提取所有磁力链接
-    all_magnets = extract_all_magnets_from_text(message_text)
+    # 从笔记文本提取所有磁力链接（一次扫描，同时得到info_hash）
+    all_magnets = [(magnet.link, magnet.info_hash) for magnet in iter_magnets(message_text)]
 
     # 如果没有找到任何磁力链接，尝试使用magnet_link字段
     if not all_magnets and note.get('magnet_link'):
-        all_magnets = [note['magnet_link']]
+        parsed = parse_magnet(note['magnet_link'])
+        all_magnets = [(note['magnet_link'], parsed.info_hash if parsed else None)]
 
-    # 为每个磁力链接提取dn和info_hash
-    for magnet in all_magnets:
+    # 为每个磁力链接提取dn
+    for magnet, info_hash in all_magnets:
         # 优先使用filename字段（校准后的完整文件名）
         dn = extract_dn_from_magnet(magnet, message_text, filename)
 
-        # 提取info_hash
-        info_hash_match = re.search(r'xt=urn:btih:([a-zA-Z0-9]+)', magnet, re.IGNORECASE)
-        info_hash = info_hash_match.group(1) if info_hash_match else None
-
         if dn or info_hash:  # 只要有dn或info_hash就添加
             dns.append({
                 'magnet': magnet,
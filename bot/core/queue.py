@@ -1,27 +1,130 @@
 """
 消息队列管理模块
-职责：初始化消息队列和工作线程
+职责：初始化分片消息队列和工作线程池
 """
-import queue
 import threading
 from bot.utils.logger import get_logger
-from bot.workers import MessageWorker
-from constants import MAX_RETRIES
+from bot.workers import (
+    MessageWorker, ShardedMessageQueue, MessageWorkerPool,
+    DurableQueueStore, DurableShardQueue, SpillableShardQueue, DeliveryLedger,
+    configure_download_pool, start_upload_queue
+)
+from bot.storage.webdav_client import WebDAVClient
+from config import (
+    load_config, load_webdav_config, getenv, MEDIA_DIR, QUEUE_DB_FILE, QUEUE_SPILL_DB_FILE, DELIVERY_LEDGER_DB_FILE
+)
+from constants import (
+    MAX_RETRIES, MESSAGE_WORKER_COUNT, MESSAGE_QUEUE_MODE, MAX_QUEUE_DEPTH, COALESCE_WINDOW,
+    DELIVERY_LEDGER_RETENTION_HOURS, DELIVERY_LEDGER_MAX_ENTRIES, DELIVERY_LEDGER_BLOOM_ERROR_RATE,
+    MEDIA_DOWNLOAD_CONCURRENCY, MEDIA_DOWNLOAD_TIMEOUT, UPLOAD_WORKERS
+)
 
 logger = get_logger(__name__)
 
 
-def initialize_message_queue(acc):
+def _get_number_setting(name: str, default, minimum, cast=int):
+    """读取数值配置（config.json / 环境变量），无效时使用默认值"""
+    value = getenv(name, load_config())
+    if value in (None, ""):
+        return default
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ {name} 配置无效: {value}，使用默认值 {default}")
+        return default
+    return max(minimum, number)
+
+
+def _get_worker_count() -> int:
+    """读取工作线程数量（config.json / 环境变量 MESSAGE_WORKERS，默认 MESSAGE_WORKER_COUNT）"""
+    return _get_number_setting("MESSAGE_WORKERS", MESSAGE_WORKER_COUNT, 1)
+
+
+def _get_queue_mode() -> str:
+    """读取队列存储模式（config.json / 环境变量 MESSAGE_QUEUE_MODE）"""
+    mode = str(getenv("MESSAGE_QUEUE_MODE", load_config()) or MESSAGE_QUEUE_MODE).strip().lower()
+    if mode not in ("memory", "durable"):
+        logger.warning(f"⚠️ MESSAGE_QUEUE_MODE 配置无效: {mode}，使用默认值 {MESSAGE_QUEUE_MODE}")
+        return MESSAGE_QUEUE_MODE
+    return mode
+
+
+def _create_message_queue(num_workers: int, mode: str) -> ShardedMessageQueue:
+    """创建分片消息队列（会恢复上次未处理完的持久化/溢出消息）"""
+    max_depth = _get_number_setting("MESSAGE_QUEUE_MAX_DEPTH", MAX_QUEUE_DEPTH, 0)
+
+    if mode == "durable":
+        store = DurableQueueStore(QUEUE_DB_FILE)
+        pending = store.recover(num_workers)
+        if pending:
+            logger.info(f"♻️ 从持久化队列恢复 {pending} 条未处理消息")
+        shards = [DurableShardQueue(store, shard_id) for shard_id in range(num_workers)]
+    else:
+        # 内存队列，overflow_policy 为 spill 的任务在队列满时溢出到磁盘
+        spill_store = DurableQueueStore(QUEUE_SPILL_DB_FILE)
+        pending = spill_store.recover(num_workers)
+        if pending:
+            logger.info(f"♻️ 从溢出队列恢复 {pending} 条未处理消息")
+        shards = [SpillableShardQueue(DurableShardQueue(spill_store, shard_id)) for shard_id in range(num_workers)]
+
+    return ShardedMessageQueue(num_workers, shards=shards, max_depth=max_depth)
+
+
+def _create_delivery_ledger():
+    """创建持久化投递记录（保留时间为 0 时关闭，返回 None）"""
+    retention_hours = _get_number_setting("DELIVERY_LEDGER_RETENTION_HOURS", DELIVERY_LEDGER_RETENTION_HOURS, 0.0,
+                                          cast=float)
+    if retention_hours <= 0:
+        return None
+    max_entries = _get_number_setting("DELIVERY_LEDGER_MAX_ENTRIES", DELIVERY_LEDGER_MAX_ENTRIES, 1000)
+    try:
+        ledger = DeliveryLedger(DELIVERY_LEDGER_DB_FILE, retention_hours * 3600, max_entries,
+                                DELIVERY_LEDGER_BLOOM_ERROR_RATE)
+    except Exception as e:
+        logger.error(f"❌ 投递记录初始化失败，重启后可能重复转发: {e}")
+        return None
+    logger.info(f"📒 已加载投递记录 {len(ledger)} 条 (保留 {retention_hours:g} 小时, 上限 {max_entries} 条)")
+    return ledger
+
+
+def _create_upload_queue():
+    """启用 WebDAV 时启动后台上传线程（记录模式的媒体先保存到本地），否则返回 None"""
+    webdav_config = load_webdav_config()
+    if not webdav_config.get('enabled', False):
+        return None
+    url = webdav_config.get('url', '').strip()
+    username = webdav_config.get('username', '').strip()
+    password = webdav_config.get('password', '').strip()
+    if not (url and username and password):
+        logger.warning("⚠️ WebDAV 配置不完整，媒体仅保存在本地")
+        return None
+
+    webdav_client = WebDAVClient(url, username, password, webdav_config.get('base_path', '/telegram_media'))
+    if not webdav_client.test_connection():
+        # 上传失败的文件留在发件箱中，连接恢复后自动重试
+        logger.warning("⚠️ WebDAV 连接测试失败，媒体先保存在本地，稍后重试上传")
+    num_workers = _get_number_setting("UPLOAD_WORKERS", UPLOAD_WORKERS, 1)
+    upload_queue = start_upload_queue(webdav_client, MEDIA_DIR, num_workers,
+                                      keep_local=webdav_config.get('keep_local_copy', False))
+    logger.info(f"☁️ 后台上传已启动 ({num_workers} 个上传线程)")
+    return upload_queue
+
+
+def initialize_message_queue(acc, num_workers: int = None):
     """
-    初始化消息队列和工作线程
+    初始化消息队列和工作线程池
+
+    消息按目标频道（记录模式按来源频道）路由到固定分片，
+    同一目标的消息保持顺序，不同目标的消息并行处理。
 
     Args:
         acc: User客户端实例（如果为None，则不初始化队列）
+        num_workers: 工作线程（分片）数量，默认读取配置
 
     Returns:
-        tuple: (message_queue, message_worker)
-            - message_queue: 消息队列实例
-            - message_worker: 消息工作线程实例
+        tuple: (message_queue, worker_pool)
+            - message_queue: 分片消息队列实例
+            - worker_pool: 工作线程池实例
             如果acc为None，返回 (None, None)
     """
     if acc is None:
@@ -30,22 +133,50 @@ def initialize_message_queue(acc):
 
     logger.info("📬 正在初始化消息队列系统...")
 
-    # 创建消息队列
-    message_queue = queue.Queue()
+    if num_workers is None:
+        num_workers = _get_worker_count()
+
+    queue_mode = _get_queue_mode()
+    coalesce_window = _get_number_setting("MESSAGE_COALESCE_WINDOW", COALESCE_WINDOW, -1.0, cast=float)
+
+    # 创建分片消息队列
+    message_queue = _create_message_queue(num_workers, queue_mode)
+    delivery_ledger = _create_delivery_ledger()
 
-    # 创建消息工作线程
-    message_worker = MessageWorker(message_queue, acc, max_retries=MAX_RETRIES)
-    worker_thread = threading.Thread(
-        target=message_worker.run,
-        daemon=True,
-        name="MessageWorker"
-    )
+    # 记录模式相册下载池（账号级并发上限，所有分片共享）
+    download_concurrency = _get_number_setting("MEDIA_DOWNLOAD_CONCURRENCY", MEDIA_DOWNLOAD_CONCURRENCY, 1)
+    download_timeout = _get_number_setting("MEDIA_DOWNLOAD_TIMEOUT", MEDIA_DOWNLOAD_TIMEOUT, 1.0, cast=float)
+    configure_download_pool(acc, download_concurrency, download_timeout)
+    upload_queue = _create_upload_queue()
+
+    # 为每个分片创建工作线程
+    workers = []
+    threads = []
+    for shard_id, shard in enumerate(message_queue.shards):
+        worker = MessageWorker(shard, acc, max_retries=MAX_RETRIES, shard_id=shard_id,
+                               coalesce_window=coalesce_window, delivery_ledger=delivery_ledger,
+                               upload_queue=upload_queue)
+        worker_thread = threading.Thread(
+            target=worker.run,
+            daemon=True,
+            name=f"MessageWorker-{shard_id}"
+        )
+        workers.append(worker)
+        threads.append(worker_thread)
 
     # 启动工作线程
-    worker_thread.start()
+    for worker_thread in threads:
+        worker_thread.start()
+
+    worker_pool = MessageWorkerPool(message_queue, workers, threads)
 
     logger.info("✅ 消息队列系统初始化完成")
     logger.info(f"   - 最大重试次数: {MAX_RETRIES}")
-    logger.info(f"   - 工作线程: {worker_thread.name}")
+    logger.info(f"   - 队列模式: {queue_mode}")
+    logger.info(f"   - 分片最大深度: {message_queue.max_depth or '不限'}")
+    logger.info(f"   - 合并转发窗口: {coalesce_window} 秒")
+    logger.info(f"   - 投递记录: {'已关闭' if delivery_ledger is None else '已启用'}")
+    logger.info(f"   - 媒体并发下载: {download_concurrency} 个 (单项超时 {download_timeout:g} 秒)")
+    logger.info(f"   - 工作线程: {num_workers} 个分片 ({', '.join(t.name for t in threads)})")
 
-    return message_queue, message_worker
+    return message_queue, worker_pool
@@ -6,6 +6,8 @@ import time
 from bot.utils.logger import get_logger
 from config import load_watch_config, reload_monitored_sources, get_monitored_sources
 from bot.services.config_import import import_watch_config_on_startup
+from bot.services.watch_index import rebuild_watch_index
+from bot.filters.engine import get_filter_backend
 from constants import MAX_RETRIES
 
 logger = get_logger(__name__)
@@ -58,6 +60,11 @@ def print_startup_config(acc):
     monitored = get_monitored_sources()
     logger.info(f"✅ 启动时已加载 {len(monitored)} 个监控源频道")
 
+    # 预先构建路由快照，第一条消息到达时无需读取配置文件
+    rebuild_watch_index()
+    if get_filter_backend() != "aho-corasick":
+        logger.warning("⚠️ 未安装 pyahocorasick，关键词过滤使用逐个子串扫描（关键词较多时较慢）")
+
     # 配置验证：检查是否有配置但监控源为空
     watch_config = load_watch_config()
     if watch_config and not monitored:
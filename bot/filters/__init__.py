@@ -1,14 +1,21 @@
 """
 Message filtering and content extraction
 """
-from .keyword import check_whitelist, check_blacklist
-from .regex import check_whitelist_regex, check_blacklist_regex
-from .extract import extract_content
+from .keyword import check_whitelist, check_blacklist, find_keyword
+from .regex import check_whitelist_regex, check_blacklist_regex, find_pattern
+from .extract import extract_content, iter_extracted, pack_texts
+from .engine import CompiledFilter, FilterVerdict
 
 __all__ = [
     'check_whitelist',
     'check_blacklist',
     'check_whitelist_regex',
     'check_blacklist_regex',
+    'find_keyword',
+    'find_pattern',
     'extract_content',
+    'iter_extracted',
+    'pack_texts',
+    'CompiledFilter',
+    'FilterVerdict',
 ]
@@ -0,0 +1,262 @@
+"""
+Compiled filter engine
+Compiles a watch rule's keyword and regex lists once per rule version and
+evaluates a message against them with a single lowercase pass
+
+Keyword lists use an Aho-Corasick automaton when pyahocorasick is installed
+(listed in requirements.txt), otherwise a substring scan over the pre-lowered
+text; startup logs a warning when the fallback is in use.
+Regex lists are compiled once and merged into one alternation where that
+does not change their meaning; patterns prone to catastrophic backtracking
+are kept apart and evaluated through bot.filters.regex_guard. The handler
+uses evaluate_in_process, which leaves messages whose verdict depends on a
+sandboxed pattern to the worker.
+"""
+import re
+import logging
+from typing import NamedTuple, Optional, Sequence
+from bot.filters.regex_guard import MODE_SANDBOX, get_quarantine_generation, guard_pattern, is_risky
+
+try:
+    import ahocorasick  # pyahocorasick (可选依赖)
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+# 无效的正则用永不匹配的模式代替，保持与逐条 re.search 时相同的过滤结果
+NEVER_MATCH = re.compile(r"(?!)")
+
+# 合并为一个分支表达式会改变含义的模式：数字反向引用、命名反向引用、开头的全局标志
+_UNMERGEABLE = re.compile(r"\\[1-9]|\(\?P=|^\(\?[aiLmsux]+\)")
+
+# Filter stages in evaluation order (blacklist has priority over whitelist)
+STAGE_BLACKLIST = "blacklist"
+STAGE_BLACKLIST_REGEX = "blacklist_regex"
+STAGE_WHITELIST = "whitelist"
+STAGE_WHITELIST_REGEX = "whitelist_regex"
+
+
+class FilterVerdict(NamedTuple):
+    """Outcome of evaluating a message against a compiled filter
+
+    Computed once per message and rule; the worker reuses it as long as the
+    rule version it was computed for is still current.
+
+    Attributes:
+        passed: Whether the message passes all filters
+        stage: Stage that rejected the message (None when passed)
+        matched: Blacklist keyword/pattern that matched (None otherwise)
+        version: Version of the rule the verdict was computed with (and, for
+            rules with guarded patterns, the quarantine generation)
+    """
+    passed: bool
+    stage: Optional[str] = None
+    matched: Optional[str] = None
+    version: Optional[str] = None
+
+
+def compile_pattern(pattern) -> "re.Pattern":
+    """Compile one regex, replacing an invalid pattern with a never-matching one"""
+    try:
+        return re.compile(pattern)
+    except (re.error, TypeError) as e:
+        logger.warning(f"⚠️ 监控规则中的正则表达式无效 '{pattern}': {e}")
+        return NEVER_MATCH
+
+
+class KeywordMatcher:
+    """Case-insensitive substring matcher for a keyword list"""
+
+    __slots__ = ('keywords', '_lowered', '_automaton', '_empty_keyword')
+
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = tuple(str(keyword) for keyword in keywords)
+        self._lowered = tuple((keyword.lower(), keyword) for keyword in self.keywords)
+        # 空关键词与任何文本都匹配（与 "" in text 一致）
+        self._empty_keyword = next((keyword for lowered, keyword in self._lowered if not lowered), None)
+        self._automaton = None
+        if ahocorasick is not None and self._lowered:
+            automaton = ahocorasick.Automaton()
+            for lowered, keyword in self._lowered:
+                if lowered and lowered not in automaton:
+                    automaton.add_word(lowered, keyword)
+            automaton.make_automaton()
+            self._automaton = automaton
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def find(self, lowered_text: str) -> Optional[str]:
+        """Return the first keyword found in the already-lowercased text, or None"""
+        if self._empty_keyword is not None:
+            return self._empty_keyword
+        if self._automaton is not None:
+            for _, keyword in self._automaton.iter(lowered_text):
+                return keyword
+            return None
+        for lowered, keyword in self._lowered:
+            if lowered in lowered_text:
+                return keyword
+        return None
+
+
+class RegexSet:
+    """A regex list compiled once; mergeable patterns are searched in one pass"""
+
+    __slots__ = ('patterns', '_mergeable', '_merged', '_standalone', '_guarded')
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = tuple(patterns)
+        mergeable = []
+        standalone = []
+        guarded = []
+        for pattern in self.patterns:
+            compiled = compile_pattern(pattern)
+            if compiled is NEVER_MATCH:
+                continue
+            if isinstance(pattern, str) and is_risky(pattern):
+                # 可能灾难性回溯：不并入分支表达式，限时执行
+                guarded.append((pattern, guard_pattern(pattern)))
+            elif isinstance(pattern, str) and not _UNMERGEABLE.search(pattern):
+                mergeable.append((pattern, compiled))
+            else:
+                standalone.append((pattern, compiled))
+
+        self._merged = None
+        if len(mergeable) > 1:
+            try:
+                self._merged = re.compile("|".join(f"(?:{pattern})" for pattern, _ in mergeable))
+            except re.error:
+                standalone = mergeable + standalone
+                mergeable = []
+        elif mergeable:
+            self._merged = mergeable[0][1]
+        self._mergeable = tuple(mergeable)
+        self._standalone = tuple(standalone)
+        self._guarded = tuple(guarded)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    @property
+    def guarded(self) -> bool:
+        """Whether any pattern is evaluated through the regex guard"""
+        return bool(self._guarded)
+
+    def deferred(self) -> bool:
+        """Whether any pattern currently runs in the sandbox subprocess"""
+        return any(guarded.mode == MODE_SANDBOX for _, guarded in self._guarded)
+
+    def search(self, text: str, sandbox: bool = True) -> bool:
+        """Whether any pattern matches the text
+
+        With ``sandbox=False`` patterns that would run in the sandbox are skipped.
+        """
+        if self._merged is not None and self._merged.search(text):
+            return True
+        if any(compiled.search(text) for _, compiled in self._standalone):
+            return True
+        return any(guarded.search(text) for _, guarded in self._guarded
+                   if sandbox or guarded.mode != MODE_SANDBOX)
+
+    def find(self, text: str, sandbox: bool = True) -> Optional[str]:
+        """Return the source of a pattern that matches the text, or None"""
+        if self._merged is not None and self._merged.search(text):
+            # 只在命中时才确定是哪一个模式
+            for pattern, compiled in self._mergeable:
+                if compiled.search(text):
+                    return pattern
+        for pattern, compiled in self._standalone:
+            if compiled.search(text):
+                return pattern
+        for pattern, guarded in self._guarded:
+            if (sandbox or guarded.mode != MODE_SANDBOX) and guarded.search(text):
+                return pattern
+        return None
+
+
+class CompiledFilter:
+    """Keyword and regex filters of one watch rule, compiled once
+
+    Evaluation order matches the worker: keyword blacklist, regex blacklist,
+    keyword whitelist, regex whitelist.
+    """
+
+    __slots__ = ('whitelist', 'blacklist', 'whitelist_regex', 'blacklist_regex', 'version', '_guarded', '_passed')
+
+    def __init__(self, whitelist: Sequence[str] = (), blacklist: Sequence[str] = (),
+                 whitelist_regex: Sequence[str] = (), blacklist_regex: Sequence[str] = (),
+                 version: Optional[str] = None):
+        self.whitelist = KeywordMatcher(whitelist)
+        self.blacklist = KeywordMatcher(blacklist)
+        self.whitelist_regex = RegexSet(whitelist_regex)
+        self.blacklist_regex = RegexSet(blacklist_regex)
+        self.version = version
+        self._guarded = self.whitelist_regex.guarded or self.blacklist_regex.guarded
+        self._passed = FilterVerdict(True, version=version)
+
+    @classmethod
+    def from_rule(cls, rule) -> "CompiledFilter":
+        return cls(rule.whitelist, rule.blacklist, rule.whitelist_regex, rule.blacklist_regex, rule.version_key)
+
+    def verdict_version(self) -> Optional[str]:
+        """Version a verdict computed now carries
+
+        Quarantining a pattern changes how guarded patterns match, so rules
+        with guarded patterns include the quarantine generation.
+        """
+        if not self._guarded:
+            return self.version
+        return f"{self.version}#{get_quarantine_generation()}"
+
+    def evaluate(self, message_text: Optional[str]) -> FilterVerdict:
+        return self._evaluate(message_text, sandbox=True)
+
+    def evaluate_in_process(self, message_text: Optional[str]) -> Optional[FilterVerdict]:
+        """Evaluate without calling the regex sandbox
+
+        Returns:
+            The verdict, or None when it depends on a pattern that runs in the sandbox
+        """
+        return self._evaluate(message_text, sandbox=False)
+
+    def _evaluate(self, message_text: Optional[str], sandbox: bool) -> Optional[FilterVerdict]:
+        text = message_text or ""
+        lowered = None
+        version = self.verdict_version()
+
+        if self.blacklist:
+            lowered = text.lower()
+            keyword = self.blacklist.find(lowered)
+            if keyword is not None:
+                return FilterVerdict(False, STAGE_BLACKLIST, keyword, version)
+
+        if self.blacklist_regex:
+            pattern = self.blacklist_regex.find(text, sandbox)
+            if pattern is not None:
+                return FilterVerdict(False, STAGE_BLACKLIST_REGEX, pattern, version)
+            if not sandbox and self.blacklist_regex.deferred():
+                return None
+
+        if self.whitelist:
+            if lowered is None:
+                lowered = text.lower()
+            if self.whitelist.find(lowered) is None:
+                return FilterVerdict(False, STAGE_WHITELIST, version=version)
+
+        if self.whitelist_regex and not self.whitelist_regex.search(text, sandbox):
+            if not sandbox and self.whitelist_regex.deferred():
+                return None
+            return FilterVerdict(False, STAGE_WHITELIST_REGEX, version=version)
+
+        return self._passed if version == self.version else FilterVerdict(True, version=version)
+
+    def passes(self, message_text: Optional[str]) -> bool:
+        return self.evaluate(message_text).passed
+
+
+def get_filter_backend() -> str:
+    """Name of the keyword matching backend in use"""
+    return "aho-corasick" if ahocorasick is not None else "substring"
+
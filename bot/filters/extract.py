@@ -3,11 +3,34 @@ Content extraction using regex patterns
 """
 import re
 import logging
-from typing import List
+from itertools import chain
+from typing import Iterable, Iterator, List, Sequence, Tuple
+from bot.filters.regex_guard import guard_pattern
+from bot.utils.magnet import base_dn_text, numbered_dn, parse_magnet
+from constants import TELEGRAM_MESSAGE_LIMIT
 
 logger = logging.getLogger(__name__)
 
 
+def iter_extracted(message_text: str, extract_patterns: List[str]) -> Iterator[str]:
+    """Yield extracted strings in first-seen order, without duplicates
+
+    Groups of a match are yielded one by one; empty matches are skipped.
+    """
+    seen = set()
+    for pattern in extract_patterns:
+        try:
+            matches = guard_pattern(pattern).iter_findall(message_text)
+            for match in matches:
+                for item in (match if isinstance(match, tuple) else (match,)):
+                    item = str(item).rstrip()
+                    if item and item not in seen:
+                        seen.add(item)
+                        yield item
+        except re.error as e:
+            logger.warning(f"   正则表达式错误: {pattern} - {e}")
+
+
 def extract_content(message_text: str, extract_patterns: List[str]) -> str:
     """Extract content from message using regex patterns
 
@@ -16,66 +39,116 @@ def extract_content(message_text: str, extract_patterns: List[str]) -> str:
         extract_patterns: List of regex patterns for extraction
 
     Returns:
-        Extracted content as newline-separated string, or empty string if nothing extracted
+        Extracted content as newline-separated string (in the order the
+        matches appear, duplicates removed), or empty string if nothing extracted
     """
     if not extract_patterns:
         return message_text  # No extraction patterns, return original text
 
     logger.debug(f"   应用提取模式: {extract_patterns}")
-    extracted_content = []
-
-    for pattern in extract_patterns:
-        try:
-            matches = re.findall(pattern, message_text)
-            if matches:
-                # Handle both simple matches and groups
-                if isinstance(matches[0], tuple):
-                    for match_group in matches:
-                        extracted_content.extend(match_group)
-                else:
-                    extracted_content.extend(matches)
-                logger.debug(f"   提取到内容: {len(matches)} 个匹配")
-        except re.error as e:
-            logger.warning(f"   正则表达式错误: {pattern} - {e}")
+    items = iter_extracted(message_text, extract_patterns)
 
-    if extracted_content:
-        # Check if this is magnet link extraction
-        is_magnet = any('magnet:' in str(item) for item in extracted_content)
-
-        if is_magnet:
-            # 提取基础DN文本（从消息开头到第一个#号）
-            hash_pos = message_text.find('#')
-            base_dn_text = message_text[:hash_pos].rstrip() if hash_pos != -1 else message_text.rstrip()
-
-            processed = []
-            magnet_count = 0
-
-            for item in extracted_content:
-                magnet_link = str(item).rstrip()
-
-                # Check if dn parameter is missing
-                if '&dn=' not in magnet_link and '?dn=' not in magnet_link:
-                    if base_dn_text and base_dn_text != magnet_link:
-                        magnet_count += 1
-
-                        # 如果有多条磁力链接，在DN结尾添加序号区分
-                        if len(extracted_content) > 1:
-                            dn_text = f"{base_dn_text}-{magnet_count}"
-                        else:
-                            dn_text = base_dn_text
-
-                        # 直接使用原始文字，不进行URL编码
-                        magnet_link += f'&dn={dn_text}'
-                        logger.debug(f"   补全DN [{magnet_count}]: {dn_text[:30]}...")
-
-                processed.append(magnet_link)
-
-            result = "\n".join(set(processed))
-        else:
-            result = "\n".join(set(extracted_content))
-
-        logger.debug(f"   提取后内容长度: {len(result)}")
-        return result
-    else:
+    # 只需知道是否多于一项（决定DN是否加序号），不必先收集全部匹配
+    first = next(items, None)
+    if first is None:
         logger.debug(f"   未提取到任何内容")
         return ""
+    second = next(items, None)
+    head = (first,) if second is None else (first, second)
+    count_hint = len(head)  # numbered_dn 只区分一项与多项
+
+    base_dn = None
+    magnet_count = 0
+    lines = []
+    for item in chain(head, items):
+        # Complete missing dn parameters of magnet links
+        magnet = parse_magnet(item)
+        if magnet is not None and magnet.dn is None:
+            if base_dn is None:
+                # 提取基础DN文本（从消息开头到第一个#号）
+                base_dn = base_dn_text(message_text)
+            if base_dn and base_dn != item:
+                magnet_count += 1
+
+                # 如果有多项提取结果，在DN结尾添加序号区分
+                dn_text = numbered_dn(base_dn, magnet_count, count_hint)
+
+                # 直接使用原始文字，不进行URL编码
+                item += f'&dn={dn_text}'
+                logger.debug(f"   补全DN [{magnet_count}]: {dn_text[:30]}...")
+        lines.append(item)
+
+    result = "\n".join(lines)
+    logger.debug(f"   提取后内容: {len(lines)} 项, 长度 {len(result)}")
+    return result
+
+
+def message_length(text: str) -> int:
+    """Length as Telegram counts it (UTF-16 code units)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _split_long(text: str, limit: int) -> Iterator[str]:
+    """Split a text longer than the limit, at line breaks where possible"""
+    current = []
+    current_len = 0
+    for line in text.split("\n"):
+        line_len = message_length(line)
+        if line_len > limit:
+            # 单行超长：按字符硬切分
+            if current:
+                yield "\n".join(current)
+                current, current_len = [], 0
+            piece_start, piece_len = 0, 0
+            for i, c in enumerate(line):
+                units = 2 if ord(c) > 0xFFFF else 1
+                if piece_len + units > limit:
+                    yield line[piece_start:i]
+                    piece_start, piece_len = i, 0
+                piece_len += units
+            current, current_len = [line[piece_start:]], piece_len
+            continue
+        added = line_len + (1 if current else 0)
+        if current and current_len + added > limit:
+            yield "\n".join(current)
+            current, current_len, added = [], 0, line_len
+        current.append(line)
+        current_len += added
+    if current:
+        yield "\n".join(current)
+
+
+def pack_texts(texts: Sequence[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[Tuple[str, Tuple[int, ...]]]:
+    """Pack consecutive texts into as few messages as possible, keeping order
+
+    Texts are joined with newlines up to ``limit``; a text longer than the
+    limit is split on line breaks into messages of its own, so its chunks
+    never share a message with other texts.
+
+    Returns:
+        List of (message text, indices of the input texts it contains)
+    """
+    packed = []
+    current: List[str] = []
+    owners: List[int] = []
+    current_len = 0
+    for index, text in enumerate(texts):
+        if not text:
+            continue
+        alone = message_length(text) > limit
+        pieces: Iterable[str] = _split_long(text, limit) if alone else (text,)
+        for piece in pieces:
+            piece_len = message_length(piece)
+            if current and (alone or current_len + 1 + piece_len > limit):
+                packed.append(("\n".join(current), tuple(owners)))
+                current, owners, current_len = [], [], 0
+            current_len += piece_len + (1 if current else 0)
+            current.append(piece)
+            if not owners or owners[-1] != index:
+                owners.append(index)
+        if alone:
+            packed.append(("\n".join(current), tuple(owners)))
+            current, owners, current_len = [], [], 0
+    if current:
+        packed.append(("\n".join(current), tuple(owners)))
+    return packed
@@ -1,10 +1,24 @@
 """
 Keyword-based filtering
 """
-import logging
-from typing import List
+from typing import List, Optional
 
-logger = logging.getLogger(__name__)
+
+def find_keyword(message_text: str, keywords: List[str]) -> Optional[str]:
+    """Return the first keyword contained in the message (case-insensitive)
+
+    Args:
+        message_text: Message text to check
+        keywords: Keywords to look for
+
+    Returns:
+        The matching keyword, or None if no keyword matches
+    """
+    lowered = (message_text or "").lower()
+    for keyword in keywords:
+        if keyword.lower() in lowered:
+            return keyword
+    return None
 
 
 def check_whitelist(message_text: str, whitelist: List[str]) -> bool:
@@ -20,14 +34,7 @@ def check_whitelist(message_text: str, whitelist: List[str]) -> bool:
     if not whitelist:
         return True  # No whitelist means pass all
 
-    for keyword in whitelist:
-        if keyword.lower() in message_text.lower():
-            logger.info(f"   ✅ 匹配到白名单关键词: '{keyword}'")
-            return True
-
-    logger.warning(f"   ⏭ 过滤：未匹配关键词白名单 {whitelist}")
-    logger.warning(f"   消息文本: {message_text[:200] if message_text else '(空)'}")
-    return False
+    return find_keyword(message_text, whitelist) is not None
 
 
 def check_blacklist(message_text: str, blacklist: List[str]) -> bool:
@@ -43,9 +50,4 @@ def check_blacklist(message_text: str, blacklist: List[str]) -> bool:
     if not blacklist:
         return False  # No blacklist means nothing to block
     
-    for keyword in blacklist:
-        if keyword.lower() in message_text.lower():
-            logger.debug(f"   ⏭ 过滤：匹配到关键词黑名单 '{keyword}'")
-            return True
-    
-    return False
+    return find_keyword(message_text, blacklist) is not None
@@ -3,17 +3,37 @@ Regex-based filtering
 """
 import re
 import logging
-from typing import List
+from typing import List, Optional
+from bot.filters.regex_guard import guard_pattern
 
 logger = logging.getLogger(__name__)
 
 
+def find_pattern(message_text: str, patterns: List[str]) -> Optional[str]:
+    """Return the first regex pattern that matches the message
+
+    Args:
+        message_text: Message text to check
+        patterns: Regex patterns (strings or compiled patterns)
+
+    Returns:
+        The matching pattern, or None if no pattern matches
+    """
+    for pattern in patterns:
+        try:
+            if guard_pattern(pattern).search(message_text):
+                return pattern
+        except re.error as e:
+            logger.warning(f"   ⚠️ 正则表达式错误 '{pattern}': {e}")
+    return None
+
+
 def check_whitelist_regex(message_text: str, whitelist_regex: List[str]) -> bool:
     """Check if message matches regex whitelist
     
     Args:
         message_text: Message text to check
-        whitelist_regex: List of regex patterns that should match
+        whitelist_regex: List of regex patterns that should match (strings or compiled patterns)
         
     Returns:
         True if message passes (matches at least one pattern), False otherwise
@@ -21,15 +41,7 @@ def check_whitelist_regex(message_text: str, whitelist_regex: List[str]) -> bool
     if not whitelist_regex:
         return True  # No whitelist means pass all
     
-    for pattern in whitelist_regex:
-        try:
-            if re.search(pattern, message_text):
-                return True
-        except re.error as e:
-            logger.warning(f"   ⚠️ 正则白名单表达式错误 '{pattern}': {e}")
-    
-    logger.debug(f"   ⏭ 过滤：未匹配正则白名单 {whitelist_regex}")
-    return False
+    return find_pattern(message_text, whitelist_regex) is not None
 
 
 def check_blacklist_regex(message_text: str, blacklist_regex: List[str]) -> bool:
@@ -37,7 +49,7 @@ def check_blacklist_regex(message_text: str, blacklist_regex: List[str]) -> bool
     
     Args:
         message_text: Message text to check
-        blacklist_regex: List of regex patterns that should NOT match
+        blacklist_regex: List of regex patterns that should NOT match (strings or compiled patterns)
         
     Returns:
         True if message should be blocked (matches a pattern), False otherwise
@@ -45,12 +57,4 @@ def check_blacklist_regex(message_text: str, blacklist_regex: List[str]) -> bool
     if not blacklist_regex:
         return False  # No blacklist means nothing to block
     
-    for pattern in blacklist_regex:
-        try:
-            if re.search(pattern, message_text):
-                logger.debug(f"   ⏭ 过滤：匹配到正则黑名单 '{pattern}'")
-                return True
-        except re.error as e:
-            logger.warning(f"   ⚠️ 正则黑名单表达式错误 '{pattern}': {e}")
-    
-    return False
+    return find_pattern(message_text, blacklist_regex) is not None
@@ -0,0 +1,402 @@
+"""
+Guarded regex evaluation
+Python's re module cannot be interrupted, so a user pattern with
+catastrophic backtracking (e.g. ``(a+)+$``) run against a long caption
+would pin the worker thread indefinitely.
+
+Patterns are classified once: plain patterns run in-process with re;
+patterns with nested or alternating repetition run with the linear-time re2
+engine when google-re2 is installed (optional dependency), otherwise in a
+warm sandbox subprocess with a per-pattern time budget. A pattern that exceeds the budget is quarantined (persisted, never
+matches again) and the owners of watches using it are notified.
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import select
+import logging
+import threading
+import subprocess
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+    import re2  # google-re2 (可选依赖)
+except ImportError:
+    re2 = None
+
+from config import load_regex_quarantine, save_regex_quarantine
+from constants import REGEX_EVAL_BUDGET, REGEX_SANDBOX_PROCESSES, REGEX_SANDBOX_START_TIMEOUT, REGEX_PROBE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regex_sandbox.py")
+# 带超时读取管道依赖 select，仅 POSIX 支持；其他平台退回进程内执行
+SANDBOX_AVAILABLE = os.name == "posix"
+
+MODE_RE = "re"
+MODE_RE2 = "re2"
+MODE_SANDBOX = "sandbox"
+MODE_QUARANTINED = "quarantined"
+
+_COUNTED_REPEAT = re.compile(r"\{(\d*),(\d*)\}|\{(\d+)\}")
+
+
+class RegexBudgetExceeded(Exception):
+    """A pattern did not finish within its evaluation budget"""
+
+
+def _repeat_at(pattern: str, pos: int) -> bool:
+    """Whether a repetition quantifier that can match more than once starts at pos"""
+    if pos >= len(pattern):
+        return False
+    if pattern[pos] in "+*":
+        return True
+    match = _COUNTED_REPEAT.match(pattern, pos)
+    if match is None:
+        return False
+    if match.group(3) is not None:
+        return int(match.group(3)) > 1
+    upper = match.group(2)
+    return not upper or int(upper) > 1
+
+
+def is_risky(pattern: str) -> bool:
+    """Whether a pattern can backtrack catastrophically
+
+    Flags repeated groups whose body itself repeats or alternates
+    (``(a+)+``, ``(\\w*\\s?)*``, ``(a|aa)+``).
+    """
+    # 每层分组记录其内容是否包含重复或分支
+    stack = [False]
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            # 跳过字符类
+            i += 1
+            if i < n and pattern[i] == "^":
+                i += 1
+            if i < n and pattern[i] == "]":
+                i += 1
+            while i < n and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+        elif c == "(":
+            stack.append(False)
+        elif c == ")" and len(stack) > 1:
+            inner = stack.pop()
+            repeated = _repeat_at(pattern, i + 1)
+            if inner and repeated:
+                return True
+            stack[-1] = stack[-1] or inner or repeated
+        elif c == "|" or _repeat_at(pattern, i):
+            stack[-1] = True
+        i += 1
+    return False
+
+
+class _SandboxProcess:
+    """One warm sandbox subprocess (used by one thread at a time)"""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-I", SANDBOX_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        try:
+            self._read(REGEX_SANDBOX_START_TIMEOUT)
+        except BaseException:
+            self.kill()
+            raise
+
+    def _read(self, timeout: float) -> Dict:
+        ready, _, _ = select.select([self.proc.stdout], [], [], timeout)
+        if not ready:
+            raise RegexBudgetExceeded(f"no response within {timeout}s")
+        line = self.proc.stdout.readline()
+        if not line:
+            raise OSError("regex sandbox exited")
+        return json.loads(line)
+
+    def call(self, request: Dict, timeout: float):
+        self.proc.stdin.write(json.dumps(request).encode("ascii") + b"\n")
+        self.proc.stdin.flush()
+        response = self._read(timeout)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["ok"]
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=1)
+        except Exception:
+            pass
+
+
+class RegexSandbox:
+    """Pool of warm subprocesses that run risky patterns with a time budget
+
+    A process that exceeds the budget is killed and replaced on next use.
+    """
+
+    def __init__(self, processes: int = REGEX_SANDBOX_PROCESSES, budget: float = REGEX_EVAL_BUDGET):
+        self.budget = budget
+        self._slots = threading.BoundedSemaphore(processes)
+        self._idle: "queue.LifoQueue[_SandboxProcess]" = queue.LifoQueue()
+        self._all: List[_SandboxProcess] = []
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+
+    def run(self, op: str, pattern: str, text: str, budget: Optional[float] = None):
+        """Run ``search`` (-> bool) or ``findall`` (-> list) in a sandbox process
+
+        Raises:
+            RegexBudgetExceeded: The pattern did not finish within the budget
+            OSError: The sandbox process could not be started or died
+            ValueError: The pattern failed inside the sandbox
+        """
+        budget = self.budget if budget is None else budget
+        with self._slots:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                process = _SandboxProcess()
+                with self._lock:
+                    self._all.append(process)
+            try:
+                result = process.call({"op": op, "pattern": pattern, "text": text}, budget)
+            except ValueError:
+                self._idle.put(process)
+                raise
+            except BaseException as e:
+                if isinstance(e, RegexBudgetExceeded):
+                    self.timeouts += 1
+                self._discard(process)
+                raise
+            self.calls += 1
+            self._idle.put(process)
+        if op == "findall":
+            # JSON 把分组元组变成了列表
+            return [tuple(item) if isinstance(item, list) else item for item in result]
+        return result
+
+    def _discard(self, process: _SandboxProcess):
+        process.kill()
+        with self._lock:
+            if process in self._all:
+                self._all.remove(process)
+
+    def shutdown(self):
+        with self._lock:
+            processes, self._all = self._all, []
+        for process in processes:
+            process.kill()
+        self._idle = queue.LifoQueue()
+
+
+sandbox = RegexSandbox()
+
+# 隔离列表：正则 -> 隔离详情，首次使用时从文件加载
+_quarantine: Optional[Dict[str, Dict]] = None
+_quarantine_lock = threading.Lock()
+_quarantine_listener: Optional[Callable[[str, Dict], None]] = None
+# 每隔离一个正则加一，缓存的过滤结果据此判断是否过期
+_quarantine_generation = 0
+
+
+def _load_quarantine() -> Dict[str, Dict]:
+    global _quarantine
+    if _quarantine is None:
+        with _quarantine_lock:
+            if _quarantine is None:
+                _quarantine = load_regex_quarantine()
+    return _quarantine
+
+
+def is_quarantined(pattern: str) -> bool:
+    return pattern in _load_quarantine()
+
+
+def get_quarantined_patterns() -> Dict[str, Dict]:
+    return dict(_load_quarantine())
+
+
+def get_quarantine_generation() -> int:
+    """Counter that changes whenever a pattern is quarantined"""
+    return _quarantine_generation
+
+
+def set_quarantine_listener(callback: Optional[Callable[[str, Dict], None]]):
+    """Register a callback(pattern, details) invoked in a background thread when a pattern is quarantined"""
+    global _quarantine_listener
+    _quarantine_listener = callback
+
+
+def quarantine_pattern(pattern: str, reason: str, text_length: Optional[int] = None) -> bool:
+    """Quarantine a pattern so it never matches again
+
+    Returns:
+        True if the pattern was newly quarantined
+    """
+    quarantine = _load_quarantine()
+    details = {
+        "reason": reason,
+        "budget": sandbox.budget,
+        "text_length": text_length,
+        "quarantined_at": int(time.time()),
+    }
+    global _quarantine_generation
+    with _quarantine_lock:
+        if pattern in quarantine:
+            return False
+        quarantine[pattern] = details
+        _quarantine_generation += 1
+        snapshot = dict(quarantine)
+    try:
+        save_regex_quarantine(snapshot)
+    except OSError as e:
+        logger.error(f"❌ 保存正则隔离列表失败: {e}")
+    logger.warning(f"🚫 正则已隔离 '{pattern}': {reason} (文本长度 {text_length}, 预算 {sandbox.budget}s)")
+
+    listener = _quarantine_listener
+    if listener is not None:
+        # 通知用户需要网络请求，不占用调用方（工作线程）
+        threading.Thread(target=_notify, args=(listener, pattern, details), daemon=True).start()
+    return True
+
+
+def _notify(listener: Callable[[str, Dict], None], pattern: str, details: Dict):
+    try:
+        listener(pattern, details)
+    except Exception as e:
+        logger.error(f"❌ 发送正则隔离通知失败: {e}")
+
+
+class GuardedPattern:
+    """A pattern evaluated in the cheapest mode that cannot stall the caller
+
+    Compiled re.Pattern objects are trusted and always run in-process.
+    """
+
+    __slots__ = ('pattern', 'mode', '_compiled')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._compiled = re.compile(pattern)  # 无效的正则在此抛出 re.error
+        self.mode = MODE_RE
+        if isinstance(pattern, str) and is_risky(pattern):
+            if is_quarantined(pattern):
+                self.mode = MODE_QUARANTINED
+            elif re2 is not None and self._compile_re2(pattern):
+                self.mode = MODE_RE2
+            elif SANDBOX_AVAILABLE:
+                self.mode = MODE_SANDBOX
+
+    def _compile_re2(self, pattern: str) -> bool:
+        try:
+            self._compiled = re2.compile(pattern)
+            return True
+        except Exception:
+            # re2 不支持反向引用、环视等，交给子进程
+            return False
+
+    def __repr__(self):
+        return f"GuardedPattern({self.pattern!r}, mode={self.mode})"
+
+    def search(self, text: str) -> bool:
+        return bool(self._run("search", text or ""))
+
+    def findall(self, text: str) -> list:
+        return self._run("findall", text or "")
+
+    def iter_findall(self, text: str) -> Iterator:
+        """Like findall, but yields matches lazily when evaluated in-process"""
+        if self.mode not in (MODE_RE, MODE_RE2):
+            yield from self.findall(text)
+            return
+        groups = self._compiled.groups
+        for match in self._compiled.finditer(text or ""):
+            if groups == 0:
+                yield match.group(0)
+            elif groups == 1:
+                yield match.group(1) or ""
+            else:
+                yield match.groups("")
+
+    def _run(self, op: str, text: str):
+        if self.mode == MODE_SANDBOX:
+            if is_quarantined(self.pattern):
+                self.mode = MODE_QUARANTINED
+            else:
+                try:
+                    return sandbox.run(op, self.pattern, text)
+                except RegexBudgetExceeded:
+                    quarantine_pattern(self.pattern, "timeout", len(text))
+                    self.mode = MODE_QUARANTINED
+                except (OSError, ValueError) as e:
+                    logger.warning(f"⚠️ 正则沙箱不可用，改为进程内执行 '{self.pattern}': {e}")
+        if self.mode == MODE_QUARANTINED:
+            return [] if op == "findall" else False
+        if op == "findall":
+            return self._compiled.findall(text)
+        return self._compiled.search(text) is not None
+
+
+@lru_cache(maxsize=512)
+def guard_pattern(pattern) -> GuardedPattern:
+    """Shared GuardedPattern for a pattern (raises re.error for invalid patterns)"""
+    return GuardedPattern(pattern)
+
+
+def _probe_texts(pattern: str) -> List[str]:
+    """Texts that make backtracking-prone patterns fail slowly
+
+    Long runs of characters the pattern is likely to accept, followed by a
+    character that forces the overall match to fail.
+    """
+    seeds = ["a", "1", " ", "a ", "a1"]
+    literals = sorted(set(c for c in re.sub(r"\\.", "", pattern) if c.isalnum()))[:5]
+    seeds.extend(literals)
+    if len(literals) > 1:
+        seeds.append("".join(literals))
+    return [(seed * (REGEX_PROBE_LENGTH // len(seed) + 1))[:REGEX_PROBE_LENGTH] + "\x00!" for seed in seeds]
+
+
+def validate_pattern(pattern: str):
+    """Validate a user-supplied pattern before it is saved to a watch
+
+    Raises:
+        re.error: The pattern is invalid, was quarantined before, or runs
+            over the evaluation budget on a probe text
+    """
+    guarded = GuardedPattern(pattern)
+    if guarded.mode == MODE_QUARANTINED:
+        raise re.error(f"{pattern} 曾因执行超时被隔离，请修改后再试")
+    if guarded.mode != MODE_SANDBOX:
+        return
+    for probe in _probe_texts(pattern):
+        try:
+            sandbox.run("search", pattern, probe)
+        except RegexBudgetExceeded:
+            raise re.error(f"{pattern} 在 {len(probe)} 字符的测试文本上执行超过 {sandbox.budget} 秒，"
+                           f"可能存在灾难性回溯（例如 (a+)+ 这类嵌套重复）")
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 无法在沙箱中检测正则 '{pattern}': {e}")
+            return
+
+
+def get_regex_guard_stats() -> Dict:
+    return {
+        "backend": "re2" if re2 is not None else ("sandbox" if SANDBOX_AVAILABLE else "re"),
+        "sandbox_calls": sandbox.calls,
+        "sandbox_timeouts": sandbox.timeouts,
+        "quarantined": len(_load_quarantine()),
+    }
@@ -0,0 +1,49 @@
+"""
+Regex sandbox process
+Runs user-supplied regexes on behalf of bot.filters.regex_guard so that a
+pattern with catastrophic backtracking only stalls this process, which the
+parent kills once the evaluation budget is exceeded.
+
+Started as a script (not imported as part of the bot package) and speaks
+one JSON object per line on stdin/stdout:
+
+    request:  {"op": "search" | "findall", "pattern": "...", "text": "..."}
+    response: {"ok": <result>} or {"error": "..."}
+
+Only the standard library is imported here to keep startup fast.
+"""
+import re
+import sys
+import json
+
+_MAX_CACHED_PATTERNS = 256
+
+
+def evaluate(cache, request):
+    pattern = request["pattern"]
+    compiled = cache.get(pattern)
+    if compiled is None:
+        if len(cache) >= _MAX_CACHED_PATTERNS:
+            cache.clear()
+        compiled = cache[pattern] = re.compile(pattern)
+    if request["op"] == "findall":
+        return compiled.findall(request["text"])
+    return compiled.search(request["text"]) is not None
+
+
+def main():
+    cache = {}
+    stdout = sys.stdout
+    stdout.write('{"ready": true}\n')
+    stdout.flush()
+    for line in sys.stdin:
+        try:
+            response = {"ok": evaluate(cache, json.loads(line))}
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
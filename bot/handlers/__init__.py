@@ -3,9 +3,10 @@ Message and callback handlers for the bot
 """
 from pyrogram import filters
 from bot.utils.logger import get_logger
+from bot.filters.regex_guard import set_quarantine_listener
 from .commands import register_command_handlers
 from .callbacks import callback_handler
-from .messages import save
+from .messages import save, notify_quarantined_pattern
 from .auto_forward import create_auto_forward_handler
 from .instances import (
     set_bot_instance, set_acc_instance,
@@ -48,6 +49,9 @@ def register_all_handlers(bot, acc, message_queue):
 
     logger.info("✅ 私聊消息处理器已注册")
 
+    # 超出执行预算而被隔离的正则通知相关用户
+    set_quarantine_listener(notify_quarantined_pattern)
+
     # 注册自动转发处理器（如果acc可用）
     if acc is not None and message_queue is not None:
         create_auto_forward_handler(acc, message_queue)
@@ -5,12 +5,11 @@
 import pyrogram
 from pyrogram import filters
 from bot.utils.logger import get_logger
-from bot.utils import is_message_processed, mark_message_processed, cleanup_old_messages
-from bot.utils.dedup import is_media_group_processed, register_processed_media_group, processed_messages
-from bot.services.peer_cache import cache_peer_if_needed
+from bot.utils import check_and_mark_message
+from bot.utils.near_duplicate import get_near_duplicate_index, media_unique_ids, simhash
+from bot.services.media_group_assembler import MediaGroupAssembler
+from bot.services.watch_index import get_watch_index
 from bot.workers import Message
-from config import load_watch_config, get_monitored_sources
-from constants import MESSAGE_CACHE_CLEANUP_THRESHOLD
 
 logger = get_logger(__name__)
 
@@ -24,9 +23,88 @@ def create_auto_forward_handler(acc, message_queue):
         message_queue: 消息队列实例
 
     Returns:
-        function: 自动转发处理器函数
+        function: 自动转发处理器函数（assembler 属性为相册组装缓冲区）
     """
 
+    def skip_near_duplicate(lookup, content_key, source_chat_id, message, route):
+        """用 lookup（check 或 check_and_add）查找近似重复，找到时记录日志并返回 True"""
+        earlier = lookup(content_key[0], content_key[1], (source_chat_id, message.id), route.near_duplicate_window)
+        if earlier is None:
+            return False
+        logger.info(f"⏭️ 跳过近似重复的内容: source={source_chat_id}, message_id={message.id}, "
+                    f"与 source={earlier[0]}, message_id={earlier[1]} 相同, watch={route.watch_key}")
+        return True
+
+    def enqueue_for_watches(message, source_chat_id, message_text, routes, album_ids=None, parts=None, block=True):
+        """为所有匹配的监控任务创建队列条目，返回入队数量
+
+        只使用内存中的路由快照；Peer 缓存在 worker 发送前完成，这里不发起任何网络请求。
+        block=False 时队列已满也不等待（block 策略改为 spill），供不能阻塞的相册组装线程使用。
+        """
+        enqueued_count = 0
+        # 近似重复检测的指纹，只在有任务启用时计算一次
+        content_key = None
+
+        for route in routes:
+            # 入队前计算一次过滤结果；未通过的消息不占用队列，通过的结果随条目传给 worker 复用。
+            # 依赖沙箱中正则的结果（None）留给 worker 计算，分发线程不等待子进程
+            verdict = route.rule.filter.evaluate_in_process(message_text)
+            if verdict is not None and not verdict.passed:
+                logger.debug(f"⏭️ 消息未通过过滤 ({verdict.stage}): user={route.user_id}, watch={route.watch_key}")
+                continue
+
+            # 其他来源转载的相同内容（新的消息ID）在任何API调用或下载之前跳过
+            index = None
+            if route.near_duplicate_window:
+                if content_key is None:
+                    media_ids = media_unique_ids(parts or (message,))
+                    content_key = (None if media_ids else simhash(message_text), media_ids)
+                index = get_near_duplicate_index(route.user_id, route.dest_chat_id)
+                # 加锁查找并记录（同时到达的转载只放行一条）；被丢弃时下面移除，投递失败时由 worker 移除
+                if skip_near_duplicate(index.check_and_add, content_key, source_chat_id, message, route):
+                    continue
+
+            # 创建紧凑的队列条目（不持有Pyrogram消息对象）
+            msg_obj = Message.from_pyrogram(
+                user_id=route.user_id,
+                watch_key=route.watch_key,
+                message=message,
+                watch_data=route.rule,
+                source_chat_id=source_chat_id,
+                dest_chat_id=route.dest_chat_id,
+                message_text=message_text,
+                media_group_key=f"{route.user_id}_{route.watch_key}_{message.media_group_id}" if message.media_group_id else None,
+                album_ids=album_ids,
+                verdict=verdict
+            )
+
+            # 入队消息进行处理；队列已满时按任务的溢出策略处理（检查与入队在分片锁内完成）
+            if not message_queue.offer(msg_obj, route.overflow_policy, block=block):
+                if index is not None:
+                    index.discard((source_chat_id, message.id))
+                logger.debug(f"⏭️ 队列已满，按策略 {route.overflow_policy} 丢弃消息: user={route.user_id}, source={source_chat_id}")
+                continue
+            enqueued_count += 1
+            logger.debug(f"📬 消息已入队: user={route.user_id}, source={source_chat_id}, dest={route.dest_chat_id}")
+
+        return enqueued_count
+
+    def flush_album(parts):
+        """相册组装完成：以第一部分为代表，携带全部部分ID和caption整体入队一次"""
+        first = parts[0]
+        source_chat_id = str(first.chat.id)
+        message_text = next((part.text or part.caption for part in parts if part.text or part.caption), "")
+        album_ids = tuple(part.id for part in parts)
+        logger.info(f"📸 相册已组装: chat_id={source_chat_id}, media_group_id={first.media_group_id}, 共 {len(parts)} 个部分")
+
+        routes = get_watch_index().routes_for(source_chat_id)
+        # 组装线程同时为其他相册计时，不能在满队列上等待
+        enqueued_count = enqueue_for_watches(first, source_chat_id, message_text, routes, album_ids, parts, block=False)
+        if enqueued_count > 0:
+            logger.info(f"✅ 本次共入队 {enqueued_count} 条消息")
+
+    assembler = MediaGroupAssembler(flush_album)
+
     @acc.on_message((filters.channel | filters.group | filters.private) & (filters.incoming | filters.outgoing))
     def auto_forward(client: pyrogram.client.Client, message: pyrogram.types.messages_and_media.message.Message):
         """处理频道/群组/私聊消息，包括转发的消息"""
@@ -46,17 +124,11 @@ def create_auto_forward_handler(acc, message_queue):
                 logger.debug("跳过：消息缺少有效的 message ID")
                 return
 
-            if is_message_processed(message.id, message.chat.id):
+            # 检查并立即标记为已处理（一次加锁），过期条目在写入时顺带淘汰
+            if check_and_mark_message(message.id, message.chat.id):
                 logger.debug(f"⏭️ 跳过已处理的消息: chat_id={message.chat.id}, message_id={message.id}")
                 return
 
-            # 立即标记为已处理，防止重复处理
-            mark_message_processed(message.id, message.chat.id)
-
-            # 定期清理旧消息记录
-            if len(processed_messages) > MESSAGE_CACHE_CLEANUP_THRESHOLD:
-                cleanup_old_messages()
-
             # 记录消息类型
             if message.outgoing:
                 logger.debug(f"📤 outgoing消息（由Bot转发）: chat_id={message.chat.id}, message_id={message.id}")
@@ -66,98 +138,23 @@ def create_auto_forward_handler(acc, message_queue):
             # 获取源chat ID
             source_chat_id = str(message.chat.id)
 
-            # 早期过滤：检查此源是否被监控
-            monitored_sources = get_monitored_sources()
-            if source_chat_id not in monitored_sources:
-                # 记录被过滤的消息（调试用）
+            # 早期过滤：在内存路由快照中查找此源的监控任务
+            routes = get_watch_index().routes_for(source_chat_id)
+            if not routes:
                 logger.debug(f"⏭️ 消息来自非监控源，已跳过: chat_id={source_chat_id}, message_id={message.id}")
-                logger.debug(f"   当前监控源列表: {monitored_sources if monitored_sources else '空'}")
                 return
 
-            logger.info(f"🔔 监控源消息: chat_id={source_chat_id}, message_id={message.id}")
+            logger.info(f"🔔 监控源消息: chat_id={source_chat_id}, message_id={message.id}, 匹配任务={len(routes)}")
 
-            # 缓存源Peer（利用Session文件的原生缓存）
-            cache_peer_if_needed(acc, source_chat_id, "源频道")
+            # 相册的各部分作为独立更新到达：交给组装缓冲区，静默期后整体入队一次
+            if message.media_group_id:
+                assembler.add(message)
+                return
 
             # 获取消息文本
             message_text = message.text or message.caption or ""
 
-            # 优化：只在必要时加载媒体组（减少内存占用）
-            # 如果是媒体组且没有文本，尝试从第一条消息获取caption
-            if message.media_group_id and not message_text:
-                try:
-                    media_group = acc.get_media_group(message.chat.id, message.id)
-                    if media_group and len(media_group) > 0:
-                        message_text = media_group[0].text or media_group[0].caption or ""
-                        logger.debug(f"📸 从媒体组第一条消息获取文本: {len(message_text)} 字符")
-                except Exception as e:
-                    logger.debug(f"📸 获取媒体组文本失败: {e}")
-
-            # 查找所有匹配的监控配置
-            watch_config = load_watch_config()
-            enqueued_count = 0
-
-            for user_id, watches in watch_config.items():
-                for watch_key, watch_data in watches.items():
-                    if isinstance(watch_data, dict):
-                        watch_source = str(watch_data.get("source", ""))
-                        dest = watch_data.get("dest")
-                        record_mode = watch_data.get("record_mode", False)
-
-                        # 匹配源
-                        if watch_source != source_chat_id:
-                            continue
-
-                        logger.info(f"✅ 匹配到监控任务: user={user_id}, source={source_chat_id}")
-
-                        # 缓存目标Peer（如果是转发模式）
-                        dest_chat_id = dest if not record_mode else None
-
-                        if dest_chat_id and dest_chat_id != "me":
-                            # 检查目标是否也是监控源
-                            if str(dest_chat_id) in monitored_sources:
-                                # 目标也是监控源 - 检查是否已经缓存
-                                from bot.utils.peer import is_dest_cached
-                                if is_dest_cached(str(dest_chat_id)):
-                                    logger.debug(f"💡 目标频道 {dest_chat_id} 也是监控源，Peer已缓存")
-                                else:
-                                    # 尝试缓存（即使是监控源，也需要确保能转发）
-                                    logger.info(f"🔄 目标频道 {dest_chat_id} 也是监控源，尝试缓存Peer...")
-                                    cache_peer_if_needed(acc, dest_chat_id, "目标频道")
-                            else:
-                                # 普通目标频道 - 尝试缓存
-                                cache_peer_if_needed(acc, dest_chat_id, "目标频道")
-
-                        # 媒体组去重
-                        if message.media_group_id:
-                            mode_suffix = "record" if record_mode else "forward"
-                            media_group_key = f"{user_id}_{watch_key}_{dest_chat_id}_{mode_suffix}_{message.media_group_id}"
-
-                            if is_media_group_processed(media_group_key):
-                                logger.debug(f"⏭️ 跳过已处理的媒体组: {media_group_key}")
-                                continue
-
-                            # 注册为已处理
-                            register_processed_media_group(media_group_key)
-                            logger.info(f"📸 首次处理媒体组: {media_group_key}")
-
-                        # 创建消息对象
-                        msg_obj = Message(
-                            user_id=user_id,
-                            watch_key=watch_key,
-                            message=message,
-                            watch_data=watch_data,
-                            source_chat_id=source_chat_id,
-                            dest_chat_id=dest_chat_id,
-                            message_text=message_text,
-                            media_group_key=f"{user_id}_{watch_key}_{message.media_group_id}" if message.media_group_id else None
-                        )
-
-                        # 入队消息进行处理
-                        message_queue.put(msg_obj)
-                        enqueued_count += 1
-                        logger.info(f"📬 消息已入队: user={user_id}, source={source_chat_id}, 队列大小={message_queue.qsize()}")
-
+            enqueued_count = enqueue_for_watches(message, source_chat_id, message_text, routes)
             if enqueued_count > 0:
                 logger.info(f"✅ 本次共入队 {enqueued_count} 条消息")
 
@@ -168,4 +165,5 @@ def create_auto_forward_handler(acc, message_queue):
         except Exception as e:
             logger.error(f"⚠️ auto_forward 意外错误: {type(e).__name__}: {e}", exc_info=True)
 
+    auto_forward.assembler = assembler
     return auto_forward
@@ -17,6 +17,8 @@ from bot.handlers.watch_setup import (
 from bot.utils.status import user_states
 from bot.utils.helpers import get_message_type
 from bot.utils.progress import progress, downstatus, upstatus
+from bot.filters.regex_guard import validate_pattern
+from bot.services.watch_rules import intern_watch_rule
 from bot.utils.logger import get_logger
 from config import load_watch_config, save_watch_config
 
@@ -75,7 +77,7 @@ def save(client: pyrogram.client.Client, message: pyrogram.types.messages_and_me
             if patterns:
                 try:
                     for pattern in patterns:
-                        re.compile(pattern)
+                        validate_pattern(pattern)
                     user_states[user_id]["whitelist_regex"] = patterns
                     bot.send_message(message.chat.id, f"✅ 正则白名单已设置：`{', '.join(patterns)}`")
                     msg = bot.send_message(message.chat.id, "⏳ 继续设置...")
@@ -94,7 +96,7 @@ def save(client: pyrogram.client.Client, message: pyrogram.types.messages_and_me
             if patterns:
                 try:
                     for pattern in patterns:
-                        re.compile(pattern)
+                        validate_pattern(pattern)
                     user_states[user_id]["blacklist_regex"] = patterns
                     bot.send_message(message.chat.id, f"✅ 正则黑名单已设置：`{', '.join(patterns)}`")
                     msg = bot.send_message(message.chat.id, "⏳ 继续设置...")
@@ -113,7 +115,7 @@ def save(client: pyrogram.client.Client, message: pyrogram.types.messages_and_me
             if patterns:
                 try:
                     for pattern in patterns:
-                        re.compile(pattern)
+                        validate_pattern(pattern)
                     
                     whitelist = user_states[user_id].get("whitelist", [])
                     blacklist = user_states[user_id].get("blacklist", [])
@@ -153,7 +155,7 @@ def save(client: pyrogram.client.Client, message: pyrogram.types.messages_and_me
                 patterns = [p.strip() for p in message.text.split(',') if p.strip()]
                 try:
                     for pattern in patterns:
-                        re.compile(pattern)
+                        validate_pattern(pattern)
                     key = "whitelist_regex" if color == "white" else "blacklist_regex"
                     watch_config[user_id_str][watch_key][key] = patterns
                 except re.error as e:
@@ -163,7 +165,7 @@ def save(client: pyrogram.client.Client, message: pyrogram.types.messages_and_me
                 patterns = [p.strip() for p in message.text.split(',') if p.strip()]
                 try:
                     for pattern in patterns:
-                        re.compile(pattern)
+                        validate_pattern(pattern)
                     watch_config[user_id_str][watch_key]["extract_patterns"] = patterns
                 except re.error as e:
                     bot.send_message(message.chat.id, f"**❌ 正则表达式错误：** `{str(e)}`\n\n请重新输入")
@@ -185,7 +187,7 @@ def save(client: pyrogram.client.Client, message: pyrogram.types.messages_and_me
             if patterns:
                 try:
                     for pattern in patterns:
-                        re.compile(pattern)
+                        validate_pattern(pattern)
 
                     watch_config = load_watch_config()
                     user_id_str = str(message.from_user.id)
@@ -390,3 +392,35 @@ def handle_private(message: pyrogram.types.messages_and_media.message.Message, c
     if os.path.exists(f'{message.id}upstatus.txt'):
         os.remove(f'{message.id}upstatus.txt')
     bot.delete_messages(message.chat.id, [smsg.id])
+
+
+def notify_quarantined_pattern(pattern: str, details: dict):
+    """Tell every user whose watches use a quarantined regex (registered as the regex_guard listener)"""
+    bot = get_bot_instance()
+    if bot is None:
+        return
+
+    for user_id, watches in load_watch_config().items():
+        if not isinstance(watches, dict):
+            continue
+        buttons = []
+        for idx, watch_data in enumerate(watches.values(), 1):
+            rule = intern_watch_rule(watch_data)
+            if rule is None:
+                continue
+            if pattern in rule.whitelist_regex + rule.blacklist_regex + rule.extract_patterns:
+                buttons.append([InlineKeyboardButton(f"✏️ 修改任务 {idx} ({rule.source})", callback_data=f"watch_view_{idx}")])
+        if not buttons:
+            continue
+
+        text = (
+            "**🚫 正则表达式已被自动停用**\n\n"
+            f"`{pattern}`\n\n"
+            f"处理一条 {details.get('text_length') or '?'} 字符的消息时执行超过 {details.get('budget')} 秒，"
+            "可能存在灾难性回溯（例如 `(a+)+` 这类嵌套重复）。\n"
+            "该表达式今后不再匹配任何消息，请修改相关任务的过滤规则。"
+        )
+        try:
+            bot.send_message(int(user_id), text, reply_markup=InlineKeyboardMarkup(buttons))
+        except Exception as e:
+            logger.warning(f"⚠️ 无法通知用户 {user_id} 正则已隔离: {e}")
@@ -0,0 +1,135 @@
+"""
+媒体组组装模块
+职责：按 (chat_id, media_group_id) 收集相册的各个更新，静默期后整体输出一次，
+替代基于时间窗口的去重和为取 caption 而发起的 get_media_group 请求
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from bot.utils.logger import get_logger
+from bot.utils.media_group_cache import media_group_cache
+from constants import MEDIA_GROUP_ASSEMBLY_QUIET, MEDIA_GROUP_ASSEMBLY_MAX_WAIT, MEDIA_GROUP_FLUSHED_TTL
+
+logger = get_logger(__name__)
+
+AlbumKey = Tuple[int, str]
+
+
+class _PendingAlbum:
+    __slots__ = ('parts', 'first_seen', 'last_seen')
+
+    def __init__(self, now: float):
+        self.parts: Dict[int, object] = {}
+        self.first_seen = now
+        self.last_seen = now
+
+
+class MediaGroupAssembler:
+    """相册组装缓冲区
+
+    add() 缓冲相册的一个部分；当某个相册在 quiet_period 内没有新部分到达
+    （或自第一部分起超过 max_wait）时，按消息ID排序后调用 on_flush(parts)。
+    输出的相册会写入媒体组缓存，后续 worker 不必再请求 get_media_group。
+    已输出的相册在 flushed_ttl 内记录下来，迟到的部分不再单独入队，而是并入
+    媒体组缓存并把相册标记为不完整，worker 改用 get_media_group 获取完整的相册。
+    """
+
+    def __init__(self, on_flush: Callable[[List], None], quiet_period: float = MEDIA_GROUP_ASSEMBLY_QUIET,
+                 max_wait: float = MEDIA_GROUP_ASSEMBLY_MAX_WAIT, flushed_ttl: float = MEDIA_GROUP_FLUSHED_TTL):
+        self.on_flush = on_flush
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.flushed_ttl = flushed_ttl
+        self._pending: "OrderedDict[AlbumKey, _PendingAlbum]" = OrderedDict()
+        self._flushed: "OrderedDict[AlbumKey, float]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.late_parts = 0
+
+    @staticmethod
+    def make_key(message) -> AlbumKey:
+        return message.chat.id, str(message.media_group_id)
+
+    def add(self, message) -> bool:
+        """Buffer one album part; returns False if the album was already emitted"""
+        key = self.make_key(message)
+        now = time.monotonic()
+        with self._cond:
+            self._expire_flushed(now)
+            if key in self._flushed:
+                self.late_parts += 1
+                media_group_cache.add_late_part(key[0], key[1], message)
+                logger.debug(f"⏭️ 相册已输出，迟到的部分并入媒体组缓存: chat_id={key[0]}, media_group_id={key[1]}, message_id={message.id}")
+                return False
+            album = self._pending.get(key)
+            if album is None:
+                album = self._pending[key] = _PendingAlbum(now)
+            album.parts[message.id] = message
+            album.last_seen = now
+            self._ensure_thread()
+            self._cond.notify()
+        return True
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _deadline(self, album: _PendingAlbum) -> float:
+        return min(album.last_seen + self.quiet_period, album.first_seen + self.max_wait)
+
+    def _expire_flushed(self, now: float):
+        while self._flushed:
+            key, flushed_at = next(iter(self._flushed.items()))
+            if now - flushed_at <= self.flushed_ttl:
+                break
+            self._flushed.popitem(last=False)
+
+    def _take_due(self, now: float, force: bool = False) -> List[Tuple[AlbumKey, List]]:
+        """Remove and return albums whose deadline has passed (caller holds the lock)"""
+        due = []
+        for key, album in list(self._pending.items()):
+            if force or self._deadline(album) <= now:
+                del self._pending[key]
+                self._flushed[key] = now
+                due.append((key, [album.parts[message_id] for message_id in sorted(album.parts)]))
+        return due
+
+    def flush_due(self, now: Optional[float] = None, force: bool = False) -> int:
+        """Emit every album that is due (or all of them when force=True)"""
+        with self._cond:
+            due = self._take_due(time.monotonic() if now is None else now, force)
+        for key, parts in due:
+            self._emit(key, parts)
+        return len(due)
+
+    def flush_all(self) -> int:
+        return self.flush_due(force=True)
+
+    def _emit(self, key: AlbumKey, parts: List):
+        # 相册各部分已经全部收到，写入缓存供 worker 和链式转发使用
+        media_group_cache.put(key[0], key[1], parts)
+        logger.debug(f"📸 相册组装完成: chat_id={key[0]}, media_group_id={key[1]}, 共 {len(parts)} 个部分")
+        try:
+            self.on_flush(parts)
+        except Exception as e:
+            logger.error(f"⚠️ 相册输出失败: {type(e).__name__}: {e}", exc_info=True)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="MediaGroupAssembler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                next_deadline = min(self._deadline(album) for album in self._pending.values())
+                if next_deadline > now:
+                    self._cond.wait(next_deadline - now)
+                    continue
+                due = self._take_due(now)
+            for key, parts in due:
+                self._emit(key, parts)
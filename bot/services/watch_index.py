@@ -0,0 +1,154 @@
+"""
+监控路由索引模块
+职责：把监控配置预先整理为按源频道索引的只读路由快照（规则已解析、正则已编译），
+使消息处理器和链式转发每条消息只做一次字典查找，而不是重新读取并遍历 watch_config.json
+
+快照构建后不再修改；配置保存或文件修改时间变化时构建新快照并整体替换（copy-on-write），
+正在使用旧快照的线程不受影响。
+"""
+import os
+import sys
+import time
+import threading
+from typing import Dict, Optional, Tuple
+from bot.utils.logger import get_logger
+from bot.services.watch_rules import WatchRule, intern_watch_rule
+from config import WATCH_FILE, load_watch_config, get_watch_config_generation
+from constants import DEFAULT_OVERFLOW_POLICY, WATCH_INDEX_MTIME_CHECK_INTERVAL, NEAR_DUPLICATE_WINDOW, NEAR_DUPLICATE_RETENTION
+
+logger = get_logger(__name__)
+
+
+def _near_duplicate_window(setting) -> float:
+    """近似重复比较窗口（秒），0 表示关闭
+
+    配置 near_duplicate 可以是 true（默认窗口）、秒数，或 {"window": 秒数}
+    """
+    if isinstance(setting, dict):
+        setting = setting.get("window", NEAR_DUPLICATE_WINDOW) if setting.get("enabled", True) else 0
+    if setting is True:
+        return NEAR_DUPLICATE_WINDOW
+    if not setting:
+        return 0.0
+    try:
+        return min(max(float(setting), 0.0), NEAR_DUPLICATE_RETENTION)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ near_duplicate 配置无效: {setting}，使用默认窗口 {NEAR_DUPLICATE_WINDOW} 秒")
+        return NEAR_DUPLICATE_WINDOW
+
+
+class WatchRoute:
+    """一个监控任务的路由信息（只读）"""
+
+    __slots__ = ('user_id', 'watch_key', 'rule', 'dest_chat_id', 'overflow_policy', 'near_duplicate_window')
+
+    def __init__(self, user_id: str, watch_key: str, rule: WatchRule):
+        self.user_id = sys.intern(str(user_id))
+        self.watch_key = sys.intern(str(watch_key))
+        self.rule = rule
+        self.dest_chat_id = rule.dest if not rule.record_mode else None
+        self.overflow_policy = rule.data.get("overflow_policy", DEFAULT_OVERFLOW_POLICY)
+        self.near_duplicate_window = _near_duplicate_window(rule.data.get("near_duplicate"))
+
+    def __repr__(self):
+        return f"WatchRoute(user_id={self.user_id!r}, watch_key={self.watch_key!r}, dest={self.dest_chat_id!r})"
+
+
+class WatchIndex:
+    """按源频道索引的路由快照
+
+    Attributes:
+        version: 快照版本号，每次重建递增
+        generation: 构建时的配置重载计数（见 config.get_watch_config_generation）
+        mtime_ns: 构建时 watch_config.json 的修改时间
+        routes_by_source: 源频道ID -> 路由元组
+        rules_by_watch: (user_id, watch_key) -> 当前规则
+    """
+
+    __slots__ = ('version', 'generation', 'mtime_ns', 'routes_by_source', 'rules_by_watch')
+
+    def __init__(self, routes_by_source: Dict[str, Tuple[WatchRoute, ...]], version: int = 0,
+                 generation: int = 0, mtime_ns: Optional[int] = None):
+        self.version = version
+        self.generation = generation
+        self.mtime_ns = mtime_ns
+        self.routes_by_source = routes_by_source
+        self.rules_by_watch: Dict[Tuple[str, str], WatchRule] = {
+            (route.user_id, route.watch_key): route.rule
+            for routes in routes_by_source.values() for route in routes
+        }
+
+    @classmethod
+    def build(cls, watch_config: Dict, version: int = 0, generation: int = 0,
+              mtime_ns: Optional[int] = None) -> "WatchIndex":
+        routes: Dict[str, list] = {}
+        for user_id, watches in watch_config.items():
+            if not isinstance(watches, dict):
+                continue
+            for watch_key, watch_data in watches.items():
+                if not isinstance(watch_data, dict):
+                    continue
+                rule = intern_watch_rule(watch_data)
+                if not rule.source:
+                    continue
+                routes.setdefault(rule.source, []).append(WatchRoute(user_id, watch_key, rule))
+        return cls({source: tuple(items) for source, items in routes.items()}, version, generation, mtime_ns)
+
+    def routes_for(self, source_chat_id: str) -> Tuple[WatchRoute, ...]:
+        return self.routes_by_source.get(source_chat_id, ())
+
+    def rule_for(self, user_id: str, watch_key: str) -> Optional[WatchRule]:
+        """Current rule of a watch, or None if it no longer exists"""
+        return self.rules_by_watch.get((str(user_id), str(watch_key)))
+
+    def __contains__(self, source_chat_id: str) -> bool:
+        return source_chat_id in self.routes_by_source
+
+    def __len__(self):
+        return sum(len(routes) for routes in self.routes_by_source.values())
+
+
+_index = WatchIndex({}, version=0, generation=-1)
+_index_lock = threading.Lock()
+_next_mtime_check = 0.0
+
+
+def _watch_file_mtime() -> Optional[int]:
+    try:
+        return os.stat(WATCH_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def rebuild_watch_index() -> WatchIndex:
+    """Reload watch_config.json and publish a new routing snapshot"""
+    global _index
+    with _index_lock:
+        generation = get_watch_config_generation()
+        # 先取修改时间再读取，读取期间的修改会在下次检查时再次触发重建
+        mtime_ns = _watch_file_mtime()
+        index = WatchIndex.build(load_watch_config(), _index.version + 1, generation, mtime_ns)
+        _index = index
+    logger.info(f"🗂️ 监控路由已重建: 版本={index.version}, {len(index.routes_by_source)} 个源, {len(index)} 个任务")
+    return index
+
+
+def get_watch_index() -> WatchIndex:
+    """Return the current routing snapshot
+
+    The snapshot is rebuilt after save_watch_config/reload_monitored_sources, or
+    when watch_config.json was modified externally (checked at most every
+    WATCH_INDEX_MTIME_CHECK_INTERVAL seconds).
+    """
+    global _next_mtime_check
+    index = _index
+    if index.generation != get_watch_config_generation():
+        return rebuild_watch_index()
+
+    now = time.monotonic()
+    if now >= _next_mtime_check:
+        _next_mtime_check = now + WATCH_INDEX_MTIME_CHECK_INTERVAL
+        if _watch_file_mtime() != index.mtime_ns:
+            logger.info("🔄 检测到 watch_config.json 被修改，重建监控路由")
+            return rebuild_watch_index()
+    return index
@@ -0,0 +1,94 @@
+"""
+监控规则模块
+职责：把监控配置字典解析为不可变的 WatchRule，并按内容驻留（intern），
+使队列中成千上万条消息共享同一个规则对象，而不是各自持有一份配置字典
+"""
+import json
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+from bot.filters.engine import CompiledFilter
+
+
+def _as_tuple(value) -> Tuple:
+    if not value:
+        return ()
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return (value,)
+
+
+class WatchRule:
+    """解析后的监控规则（只读）
+
+    Attributes:
+        data: 原始配置字典（只读使用，不要修改）
+        version_key: 规则内容的规范化 JSON，用作驻留键
+    """
+
+    __slots__ = (
+        'data', 'version_key', 'source', 'dest', 'record_mode', 'forward_mode',
+        'whitelist', 'blacklist', 'whitelist_regex', 'blacklist_regex',
+        'extract_patterns', 'preserve_forward_source', 'append_dn',
+        '_filter', '__weakref__'
+    )
+
+    def __init__(self, data: Dict[str, Any], version_key: str):
+        self.data = data
+        self.version_key = version_key
+        self.source = str(data.get("source", ""))
+        self.dest = data.get("dest")
+        self.record_mode = bool(data.get("record_mode", False))
+        self.forward_mode = data.get("forward_mode", "full")
+        self.whitelist = _as_tuple(data.get("whitelist"))
+        self.blacklist = _as_tuple(data.get("blacklist"))
+        self.whitelist_regex = _as_tuple(data.get("whitelist_regex"))
+        self.blacklist_regex = _as_tuple(data.get("blacklist_regex"))
+        self.extract_patterns = _as_tuple(data.get("extract_patterns"))
+        self.preserve_forward_source = bool(data.get("preserve_forward_source", False))
+        self.append_dn = bool(data.get("append_dn_to_magnet", False))
+        self._filter = None
+
+    @property
+    def filter(self) -> CompiledFilter:
+        """关键词自动机和正则集合，首次使用时编译一次，所有引用此规则的消息共享"""
+        compiled = self._filter
+        if compiled is None:
+            compiled = self._filter = CompiledFilter.from_rule(self)
+        return compiled
+
+    def __repr__(self):
+        return f"WatchRule(source={self.source!r}, dest={self.dest!r}, record_mode={self.record_mode})"
+
+
+# 规则对象只被队列中的消息引用，没有消息引用时自动回收
+_rules: "weakref.WeakValueDictionary[str, WatchRule]" = weakref.WeakValueDictionary()
+_rules_lock = threading.Lock()
+
+
+def intern_watch_rule(watch_data: Optional[Dict[str, Any]]) -> Optional[WatchRule]:
+    """获取与配置内容对应的共享 WatchRule
+
+    内容相同的配置（即使是每次 load_watch_config 新加载的字典）返回同一个对象；
+    配置被修改后内容不同，会得到新的规则对象，已入队消息仍使用入队时的规则。
+
+    Args:
+        watch_data: 监控配置字典（或已解析的 WatchRule）
+
+    Returns:
+        WatchRule，watch_data 已经是 WatchRule 时原样返回，不是字典时返回 None
+    """
+    if isinstance(watch_data, WatchRule):
+        return watch_data
+    if not isinstance(watch_data, dict):
+        return None
+    version_key = json.dumps(watch_data, sort_keys=True, ensure_ascii=False, default=str)
+    rule = _rules.get(version_key)
+    if rule is not None:
+        return rule
+    with _rules_lock:
+        rule = _rules.get(version_key)
+        if rule is None:
+            rule = WatchRule(dict(watch_data), version_key)
+            _rules[version_key] = rule
+        return rule
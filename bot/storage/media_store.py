@@ -0,0 +1,25 @@
+"""
+Content-addressed media store
+Downloaded media is stored once under the SHA-256 of its content; the
+database maps Telegram file_unique_ids to stored blobs and counts the notes
+(and in-flight record-mode saves) referencing each blob (see
+database.pin_media_blob / register_media_blob / release_media_blobs).
+"""
+import hashlib
+
+BLOB_DIR = "blobs"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_location(content_hash: str, suffix: str = ".jpg") -> str:
+    """Storage location of a blob, fanned out by the first two hex digits"""
+    return f"{BLOB_DIR}/{content_hash[:2]}/{content_hash}{suffix}"
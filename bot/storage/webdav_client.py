@@ -3,38 +3,148 @@ WebDAV Client and Storage Manager
 Handles media storage with WebDAV support
 """
 import os
+import time
+import errno
+import shutil
 import logging
+import threading
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+from constants import (
+    MEDIA_FSYNC_BATCH_SIZE, MEDIA_FSYNC_INTERVAL,
+    WEBDAV_TIMEOUT, WEBDAV_MAX_RETRIES, WEBDAV_RETRY_BACKOFF, WEBDAV_CHUNK_SIZE, WEBDAV_POOL_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
+# 后台上传完成后笔记中记录的远程位置前缀（其后为 WebDAV base_path 下的相对路径）
+REMOTE_LOCATION_PREFIX = "webdav:"
+
 
 class WebDAVClient:
-    """WebDAV client for remote storage"""
-    
+    """WebDAV client for remote storage
+
+    All requests share one pooled HTTP session. Files are uploaded with a
+    streaming chunked PUT; parent collections are created with MKCOL once and
+    remembered. Connection errors and 5xx/429 responses are retried with
+    exponential backoff.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
     def __init__(self, url, username, password, base_path='/telegram_media'):
-        self.url = url
+        self.url = url.rstrip('/')
         self.username = username
         self.password = password
-        self.base_path = base_path
-    
+        self.base_path = '/'.join(segment for segment in base_path.split('/') if segment)
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WEBDAV_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # 已确认存在的集合路径，MKCOL 每个只发一次
+        self._known_dirs = set()
+        self._dirs_lock = threading.Lock()
+
+    def _remote_url(self, remote_path=''):
+        path = '/'.join(segment for segment in (self.base_path, remote_path.strip('/')) if segment)
+        return f"{self.url}/{quote(path)}" if path else f"{self.url}/"
+
+    def _request(self, method, url, data_factory=None, **kwargs):
+        """Send a request, retrying connection errors and transient statuses
+
+        Args:
+            data_factory: Callable returning the request body; called again
+                for every attempt so streamed bodies can be resent
+        """
+        for attempt in range(WEBDAV_MAX_RETRIES + 1):
+            if data_factory is not None:
+                kwargs['data'] = data_factory()
+            try:
+                response = self.session.request(method, url, timeout=WEBDAV_TIMEOUT, **kwargs)
+            except requests.RequestException as e:
+                if attempt == WEBDAV_MAX_RETRIES:
+                    raise
+                logger.warning(f"WebDAV {method} {url} failed ({e}), retrying")
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == WEBDAV_MAX_RETRIES:
+                    return response
+                response.close()
+                logger.warning(f"WebDAV {method} {url} returned {response.status_code}, retrying")
+            time.sleep(WEBDAV_RETRY_BACKOFF * 2 ** attempt)
+
     def test_connection(self):
-        """Test WebDAV connection"""
+        """Test WebDAV connection (creates the base path if it is missing)"""
         try:
-            # Placeholder implementation
             logger.info(f"Testing WebDAV connection to {self.url}")
-            return True
+            response = self._request('PROPFIND', self._remote_url(), headers={'Depth': '0'})
+            if response.status_code == 404 and self.base_path:
+                self.ensure_directory('')
+                return True
+            if response.status_code in (200, 207):
+                return True
+            logger.error(f"WebDAV connection test failed: HTTP {response.status_code}")
+            return False
         except Exception as e:
             logger.error(f"WebDAV connection test failed: {e}")
             return False
-    
+
+    def ensure_directory(self, remote_dir):
+        """Create a collection and its missing parents (MKCOL), skipping known ones"""
+        segments = [segment for segment in f"{self.base_path}/{remote_dir}".split('/') if segment]
+        for depth in range(1, len(segments) + 1):
+            path = '/'.join(segments[:depth])
+            if path in self._known_dirs:
+                continue
+            response = self._request('MKCOL', f"{self.url}/{quote(path)}/")
+            response.close()
+            # 201 已创建；405 已存在
+            if response.status_code not in (200, 201, 405):
+                raise IOError(f"MKCOL {path} failed: HTTP {response.status_code}")
+            with self._dirs_lock:
+                self._known_dirs.add(path)
+
     def upload_file(self, local_path, remote_path):
-        """Upload file to WebDAV"""
-        logger.info(f"Uploading {local_path} to {remote_path}")
-        return True
-    
+        """Upload file to WebDAV
+
+        Returns:
+            True if the server stored the file
+        """
+        remote_dir = os.path.dirname(remote_path.strip('/'))
+        self.ensure_directory(remote_dir)
+
+        def chunks():
+            with open(local_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(WEBDAV_CHUNK_SIZE), b''):
+                    yield chunk
+
+        response = self._request('PUT', self._remote_url(remote_path), data_factory=chunks)
+        response.close()
+        if response.status_code in (200, 201, 204):
+            return True
+        logger.error(f"WebDAV upload of {remote_path} failed: HTTP {response.status_code}")
+        return False
+
+    def delete_file(self, remote_path):
+        """Delete a file from WebDAV
+
+        Returns:
+            True if the file is gone (deleted, or already missing)
+        """
+        response = self._request('DELETE', self._remote_url(remote_path))
+        response.close()
+        if response.status_code in (200, 204, 404):
+            return True
+        logger.error(f"WebDAV delete of {remote_path} failed: HTTP {response.status_code}")
+        return False
+
     def get_file_url(self, remote_path):
         """Get WebDAV file URL"""
-        return f"{self.url}{self.base_path}/{remote_path}"
+        return self._remote_url(remote_path)
+
+    def close(self):
+        self.session.close()
 
 
 class StorageManager:
@@ -44,30 +154,151 @@ class StorageManager:
         self.media_dir = media_dir
         self.webdav_client = webdav_client
         os.makedirs(media_dir, exist_ok=True)
+        self._pending_sync = []
+        self._pending_since = 0.0
+        self._sync_lock = threading.Lock()
     
     def get_file_path(self, storage_location):
-        """Get file path or URL for storage location"""
+        """Get file path or URL for storage location
+
+        Files uploaded in the background are recorded with
+        ``REMOTE_LOCATION_PREFIX``; a local copy that was kept is served first.
+        """
+        if storage_location.startswith(REMOTE_LOCATION_PREFIX):
+            storage_location = storage_location[len(REMOTE_LOCATION_PREFIX):]
+        local_path = os.path.join(self.media_dir, storage_location)
+        if os.path.exists(local_path):
+            return local_path
         if self.webdav_client:
             return self.webdav_client.get_file_url(storage_location)
-        else:
-            local_path = os.path.join(self.media_dir, storage_location)
-            if os.path.exists(local_path):
-                return local_path
         return None
     
-    def save_file(self, source_path, filename):
-        """Save file to storage"""
+    def save_file(self, source_path, filename, keep_local=False, keep_source=False):
+        """Save file to storage
+
+        The file is placed in ``media_dir`` without copying its data when
+        possible: renamed (or, with ``keep_source``, hard-linked) on the same
+        filesystem, streamed only across filesystems. A source that already
+        is the destination is left as it is. New files are fsynced in batches
+        (see ``flush``).
+
+        Args:
+            source_path: Downloaded file
+            filename: Storage location (relative to ``media_dir``)
+            keep_local: Keep the local file after a WebDAV upload
+            keep_source: Leave ``source_path`` in place
+
+        Returns:
+            (success, storage_location)
+        """
         dest_path = os.path.join(self.media_dir, filename)
-        
-        # Copy to local storage
-        import shutil
-        shutil.copy2(source_path, dest_path)
-        
+        try:
+            if not _same_file(source_path, dest_path):
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                self._place(source_path, dest_path, keep_source)
+                self._schedule_sync(dest_path)
+        except OSError as e:
+            logger.error(f"Saving {filename} failed: {e}")
+            return False, None
+
         # Upload to WebDAV if configured
         if self.webdav_client:
             try:
-                self.webdav_client.upload_file(dest_path, filename)
+                if self.webdav_client.upload_file(dest_path, filename) and not keep_local:
+                    self._discard_local(dest_path)
             except Exception as e:
                 logger.warning(f"WebDAV upload failed, file saved locally: {e}")
-        
-        return filename
+
+        return True, filename
+
+    @staticmethod
+    def _place(source_path, dest_path, keep_source):
+        if not keep_source:
+            try:
+                os.replace(source_path, dest_path)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        else:
+            # 先链接到临时名再替换，已存在的目标也能原子覆盖
+            temp_path = _temp_path(dest_path)
+            try:
+                os.link(source_path, temp_path)
+                os.replace(temp_path, dest_path)
+                return
+            except OSError:
+                _remove_quietly(temp_path)
+
+        # 跨文件系统（或不支持硬链接）时才复制数据
+        temp_path = _temp_path(dest_path)
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, dest_path)
+        except OSError:
+            _remove_quietly(temp_path)
+            raise
+        if not keep_source:
+            _remove_quietly(source_path)
+
+    def _schedule_sync(self, path):
+        with self._sync_lock:
+            if not self._pending_sync:
+                self._pending_since = time.monotonic()
+            self._pending_sync.append(path)
+            due = (len(self._pending_sync) >= MEDIA_FSYNC_BATCH_SIZE
+                   or time.monotonic() - self._pending_since >= MEDIA_FSYNC_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """fsync the files saved since the last flush and their directories"""
+        with self._sync_lock:
+            paths, self._pending_sync = self._pending_sync, []
+        if not paths:
+            return
+        directories = set()
+        for path in paths:
+            directories.add(os.path.dirname(path))
+            _fsync_path(path, os.O_RDONLY)
+        # 每个目录只同步一次，使批内的重命名持久化
+        for directory in directories:
+            _fsync_path(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+
+    def _discard_local(self, dest_path):
+        with self._sync_lock:
+            if dest_path in self._pending_sync:
+                self._pending_sync.remove(dest_path)
+        _remove_quietly(dest_path)
+
+
+def _same_file(source_path, dest_path):
+    try:
+        return os.path.samefile(source_path, dest_path)
+    except OSError:
+        return False
+
+
+def _temp_path(dest_path):
+    return f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _fsync_path(path, flags):
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        # 已被删除（例如上传后不保留本地副本）
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        logger.warning(f"fsync {path} failed: {e}")
+    finally:
+        os.close(fd)
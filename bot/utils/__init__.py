@@ -6,6 +6,7 @@ from .dedup import (
     is_media_group_processed,
     is_message_processed,
     mark_message_processed,
+    check_and_mark_message,
     cleanup_old_messages,
     get_cache_stats
 )
@@ -19,6 +20,7 @@ __all__ = [
     'is_media_group_processed',
     'is_message_processed',
     'mark_message_processed',
+    'check_and_mark_message',
     'cleanup_old_messages',
     'get_cache_stats',
     'downstatus',
@@ -5,15 +5,88 @@ Prevents duplicate processing of messages and media groups
 import time
 import logging
 import threading
-from typing import Dict
-from collections import OrderedDict
-from constants import MESSAGE_CACHE_TTL, MAX_MEDIA_GROUP_CACHE, MEDIA_GROUP_CLEANUP_BATCH_SIZE, MESSAGE_CACHE_CLEANUP_THRESHOLD
+from typing import Callable, Dict, Hashable, Tuple
+from collections import OrderedDict, deque
+from constants import MESSAGE_CACHE_TTL, MESSAGE_CACHE_MAX_SIZE, MAX_MEDIA_GROUP_CACHE, MEDIA_GROUP_CLEANUP_BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 
-# Message deduplication cache
-processed_messages: Dict[str, float] = {}
-_message_lock = threading.Lock()
+
+class TTLRing:
+    """Set of recently seen keys that forgets each key ``ttl`` seconds after it was added
+
+    Keys live in a dict (key -> deadline) and in a FIFO ring of
+    (deadline, key) in insertion order. Every key gets the same TTL, so the
+    ring is sorted by deadline and expiry only ever pops from its head:
+    insert, lookup and expiry are amortized O(1), with no scan and no sort.
+    ``max_size`` bounds memory; beyond it the oldest keys are dropped first.
+    """
+    __slots__ = ("ttl", "max_size", "_deadlines", "_ring", "_lock", "_clock")
+
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._deadlines: Dict[Hashable, float] = {}
+        self._ring: deque = deque()
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def _expire(self, now: float) -> int:
+        # 调用方持有锁；被重新标记的键在环中留有旧记录，按截止时间比对后跳过
+        ring = self._ring
+        deadlines = self._deadlines
+        removed = 0
+        while ring and (ring[0][0] <= now or len(deadlines) > self.max_size):
+            deadline, key = ring.popleft()
+            if deadlines.get(key) == deadline:
+                del deadlines[key]
+                removed += 1
+        return removed
+
+    def _add(self, key: Hashable, now: float):
+        deadline = now + self.ttl
+        self._deadlines[key] = deadline
+        self._ring.append((deadline, key))
+        if len(self._deadlines) > self.max_size:
+            self._expire(now)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            deadline = self._deadlines.get(key)
+            return deadline is not None and deadline > self._clock()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def add(self, key: Hashable):
+        """Add a key, or restart its TTL if already present"""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            self._add(key, now)
+
+    def check_and_add(self, key: Hashable) -> bool:
+        """Add a key unless it is already present
+
+        Returns:
+            True if the key was seen within the TTL (a duplicate)
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            if key in self._deadlines:
+                return True
+            self._add(key, now)
+            return False
+
+    def expire(self) -> int:
+        """Drop expired keys, returns how many were removed"""
+        with self._lock:
+            return self._expire(self._clock())
+
+
+# Message deduplication cache, keyed by (chat_id, message_id)
+processed_messages = TTLRing(MESSAGE_CACHE_TTL, MESSAGE_CACHE_MAX_SIZE)
 
 # Media group deduplication cache (LRU with OrderedDict for efficient cleanup)
 # 改为存储时间戳，支持基于时间的去重
@@ -23,8 +96,9 @@ _media_group_lock = threading.Lock()
 # 媒体组去重的时间窗口（秒）- 优化：从2秒降到1秒，减少缓存时间
 MEDIA_GROUP_DEDUP_WINDOW = 1.0  # 1秒内的重复媒体组会被过滤
 
-# 消息缓存清理阈值（当缓存超过此大小时触发清理）
-MESSAGE_CACHE_MAX_SIZE = MESSAGE_CACHE_CLEANUP_THRESHOLD
+
+def _message_key(message_id: int, chat_id: int) -> Tuple[int, int]:
+    return (chat_id, message_id)
 
 
 def register_processed_media_group(key: str):
@@ -101,16 +175,7 @@ def is_message_processed(message_id: int, chat_id: int) -> bool:
     Returns:
         True if message was processed within MESSAGE_CACHE_TTL seconds
     """
-    key = f"{chat_id}_{message_id}"
-    
-    with _message_lock:
-        if key in processed_messages:
-            timestamp = processed_messages[key]
-            if time.time() - timestamp < MESSAGE_CACHE_TTL:
-                return True
-            # Expired, remove it
-            del processed_messages[key]
-        return False
+    return _message_key(message_id, chat_id) in processed_messages
 
 
 def mark_message_processed(message_id: int, chat_id: int):
@@ -120,40 +185,32 @@ def mark_message_processed(message_id: int, chat_id: int):
         message_id: Telegram message ID
         chat_id: Telegram chat ID
     """
-    key = f"{chat_id}_{message_id}"
-    
-    with _message_lock:
-        processed_messages[key] = time.time()
+    processed_messages.add(_message_key(message_id, chat_id))
+
+
+def check_and_mark_message(message_id: int, chat_id: int) -> bool:
+    """Mark a message as processed in one step (thread-safe)
+
+    Args:
+        message_id: Telegram message ID
+        chat_id: Telegram chat ID
+
+    Returns:
+        True if the message was already processed within MESSAGE_CACHE_TTL seconds
+    """
+    return processed_messages.check_and_add(_message_key(message_id, chat_id))
 
 
 def cleanup_old_messages():
-    """Clean up expired message records (thread-safe)
+    """Clean up expired message and media group records (thread-safe)
 
-    优化：
-    1. 清理过期的消息记录
-    2. 清理过期的媒体组记录
-    3. 如果缓存超过阈值，强制清理最旧的条目
+    消息缓存在每次写入时已按到期顺序淘汰，这里只处理长时间无新消息时残留的条目
     """
     current_time = time.time()
 
-    with _message_lock:
-        # 清理过期条目
-        expired_keys = [key for key, timestamp in processed_messages.items()
-                        if current_time - timestamp > MESSAGE_CACHE_TTL]
-        for key in expired_keys:
-            del processed_messages[key]
-
-        if expired_keys:
-            logger.debug(f"🧹 消息缓存清理: 移除{len(expired_keys)}个过期条目")
-
-        # 如果缓存仍然过大，强制清理最旧的条目
-        if len(processed_messages) > MESSAGE_CACHE_MAX_SIZE:
-            # 按时间戳排序，删除最旧的50%
-            sorted_items = sorted(processed_messages.items(), key=lambda x: x[1])
-            remove_count = len(sorted_items) // 2
-            for key, _ in sorted_items[:remove_count]:
-                del processed_messages[key]
-            logger.info(f"🧹 消息缓存超限，强制清理{remove_count}个最旧条目 (剩余: {len(processed_messages)})")
+    expired_count = processed_messages.expire()
+    if expired_count:
+        logger.debug(f"🧹 消息缓存清理: 移除{expired_count}个过期条目")
 
     # 优化：同时清理过期的媒体组缓存
     with _media_group_lock:
@@ -172,8 +229,7 @@ def get_cache_stats() -> dict:
     Returns:
         Dictionary with cache statistics
     """
-    with _message_lock:
-        message_count = len(processed_messages)
+    message_count = len(processed_messages)
     
     with _media_group_lock:
         media_group_count = len(processed_media_groups)
@@ -182,5 +238,6 @@ def get_cache_stats() -> dict:
         'message_cache_size': message_count,
         'media_group_cache_size': media_group_count,
         'message_cache_ttl': MESSAGE_CACHE_TTL,
+        'message_cache_max': MESSAGE_CACHE_MAX_SIZE,
         'media_group_cache_max': MAX_MEDIA_GROUP_CACHE
     }
@@ -0,0 +1,194 @@
+"""
+Media group fetch cache
+Shares get_media_group results across the handler, workers and chain hops
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from constants import MEDIA_GROUP_FETCH_CACHE_TTL, MEDIA_GROUP_FETCH_CACHE_SIZE, MEDIA_GROUP_FETCH_WAIT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupCache:
+    """Process-wide TTL + LRU cache of albums keyed by (chat_id, media_group_id)
+
+    Concurrent requests for the same album are collapsed: the first caller
+    fetches, the others wait for its result instead of calling the API again.
+    Albums that got a part after the handler assembled them are remembered as
+    incomplete, so their assembled ids are not trusted.
+    """
+
+    def __init__(self, ttl: float = MEDIA_GROUP_FETCH_CACHE_TTL, max_size: int = MEDIA_GROUP_FETCH_CACHE_SIZE,
+                 wait_timeout: float = MEDIA_GROUP_FETCH_WAIT_TIMEOUT):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, tuple]]" = OrderedDict()
+        self._pending: Dict[Tuple[int, str], threading.Event] = {}
+        # 组装后又收到迟到部分的相册（只保留最近 max_size 个）
+        self._incomplete: "OrderedDict[Tuple[int, str], None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(chat_id, media_group_id) -> Tuple[int, str]:
+        return int(chat_id), str(media_group_id)
+
+    def _lookup(self, key, now: float) -> Optional[tuple]:
+        """Return a fresh entry or None (caller holds the lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, messages = entry
+        if now - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return messages
+
+    def get(self, chat_id, media_group_id) -> Optional[List]:
+        """Return the cached album or None, counting a hit or a miss"""
+        key = self.make_key(chat_id, media_group_id)
+        with self._lock:
+            messages = self._lookup(key, time.monotonic())
+            if messages is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(messages)
+
+    def put(self, chat_id, media_group_id, messages):
+        """Store an album (empty results are not cached)"""
+        if not messages:
+            return
+        key = self.make_key(chat_id, media_group_id)
+        with self._lock:
+            self._store(key, tuple(messages))
+
+    def _store(self, key, messages: tuple):
+        self._entries[key] = (time.monotonic(), messages)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def add_late_part(self, chat_id, media_group_id, message):
+        """Record a part that arrived after its album was assembled
+
+        The part is merged into the cached album, and the album is marked
+        incomplete (see ``is_complete``).
+        """
+        key = self.make_key(chat_id, media_group_id)
+        with self._lock:
+            self._incomplete[key] = None
+            self._incomplete.move_to_end(key)
+            while len(self._incomplete) > self.max_size:
+                self._incomplete.popitem(last=False)
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, messages = entry
+                parts = {part.id: part for part in messages}
+                parts[message.id] = message
+                self._entries[key] = (stored_at, tuple(parts[message_id] for message_id in sorted(parts)))
+
+    def is_complete(self, chat_id, media_group_id) -> bool:
+        """Whether no part of the album arrived after the handler assembled it"""
+        key = self.make_key(chat_id, media_group_id)
+        with self._lock:
+            return key not in self._incomplete
+
+    def get_or_fetch(self, chat_id, media_group_id, fetch: Callable[[], List]) -> List:
+        """Return the cached album, calling fetch() at most once per album per TTL
+
+        Exceptions from fetch() propagate to the caller that made the request;
+        waiting callers then retry the fetch themselves.
+        """
+        key = self.make_key(chat_id, media_group_id)
+        while True:
+            with self._lock:
+                messages = self._lookup(key, time.monotonic())
+                if messages is not None:
+                    self.hits += 1
+                    return list(messages)
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+
+            # 同一相册正在被其他线程获取，等待其结果
+            if not pending.wait(self.wait_timeout):
+                logger.debug(f"📸 等待媒体组请求超时，直接获取: {key}")
+                with self._lock:
+                    self.misses += 1
+                return list(fetch() or [])
+
+            with self._lock:
+                messages = self._lookup(key, time.monotonic())
+                if messages is not None:
+                    self.hits += 1
+                    return list(messages)
+                if key in self._pending:
+                    continue
+                # 领头请求失败：自己发起请求
+                self.misses += 1
+                pending = self._pending[key] = threading.Event()
+                break
+
+        try:
+            messages = list(fetch() or [])
+            if messages:
+                with self._lock:
+                    self._store(key, tuple(messages))
+            return messages
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._incomplete.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return hit/miss counters (misses equal the get_media_group calls made)"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+media_group_cache = MediaGroupCache()
+
+
+def get_media_group(client, chat_id, message_id, media_group_id=None, fetch: Optional[Callable[[], List]] = None) -> List:
+    """Cached replacement for client.get_media_group(chat_id, message_id)
+
+    Args:
+        client: Pyrogram client used when the album is not cached
+        chat_id: Chat the album belongs to
+        message_id: Any message id in the album
+        media_group_id: Album id; without it the result cannot be cached
+        fetch: Optional callable replacing the direct API call (e.g. wrapped in FloodWait retry)
+    """
+    if fetch is None:
+        fetch = lambda: client.get_media_group(chat_id, message_id)
+    if not media_group_id:
+        return list(fetch() or [])
+    return media_group_cache.get_or_fetch(chat_id, media_group_id, fetch)
+
+
+def get_media_group_cache_stats() -> Dict[str, int]:
+    return media_group_cache.get_stats()
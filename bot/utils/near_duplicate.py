@@ -0,0 +1,282 @@
+"""
+Near-duplicate detection
+Keeps a rolling index of recently enqueued posts per destination: a 64-bit
+SimHash of the text and the file_unique_id of every media file. Reposts of
+the same post from other sources (new message ids, small edits) are found
+before any API call or download. A post is recorded only once the queue
+admits it, and forgotten again when it is dropped or its delivery fails.
+
+SimHash lookups use band indexing: two fingerprints within a Hamming distance
+of k agree on at least one of k+1 bands (pigeonhole), so a lookup is k+1 dict
+lookups plus one popcount per candidate. Fingerprints are computed on the
+dispatcher thread, so only the first NEAR_DUPLICATE_MAX_TEXT_LENGTH normalized
+characters are shingled and the per-bit counts are summed in packed integers.
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from constants import (
+    NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_MIN_TEXT_LENGTH, NEAR_DUPLICATE_MAX_TEXT_LENGTH,
+    NEAR_DUPLICATE_RETENTION, NEAR_DUPLICATE_MAX_ENTRIES
+)
+
+# 忽略大小写、空白和标点的差异
+_NOISE = re.compile(r"[\W_]+")
+SHINGLE_SIZE = 3
+HASH_BITS = 64
+
+# 每一位的计数占一个 16 位的槽，64 个槽打包进一个整数，一次加法累加全部 64 位
+_LANE_BITS = 16
+_LANE_MASK = (1 << _LANE_BITS) - 1
+# _SPREAD[i][b]: 哈希第 i 个字节取值为 b 时各位对应槽加一
+_SPREAD = [[sum(1 << ((i * 8 + bit) * _LANE_BITS) for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+           for i in range(HASH_BITS // 8)]
+
+# 带 file_unique_id 的媒体类型
+MEDIA_ATTRIBUTES = ("photo", "video", "animation", "document", "audio", "voice", "video_note", "sticker")
+
+# (source_chat_id, message_id)
+Origin = Tuple[str, int]
+
+
+def normalize_text(text: Optional[str]) -> str:
+    return _NOISE.sub("", text.lower()) if text else ""
+
+
+def simhash(text: Optional[str]) -> Optional[int]:
+    """64-bit SimHash over character 3-grams, or None for texts too short to compare
+
+    Character shingles need no word segmentation, so Chinese and mixed texts
+    work the same way as space-separated ones. Python's hash() is used for
+    the shingles: fingerprints are only compared within one process. Only the
+    first NEAR_DUPLICATE_MAX_TEXT_LENGTH normalized characters are used.
+    """
+    normalized = normalize_text(text)[:NEAR_DUPLICATE_MAX_TEXT_LENGTH]
+    if len(normalized) < NEAR_DUPLICATE_MIN_TEXT_LENGTH:
+        return None
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    s0, s1, s2, s3, s4, s5, s6, s7 = _SPREAD
+    counts = 0
+    for shingle in shingles:
+        h = hash(shingle)
+        counts += (s0[h & 0xFF] + s1[h >> 8 & 0xFF] + s2[h >> 16 & 0xFF] + s3[h >> 24 & 0xFF]
+                   + s4[h >> 32 & 0xFF] + s5[h >> 40 & 0xFF] + s6[h >> 48 & 0xFF] + s7[h >> 56 & 0xFF])
+    total = len(shingles)
+    fingerprint = 0
+    for bit in range(HASH_BITS):
+        if (counts >> (bit * _LANE_BITS) & _LANE_MASK) * 2 > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def media_unique_ids(messages: Iterable) -> Tuple[str, ...]:
+    """file_unique_id of every media file in a message or the parts of an album"""
+    ids = []
+    for message in messages:
+        for attribute in MEDIA_ATTRIBUTES:
+            media = getattr(message, attribute, None)
+            unique_id = getattr(media, 'file_unique_id', None) if media is not None else None
+            if unique_id:
+                ids.append(unique_id)
+                break
+    return tuple(ids)
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'media_ids', 'origin', 'added_at')
+
+    def __init__(self, fingerprint: Optional[int], media_ids: Tuple[str, ...], origin: Origin, added_at: float):
+        self.fingerprint = fingerprint
+        self.media_ids = media_ids
+        self.origin = origin
+        self.added_at = added_at
+
+
+class NearDuplicateIndex:
+    """Rolling index of recent posts for one destination
+
+    Entries are kept for ``retention`` seconds (at most ``max_entries``) and
+    expire in insertion order. A post with media is a duplicate when all of
+    its files were seen; a text-only post when an earlier text is within
+    ``max_distance`` bits. Matches with the same origin (the same message
+    enqueued for another watch) do not count.
+    """
+
+    def __init__(self, retention: float = NEAR_DUPLICATE_RETENTION, max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES,
+                 max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE, clock: Callable[[], float] = time.monotonic):
+        self.retention = retention
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._clock = clock
+        bands = max_distance + 1
+        width = HASH_BITS // bands
+        # (位移, 掩码)，最后一段包含除不尽的剩余位
+        self._band_specs = [(i * width, (1 << (width if i < bands - 1 else HASH_BITS - i * width)) - 1)
+                            for i in range(bands)]
+        self._bands: List[Dict[int, List[_Entry]]] = [{} for _ in range(bands)]
+        self._media: Dict[str, _Entry] = {}
+        # 按来源索引条目，discard 无需扫描
+        self._origins: Dict[Origin, List[_Entry]] = {}
+        # 按加入顺序排列的条目（OrderedDict 当作可按键删除的队列用）
+        self._ring: "OrderedDict[_Entry, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    def _band_keys(self, fingerprint: int):
+        return [(fingerprint >> shift) & mask for shift, mask in self._band_specs]
+
+    def _expire(self, now: float):
+        ring = self._ring
+        deadline = now - self.retention
+        while ring:
+            oldest = next(iter(ring))
+            if oldest.added_at > deadline and len(ring) <= self.max_entries:
+                break
+            del ring[oldest]
+            self._unlink(oldest)
+
+    def _unlink(self, entry: _Entry):
+        if entry.fingerprint is not None:
+            for band, key in zip(self._bands, self._band_keys(entry.fingerprint)):
+                bucket = band.get(key)
+                if bucket is not None:
+                    bucket.remove(entry)
+                    if not bucket:
+                        del band[key]
+        for unique_id in entry.media_ids:
+            if self._media.get(unique_id) is entry:
+                del self._media[unique_id]
+        entries = self._origins.get(entry.origin)
+        if entries is not None:
+            entries.remove(entry)
+            if not entries:
+                del self._origins[entry.origin]
+
+    def _find(self, fingerprint: Optional[int], media_ids: Tuple[str, ...], origin: Origin,
+              since: float) -> Optional[_Entry]:
+        if media_ids:
+            matched = None
+            for unique_id in media_ids:
+                entry = self._media.get(unique_id)
+                if entry is None or entry.added_at < since or entry.origin == origin:
+                    return None
+                matched = entry
+            return matched
+        if fingerprint is None:
+            return None
+        for band, key in zip(self._bands, self._band_keys(fingerprint)):
+            for entry in band.get(key, ()):
+                if (entry.added_at >= since and entry.origin != origin
+                        and hamming_distance(entry.fingerprint, fingerprint) <= self.max_distance):
+                    return entry
+        return None
+
+    def check(self, fingerprint: Optional[int], media_ids: Tuple[str, ...], origin: Origin,
+              window: float) -> Optional[Origin]:
+        """Look up a post without remembering it
+
+        Args:
+            fingerprint: SimHash of the text (None when too short)
+            media_ids: file_unique_ids of the post's media
+            origin: (source_chat_id, message_id) of the post
+            window: Only posts added within this many seconds count
+
+        Returns:
+            Origin of the earlier post if this one is a near duplicate, else None
+        """
+        if fingerprint is None and not media_ids:
+            return None
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            match = self._find(fingerprint, media_ids, origin, now - window)
+            return match.origin if match is not None else None
+
+    def add(self, fingerprint: Optional[int], media_ids: Tuple[str, ...], origin: Origin):
+        """Remember a post that is on its way to the destination"""
+        if fingerprint is None and not media_ids:
+            return
+        with self._lock:
+            self._add(fingerprint, media_ids, origin, self._clock())
+
+    def check_and_add(self, fingerprint: Optional[int], media_ids: Tuple[str, ...], origin: Origin,
+                      window: float) -> Optional[Origin]:
+        """``check`` and, if the post is new, ``add`` under one lock"""
+        if fingerprint is None and not media_ids:
+            return None
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            match = self._find(fingerprint, media_ids, origin, now - window)
+            if match is not None:
+                return match.origin
+            self._add(fingerprint, media_ids, origin, now)
+            return None
+
+    def discard(self, origin: Origin) -> bool:
+        """Forget the latest post of an origin that was not delivered (dropped or failed)
+
+        Returns:
+            True if an entry was removed
+        """
+        with self._lock:
+            entries = self._origins.get(origin)
+            if not entries:
+                return False
+            entry = entries[-1]
+            del self._ring[entry]
+            self._unlink(entry)
+            return True
+
+    def _add(self, fingerprint: Optional[int], media_ids: Tuple[str, ...], origin: Origin, now: float):
+        entry = _Entry(fingerprint, media_ids, origin, now)
+        self._ring[entry] = None
+        self._origins.setdefault(origin, []).append(entry)
+        if fingerprint is not None:
+            for band, key in zip(self._bands, self._band_keys(fingerprint)):
+                band.setdefault(key, []).append(entry)
+        for unique_id in media_ids:
+            self._media[unique_id] = entry
+        if len(self._ring) > self.max_entries:
+            self._expire(now)
+
+
+# 每个用户、每个目标一个索引：发往同一目标的不同来源共享，才能识别跨来源的转载
+_indexes: Dict[Tuple[str, str], NearDuplicateIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _scope(user_id: str, dest_chat_id: Optional[str]) -> Tuple[str, str]:
+    return str(user_id), str(dest_chat_id) if dest_chat_id else "record"
+
+
+def get_near_duplicate_index(user_id: str, dest_chat_id: Optional[str]) -> NearDuplicateIndex:
+    """Index shared by the watches of a user that deliver to one destination (record mode shares one)"""
+    scope = _scope(user_id, dest_chat_id)
+    index = _indexes.get(scope)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(scope, NearDuplicateIndex())
+    return index
+
+
+def forget_undelivered(msg_obj):
+    """Drop a queue entry that was not delivered (dropped or failed) from its destination's index
+
+    Only watches with near-duplicate suppression recorded the entry; reposts
+    of its content are let through again.
+    """
+    rule = getattr(msg_obj, 'rule', None)
+    if rule is None or not rule.data.get("near_duplicate") or getattr(msg_obj, 'message_id', None) is None:
+        return
+    index = _indexes.get(_scope(msg_obj.user_id, msg_obj.dest_chat_id))
+    if index is not None:
+        index.discard((msg_obj.source_chat_id, msg_obj.message_id))
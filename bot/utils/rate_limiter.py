@@ -0,0 +1,191 @@
+"""
+Adaptive token-bucket rate limiter
+Per-destination buckets plus one account-wide bucket. Destination rates are
+lowered when Telegram answers with FloodWait and recover gradually on success;
+learned rates are persisted across restarts.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+from config import load_rate_limit_state, save_rate_limit_state
+from constants import (
+    RATE_LIMIT_DELAY, RATE_LIMIT_BURST, GLOBAL_RATE_LIMIT, GLOBAL_RATE_LIMIT_BURST,
+    RATE_LIMIT_MIN_RATE, RATE_LIMIT_RECOVERY_STEP, RATE_LIMIT_SAVE_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket using reservations: tokens may go negative, the caller waits"""
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token and return how long the caller must wait for it"""
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class AdaptiveRateLimiter:
+    """Rate limiter keyed by destination chat with AIMD rate adaptation"""
+
+    def __init__(self, default_rate: float = 1.0 / RATE_LIMIT_DELAY, burst: float = RATE_LIMIT_BURST,
+                 global_rate: float = GLOBAL_RATE_LIMIT, global_burst: float = GLOBAL_RATE_LIMIT_BURST,
+                 persist: bool = True):
+        self.default_rate = default_rate
+        self.burst = burst
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._global = TokenBucket(global_rate, global_burst)
+        self._learned_rates: Dict[str, float] = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+        if persist:
+            self._load()
+
+    def _load(self):
+        """Restore learned destination rates from disk"""
+        try:
+            state = load_rate_limit_state()
+        except Exception as e:
+            logger.warning(f"⚠️ 加载限流状态失败: {e}")
+            return
+        for dest_key, entry in state.get("destinations", {}).items():
+            try:
+                rate = float(entry.get("rate", self.default_rate))
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if RATE_LIMIT_MIN_RATE <= rate < self.default_rate:
+                self._learned_rates[dest_key] = rate
+        if self._learned_rates:
+            logger.info(f"🚦 已恢复 {len(self._learned_rates)} 个目标的限流速率")
+
+    def _save(self, force: bool = False):
+        """Persist learned rates (throttled to RATE_LIMIT_SAVE_INTERVAL)"""
+        if not self.persist or not self._dirty:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_save < RATE_LIMIT_SAVE_INTERVAL:
+            return
+        with self._lock:
+            state = {
+                "destinations": {
+                    dest_key: {"rate": round(rate, 6), "updated": int(time.time())}
+                    for dest_key, rate in self._learned_rates.items()
+                }
+            }
+            self._dirty = False
+            self._last_save = now
+        try:
+            save_rate_limit_state(state)
+        except Exception as e:
+            logger.warning(f"⚠️ 保存限流状态失败: {e}")
+
+    def _bucket(self, dest_key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(dest_key)
+        if bucket is None:
+            rate = self._learned_rates.get(dest_key, self.default_rate)
+            bucket = TokenBucket(rate, self.burst, now)
+            self._buckets[dest_key] = bucket
+        return bucket
+
+    def get_rate(self, dest_key: str) -> float:
+        """Current allowed rate (messages per second) for a destination"""
+        with self._lock:
+            bucket = self._buckets.get(dest_key)
+            if bucket is not None:
+                return bucket.rate
+            return self._learned_rates.get(dest_key, self.default_rate)
+
+    def reserve(self, dest_key: Optional[str]) -> float:
+        """Reserve a send slot and return the wait time in seconds (no sleeping)"""
+        now = time.monotonic()
+        with self._lock:
+            wait = self._global.reserve(now)
+            if dest_key is not None:
+                wait = max(wait, self._bucket(dest_key, now).reserve(now))
+                blocked_until = self._blocked_until.get(dest_key)
+                if blocked_until is not None:
+                    if blocked_until > now:
+                        wait = max(wait, blocked_until - now)
+                    else:
+                        del self._blocked_until[dest_key]
+        return wait
+
+    def acquire(self, dest_key: Optional[str]):
+        """Block until a message may be sent to ``dest_key``"""
+        wait = self.reserve(dest_key)
+        if wait > 0:
+            logger.debug(f"🚦 限流等待 {wait:.2f} 秒 (目标: {dest_key})")
+            time.sleep(wait)
+
+    def report_flood_wait(self, dest_key: Optional[str], wait_seconds: float):
+        """Learn from a FloodWait: pause the destination and halve its rate"""
+        now = time.monotonic()
+        with self._lock:
+            if dest_key is None:
+                # 没有目标信息时暂停整个账号的发送
+                self._global.tokens = min(self._global.tokens, 0) - wait_seconds * self._global.rate
+                return
+            self._blocked_until[dest_key] = max(self._blocked_until.get(dest_key, 0), now + wait_seconds)
+            bucket = self._bucket(dest_key, now)
+            bucket.rate = max(RATE_LIMIT_MIN_RATE, min(bucket.rate / 2, 1.0 / max(wait_seconds, 1.0)))
+            bucket.tokens = min(bucket.tokens, 0)
+            self._learned_rates[dest_key] = bucket.rate
+            self._dirty = True
+        logger.warning(f"🚦 目标 {dest_key} 触发 FloodWait({wait_seconds}s)，速率降至 {bucket.rate:.3f} 条/秒")
+        self._save(force=True)
+
+    def report_success(self, dest_key: Optional[str]):
+        """Additive increase of a throttled destination's rate after a successful send"""
+        if dest_key is None:
+            return
+        with self._lock:
+            bucket = self._buckets.get(dest_key)
+            if bucket is None or bucket.rate >= self.default_rate:
+                return
+            bucket.rate = min(self.default_rate, bucket.rate + RATE_LIMIT_RECOVERY_STEP)
+            if bucket.rate >= self.default_rate:
+                self._learned_rates.pop(dest_key, None)
+            else:
+                self._learned_rates[dest_key] = bucket.rate
+            self._dirty = True
+        self._save()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Destinations currently running below the default rate"""
+        with self._lock:
+            return dict(self._learned_rates)
+
+
+_rate_limiter: Optional[AdaptiveRateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """Get the process-wide rate limiter (shared by all workers)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = AdaptiveRateLimiter()
+    return _rate_limiter
@@ -1,6 +1,27 @@
 """
 Worker threads for background processing
 """
-from .message_worker import MessageWorker, Message, UnrecoverableError
+from .message_worker import MessageWorker, Message, MessageRef, UnrecoverableError
+from .sharded_queue import ShardedMessageQueue, MessageWorkerPool, get_shard_key
+from .durable_queue import DurableQueueStore, DurableShardQueue, SpillableShardQueue
+from .delivery_ledger import DeliveryLedger
+from .download_pool import DownloadPool, configure_download_pool
+from .upload_queue import UploadQueue, start_upload_queue
 
-__all__ = ['MessageWorker', 'Message', 'UnrecoverableError']
+__all__ = [
+    'MessageWorker',
+    'Message',
+    'MessageRef',
+    'UnrecoverableError',
+    'ShardedMessageQueue',
+    'MessageWorkerPool',
+    'get_shard_key',
+    'DurableQueueStore',
+    'DurableShardQueue',
+    'SpillableShardQueue',
+    'DeliveryLedger',
+    'DownloadPool',
+    'configure_download_pool',
+    'UploadQueue',
+    'start_upload_queue',
+]
@@ -0,0 +1,190 @@
+"""
+Persistent delivery ledger backed by SQLite
+Records which (source chat, message id, watch) entries were already delivered,
+so updates replayed after a restart or reconnect are not forwarded again. An
+in-memory Bloom filter in front of the table answers most lookups (messages
+never seen before) without touching the database.
+"""
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (source_chat_id, message_id, user_id, watch_key)
+DeliveryKey = Tuple[int, int, str, str]
+
+# 清理过期记录的最小间隔（秒）
+PRUNE_INTERVAL = 60.0
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over hashable keys
+
+    Positions come from Python's hash() split into two halves (double
+    hashing). The filter only lives in memory and is rebuilt from the table
+    on start, so per-process hash randomization does not matter.
+    """
+    __slots__ = ("size", "hashes", "count", "_bits")
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self._bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DeliveryLedger:
+    """SQLite table of delivered entries with a Bloom filter front (one connection per thread)
+
+    Records older than ``retention`` seconds, and the oldest records beyond
+    ``max_entries``, are pruned at most once per PRUNE_INTERVAL.
+    """
+
+    def __init__(self, db_path: str, retention: float, max_entries: int, error_rate: float = 0.01):
+        self.db_path = db_path
+        self.retention = retention
+        self.max_entries = max_entries
+        self.error_rate = error_rate
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        # 统计：布隆过滤器直接排除的查询 / 查询数据库的次数
+        self.bloom_negatives = 0
+        self.db_lookups = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_schema()
+        self.prune()
+        self._bloom = self._build_bloom()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS deliveries (
+                source_chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                watch_key TEXT NOT NULL,
+                delivered_at REAL NOT NULL,
+                PRIMARY KEY (source_chat_id, message_id, user_id, watch_key)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_deliveries_delivered_at
+            ON deliveries(delivered_at)
+        ''')
+
+    def _build_bloom(self) -> BloomFilter:
+        bloom = BloomFilter(self.max_entries, self.error_rate)
+        for row in self._connect().execute(
+                "SELECT source_chat_id, message_id, user_id, watch_key FROM deliveries"):
+            bloom.add(tuple(row))
+        return bloom
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+
+    def was_delivered(self, key: DeliveryKey) -> bool:
+        """Check whether an entry was delivered within the retention period"""
+        with self._lock:
+            if key not in self._bloom:
+                self.bloom_negatives += 1
+                return False
+            self.db_lookups += 1
+        row = self._connect().execute('''
+            SELECT delivered_at FROM deliveries
+            WHERE source_chat_id = ? AND message_id = ? AND user_id = ? AND watch_key = ?
+        ''', key).fetchone()
+        return row is not None and row[0] > time.time() - self.retention
+
+    def record(self, key: DeliveryKey):
+        """Record a delivered entry"""
+        self._connect().execute('''
+            INSERT OR REPLACE INTO deliveries (source_chat_id, message_id, user_id, watch_key, delivered_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', key + (time.time(),))
+        with self._lock:
+            self._bloom.add(key)
+            due = time.monotonic() - self._last_prune >= PRUNE_INTERVAL
+        if due:
+            self.prune()
+
+    def prune(self) -> int:
+        """Remove records past the retention period or beyond max_entries
+
+        Returns:
+            Number of removed records
+        """
+        with self._lock:
+            self._last_prune = time.monotonic()
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM deliveries WHERE delivered_at < ?",
+                               (time.time() - self.retention,)).rowcount
+        removed += conn.execute('''
+            DELETE FROM deliveries WHERE delivered_at <= (
+                SELECT delivered_at FROM deliveries ORDER BY delivered_at DESC LIMIT 1 OFFSET ?
+            )
+        ''', (self.max_entries,)).rowcount
+
+        # 布隆过滤器无法删除元素：插入次数超过容量后按表中剩余记录重建，保持误判率
+        # 重建期间持有锁：记录先写表再加锁更新过滤器，因此不会漏掉并发写入的记录
+        with self._lock:
+            bloom = getattr(self, '_bloom', None)
+            if bloom is not None and bloom.count > self.max_entries:
+                self._bloom = self._build_bloom()
+        if removed:
+            logger.debug(f"🧹 投递记录清理: 移除 {removed} 条过期记录")
+        return removed
+
+    def get_stats(self) -> dict:
+        return {
+            'entries': len(self),
+            'bloom_negatives': self.bloom_negatives,
+            'db_lookups': self.db_lookups,
+            'retention': self.retention,
+            'max_entries': self.max_entries,
+        }
+
+
+def delivery_key(msg_obj) -> Optional[DeliveryKey]:
+    """Ledger key of a queue entry, or None if it has no message id"""
+    if getattr(msg_obj, 'message_id', None) is None:
+        return None
+    try:
+        source_chat_id = int(msg_obj.source_chat_id)
+    except (TypeError, ValueError):
+        return None
+    return (source_chat_id, int(msg_obj.message_id), str(msg_obj.user_id), str(msg_obj.watch_key))
@@ -0,0 +1,135 @@
+"""
+Media download pool
+Runs the items of a record-mode album concurrently on a thread pool shared by
+all workers of an account, so the account never has more than ``max_workers``
+downloads in flight. Results come back in album order; an item that runs
+longer than ``item_timeout`` is skipped, and a result it produces afterwards
+is handed to the caller's ``discard`` callback instead.
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from constants import MEDIA_DOWNLOAD_CONCURRENCY, MEDIA_DOWNLOAD_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadItem:
+    """State of one submitted item, passed to its task
+
+    A task whose item was abandoned (timed out) after it started should
+    discard its result instead of saving it. ``abandoned`` and ``finished``
+    are decided under ``lock``, so a result is either returned by
+    ``run_ordered`` or passed to ``discard``, never both or neither.
+    """
+    __slots__ = ('index', 'started', 'abandoned', 'finished', 'lock')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.started: Optional[float] = None
+        self.abandoned = False
+        self.finished = False
+        self.lock = threading.Lock()
+
+
+class DownloadPool:
+    """Bounded pool for media downloads of one account"""
+
+    def __init__(self, max_workers: int = MEDIA_DOWNLOAD_CONCURRENCY, item_timeout: float = MEDIA_DOWNLOAD_TIMEOUT):
+        self.max_workers = max_workers
+        self.item_timeout = item_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="MediaDownload")
+
+    @staticmethod
+    def _run(task: Callable[[DownloadItem], Any], item: DownloadItem, discard: Optional[Callable[[Any], None]]):
+        if item.abandoned:
+            return None
+        item.started = time.monotonic()
+        result = task(item)
+        with item.lock:
+            if not item.abandoned:
+                item.finished = True
+                return result
+        if discard is not None and result is not None:
+            try:
+                discard(result)
+            except Exception as e:
+                logger.error(f"      ❌ 丢弃媒体 {item.index + 1} 的结果失败: {e}")
+        return None
+
+    def run_ordered(self, tasks: Sequence[Callable[[DownloadItem], Any]],
+                    discard: Optional[Callable[[Any], None]] = None) -> List[Optional[Any]]:
+        """Run tasks concurrently and return their results in task order
+
+        A task that raises or runs longer than ``item_timeout`` yields None.
+        Items still waiting for a thread when the album as a whole has had
+        ``item_timeout`` per item are abandoned as well.
+
+        Args:
+            tasks: Callables taking their DownloadItem
+            discard: Called on the pool thread with the result of a task that
+                finished after its item was abandoned
+
+        Returns:
+            One result per task, in the same order
+        """
+        items = [DownloadItem(index) for index in range(len(tasks))]
+        futures = [self._executor.submit(self._run, task, item, discard) for task, item in zip(tasks, items)]
+        album_deadline = time.monotonic() + self.item_timeout * max(len(tasks), 1)
+        return [self._wait(future, item, album_deadline) for future, item in zip(futures, items)]
+
+    def _wait(self, future, item: DownloadItem, album_deadline: float):
+        while True:
+            now = time.monotonic()
+            started = item.started
+            deadline = album_deadline if started is None else min(started + self.item_timeout, album_deadline)
+            remaining = deadline - now
+            # 等待前面的项时已经完成的项直接取结果
+            if remaining <= 0 and not future.done():
+                with item.lock:
+                    # 任务已产出结果、正在返回时不再放弃
+                    item.abandoned = not item.finished
+                if item.abandoned:
+                    future.cancel()
+                    logger.warning(f"      ⚠️ 媒体 {item.index + 1} 处理超时（{self.item_timeout}秒），已跳过")
+                    return None
+                remaining = self.item_timeout
+            if started is None:
+                # 还在排队：等待一个超时周期后按实际开始时间重新计算
+                remaining = min(remaining, self.item_timeout)
+            try:
+                return future.result(timeout=max(remaining, 0))
+            except FuturesTimeoutError:
+                continue
+            except Exception as e:
+                logger.error(f"      ❌ 媒体 {item.index + 1} 处理失败: {e}")
+                return None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# 每个账号一个下载池，所有工作线程共享并发上限
+_pools: Dict[int, DownloadPool] = {}
+_pools_lock = threading.Lock()
+
+
+def configure_download_pool(acc, max_workers: int, item_timeout: float) -> DownloadPool:
+    """Create (or replace) the download pool of an account"""
+    with _pools_lock:
+        old = _pools.get(id(acc))
+        pool = _pools[id(acc)] = DownloadPool(max_workers, item_timeout)
+    if old is not None:
+        old.shutdown()
+    return pool
+
+
+def get_download_pool(acc) -> DownloadPool:
+    """Download pool of an account, created with the default limits on first use"""
+    pool = _pools.get(id(acc))
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(id(acc), DownloadPool())
+    return pool
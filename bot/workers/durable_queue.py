@@ -0,0 +1,289 @@
+"""
+Durable message queue backed by SQLite
+Stores a compact descriptor per queued message (chat id, message id, user id,
+watch key) in an append-only WAL table with claim/ack/nack semantics, so queued
+and retrying messages survive crashes and restarts. The worker refetches the
+Pyrogram message when the item is processed.
+"""
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 0
+STATUS_CLAIMED = 1
+
+
+class DurableQueueStore:
+    """SQLite storage shared by all durable shards (one connection per thread)"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS queue_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shard INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                watch_key TEXT NOT NULL,
+                dest_chat_id TEXT,
+                retry_count INTEGER NOT NULL DEFAULT 0,
+                status INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                claimed_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_queue_items_claim
+            ON queue_items(shard, status, id)
+        ''')
+
+    def notify(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait(self, timeout: float):
+        with self._condition:
+            self._condition.wait(timeout)
+
+    def recover(self, num_shards: int) -> int:
+        """Return items claimed by a previous process to the pending state
+
+        Items stored for a shard that no longer exists (worker count changed)
+        are moved to ``shard % num_shards``.
+
+        Returns:
+            Number of pending items after recovery
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE queue_items SET status = ?, claimed_at = NULL WHERE status = ?",
+                         (STATUS_PENDING, STATUS_CLAIMED))
+            conn.execute("UPDATE queue_items SET shard = shard % ? WHERE shard >= ?", (num_shards, num_shards))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.count()
+
+    def enqueue(self, shard: int, chat_id: int, message_id: int, user_id: str, watch_key: str,
+                dest_chat_id: Optional[str] = None, retry_count: int = 0) -> int:
+        """Append a descriptor and return its item id"""
+        cursor = self._connect().execute('''
+            INSERT INTO queue_items (shard, chat_id, message_id, user_id, watch_key, dest_chat_id, retry_count, status, enqueued_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (shard, chat_id, message_id, user_id, watch_key, dest_chat_id, retry_count, STATUS_PENDING, time.time()))
+        return cursor.lastrowid
+
+    def claim(self, shard: int) -> Optional[Tuple]:
+        """Claim the oldest pending item of a shard
+
+        Returns:
+            (id, chat_id, message_id, user_id, watch_key, dest_chat_id, retry_count) or None
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute('''
+                SELECT id, chat_id, message_id, user_id, watch_key, dest_chat_id, retry_count
+                FROM queue_items WHERE shard = ? AND status = ? ORDER BY id LIMIT 1
+            ''', (shard, STATUS_PENDING)).fetchone()
+            if row:
+                conn.execute("UPDATE queue_items SET status = ?, claimed_at = ? WHERE id = ?",
+                             (STATUS_CLAIMED, time.time(), row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def ack(self, item_id: int):
+        """Remove a finished item"""
+        self._connect().execute("DELETE FROM queue_items WHERE id = ?", (item_id,))
+
+    def nack(self, item_id: int, retry_count: int):
+        """Return a claimed item to the pending state for another attempt"""
+        self._connect().execute(
+            "UPDATE queue_items SET status = ?, retry_count = ?, claimed_at = NULL WHERE id = ?",
+            (STATUS_PENDING, retry_count, item_id)
+        )
+
+    def count(self, shard: Optional[int] = None, status: Optional[int] = None) -> int:
+        query = "SELECT COUNT(*) FROM queue_items WHERE 1=1"
+        params = []
+        if shard is not None:
+            query += " AND shard = ?"
+            params.append(shard)
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        return self._connect().execute(query, params).fetchone()[0]
+
+
+class DurableShardQueue:
+    """One shard of the durable queue, exposing the ``queue.Queue`` API used by MessageWorker
+
+    ``put`` persists only the descriptor. ``get`` returns the live Message when it
+    was enqueued by this process, otherwise (after a restart) a Message whose
+    Pyrogram message and watch data must be rehydrated by the worker. ``ack``
+    removes an item once its outcome is final.
+    """
+
+    def __init__(self, store: DurableQueueStore, shard_id: int):
+        self.store = store
+        self.shard_id = shard_id
+        # 本进程入队的消息对象，取出时直接复用，只有重启后恢复的条目需要重新获取
+        self._live: Dict[int, Any] = {}
+
+    def put(self, msg_obj, block: bool = True, timeout: float = None):
+        if msg_obj.queue_id is not None:
+            self.store.nack(msg_obj.queue_id, msg_obj.retry_count)
+        else:
+            msg_obj.queue_id = self.store.enqueue(
+                self.shard_id,
+                int(msg_obj.source_chat_id),
+                msg_obj.message_id,
+                str(msg_obj.user_id),
+                msg_obj.watch_key,
+                msg_obj.dest_chat_id,
+                msg_obj.retry_count
+            )
+        self._live[msg_obj.queue_id] = msg_obj
+        self.store.notify()
+
+    def put_nowait(self, msg_obj):
+        self.put(msg_obj, block=False)
+
+    def spill_put(self, msg_obj):
+        """Enqueue only the descriptor, without keeping the entry in memory"""
+        self.put(msg_obj)
+        self._live.pop(msg_obj.queue_id, None)
+
+    def get(self, block: bool = True, timeout: float = None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            row = self.store.claim(self.shard_id)
+            if row:
+                return self._to_message(row)
+            if not block:
+                raise queue.Empty
+            remaining = 1.0 if deadline is None else deadline - time.time()
+            if remaining <= 0:
+                raise queue.Empty
+            self.store.wait(min(remaining, 1.0))
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def _to_message(self, row):
+        from bot.workers.message_worker import Message
+
+        item_id, chat_id, message_id, user_id, watch_key, dest_chat_id, retry_count = row
+        live = self._live.pop(item_id, None)
+        if live is not None:
+            return live
+        return Message(
+            user_id=user_id,
+            watch_key=watch_key,
+            message=None,
+            watch_data=None,
+            source_chat_id=str(chat_id),
+            dest_chat_id=dest_chat_id,
+            message_text="",
+            retry_count=retry_count,
+            message_id=message_id,
+            queue_id=item_id
+        )
+
+    def ack(self, msg_obj):
+        if msg_obj.queue_id is not None:
+            self._live.pop(msg_obj.queue_id, None)
+            self.store.ack(msg_obj.queue_id)
+
+    def task_done(self):
+        pass
+
+    def qsize(self) -> int:
+        return self.store.count(self.shard_id, STATUS_PENDING)
+
+    def join(self):
+        """Block until the shard holds no pending or claimed items"""
+        while self.store.count(self.shard_id) > 0:
+            time.sleep(0.05)
+
+
+class SpillableShardQueue(queue.Queue):
+    """In-memory shard that overflows to a DurableShardQueue
+
+    Entries handed to ``spill_put`` are written to disk as descriptors. While
+    any spilled entry is pending, new entries are spilled too so the shard stays
+    FIFO: in-memory entries are always older than spilled ones.
+    """
+
+    def __init__(self, spill: DurableShardQueue):
+        super().__init__()
+        self.spill = spill
+        # 上次运行时溢出到磁盘、尚未处理的条目
+        self._spill_pending = spill.qsize()
+        self.unfinished_tasks = self._spill_pending
+
+    def _qsize(self):
+        return len(self.queue) + self._spill_pending
+
+    def _put(self, msg_obj):
+        # 已溢出条目的重试、或仍有条目在磁盘上时，保持在磁盘上排队
+        if getattr(msg_obj, 'queue_id', None) is not None or self._spill_pending:
+            self._spill(msg_obj)
+        else:
+            self.queue.append(msg_obj)
+
+    def _get(self):
+        if self.queue:
+            return self.queue.popleft()
+        self._spill_pending -= 1
+        return self.spill.get(block=False)
+
+    def _spill(self, msg_obj):
+        self.spill.spill_put(msg_obj)
+        self._spill_pending += 1
+
+    def spill_put(self, msg_obj):
+        """Enqueue an entry on disk instead of in memory"""
+        with self.not_full:
+            self._spill(msg_obj)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def memory_size(self) -> int:
+        """Number of entries held in memory"""
+        with self.mutex:
+            return len(self.queue)
+
+    def ack(self, msg_obj):
+        if getattr(msg_obj, 'queue_id', None) is not None:
+            self.spill.ack(msg_obj)
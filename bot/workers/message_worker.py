@@ -2,27 +2,42 @@
 Message queue worker thread
 Processes messages from the queue and handles forwarding/recording
 """
+import sys
 import time
 import asyncio
 import os
 import logging
 import queue
 import re
-from dataclasses import dataclass, field
-from typing import Optional, Dict, Any
+from collections import deque
+from functools import partial
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import pyrogram
 from pyrogram.errors import FloodWait
 
-from database import add_note
+from database import add_note, pin_media_blob, register_media_blob, release_media_blobs
 from config import load_watch_config, load_webdav_config, MEDIA_DIR
-from bot.filters import check_whitelist, check_blacklist, check_whitelist_regex, check_blacklist_regex, extract_content
+from bot.filters import extract_content, pack_texts
+from bot.filters.engine import FilterVerdict, STAGE_BLACKLIST, STAGE_BLACKLIST_REGEX, STAGE_WHITELIST
 from bot.storage.webdav_client import WebDAVClient, StorageManager
+from bot.storage.media_store import file_content_hash, blob_location
+from bot.workers.retry_scheduler import RetryScheduler
+from bot.workers.delivery_ledger import delivery_key
+from bot.workers.download_pool import get_download_pool
+from bot.services.watch_rules import WatchRule, intern_watch_rule
+from bot.services.peer_cache import cache_peer_if_needed
+from bot.services.watch_index import get_watch_index
+from bot.utils.peer import is_dest_cached
 from bot.utils.dedup import cleanup_old_messages
+from bot.utils.media_group_cache import media_group_cache, get_media_group, get_media_group_cache_stats
+from bot.utils.magnet import fill_missing_dn
+from bot.utils.near_duplicate import forget_undelivered
+from bot.utils.rate_limiter import get_rate_limiter
 from constants import (
     MAX_RETRIES, MAX_FLOOD_RETRIES, OPERATION_TIMEOUT,
-    WORKER_STATS_INTERVAL, RATE_LIMIT_DELAY, get_backoff_time, MAX_MEDIA_PER_GROUP
+    WORKER_STATS_INTERVAL, get_backoff_time, MAX_MEDIA_PER_GROUP,
+    COALESCE_WINDOW, COALESCE_MAX_BATCH
 )
 
 logger = logging.getLogger(__name__)
@@ -36,47 +51,173 @@ class UnrecoverableError(Exception):
     pass
 
 
-@dataclass
+MEDIA_KINDS = ("photo", "video", "animation", "document")
+DOWNLOADABLE_MEDIA_KINDS = ("photo", "video", "animation")
+
+# 可合并处理的消息类型（见 MessageWorker._coalesce_kind）
+COALESCE_FORWARD = "forward"
+COALESCE_EXTRACT = "extract"
+
+
+def get_media_kind(message) -> Optional[str]:
+    """Get the media type of a Pyrogram message relevant for forwarding/recording"""
+    for kind in MEDIA_KINDS:
+        if getattr(message, kind, None):
+            return kind
+    return None
+
+
+class MessageRef:
+    """Identifies a Telegram message for forward/copy calls without holding the Pyrogram object"""
+
+    __slots__ = ('chat_id', 'id', 'media_group_id', 'media_kind', 'album_ids')
+
+    def __init__(self, chat_id: int, message_id: int, media_group_id: Optional[str] = None,
+                 media_kind: Optional[str] = None, album_ids: Optional[Tuple[int, ...]] = None):
+        self.chat_id = chat_id
+        self.id = message_id
+        self.media_group_id = media_group_id
+        self.media_kind = media_kind
+        self.album_ids = album_ids  # 处理器组装好的相册各部分ID（未知时为 None）
+
+    @classmethod
+    def from_message(cls, message) -> "MessageRef":
+        return cls(message.chat.id, message.id, message.media_group_id, get_media_kind(message))
+
+
 class Message:
-    """消息对象，封装消息元数据（优化：只保留必要数据，减少内存占用）"""
-    user_id: str
-    watch_key: str
-    message: pyrogram.types.messages_and_media.message.Message  # 保留完整对象用于转发
-    watch_data: Dict[str, Any]
-    source_chat_id: str
-    dest_chat_id: Optional[str]
-    message_text: str
-    timestamp: float = field(default_factory=time.time)
-    retry_count: int = 0
-    media_group_key: Optional[str] = None
-
-    def __post_init__(self):
-        """优化：清理message对象中不必要的大型属性以减少内存"""
-        # 注意：不能删除message对象本身，因为转发需要它
-        # 但可以在处理完成后由worker清理
-        pass
+    """队列中的消息条目（紧凑结构，使用 __slots__）
+
+    只保存消息ID、预处理后的文本和共享的 WatchRule，不持有 Pyrogram 消息对象。
+    转发/复制只需要ID；记录模式需要下载媒体时，worker 才重新获取原始消息。
+    """
+
+    __slots__ = (
+        'user_id', 'watch_key', 'message', 'rule', 'source_chat_id', 'dest_chat_id',
+        'message_text', 'timestamp', 'retry_count', 'media_group_key', 'message_id',
+        'queue_id', 'media_group_id', 'media_kind', 'source_name', 'album_ids', 'verdict'
+    )
+
+    def __init__(self, user_id: str, watch_key: str, message, watch_data: Optional[Dict[str, Any]],
+                 source_chat_id: str, dest_chat_id: Optional[str], message_text: str,
+                 timestamp: Optional[float] = None, retry_count: int = 0,
+                 media_group_key: Optional[str] = None, message_id: Optional[int] = None,
+                 queue_id: Optional[int] = None, media_group_id: Optional[str] = None,
+                 media_kind: Optional[str] = None, source_name: Optional[str] = None,
+                 album_ids: Optional[Tuple[int, ...]] = None, verdict: Optional[FilterVerdict] = None):
+        self.user_id = user_id
+        self.watch_key = watch_key
+        self.message = message  # Pyrogram 消息对象，仅在重新获取后暂存
+        self.rule = intern_watch_rule(watch_data)
+        self.source_chat_id = source_chat_id
+        self.dest_chat_id = dest_chat_id
+        self.message_text = message_text
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.retry_count = retry_count
+        self.media_group_key = media_group_key
+        self.message_id = message_id
+        self.queue_id = queue_id  # 持久化队列中的条目ID
+        self.media_group_id = media_group_id
+        self.media_kind = media_kind
+        self.source_name = source_name
+        self.album_ids = album_ids
+        self.verdict = verdict  # 入队时计算的过滤结果（带规则版本）
+
+    @classmethod
+    def from_pyrogram(cls, user_id: str, watch_key: str, message, watch_data: Dict[str, Any],
+                      source_chat_id: str, dest_chat_id: Optional[str], message_text: str,
+                      media_group_key: Optional[str] = None,
+                      album_ids: Optional[Tuple[int, ...]] = None,
+                      verdict: Optional[FilterVerdict] = None) -> "Message":
+        """Build a compact entry from a Pyrogram message without keeping a reference to it"""
+        chat = message.chat
+        source_name = getattr(chat, 'title', None) or getattr(chat, 'username', None)
+        return cls(
+            user_id=user_id,
+            watch_key=watch_key,
+            message=None,
+            watch_data=watch_data,
+            source_chat_id=sys.intern(source_chat_id),
+            dest_chat_id=dest_chat_id,
+            message_text=message_text,
+            media_group_key=media_group_key,
+            message_id=message.id,
+            media_group_id=sys.intern(str(message.media_group_id)) if message.media_group_id else None,
+            media_kind=get_media_kind(message),
+            source_name=sys.intern(source_name) if source_name else None,
+            album_ids=tuple(album_ids) if album_ids else None,
+            verdict=verdict
+        )
+
+    @property
+    def watch_data(self) -> Optional[Dict[str, Any]]:
+        return self.rule.data if self.rule is not None else None
+
+    @watch_data.setter
+    def watch_data(self, watch_data: Optional[Dict[str, Any]]):
+        self.rule = intern_watch_rule(watch_data)
+
+    def needs_download(self) -> bool:
+        """Whether record mode must fetch the original message to download media"""
+        return bool(self.media_group_id) or self.media_kind in DOWNLOADABLE_MEDIA_KINDS
+
+    def ref(self) -> MessageRef:
+        if self.message is not None:
+            ref = MessageRef.from_message(self.message)
+            ref.album_ids = self.album_ids
+            return ref
+        return MessageRef(int(self.source_chat_id), self.message_id, self.media_group_id, self.media_kind,
+                          self.album_ids)
+
+    def __repr__(self):
+        return (f"Message(user_id={self.user_id!r}, watch_key={self.watch_key!r}, "
+                f"source_chat_id={self.source_chat_id!r}, dest_chat_id={self.dest_chat_id!r}, "
+                f"message_id={self.message_id!r}, retry_count={self.retry_count})")
 
 
 class MessageWorker:
     """消息工作线程，处理队列中的消息"""
 
-    def __init__(self, message_queue: queue.Queue, acc_client, max_retries: int = MAX_RETRIES):
+    def __init__(self, message_queue: queue.Queue, acc_client, max_retries: int = MAX_RETRIES, shard_id: int = 0,
+                 coalesce_window: float = COALESCE_WINDOW, delivery_ledger=None, upload_queue=None):
         self.message_queue = message_queue
         self.acc = acc_client
         self.max_retries = max_retries
+        self.shard_id = shard_id
         self.processed_count = 0
         self.failed_count = 0
         self.skipped_count = 0
         self.retry_count = 0
+        self.in_flight = 0
         self.running = True
+        self.retry_scheduler = RetryScheduler()
+        self.coalesce_window = coalesce_window
+        # 持久化的已投递记录（可选），跳过重启或重连后重放的已投递消息
+        self.delivery_ledger = delivery_ledger
+        # 后台上传队列（可选）：启用时媒体先保存到本地，笔记保存后再上传到 WebDAV
+        self.upload_queue = upload_queue
+        # 合并转发时取出但不属于当前批次的消息，按顺序优先处理
+        self._stash = deque()
+        # 已在本线程确认可用的 Peer（Peer 缓存从消息处理器移到发送前进行）
+        self._warmed_peers = set()
+        self.rate_limiter = get_rate_limiter()
         self.last_stats_time = time.time()
         self.loop = None
 
+        # 吞吐量统计（基于两次采样之间完成的消息数）
+        self._throughput_sample_time = time.time()
+        self._throughput_sample_count = 0
+        self._throughput = 0.0
+
         # 初始化存储管理器
         self.storage_manager = self._init_storage_manager()
 
     def _init_storage_manager(self) -> StorageManager:
         """初始化存储管理器"""
+        if self.upload_queue is not None:
+            logger.info("📁 媒体保存到本地，由后台上传线程推送到 WebDAV")
+            return StorageManager(MEDIA_DIR)
+
         try:
             # 加载 WebDAV 配置
             webdav_config = load_webdav_config()
@@ -111,6 +252,36 @@ class MessageWorker:
             logger.error(f"❌ 存储管理器初始化失败: {e}，使用本地存储")
             return StorageManager(MEDIA_DIR)
 
+    def get_throughput(self) -> float:
+        """Messages completed per second since the previous sample"""
+        now = time.time()
+        elapsed = now - self._throughput_sample_time
+        if elapsed >= 1.0:
+            completed = self.processed_count + self.skipped_count + self.failed_count
+            self._throughput = (completed - self._throughput_sample_count) / elapsed
+            self._throughput_sample_count = completed
+            self._throughput_sample_time = now
+        return self._throughput
+
+    def _log_stats(self):
+        """Log shard statistics"""
+        queue_size = self.message_queue.qsize()
+        if queue_size > 0 or self.processed_count > 0 or len(self.retry_scheduler) > 0:
+            logger.info(
+                f"📊 分片#{self.shard_id} 统计: 待处理={queue_size}, 处理中={self.in_flight}, "
+                f"吞吐={self.get_throughput():.2f}条/秒, 已完成={self.processed_count}, "
+                f"跳过={self.skipped_count}, 失败={self.failed_count}, 重试={self.retry_count}, "
+                f"等待重试={len(self.retry_scheduler)}"
+            )
+        # 媒体组缓存是进程级共享的，只由一个分片输出
+        if self.shard_id == 0:
+            cache_stats = get_media_group_cache_stats()
+            if cache_stats["hits"] or cache_stats["misses"]:
+                logger.info(
+                    f"📸 媒体组缓存: 命中={cache_stats['hits']}, 未命中={cache_stats['misses']}, "
+                    f"缓存={cache_stats['size']}"
+                )
+
     def run(self):
         """主循环：持续处理队列消息"""
         import gc
@@ -118,88 +289,231 @@ class MessageWorker:
         # Create event loop for this thread
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
-        logger.info("🔧 消息工作线程已启动（带事件循环）")
+        logger.info(f"🔧 消息工作线程 #{self.shard_id} 已启动（带事件循环）")
 
         # 优化：记录垃圾回收计数器
         gc_counter = 0
 
         while self.running:
+            # 已从队列取出但尚未确认（task_done）的消息数
+            unacked = 0
             try:
-                # 获取消息，超时1秒以便定期检查running状态
+                # Periodically log statistics and cleanup (also under sustained load)
+                if time.time() - self.last_stats_time > WORKER_STATS_INTERVAL:
+                    self._log_stats()
+
+                    # 清理过期的消息缓存，防止内存泄漏
+                    cleanup_old_messages()
+
+                    # 优化：定期强制垃圾回收（每3个清理周期）
+                    gc_counter += 1
+                    if gc_counter >= 3:
+                        collected = gc.collect()
+                        logger.debug(f"🧹 强制垃圾回收: 回收了 {collected} 个对象")
+                        gc_counter = 0
+
+                    self.last_stats_time = time.time()
+
+                # 退避时间已到的重试消息重新入队
+                for due_msg in self.retry_scheduler.pop_due():
+                    self.message_queue.put(due_msg)
+                    logger.info(f"🔄 消息已重新入队 (第 {due_msg.retry_count}/{self.max_retries} 次重试)")
+
+                # 获取消息，超时1秒以便定期检查running状态（有挂起的重试时按到期时间缩短）
+                wait_timeout = 1.0
+                next_due = self.retry_scheduler.time_until_next()
+                if next_due is not None:
+                    wait_timeout = min(wait_timeout, max(next_due, 0.01))
                 try:
-                    msg_obj = self.message_queue.get(timeout=1)
+                    if self._stash:
+                        msg_obj = self._stash.popleft()
+                    else:
+                        msg_obj = self.message_queue.get(timeout=wait_timeout)
+                    unacked = 1
                 except queue.Empty:
-                    # Periodically log statistics and cleanup
-                    if time.time() - self.last_stats_time > WORKER_STATS_INTERVAL:
-                        queue_size = self.message_queue.qsize()
-                        if queue_size > 0 or self.processed_count > 0:
-                            logger.info(f"📊 队列统计: 待处理={queue_size}, 已完成={self.processed_count}, 跳过={self.skipped_count}, 失败={self.failed_count}, 重试={self.retry_count}")
-
-                        # 清理过期的消息缓存，防止内存泄漏
-                        cleanup_old_messages()
-
-                        # 优化：定期强制垃圾回收（每3个清理周期）
-                        gc_counter += 1
-                        if gc_counter >= 3:
-                            collected = gc.collect()
-                            logger.debug(f"🧹 强制垃圾回收: 回收了 {collected} 个对象")
-                            gc_counter = 0
-
-                        self.last_stats_time = time.time()
+                    # 空闲时同步尚未 fsync 的媒体文件
+                    self.storage_manager.flush()
                     continue
+
+                # 合并同一来源、同一目标的连续转发
+                batch = self._collect_batch(msg_obj)
+                unacked = len(batch)
                 
                 # 记录队列统计信息
                 queue_size = self.message_queue.qsize()
-                logger.info(f"📥 从队列取出消息 (队列剩余: {queue_size}, 已处理: {self.processed_count}, 跳过: {self.skipped_count}, 失败: {self.failed_count})")
+                logger.info(f"📥 分片#{self.shard_id} 从队列取出 {len(batch)} 条消息 (队列剩余: {queue_size}, 已处理: {self.processed_count}, 跳过: {self.skipped_count}, 失败: {self.failed_count})")
                 
-                # 处理消息
-                result = self.process_message(msg_obj)
-
-                # 优化：处理完成后立即清理消息对象，释放内存
-                try:
-                    del msg_obj.message  # 删除Pyrogram消息对象
-                    msg_obj.message = None
-                except:
-                    pass
-
-                if result == "success":
-                    self.processed_count += 1
-                    logger.info(f"✅ 消息处理成功 (总计: {self.processed_count})")
-                elif result == "skip":
-                    self.skipped_count += 1
-                    logger.info(f"⏭️ 消息已跳过 (总计: {self.skipped_count})")
-                elif result == "retry":
-                    # 失败处理：重试或放弃
-                    if msg_obj.retry_count < self.max_retries:
-                        msg_obj.retry_count += 1
-                        self.retry_count += 1
-                        # Calculate exponential backoff time
-                        backoff_time = get_backoff_time(msg_obj.retry_count)
-                        logger.warning(f"⚠️ 消息处理失败，将在 {backoff_time} 秒后重试 (第 {msg_obj.retry_count}/{self.max_retries} 次)")
-                        time.sleep(backoff_time)
-                        # 重新入队
-                        self.message_queue.put(msg_obj)
-                        logger.info(f"🔄 消息已重新入队")
+                # 处理消息（重启或重连前已投递过的消息直接跳过）
+                results = []
+                pending = []
+                for entry in batch:
+                    if self._already_delivered(entry):
+                        results.append((entry, "skip"))
                     else:
-                        self.failed_count += 1
-                        logger.error(f"❌ 消息处理最终失败，已达最大重试次数 (总失败: {self.failed_count})")
-                
-                # 标记任务完成
-                self.message_queue.task_done()
+                        pending.append(entry)
+                self.in_flight += len(pending)
+                try:
+                    if len(pending) > 1:
+                        results += self._process_batch(pending)
+                    elif pending:
+                        results.append((pending[0], self.process_message(pending[0])))
+                finally:
+                    self.in_flight -= len(pending)
+
+                for done_msg, result in results:
+                    self._finish_message(done_msg, result)
+                    # 标记任务完成
+                    self.message_queue.task_done()
+                    unacked -= 1
                 
             except Exception as e:
                 logger.error(f"⚠️ 工作线程异常: {e}", exc_info=True)
-                # 确保task_done被调用
-                try:
-                    self.message_queue.task_done()
-                except ValueError:
-                    pass
+            finally:
+                # 确保取出的每条消息都调用 task_done，queue.join() 和队列统计保持准确
+                for _ in range(unacked):
+                    try:
+                        self.message_queue.task_done()
+                    except ValueError:
+                        break
         
+        self.storage_manager.flush()
+
         # Clean up event loop
         if self.loop:
             self.loop.close()
-        logger.info("🛑 消息工作线程已停止")
+        logger.info(f"🛑 消息工作线程 #{self.shard_id} 已停止")
     
+    def _already_delivered(self, msg_obj: Message) -> bool:
+        """Check the delivery ledger for an entry delivered before a restart or reconnect"""
+        if self.delivery_ledger is None:
+            return False
+        key = delivery_key(msg_obj)
+        if key is None:
+            return False
+        try:
+            delivered = self.delivery_ledger.was_delivered(key)
+        except Exception as e:
+            logger.error(f"❌ 查询投递记录失败: {e}")
+            return False
+        if delivered:
+            logger.info(f"⏭️ 消息已投递过，跳过: source={msg_obj.source_chat_id}, message_id={msg_obj.message_id}, watch={msg_obj.watch_key}")
+        return delivered
+
+    def _record_delivery(self, msg_obj: Message):
+        key = delivery_key(msg_obj)
+        if key is None:
+            return
+        try:
+            self.delivery_ledger.record(key)
+        except Exception as e:
+            logger.error(f"❌ 写入投递记录失败: {e}")
+
+    def _finish_message(self, msg_obj: Message, result: str):
+        """Update counters and acknowledge, park or give up a processed entry"""
+        # 先写投递记录再确认出队，两者之间崩溃时由投递记录挡住重放
+        if result == "success" and self.delivery_ledger is not None:
+            self._record_delivery(msg_obj)
+
+        # 优化：处理完成后立即清理消息对象，释放内存（待重试的消息需保留）
+        # 最终结果（成功/跳过/放弃）同时确认出队，待重试的消息保留在持久化队列中
+        if result != "retry" or msg_obj.retry_count >= self.max_retries:
+            msg_obj.message = None  # 释放重新获取的Pyrogram消息对象
+            self._ack(msg_obj)
+            # 只有投递失败才忘记指纹；跳过（如已投递过的重放）的原帖仍在目标中
+            if result == "retry":
+                forget_undelivered(msg_obj)
+
+        if result == "success":
+            self.processed_count += 1
+            logger.info(f"✅ 消息处理成功 (总计: {self.processed_count})")
+        elif result == "skip":
+            self.skipped_count += 1
+            logger.info(f"⏭️ 消息已跳过 (总计: {self.skipped_count})")
+        elif result == "retry":
+            # 失败处理：重试或放弃
+            if msg_obj.retry_count < self.max_retries:
+                msg_obj.retry_count += 1
+                self.retry_count += 1
+                # Calculate exponential backoff time
+                backoff_time = get_backoff_time(msg_obj.retry_count)
+                # 挂起到重试堆中，不阻塞后续消息的处理
+                if self.retry_scheduler.schedule(msg_obj, backoff_time):
+                    logger.warning(f"⚠️ 消息处理失败，约 {backoff_time} 秒后重试 (第 {msg_obj.retry_count}/{self.max_retries} 次，等待重试: {len(self.retry_scheduler)})")
+                else:
+                    self.failed_count += 1
+                    self._ack(msg_obj)
+                    forget_undelivered(msg_obj)
+                    logger.error(f"❌ 重试队列已满（{self.retry_scheduler.max_parked}），放弃该消息 (总失败: {self.failed_count})")
+            else:
+                self.failed_count += 1
+                logger.error(f"❌ 消息处理最终失败，已达最大重试次数 (总失败: {self.failed_count})")
+
+    def _ack(self, msg_obj: Message):
+        """确认消息已处理完毕（仅持久化队列需要）"""
+        ack = getattr(self.message_queue, 'ack', None)
+        if ack is None:
+            return
+        try:
+            ack(msg_obj)
+        except Exception as e:
+            logger.error(f"❌ 持久化队列确认失败: {e}")
+
+    def _rehydrate_message(self, msg_obj: Message):
+        """重新获取队列条目缺少的监控规则和原始消息
+
+        持久化队列重启后恢复的条目两者都需要；普通条目只在记录模式下载媒体时获取原始消息。
+
+        Raises:
+            UnrecoverableError: 原始消息或监控配置已不存在
+        """
+        if msg_obj.rule is None:
+            watch_data = load_watch_config().get(str(msg_obj.user_id), {}).get(msg_obj.watch_key)
+            if not isinstance(watch_data, dict):
+                raise UnrecoverableError(f"监控配置已删除: user={msg_obj.user_id}, watch={msg_obj.watch_key}")
+            msg_obj.watch_data = watch_data
+
+        if msg_obj.message is None:
+            chat_id = int(msg_obj.source_chat_id)
+            message = self._find_in_album_cache(chat_id, msg_obj)
+            if message is None:
+                message = self._execute_with_flood_retry(
+                    "获取原始消息",
+                    lambda: self.acc.get_messages(chat_id, msg_obj.message_id)
+                )
+            if not message or getattr(message, 'empty', False):
+                raise UnrecoverableError(f"原始消息已不存在: chat={chat_id}, message_id={msg_obj.message_id}")
+            msg_obj.message = message
+            msg_obj.media_group_id = str(message.media_group_id) if message.media_group_id else None
+            msg_obj.media_kind = get_media_kind(message)
+            if not msg_obj.source_name:
+                msg_obj.source_name = message.chat.title or message.chat.username
+            logger.debug(f"   已重新获取原始消息: chat={chat_id}, message_id={msg_obj.message_id}")
+
+            if not msg_obj.message_text:
+                message_text = message.text or message.caption or ""
+                if message.media_group_id and not message_text:
+                    try:
+                        media_group = get_media_group(self.acc, chat_id, message.id, message.media_group_id)
+                        if media_group:
+                            message_text = media_group[0].text or media_group[0].caption or ""
+                    except Exception as e:
+                        logger.debug(f"📸 获取媒体组文本失败: {e}")
+                msg_obj.message_text = message_text
+
+            if message.media_group_id and not msg_obj.media_group_key:
+                msg_obj.media_group_key = f"{msg_obj.user_id}_{msg_obj.watch_key}_{message.media_group_id}"
+
+    @staticmethod
+    def _find_in_album_cache(chat_id: int, msg_obj: Message):
+        """Return the original message from an assembled album in the cache, if present"""
+        if not msg_obj.media_group_id:
+            return None
+        album = media_group_cache.get(chat_id, msg_obj.media_group_id)
+        for part in album or ():
+            if part.id == msg_obj.message_id:
+                return part
+        return None
+
     def _run_async_with_timeout(self, coro, timeout: float = OPERATION_TIMEOUT):
         """Execute async operation with timeout in the worker thread"""
         # Validate that we have a proper coroutine or awaitable
@@ -222,25 +536,36 @@ class MessageWorker:
             logger.error(f"❌ 操作超时（{timeout}秒）")
             raise
     
-    def _execute_with_flood_retry(self, operation_name: str, operation_func, max_flood_retries: int = MAX_FLOOD_RETRIES, timeout: float = OPERATION_TIMEOUT):
+    def _execute_with_flood_retry(self, operation_name: str, operation_func, max_flood_retries: int = MAX_FLOOD_RETRIES, timeout: float = OPERATION_TIMEOUT, rate_limit_key: Optional[str] = None):
         """Execute operation with FloodWait retry and timeout handling
 
+        Args:
+            rate_limit_key: 目标聊天标识；提供时发送前经过限流器，FloodWait 只降低该目标的速率
+
         Returns:
             操作的返回结果（消息对象或消息ID列表）
         """
         for flood_attempt in range(max_flood_retries):
             try:
+                if rate_limit_key is not None:
+                    self.rate_limiter.acquire(rate_limit_key)
                 result = operation_func()
                 # Check if result is a coroutine (async operation)
                 if asyncio.iscoroutine(result):
                     result = self._run_async_with_timeout(result, timeout=timeout)
+                if rate_limit_key is not None:
+                    self.rate_limiter.report_success(rate_limit_key)
                 return result
             except FloodWait as e:
                 wait_time = e.value
                 if flood_attempt < max_flood_retries - 1:
                     logger.warning(f"⏳ {operation_name}: 遇到限流 FLOOD_WAIT, 需等待 {wait_time} 秒")
                     logger.info(f"   将在 {wait_time + 1} 秒后重试 (FloodWait 重试 {flood_attempt + 1}/{max_flood_retries})")
-                    time.sleep(wait_time + 1)
+                    if rate_limit_key is not None:
+                        # 限流器记录暂停时间，下次 acquire 时等待
+                        self.rate_limiter.report_flood_wait(rate_limit_key, wait_time + 1)
+                    else:
+                        time.sleep(wait_time + 1)
                 else:
                     logger.error(f"❌ {operation_name}: FloodWait 重试次数已达上限，放弃操作")
                     raise UnrecoverableError(f"FloodWait retry limit exceeded for {operation_name}")
@@ -277,57 +602,43 @@ class MessageWorker:
             "retry": Message failed but can be retried
         """
         try:
+            # 持久化队列重启后恢复的条目只有ID，需要重新获取规则和消息
+            if msg_obj.rule is None:
+                self._rehydrate_message(msg_obj)
+
             logger.info(f"⚙️ 开始处理消息: user={msg_obj.user_id}, source={msg_obj.source_chat_id}")
             logger.debug(f"   重试次数: {msg_obj.retry_count}, 消息文本: {msg_obj.message_text[:100] if msg_obj.message_text else 'None'}...")
             
-            message = msg_obj.message
-            watch_data = msg_obj.watch_data
+            rule = self._resolve_rule(msg_obj)
             user_id = msg_obj.user_id
             source_chat_id = msg_obj.source_chat_id
             dest_chat_id = msg_obj.dest_chat_id
             message_text = msg_obj.message_text
             
             # 提取配置
-            whitelist = watch_data.get("whitelist", [])
-            blacklist = watch_data.get("blacklist", [])
-            whitelist_regex = watch_data.get("whitelist_regex", [])
-            blacklist_regex = watch_data.get("blacklist_regex", [])
-            preserve_forward_source = watch_data.get("preserve_forward_source", False)
-            forward_mode = watch_data.get("forward_mode", "full")
-            extract_patterns = watch_data.get("extract_patterns", [])
-            record_mode = watch_data.get("record_mode", False)
-            append_dn = watch_data.get("append_dn_to_magnet", False)
-            
-            # 再次验证过滤规则（防止配置在入队后被修改）
-            # Priority: blacklist > whitelist (blacklist has higher priority)
+            preserve_forward_source = rule.preserve_forward_source
+            forward_mode = rule.forward_mode
+            extract_patterns = list(rule.extract_patterns)
+            record_mode = rule.record_mode
+            append_dn = rule.append_dn
             
-            # Step 1: Check blacklists first (higher priority)
-            if check_blacklist(message_text, blacklist):
-                logger.info(f"⏭️ 消息被黑名单过滤: {blacklist}")
-                return "skip"
-
-            if check_blacklist_regex(message_text, blacklist_regex):
-                logger.info(f"⏭️ 消息被正则黑名单过滤: {blacklist_regex}")
-                return "skip"
-
-            # Step 2: Check whitelists
-            if not check_whitelist(message_text, whitelist):
-                logger.info(f"⏭️ 消息未通过白名单: {whitelist}")
-                return "skip"
-
-            if not check_whitelist_regex(message_text, whitelist_regex):
-                logger.info(f"⏭️ 消息未通过正则白名单: {whitelist_regex}")
+            if not self._passes_filters(msg_obj):
                 return "skip"
             
             logger.info(f"🎯 消息通过所有过滤规则，准备处理")
+
+            self._warm_peers(msg_obj)
             
             # Record mode - save to database
             if record_mode:
-                return self._handle_record_mode(message, user_id, source_chat_id, message_text, forward_mode, extract_patterns)
+                # 只有需要下载媒体时才重新获取原始消息
+                if msg_obj.message is None and msg_obj.needs_download():
+                    self._rehydrate_message(msg_obj)
+                return self._handle_record_mode(msg_obj.message, user_id, source_chat_id, message_text, forward_mode, extract_patterns, source_name=msg_obj.source_name)
             
-            # Forward mode
+            # Forward mode（转发/复制只需要消息ID）
             else:
-                return self._handle_forward_mode(message, dest_chat_id, message_text, forward_mode, extract_patterns, preserve_forward_source, record_mode, append_dn)
+                return self._handle_forward_mode(msg_obj.ref(), dest_chat_id, message_text, forward_mode, extract_patterns, preserve_forward_source, record_mode, append_dn)
             
         except UnrecoverableError as e:
             logger.warning(f"⚠️ 消息处理失败（不可恢复），跳过: {e}")
@@ -344,11 +655,343 @@ class MessageWorker:
             logger.error(f"❌ 处理消息时出错: {e}", exc_info=True)
             return "retry"
     
-    def _handle_record_mode(self, message, user_id, source_chat_id, message_text, forward_mode, extract_patterns):
-        """Handle record mode processing"""
+    def _resolve_rule(self, msg_obj: Message) -> WatchRule:
+        """Switch the entry to the current rule of its watch
+
+        The rule in the routing snapshot replaces the one captured at enqueue
+        time (if the watch still exists), so filtering and sending read the
+        same rule.
+        """
+        rule = get_watch_index().rule_for(msg_obj.user_id, msg_obj.watch_key)
+        if rule is not None and rule is not msg_obj.rule:
+            msg_obj.rule = rule
+        return msg_obj.rule
+
+    def _passes_filters(self, msg_obj: Message) -> bool:
+        """检查过滤规则，复用入队时计算的结果
+
+        调用前须先用 _resolve_rule 切换到当前规则；入队时未计算（依赖沙箱中的正则）、
+        监控配置在入队后被修改或期间有正则被隔离（版本不同）时才重新计算。
+        Priority: blacklist > whitelist (blacklist has higher priority)
+        """
+        rule = msg_obj.rule
+        verdict = msg_obj.verdict
+        if verdict is None or verdict.version != rule.filter.verdict_version():
+            verdict = msg_obj.verdict = rule.filter.evaluate(msg_obj.message_text)
+        if verdict.passed:
+            return True
+
+        # 过滤顺序：关键词黑名单 → 正则黑名单 → 关键词白名单 → 正则白名单
+        if verdict.stage == STAGE_BLACKLIST:
+            logger.debug(f"⏭️ 消息被黑名单过滤: '{verdict.matched}'")
+        elif verdict.stage == STAGE_BLACKLIST_REGEX:
+            logger.debug(f"⏭️ 消息被正则黑名单过滤: '{verdict.matched}'")
+        elif verdict.stage == STAGE_WHITELIST:
+            logger.debug(f"⏭️ 消息未通过白名单: {list(rule.whitelist)}")
+        else:
+            logger.debug(f"⏭️ 消息未通过正则白名单: {list(rule.whitelist_regex)}")
+        return False
+
+    def _coalesce_kind(self, msg_obj) -> Optional[str]:
+        """How an entry may be merged with neighbouring entries
+
+        - COALESCE_FORWARD: plain forwards that keep the source, merged into
+          one forward_messages call
+        - COALESCE_EXTRACT: extract mode, extracted texts for one destination
+          packed into as few messages as possible
+        - None: record mode, copies, DN completion and albums need
+          per-message handling
+        """
+        rule = getattr(msg_obj, 'rule', None)
+        if rule is None or getattr(msg_obj, 'message_id', None) is None:
+            return None
+        if rule.record_mode or not msg_obj.dest_chat_id:
+            return None
+        if rule.forward_mode == "extract" and rule.extract_patterns:
+            return COALESCE_EXTRACT
+        if not rule.preserve_forward_source:
+            return None
+        if rule.append_dn and msg_obj.message_text:
+            return None
+        return None if msg_obj.media_group_id else COALESCE_FORWARD
+
+    def _collect_batch(self, first) -> list:
+        """Collect queued entries that can be processed together with ``first``
+
+        Waits up to ``coalesce_window`` for entries of the same kind and
+        destination (forwards also need the same source). Other entries are
+        stashed and processed afterwards; an entry for the same destination
+        that cannot be merged ends the batch so the destination keeps its order.
+        """
+        kind = self._coalesce_kind(first)
+        if self.coalesce_window < 0 or kind is None:
+            return [first]
+
+        def matches(item) -> bool:
+            if item.dest_chat_id != first.dest_chat_id or self._coalesce_kind(item) != kind:
+                return False
+            return kind == COALESCE_EXTRACT or item.source_chat_id == first.source_chat_id
+
+        batch = [first]
+
+        # 暂存区中的消息比队列中的更早，先从暂存区合并
+        for item in list(self._stash):
+            if len(batch) >= COALESCE_MAX_BATCH:
+                return batch
+            if matches(item):
+                batch.append(item)
+                self._stash.remove(item)
+            elif item.dest_chat_id == first.dest_chat_id:
+                return batch
+
+        deadline = time.monotonic() + self.coalesce_window
+        while len(batch) < COALESCE_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self.message_queue.get(timeout=remaining)
+                else:
+                    item = self.message_queue.get_nowait()
+            except queue.Empty:
+                break
+            if matches(item):
+                batch.append(item)
+                continue
+            self._stash.append(item)
+            if item.dest_chat_id == first.dest_chat_id:
+                break
+        return batch
+
+    def _warm_peers(self, msg_obj: Message):
+        """Make sure the source and destination peers are resolved before sending"""
+        self._warm_peer(msg_obj.source_chat_id, "源频道")
+        dest_chat_id = msg_obj.dest_chat_id
+        if dest_chat_id and dest_chat_id != "me":
+            self._warm_peer(dest_chat_id, "目标频道")
+
+    def _warm_peer(self, peer_id, peer_type: str):
+        peer_id = str(peer_id)
+        if peer_id in self._warmed_peers:
+            return
+        if is_dest_cached(peer_id) or cache_peer_if_needed(self.acc, peer_id, peer_type):
+            self._warmed_peers.add(peer_id)
+
+    def _process_batch(self, batch: list) -> list:
+        """Forward a coalesced batch with one forward_messages call
+
+        Rules are resolved and filters evaluated per entry; an entry whose
+        current rule no longer allows merging is processed on its own. If the
+        batch call fails with a recoverable error, the entries are processed
+        one by one. Entries that Telegram did not forward (deleted or
+        protected) are skipped.
+
+        Returns:
+            List of (msg_obj, result) tuples
+        """
+        kind = self._coalesce_kind(batch[0])
+        results = []
+        merged = []
+        for msg_obj in batch:
+            self._resolve_rule(msg_obj)
+            if self._coalesce_kind(msg_obj) == kind:
+                merged.append(msg_obj)
+            else:
+                # 入队后监控配置已修改，当前规则不再允许合并
+                results.append((msg_obj, self.process_message(msg_obj)))
+        if not merged:
+            return results
+        if kind == COALESCE_EXTRACT:
+            return results + self._process_extract_batch(merged)
+
+        passed = []
+        for msg_obj in merged:
+            if self._passes_filters(msg_obj):
+                passed.append(msg_obj)
+            else:
+                results.append((msg_obj, "skip"))
+        if not passed:
+            return results
+
+        first = passed[0]
+        self._warm_peers(first)
+        dest_chat_id = first.dest_chat_id
+        dest_id = "me" if dest_chat_id == "me" else int(dest_chat_id)
+        source_id = int(first.source_chat_id)
+        message_ids = [msg_obj.message_id for msg_obj in passed]
+        logger.info(f"📦 合并转发 {len(message_ids)} 条消息: {first.source_chat_id} → {dest_chat_id}")
+
+        try:
+            result = self._execute_with_flood_retry(
+                f"批量转发 {len(message_ids)} 条消息",
+                lambda: self.acc.forward_messages(dest_id, source_id, message_ids),
+                rate_limit_key=str(dest_id)
+            )
+        except UnrecoverableError as e:
+            logger.warning(f"⚠️ 批量转发失败（不可恢复），跳过 {len(passed)} 条消息: {e}")
+            return results + [(msg_obj, "skip") for msg_obj in passed]
+        except Exception as e:
+            logger.warning(f"⚠️ 批量转发失败，回退到逐条处理: {e}")
+            return results + [(msg_obj, self.process_message(msg_obj)) for msg_obj in passed]
+
+        forwarded = result if isinstance(result, list) else [result]
+        matched = self._match_forwarded(passed, forwarded)
+        for index, msg_obj in enumerate(passed):
+            forwarded_msg = matched.get(index)
+            if forwarded_msg is None:
+                # 已删除或受保护的消息不会出现在返回结果中，重试也无法转发
+                results.append((msg_obj, "skip"))
+                continue
+            if dest_chat_id != "me":
+                forwarded_id = forwarded_msg.id if hasattr(forwarded_msg, 'id') else forwarded_msg
+                self._trigger_dest_monitoring(dest_chat_id, forwarded_id, msg_obj.message_text)
+            results.append((msg_obj, "success"))
+        if len(matched) < len(passed):
+            logger.warning(f"⚠️ 合并转发只返回了 {len(matched)}/{len(passed)} 条消息，其余已跳过")
+        logger.info(f"   ✅ 已合并转发 {len(matched)} 条消息")
+        return results
+
+    @staticmethod
+    def _match_forwarded(passed: list, forwarded: list) -> dict:
+        """Match the messages returned by forward_messages to their sources
+
+        Telegram omits messages that were deleted or are protected, so the
+        result cannot be paired by position. Forwards that keep their origin
+        carry ``forward_from_message_id``; the others are paired in order
+        only when nothing was omitted.
+
+        Returns:
+            Dict of index in ``passed`` -> forwarded message
+        """
+        waiting = {}
+        for index, msg_obj in enumerate(passed):
+            waiting.setdefault(msg_obj.message_id, []).append(index)
+        matched = {}
+        unmatched = []
+        for forwarded_msg in forwarded:
+            if forwarded_msg is None:
+                continue
+            indexes = waiting.get(getattr(forwarded_msg, 'forward_from_message_id', None))
+            if indexes:
+                matched[indexes.pop(0)] = forwarded_msg
+            else:
+                unmatched.append(forwarded_msg)
+        remaining = [index for index in range(len(passed)) if index not in matched]
+        if unmatched and len(unmatched) == len(remaining):
+            matched.update(zip(remaining, unmatched))
+        return matched
+
+    def _process_extract_batch(self, batch: list) -> list:
+        """Send the extracts of consecutive entries for one destination packed together
+
+        Extracted texts are joined in queue order into messages of at most
+        TELEGRAM_MESSAGE_LIMIT characters, so a burst from a high-volume
+        channel costs a few send_message calls instead of one per entry.
+
+        Returns:
+            List of (msg_obj, result) tuples
+        """
+        results = []
+        passed = []
+        texts = []
+        for msg_obj in batch:
+            if not self._passes_filters(msg_obj):
+                results.append((msg_obj, "skip"))
+                continue
+            extracted_text = extract_content(msg_obj.message_text, list(msg_obj.rule.extract_patterns))
+            if not extracted_text:
+                logger.debug(f"   未提取到任何内容，跳过发送")
+                results.append((msg_obj, "success"))
+                continue
+            passed.append(msg_obj)
+            texts.append(extracted_text)
+        if not passed:
+            return results
+
+        first = passed[0]
+        self._warm_peers(first)
+        dest_chat_id = first.dest_chat_id
+        dest_id = "me" if dest_chat_id == "me" else int(dest_chat_id)
+        packed = pack_texts(texts)
+        logger.info(f"📦 合并发送 {len(passed)} 条提取结果，共 {len(packed)} 条消息 → {dest_chat_id}")
+
+        outcomes = ["success"] * len(passed)
+        # 已有分段发送成功的条目：后续分段失败时不再整体重试，避免重复发送已送达的部分
+        delivered = [False] * len(passed)
+        for text, owners in packed:
+            if all(outcomes[index] != "success" for index in owners):
+                # 超长提取结果的前一段已失败，剩余分段不再发送（整条稍后重试或已跳过）
+                continue
+            try:
+                sent_msg = self._execute_with_flood_retry(
+                    "发送提取内容",
+                    lambda text=text: self.acc.send_message(dest_id, text),
+                    rate_limit_key=str(dest_id)
+                )
+            except UnrecoverableError as e:
+                logger.warning(f"⚠️ 发送提取内容失败（不可恢复），跳过 {len(owners)} 条消息: {e}")
+                for index in owners:
+                    if outcomes[index] == "success":
+                        outcomes[index] = "skip"
+                continue
+            except Exception as e:
+                logger.error(f"❌ 发送提取内容失败，{len(owners)} 条消息稍后重试: {e}")
+                for index in owners:
+                    if delivered[index]:
+                        logger.warning(f"⚠️ 消息 {passed[index].message_id} 的提取内容只发送了一部分，其余部分已丢弃")
+                    else:
+                        outcomes[index] = "retry"
+                continue
+            for index in owners:
+                delivered[index] = True
+
+            # 目标频道也是监控源时，按实际发送的内容触发链式转发
+            if dest_chat_id != "me" and sent_msg is not None and hasattr(sent_msg, 'id'):
+                self._trigger_dest_monitoring(dest_chat_id, sent_msg.id, text)
+
+        logger.info(f"   ✅ 提取内容已合并发送")
+        return results + list(zip(passed, outcomes))
+
+    def _handle_record_mode(self, message, user_id, source_chat_id, message_text, forward_mode, extract_patterns, source_name=None):
+        """Handle record mode processing
+
+        ``message`` is the Pyrogram message, only required when media must be
+        downloaded; it is None for text-only entries. Stored media stay
+        pinned until the note is saved or has failed, so a blob can neither
+        be deleted in between nor be left without an owner. The pins of one
+        note are collected in a list owned by this call.
+        """
+        pins = []
+        try:
+            return self._record_note(message, user_id, source_chat_id, message_text, forward_mode, extract_patterns,
+                                     pins, source_name)
+        finally:
+            self._release_media_pins(pins)
+
+    @staticmethod
+    def _release_media_pins(pins):
+        if pins:
+            try:
+                release_media_blobs(pins)
+            except Exception as e:
+                logger.error(f"❌ 释放媒体引用失败: {e}")
+
+    def _release_album_item(self, result):
+        """Release the pin of an album item that finished after it was abandoned (runs on the download pool)"""
+        _, content_hash = result
+        self._release_media_pins([content_hash] if content_hash else None)
+
+    def _record_note(self, message, user_id, source_chat_id, message_text, forward_mode, extract_patterns, pins,
+                     source_name=None):
+        """Download the media of a message and save it as a note
+
+        Content hashes of the blobs pinned for the note are appended to ``pins``.
+        """
+        if not source_name and message is not None:
+            source_name = getattr(message.chat, 'title', None) or getattr(message.chat, 'username', None)
         logger.info(f"📝 记录模式：开始处理消息")
-        logger.info(f"   来源: {source_chat_id} ({getattr(message.chat, 'title', None) or getattr(message.chat, 'username', None)})")
-        source_name = message.chat.title or message.chat.username or source_chat_id
+        logger.info(f"   来源: {source_chat_id} ({source_name})")
+        source_name = source_name or source_chat_id
+        media_group_id = message.media_group_id if message is not None else None
         
         # Handle text content with extraction
         content_to_save = message_text
@@ -365,20 +1008,22 @@ class MessageWorker:
         logger.debug(f"   开始处理媒体")
         
         # Check if this is a media group (multiple images)
-        if message.media_group_id:
-            media_type, media_path, media_paths, content_to_save = self._handle_media_group(message, content_to_save)
+        if message is None:
+            pass
+        elif media_group_id:
+            media_type, media_path, media_paths, content_to_save = self._handle_media_group(message, content_to_save, pins)
         
         # Single photo
         elif message.photo:
-            media_type, media_path, media_paths = self._handle_single_photo(message)
+            media_type, media_path, media_paths = self._handle_single_photo(message, pins)
         
         # Single video
         elif message.video:
-            media_type, media_path, media_paths = self._handle_single_video(message)
+            media_type, media_path, media_paths = self._handle_single_video(message, pins)
         
         # Single animation (GIF)
         elif message.animation:
-            media_type, media_path, media_paths = self._handle_single_animation(message)
+            media_type, media_path, media_paths = self._handle_single_animation(message, pins)
         
         # Save to database
         logger.info(f"💾 记录模式：准备保存笔记到数据库")
@@ -387,7 +1032,7 @@ class MessageWorker:
         logger.info(f"   - 文本: {bool(content_to_save)} ({len(content_to_save) if content_to_save else 0} 字符)")
         logger.info(f"   - 媒体类型: {media_type}")
         logger.info(f"   - 媒体数量: {len(media_paths)} 个")
-        logger.info(f"   - 媒体组ID: {message.media_group_id if message.media_group_id else 'None'}")
+        logger.info(f"   - 媒体组ID: {media_group_id if media_group_id else 'None'}")
         
         try:
             note_id = add_note(
@@ -398,16 +1043,27 @@ class MessageWorker:
                 media_type=media_type,
                 media_path=media_path,
                 media_paths=media_paths if media_paths else None,
-                media_group_id=str(message.media_group_id) if message.media_group_id else None
+                media_group_id=str(media_group_id) if media_group_id else None
             )
             logger.info(f"✅ 记录模式：笔记保存成功！笔记ID: {note_id}")
+            if self.upload_queue is not None and media_paths:
+                try:
+                    self.upload_queue.submit(media_paths)
+                except Exception as e:
+                    logger.error(f"❌ 媒体加入上传队列失败，文件保留在本地: {e}")
             return "success"
         except Exception as e:
             logger.error(f"❌ 记录模式：保存笔记失败！", exc_info=True)
             raise
     
-    def _handle_media_group(self, message, content_to_save):
-        """Handle media group download"""
+    def _handle_media_group(self, message, content_to_save, pins):
+        """Handle media group download
+
+        Album items are downloaded concurrently through the account's
+        download pool; ``media_paths`` keeps the album order. Each item
+        returns its pin with its location, and items that finish after they
+        were abandoned release their pin themselves.
+        """
         media_type = None
         media_path = None
         media_paths = []
@@ -417,35 +1073,25 @@ class MessageWorker:
         keep_local = webdav_config.get('keep_local_copy', False)
 
         try:
-            media_group = self.acc.get_media_group(message.chat.id, message.id)
+            media_group = get_media_group(self.acc, message.chat.id, message.id, message.media_group_id)
             if media_group:
                 logger.info(f"   📷 发现媒体组，共 {len(media_group)} 个媒体")
+                timestamp = datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')
+                # (相册位置, file_id, file_unique_id, 文件名, 描述)
+                downloads = []
                 for idx, msg in enumerate(media_group):
-                    saved = False
-                    storage_location = None
+                    if msg.caption and not content_to_save:
+                        content_to_save = msg.caption
+
+                    if len(downloads) >= MAX_MEDIA_PER_GROUP:
+                        logger.warning(f"   ⚠️ 媒体组超过{MAX_MEDIA_PER_GROUP}个，仅保存前{MAX_MEDIA_PER_GROUP}个")
+                        break
 
                     # 处理图片
                     if msg.photo:
                         media_type = "photo"
-                        file_name = f"{msg.id}_{idx}_{datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')}.jpg"
-                        file_path = os.path.join(MEDIA_DIR, file_name)
-                        try:
-                            # 下载到本地临时文件
-                            self.acc.download_media(msg.photo.file_id, file_name=file_path)
-
-                            # 使用存储管理器保存
-                            success, storage_location = self.storage_manager.save_file(file_path, file_name, keep_local=keep_local)
-
-                            if success:
-                                media_paths.append(storage_location)
-                                if idx == 0:
-                                    media_path = storage_location
-                                saved = True
-                                logger.debug(f"      ✅ 保存图片: {file_name}")
-                            else:
-                                logger.error(f"      ❌ 存储图片失败: {file_name}")
-                        except Exception as e:
-                            logger.error(f"      ❌ 下载图片失败: {e}")
+                        downloads.append((idx, msg.photo.file_id, getattr(msg.photo, 'file_unique_id', None),
+                                          f"{msg.id}_{idx}_{timestamp}.jpg", "图片"))
 
                     # 处理视频缩略图
                     elif msg.video:
@@ -453,25 +1099,10 @@ class MessageWorker:
                             media_type = "video"
                         if msg.video.thumbs and len(msg.video.thumbs) > 0:
                             thumb = msg.video.thumbs[-1]
-                            file_name = f"{msg.id}_{idx}_thumb_{datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')}.jpg"
-                            file_path = os.path.join(MEDIA_DIR, file_name)
-                            try:
-                                # 下载到本地临时文件
-                                self.acc.download_media(thumb.file_id, file_name=file_path)
-
-                                # 使用存储管理器保存
-                                success, storage_location = self.storage_manager.save_file(file_path, file_name, keep_local=keep_local)
-
-                                if success:
-                                    media_paths.append(storage_location)
-                                    if idx == 0:
-                                        media_path = storage_location
-                                    saved = True
-                                    logger.debug(f"      ✅ 保存视频缩略图: {file_name}")
-                                else:
-                                    logger.error(f"      ❌ 存储视频缩略图失败: {file_name}")
-                            except Exception as e:
-                                logger.error(f"      ❌ 下载视频缩略图失败: {e}")
+                            downloads.append((idx, thumb.file_id, getattr(thumb, 'file_unique_id', None),
+                                              f"{msg.id}_{idx}_thumb_{timestamp}.jpg", "视频缩略图"))
+                        else:
+                            logger.warning(f"      ⚠️ 媒体 {idx+1} 没有缩略图")
 
                     # 处理GIF动图缩略图
                     elif msg.animation:
@@ -479,66 +1110,156 @@ class MessageWorker:
                             media_type = "animation"
                         if msg.animation.thumbs and len(msg.animation.thumbs) > 0:
                             thumb = msg.animation.thumbs[-1]
-                            file_name = f"{msg.id}_{idx}_gif_thumb_{datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')}.jpg"
-                            file_path = os.path.join(MEDIA_DIR, file_name)
-                            try:
-                                # 下载到本地临时文件
-                                self.acc.download_media(thumb.file_id, file_name=file_path)
-
-                                # 使用存储管理器保存
-                                success, storage_location = self.storage_manager.save_file(file_path, file_name, keep_local=keep_local)
-
-                                if success:
-                                    media_paths.append(storage_location)
-                                    if idx == 0:
-                                        media_path = storage_location
-                                    saved = True
-                                    logger.debug(f"      ✅ 保存GIF缩略图: {file_name}")
-                                else:
-                                    logger.error(f"      ❌ 存储GIF缩略图失败: {file_name}")
-                            except Exception as e:
-                                logger.error(f"      ❌ 下载GIF缩略图失败: {e}")
-
-                    if not saved:
-                        logger.warning(f"      ⚠️ 媒体 {idx+1} 类型不支持或无缩略图")
-
-                    if len(media_paths) >= MAX_MEDIA_PER_GROUP:
-                        logger.warning(f"   ⚠️ 媒体组超过{MAX_MEDIA_PER_GROUP}个，仅保存前{MAX_MEDIA_PER_GROUP}个")
-                        break
+                            downloads.append((idx, thumb.file_id, getattr(thumb, 'file_unique_id', None),
+                                              f"{msg.id}_{idx}_gif_thumb_{timestamp}.jpg", "GIF缩略图"))
+                        else:
+                            logger.warning(f"      ⚠️ 媒体 {idx+1} 没有缩略图")
 
-                    if msg.caption and not content_to_save:
-                        content_to_save = msg.caption
+                    else:
+                        logger.warning(f"      ⚠️ 媒体 {idx+1} 类型不支持")
+
+                tasks = [partial(self._download_album_item, file_id, file_unique_id, file_name, label, keep_local)
+                         for _, file_id, file_unique_id, file_name, label in downloads]
+                results = get_download_pool(self.acc).run_ordered(tasks, discard=self._release_album_item)
+                for (idx, _, _, _, _), result in zip(downloads, results):
+                    storage_location, content_hash = result or (None, None)
+                    if content_hash:
+                        pins.append(content_hash)
+                    if storage_location:
+                        media_paths.append(storage_location)
+                        if idx == 0:
+                            media_path = storage_location
 
                 logger.info(f"   ✅ 媒体组处理完成，共保存 {len(media_paths)} 个文件")
         except Exception as e:
             logger.error(f"   ❌ 获取媒体组失败: {e}", exc_info=True)
             if message.photo:
-                media_type, media_path, media_paths = self._handle_single_photo(message)
+                media_type, media_path, media_paths = self._handle_single_photo(message, pins)
 
         return media_type, media_path, media_paths, content_to_save
-    
-    def _handle_single_photo(self, message):
+
+    def _download_album_item(self, file_id, file_unique_id, file_name, label, keep_local,
+                             item) -> Tuple[Optional[str], Optional[str]]:
+        """Download one album item and save it (runs on the download pool)
+
+        Returns:
+            (storage location, pinned content hash); the location is None if
+            the item could not be saved
+        """
+        try:
+            return self._store_media(file_id, file_unique_id, file_name, label, keep_local, item)
+        except Exception as e:
+            logger.error(f"      ❌ 下载{label}失败: {e}")
+            return None, None
+
+    def _store_media(self, file_id, file_unique_id, file_name, label, keep_local,
+                     item=None) -> Tuple[Optional[str], Optional[str]]:
+        """Download a media file into the content-addressed store
+
+        A file whose ``file_unique_id`` was stored before is not downloaded
+        again; a downloaded file whose content is already stored is not saved
+        again. Either way the existing location is returned. New files are
+        saved under their content hash. The blob is pinned for the caller
+        (see ``_handle_record_mode``); ``add_note`` takes the note's references.
+
+        Raises:
+            Exception: If the download fails
+
+        Returns:
+            (storage location, pinned content hash). The location is None if
+            the file could not be saved; nothing is pinned then, nor when the
+            album item was abandoned.
+        """
+        if file_unique_id:
+            pinned = pin_media_blob(file_unique_id=file_unique_id)
+            if pinned:
+                content_hash, storage_location = pinned
+                if self._abandoned(content_hash, item):
+                    return None, None
+                logger.debug(f"      ♻️ 复用已保存的{label}: {storage_location}")
+                return storage_location, content_hash
+
+        # 下载到本地临时文件
+        file_path = os.path.join(MEDIA_DIR, file_name)
+        self.acc.download_media(file_id, file_name=file_path)
+
+        # 已超时被跳过的项不再保存
+        if item is not None and item.abandoned:
+            self._remove_download(file_path)
+            return None, None
+
+        try:
+            content_hash = file_content_hash(file_path)
+            size = os.path.getsize(file_path)
+        except OSError as e:
+            logger.warning(f"      ⚠️ 无法计算{label}内容哈希，按原文件名保存: {e}")
+            content_hash = None
+
+        store_name = file_name
+        if content_hash:
+            pinned = pin_media_blob(content_hash=content_hash)
+            if pinned:
+                storage_location = pinned[1]
+                self._remove_download(file_path)
+                register_media_blob(content_hash, storage_location, size, file_unique_id)
+                if self._abandoned(content_hash, item):
+                    return None, None
+                logger.debug(f"      ♻️ {label}内容已保存过: {storage_location}")
+                return storage_location, content_hash
+            store_name = blob_location(content_hash, os.path.splitext(file_name)[1] or ".jpg")
+
+        # 使用存储管理器保存
+        success, storage_location = self.storage_manager.save_file(file_path, store_name, keep_local=keep_local)
+        if not success:
+            logger.error(f"      ❌ 存储{label}失败: {file_name}")
+            return None, None
+        if content_hash:
+            self._remove_download(file_path)
+            storage_location = register_media_blob(content_hash, storage_location, size, file_unique_id, pin=True)
+            if self._abandoned(content_hash, item):
+                return None, None
+        logger.debug(f"      ✅ 保存{label}: {storage_location}")
+        return storage_location, content_hash
+
+    def _abandoned(self, content_hash, item) -> bool:
+        """Release the pin at once if the album item was abandoned while it was being stored"""
+        if item is None or not item.abandoned:
+            return False
+        self._release_media_pins([content_hash])
+        return True
+
+    @staticmethod
+    def _remove_download(file_path: str):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def _store_pinned(self, pins, file_id, file_unique_id, file_name, label, keep_local) -> Optional[str]:
+        """``_store_media`` on the worker thread, keeping the pin in ``pins``"""
+        storage_location, content_hash = self._store_media(file_id, file_unique_id, file_name, label, keep_local)
+        if content_hash:
+            pins.append(content_hash)
+        return storage_location
+
+    def _handle_single_photo(self, message, pins):
         """Handle single photo download"""
         logger.info(f"   📷 处理单张图片")
         media_type = "photo"
         file_name = f"{message.id}_{datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')}.jpg"
-        file_path = os.path.join(MEDIA_DIR, file_name)
 
-        # 下载到本地临时文件
-        self.acc.download_media(message.photo.file_id, file_name=file_path)
-
-        # 使用存储管理器保存
         webdav_config = load_webdav_config()
         keep_local = webdav_config.get('keep_local_copy', False)
-        success, storage_location = self.storage_manager.save_file(file_path, file_name, keep_local=keep_local)
+        storage_location = self._store_pinned(pins, message.photo.file_id, getattr(message.photo, 'file_unique_id', None),
+                                              file_name, "图片", keep_local)
 
-        if success:
+        if storage_location:
             return media_type, storage_location, [storage_location]
         else:
             logger.warning(f"⚠️ 存储失败，使用本地路径: {file_name}")
             return media_type, file_name, [file_name]
     
-    def _handle_single_video(self, message):
+    def _handle_single_video(self, message, pins):
         """Handle single video thumbnail download"""
         logger.info(f"   📹 处理视频消息")
         media_type = "video"
@@ -549,17 +1270,13 @@ class MessageWorker:
             if message.video.thumbs and len(message.video.thumbs) > 0:
                 thumb = message.video.thumbs[-1]
                 file_name = f"{message.id}_{datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')}_thumb.jpg"
-                file_path = os.path.join(MEDIA_DIR, file_name)
-
-                # 下载到本地临时文件
-                self.acc.download_media(thumb.file_id, file_name=file_path)
 
-                # 使用存储管理器保存
                 webdav_config = load_webdav_config()
                 keep_local = webdav_config.get('keep_local_copy', False)
-                success, storage_location = self.storage_manager.save_file(file_path, file_name, keep_local=keep_local)
+                storage_location = self._store_pinned(pins, thumb.file_id, getattr(thumb, 'file_unique_id', None),
+                                                      file_name, "视频缩略图", keep_local)
 
-                if success:
+                if storage_location:
                     media_path = storage_location
                     media_paths = [storage_location]
                 else:
@@ -574,7 +1291,7 @@ class MessageWorker:
 
         return media_type, media_path, media_paths
     
-    def _handle_single_animation(self, message):
+    def _handle_single_animation(self, message, pins):
         """Handle single GIF animation thumbnail download"""
         logger.info(f"   🎞️ 处理GIF动图消息")
         media_type = "animation"
@@ -585,17 +1302,13 @@ class MessageWorker:
             if message.animation.thumbs and len(message.animation.thumbs) > 0:
                 thumb = message.animation.thumbs[-1]
                 file_name = f"{message.id}_{datetime.now(CHINA_TZ).strftime('%Y%m%d_%H%M%S')}_gif_thumb.jpg"
-                file_path = os.path.join(MEDIA_DIR, file_name)
 
-                # 下载到本地临时文件
-                self.acc.download_media(thumb.file_id, file_name=file_path)
-
-                # 使用存储管理器保存
                 webdav_config = load_webdav_config()
                 keep_local = webdav_config.get('keep_local_copy', False)
-                success, storage_location = self.storage_manager.save_file(file_path, file_name, keep_local=keep_local)
+                storage_location = self._store_pinned(pins, thumb.file_id, getattr(thumb, 'file_unique_id', None),
+                                                      file_name, "GIF缩略图", keep_local)
 
-                if success:
+                if storage_location:
                     media_path = storage_location
                     media_paths = [storage_location]
                 else:
@@ -611,7 +1324,10 @@ class MessageWorker:
         return media_type, media_path, media_paths
     
     def _handle_forward_mode(self, message, dest_chat_id, message_text, forward_mode, extract_patterns, preserve_forward_source, record_mode, append_dn=False):
-        """Handle forward mode processing"""
+        """Handle forward mode processing
+
+        ``message`` is a MessageRef: forwarding and copying only need the ids.
+        """
         logger.info(f"📤 转发模式：开始处理，目标: {dest_chat_id}")
 
         # 用于存储转发后的新消息ID(用于链式转发)
@@ -624,14 +1340,16 @@ class MessageWorker:
             if extracted_text:
                 logger.info(f"   提取到内容，准备发送")
                 dest_id = "me" if dest_chat_id == "me" else int(dest_chat_id)
-                sent_msg = self._execute_with_flood_retry(
-                    "发送提取内容",
-                    lambda: self.acc.send_message(dest_id, extracted_text)
-                )
-                if sent_msg:
-                    forwarded_message_id = sent_msg.id if hasattr(sent_msg, 'id') else None
+                # 超过单条消息长度限制时按行拆分发送
+                for text, _ in pack_texts([extracted_text]):
+                    sent_msg = self._execute_with_flood_retry(
+                        "发送提取内容",
+                        lambda text=text: self.acc.send_message(dest_id, text),
+                        rate_limit_key=str(dest_id)
+                    )
+                    if sent_msg and forwarded_message_id is None:
+                        forwarded_message_id = sent_msg.id if hasattr(sent_msg, 'id') else None
                 logger.info(f"   ✅ 提取内容已发送")
-                time.sleep(RATE_LIMIT_DELAY)
             else:
                 logger.debug(f"   未提取到任何内容，跳过发送")
 
@@ -680,52 +1398,16 @@ class MessageWorker:
         Returns:
             处理后的文本
         """
-        import re
-
-        # 查找所有磁力链接
-        magnet_pattern = r'magnet:\?xt=urn:btih:[a-zA-Z0-9]+(?:[&?][^\s\n\r|]*)?'
-        magnets = re.findall(magnet_pattern, message_text)
-
-        if not magnets:
-            return message_text
-
-        # 提取基础DN文本（从消息开头到第一个#号）
-        hash_pos = message_text.find('#')
-        base_dn_text = message_text[:hash_pos].rstrip() if hash_pos != -1 else message_text.rstrip()
-
-        # 如果基础DN文本为空或就是磁力链接本身，跳过
-        if not base_dn_text or base_dn_text in magnets:
-            return message_text
-
-        processed_text = message_text
-        magnet_count = 0
-
-        for magnet_link in magnets:
-            # 检查是否已有dn参数
-            if '&dn=' not in magnet_link and '?dn=' not in magnet_link:
-                magnet_count += 1
-
-                # 如果有多条磁力链接，在DN结尾添加序号区分
-                if len(magnets) > 1:
-                    dn_text = f"{base_dn_text}-{magnet_count}"
-                else:
-                    dn_text = base_dn_text
-
-                # 直接使用原始文字，不进行URL编码
-                new_magnet = f"{magnet_link}&dn={dn_text}"
-                processed_text = processed_text.replace(magnet_link, new_magnet)
-                logger.debug(f"   补全DN [{magnet_count}]: {dn_text[:30]}...")
-
+        processed_text, magnet_count = fill_missing_dn(message_text)
         if magnet_count > 0:
             logger.info(f"   🧲 共补全 {magnet_count} 条磁力链接的DN参数")
-
         return processed_text
     
     def _forward_with_modified_text(self, message, dest_id, modified_text, preserve_source=False):
         """转发消息并修改文本内容（用于DN补全）
 
         Args:
-            message: 原始消息对象
+            message: 原始消息引用（MessageRef）
             dest_id: 目标ID
             modified_text: 修改后的文本（补全DN的磁力链接）
             preserve_source: 是否保留转发来源
@@ -738,65 +1420,31 @@ class MessageWorker:
         forwarded_msg_id = None
 
         # 如果消息有媒体（图片、视频等），需要复制媒体并修改caption
-        if message.photo or message.video or message.animation or message.document:
+        if message.media_kind:
             # 对于媒体消息，使用copy_message并修改caption
             if message.media_group_id:
-                # 媒体组：使用copy_media_group并修改第一条消息的caption
+                # 媒体组：一次copy_media_group复制整个相册，只替换第一条媒体的caption
                 try:
-                    # 注意：copy_media_group会复制整个媒体组，但只能设置第一条消息的caption
-                    # 这正是我们需要的：第一条消息使用补全DN的文本，其他消息保持原样
-                    result = self._execute_with_flood_retry(
-                        "复制媒体组并修改caption",
-                        lambda: self.acc.copy_media_group(
-                            dest_id,
-                            message.chat.id,
-                            message.id,
-                            captions=[modified_text]  # 只修改第一条消息的caption
-                        )
-                    )
-                    # copy_media_group返回消息ID列表，取第一个
-                    if result and len(result) > 0:
-                        forwarded_msg_id = result[0].id if hasattr(result[0], 'id') else result[0]
+                    forwarded_msg_id = self._copy_media_group(message, dest_id, caption=modified_text)
                     logger.info(f"   ✅ 媒体组已复制（第一条消息的caption已修改）")
+                except UnrecoverableError:
+                    raise
                 except Exception as e:
-                    logger.warning(f"   copy_media_group失败，尝试逐个复制: {e}")
-                    # 回退方案：逐个复制
-                    try:
-                        media_group = self.acc.get_media_group(message.chat.id, message.id)
-                        if media_group:
-                            logger.debug(f"   逐个处理媒体组，共 {len(media_group)} 个媒体")
-                            for idx, msg in enumerate(media_group):
-                                # 第一条消息使用修改后的文本，其他消息保持原样
-                                caption_to_use = modified_text if idx == 0 else (msg.caption or "")
-
-                                result = self._execute_with_flood_retry(
-                                    f"复制媒体 {idx+1}/{len(media_group)}",
-                                    lambda m=msg, c=caption_to_use: self.acc.copy_message(
-                                        dest_id, m.chat.id, m.id, caption=c
-                                    )
-                                )
-                                # 保存第一条消息的ID
-                                if idx == 0 and result:
-                                    forwarded_msg_id = result.id if hasattr(result, 'id') else result
-                                time.sleep(0.3)
-                            logger.info(f"   ✅ 媒体组已逐个复制完成")
-                        else:
-                            raise Exception("无法获取媒体组")
-                    except Exception as e2:
-                        logger.error(f"   逐个复制也失败: {e2}")
-                        # 最后的回退：复制单条消息
-                        result = self._execute_with_flood_retry(
-                            "复制单条媒体消息",
-                            lambda: self.acc.copy_message(dest_id, message.chat.id, message.id, caption=modified_text)
-                        )
-                        if result:
-                            forwarded_msg_id = result.id if hasattr(result, 'id') else result
-                        logger.info(f"   ✅ 已复制单条媒体消息")
+                    logger.warning(f"   copy_media_group失败，回退到复制单条媒体消息: {e}")
+                    result = self._execute_with_flood_retry(
+                        "复制单条媒体消息",
+                        lambda: self.acc.copy_message(dest_id, message.chat_id, message.id, caption=modified_text),
+                        rate_limit_key=str(dest_id)
+                    )
+                    if result:
+                        forwarded_msg_id = result.id if hasattr(result, 'id') else result
+                    logger.info(f"   ✅ 已复制单条媒体消息")
             else:
                 # 单个媒体：直接复制并修改caption
                 result = self._execute_with_flood_retry(
                     "复制媒体消息",
-                    lambda: self.acc.copy_message(dest_id, message.chat.id, message.id, caption=modified_text)
+                    lambda: self.acc.copy_message(dest_id, message.chat_id, message.id, caption=modified_text),
+                    rate_limit_key=str(dest_id)
                 )
                 if result:
                     forwarded_msg_id = result.id if hasattr(result, 'id') else result
@@ -805,13 +1453,13 @@ class MessageWorker:
             # 纯文本消息：直接发送修改后的文本
             result = self._execute_with_flood_retry(
                 "发送修改后的文本",
-                lambda: self.acc.send_message(dest_id, modified_text)
+                lambda: self.acc.send_message(dest_id, modified_text),
+                rate_limit_key=str(dest_id)
             )
             if result:
                 forwarded_msg_id = result.id if hasattr(result, 'id') else result
             logger.info(f"   ✅ 文本消息已发送（文本已修改）")
 
-        time.sleep(RATE_LIMIT_DELAY)
         return forwarded_msg_id
 
     def _forward_with_source(self, message, dest_id):
@@ -825,11 +1473,16 @@ class MessageWorker:
 
         if message.media_group_id:
             try:
-                media_group = self.acc.get_media_group(message.chat.id, message.id)
-                message_ids = [msg.id for msg in media_group] if media_group else [message.id]
+                # 组装后又收到迟到部分的相册，组装时的ID不完整，改为查询媒体组
+                if message.album_ids and media_group_cache.is_complete(message.chat_id, message.media_group_id):
+                    message_ids = list(message.album_ids)
+                else:
+                    media_group = get_media_group(self.acc, message.chat_id, message.id, message.media_group_id)
+                    message_ids = [msg.id for msg in media_group] if media_group else [message.id]
                 result = self._execute_with_flood_retry(
                     "转发媒体组",
-                    lambda: self.acc.forward_messages(dest_id, message.chat.id, message_ids)
+                    lambda: self.acc.forward_messages(dest_id, message.chat_id, message_ids),
+                    rate_limit_key=str(dest_id)
                 )
                 # forward_messages 返回消息列表，取第一个
                 if result:
@@ -838,14 +1491,14 @@ class MessageWorker:
                     else:
                         forwarded_msg_id = result.id if hasattr(result, 'id') else result
                 logger.info(f"   ✅ 媒体组已转发")
-                time.sleep(RATE_LIMIT_DELAY)
             except UnrecoverableError:
                 raise
             except Exception as e:
                 logger.warning(f"   转发媒体组失败，回退到单条转发: {e}")
                 result = self._execute_with_flood_retry(
                     "转发单条消息",
-                    lambda: self.acc.forward_messages(dest_id, message.chat.id, message.id)
+                    lambda: self.acc.forward_messages(dest_id, message.chat_id, message.id),
+                    rate_limit_key=str(dest_id)
                 )
                 if result:
                     if isinstance(result, list) and len(result) > 0:
@@ -853,11 +1506,11 @@ class MessageWorker:
                     else:
                         forwarded_msg_id = result.id if hasattr(result, 'id') else result
                 logger.info(f"   ✅ 消息已转发（单条）")
-                time.sleep(RATE_LIMIT_DELAY)
         else:
             result = self._execute_with_flood_retry(
                 "转发消息",
-                lambda: self.acc.forward_messages(dest_id, message.chat.id, message.id)
+                lambda: self.acc.forward_messages(dest_id, message.chat_id, message.id),
+                rate_limit_key=str(dest_id)
             )
             if result:
                 if isinstance(result, list) and len(result) > 0:
@@ -865,7 +1518,6 @@ class MessageWorker:
                 else:
                     forwarded_msg_id = result.id if hasattr(result, 'id') else result
             logger.info(f"   ✅ 消息已转发")
-            time.sleep(RATE_LIMIT_DELAY)
 
         return forwarded_msg_id
     
@@ -880,42 +1532,56 @@ class MessageWorker:
 
         if message.media_group_id:
             try:
-                result = self._execute_with_flood_retry(
-                    "复制媒体组",
-                    lambda: self.acc.copy_media_group(dest_id, message.chat.id, message.id)
-                )
-                # copy_media_group 返回消息列表，取第一个
-                if result:
-                    if isinstance(result, list) and len(result) > 0:
-                        forwarded_msg_id = result[0].id if hasattr(result[0], 'id') else result[0]
-                    else:
-                        forwarded_msg_id = result.id if hasattr(result, 'id') else result
+                forwarded_msg_id = self._copy_media_group(message, dest_id)
                 logger.info(f"   ✅ 媒体组已复制（隐藏引用）")
-                time.sleep(RATE_LIMIT_DELAY)
             except UnrecoverableError:
                 raise
             except Exception as e:
                 logger.warning(f"   复制媒体组失败，回退到复制单条: {e}")
                 result = self._execute_with_flood_retry(
                     "复制单条消息",
-                    lambda: self.acc.copy_message(dest_id, message.chat.id, message.id)
+                    lambda: self.acc.copy_message(dest_id, message.chat_id, message.id),
+                    rate_limit_key=str(dest_id)
                 )
                 if result:
                     forwarded_msg_id = result.id if hasattr(result, 'id') else result
                 logger.info(f"   ✅ 消息已复制（单条）")
-                time.sleep(RATE_LIMIT_DELAY)
         else:
             result = self._execute_with_flood_retry(
                 "复制消息",
-                lambda: self.acc.copy_message(dest_id, message.chat.id, message.id)
+                lambda: self.acc.copy_message(dest_id, message.chat_id, message.id),
+                rate_limit_key=str(dest_id)
             )
             if result:
                 forwarded_msg_id = result.id if hasattr(result, 'id') else result
             logger.info(f"   ✅ 消息已复制")
-            time.sleep(RATE_LIMIT_DELAY)
 
         return forwarded_msg_id
 
+    def _copy_media_group(self, message, dest_id, caption: Optional[str] = None):
+        """Copy a whole album with one copy_media_group call, keeping it grouped
+
+        Args:
+            message: 相册中任意一条消息的引用（MessageRef）
+            dest_id: 目标ID
+            caption: 替换第一条媒体的caption（其余媒体保留原caption），None 表示全部保留
+
+        Returns:
+            复制后的第一条消息ID（用于链式转发）
+        """
+        # 传入列表时只替换对应位置的caption；传入字符串会清空其余媒体的caption
+        captions = [caption] if caption is not None else None
+        result = self._execute_with_flood_retry(
+            "复制媒体组",
+            lambda: self.acc.copy_media_group(dest_id, message.chat_id, message.id, captions=captions),
+            rate_limit_key=str(dest_id)
+        )
+        # copy_media_group 返回消息列表，取第一个
+        if not result:
+            return None
+        first = result[0] if isinstance(result, list) else result
+        return first.id if hasattr(first, 'id') else first
+
     def _trigger_dest_monitoring(self, dest_chat_id, forwarded_message_id, message_text):
         """手动触发目标频道的监控配置处理
 
@@ -927,13 +1593,11 @@ class MessageWorker:
             forwarded_message_id: 转发后的消息ID（在目标频道中）
             message_text: 消息文本内容
         """
-        from config import load_watch_config, get_monitored_sources
-
         dest_chat_id_str = str(dest_chat_id)
-        monitored_sources = get_monitored_sources()
 
-        # 检查目标是否是监控源
-        if dest_chat_id_str not in monitored_sources:
+        # 检查目标是否是监控源（内存路由快照中的一次字典查找）
+        routes = get_watch_index().routes_for(dest_chat_id_str)
+        if not routes:
             return
 
         logger.info(f"🔄 目标频道 {dest_chat_id} 也是监控源，手动触发其配置处理...")
@@ -951,98 +1615,69 @@ class MessageWorker:
             logger.error(f"   ❌ 获取转发后的消息对象失败: {e}")
             return
 
-        watch_config = load_watch_config()
         matched_configs = 0
 
-        for check_user_id, check_watches in watch_config.items():
-            for check_watch_key, check_watch_data in check_watches.items():
-                if isinstance(check_watch_data, dict):
-                    check_source = str(check_watch_data.get("source", ""))
+        for route in routes:
+            rule = route.rule
+            matched_configs += 1
 
-                    # 匹配目标频道的配置
-                    if check_source != dest_chat_id_str:
-                        continue
+            # 跳过"转发到自己"的配置，避免无限循环
+            if not rule.record_mode and rule.dest == dest_chat_id_str:
+                logger.debug(f"   ⏭️ 跳过转发到自己的配置，避免循环")
+                continue
 
-                    matched_configs += 1
+            logger.info(f"   ✅ 找到目标频道的配置 #{matched_configs}: user={route.user_id}, mode={'记录' if rule.record_mode else '转发到 ' + str(rule.dest)}")
 
-                    # 提取配置
-                    check_record_mode = check_watch_data.get("record_mode", False)
-                    check_dest = check_watch_data.get("dest")
+            # 应用过滤规则（规则首次使用时编译一次）
+            result = rule.filter.evaluate(message_text)
+            if not result.passed:
+                logger.debug(f"   ⏭️ 目标频道配置：{result.stage} 过滤")
+                continue
 
-                    # 跳过"转发到自己"的配置，避免无限循环
-                    if not check_record_mode and check_dest == dest_chat_id_str:
-                        logger.debug(f"   ⏭️ 跳过转发到自己的配置，避免循环")
-                        continue
+            logger.info(f"   🎯 目标频道配置：通过过滤规则")
 
-                    logger.info(f"   ✅ 找到目标频道的配置 #{matched_configs}: user={check_user_id}, mode={'记录' if check_record_mode else '转发到 ' + str(check_dest)}")
-                    dest_whitelist = check_watch_data.get("whitelist", [])
-                    dest_blacklist = check_watch_data.get("blacklist", [])
-                    dest_whitelist_regex = check_watch_data.get("whitelist_regex", [])
-                    dest_blacklist_regex = check_watch_data.get("blacklist_regex", [])
-                    check_forward_mode = check_watch_data.get("forward_mode", "full")
-                    check_extract_patterns = check_watch_data.get("extract_patterns", [])
-
-                    # 应用过滤规则
-                    if check_blacklist(message_text, dest_blacklist):
-                        logger.debug(f"   ⏭️ 目标频道配置：黑名单过滤")
-                        continue
-                    if check_blacklist_regex(message_text, dest_blacklist_regex):
-                        logger.debug(f"   ⏭️ 目标频道配置：正则黑名单过滤")
-                        continue
-                    if not check_whitelist(message_text, dest_whitelist):
-                        logger.debug(f"   ⏭️ 目标频道配置：白名单过滤")
-                        continue
-                    if not check_whitelist_regex(message_text, dest_whitelist_regex):
-                        logger.debug(f"   ⏭️ 目标频道配置：正则白名单过滤")
+            # 记录模式
+            if rule.record_mode:
+                logger.info(f"   📝 目标频道配置：记录模式")
+                try:
+                    self._handle_record_mode(
+                        forwarded_message, route.user_id, dest_chat_id_str,
+                        message_text, rule.forward_mode, list(rule.extract_patterns)
+                    )
+                except Exception as e:
+                    logger.error(f"   ❌ 目标频道记录失败: {e}", exc_info=True)
+
+            # 转发模式（注意：不使用elif，因为一个频道可能同时有记录和转发配置）
+            check_dest = rule.dest
+            if check_dest and check_dest != "me":
+                logger.info(f"   📤 目标频道配置：转发到 {check_dest}")
+                logger.debug(f"      转发模式: {rule.forward_mode}")
+                if rule.extract_patterns:
+                    logger.debug(f"      提取规则: {list(rule.extract_patterns)}")
+
+                # 缓存下一级目标的Peer（仅在未缓存时）
+                check_dest_id = int(check_dest)
+                check_dest_str = str(check_dest)
+
+                # 只有未缓存时才尝试缓存
+                if not is_dest_cached(check_dest_str):
+                    logger.debug(f"      尝试缓存下一级目标Peer: {check_dest}")
+                    if not cache_peer_if_needed(self.acc, check_dest_id, "下一级目标"):
+                        logger.warning(f"   ⚠️ 下一级目标Peer缓存失败: {check_dest}")
+                        logger.warning(f"      💡 提示：如果目标是私聊用户，请确保该用户已与账号建立过对话")
+                        logger.warning(f"      💡 可以让该用户向账号发送一条消息，然后重启Bot")
                         continue
+                else:
+                    logger.debug(f"      下一级目标Peer已缓存: {check_dest}")
 
-                    logger.info(f"   🎯 目标频道配置：通过过滤规则")
-
-                    # 记录模式
-                    if check_record_mode:
-                        logger.info(f"   📝 目标频道配置：记录模式")
-                        try:
-                            self._handle_record_mode(
-                                forwarded_message, check_user_id, dest_chat_id_str,
-                                message_text, check_forward_mode, check_extract_patterns
-                            )
-                        except Exception as e:
-                            logger.error(f"   ❌ 目标频道记录失败: {e}", exc_info=True)
-
-                    # 转发模式（注意：不使用elif，因为一个频道可能同时有记录和转发配置）
-                    if check_dest and check_dest != "me":
-                        logger.info(f"   📤 目标频道配置：转发到 {check_dest}")
-                        logger.debug(f"      转发模式: {check_forward_mode}")
-                        if check_extract_patterns:
-                            logger.debug(f"      提取规则: {check_extract_patterns}")
-
-                        # 缓存下一级目标的Peer（仅在未缓存时）
-                        from bot.services.peer_cache import cache_peer_if_needed
-                        from bot.utils.peer import is_dest_cached
-                        check_dest_id = int(check_dest)
-                        check_dest_str = str(check_dest)
-
-                        # 只有未缓存时才尝试缓存
-                        if not is_dest_cached(check_dest_str):
-                            logger.debug(f"      尝试缓存下一级目标Peer: {check_dest}")
-                            if not cache_peer_if_needed(self.acc, check_dest_id, "下一级目标"):
-                                logger.warning(f"   ⚠️ 下一级目标Peer缓存失败: {check_dest}")
-                                logger.warning(f"      💡 提示：如果目标是私聊用户，请确保该用户已与账号建立过对话")
-                                logger.warning(f"      💡 可以让该用户向账号发送一条消息，然后重启Bot")
-                                continue
-                        else:
-                            logger.debug(f"      下一级目标Peer已缓存: {check_dest}")
-
-                        try:
-                            check_preserve_source = check_watch_data.get("preserve_forward_source", False)
-                            check_append_dn = check_watch_data.get("append_dn_to_magnet", False)
-                            self._handle_forward_mode(
-                                forwarded_message, check_dest, message_text,
-                                check_forward_mode, check_extract_patterns,
-                                check_preserve_source, False, check_append_dn
-                            )
-                        except Exception as e:
-                            logger.error(f"   ❌ 目标频道转发失败: {e}", exc_info=True)
+                try:
+                    self._handle_forward_mode(
+                        MessageRef.from_message(forwarded_message), check_dest, message_text,
+                        rule.forward_mode, list(rule.extract_patterns),
+                        rule.preserve_forward_source, False, rule.append_dn
+                    )
+                except Exception as e:
+                    logger.error(f"   ❌ 目标频道转发失败: {e}", exc_info=True)
 
         if matched_configs == 0:
             logger.debug(f"   ℹ️ 目标频道 {dest_chat_id} 没有匹配的配置")
@@ -1052,4 +1687,4 @@ class MessageWorker:
     def stop(self):
         """停止工作线程"""
         self.running = False
-        logger.info("🛑 正在停止消息工作线程...")
+        logger.info(f"🛑 正在停止消息工作线程 #{self.shard_id}...")
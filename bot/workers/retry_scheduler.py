@@ -0,0 +1,72 @@
+"""
+Delayed retry scheduler
+Holds retrying messages in a due-time ordered heap so the worker keeps
+draining fresh messages while failed ones wait for their backoff
+"""
+import time
+import heapq
+import random
+import itertools
+import threading
+import logging
+from typing import Any, List, Optional
+
+from constants import MAX_PARKED_RETRIES, RETRY_JITTER_RATIO
+
+logger = logging.getLogger(__name__)
+
+
+class RetryScheduler:
+    """Min-heap of (due_time, seq, item) with jitter and a parked-item limit"""
+
+    def __init__(self, max_parked: int = MAX_PARKED_RETRIES, jitter_ratio: float = RETRY_JITTER_RATIO):
+        self.max_parked = max_parked
+        self.jitter_ratio = jitter_ratio
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, item: Any, delay: float, now: Optional[float] = None) -> bool:
+        """Park an item until ``delay`` seconds (± jitter) from now
+
+        Args:
+            item: Item to retry later
+            delay: Backoff in seconds
+            now: Current time (defaults to time.time())
+
+        Returns:
+            True if parked, False if the scheduler is full
+        """
+        if now is None:
+            now = time.time()
+        if self.jitter_ratio > 0:
+            delay *= 1 + random.uniform(-self.jitter_ratio, self.jitter_ratio)
+
+        with self._lock:
+            if len(self._heap) >= self.max_parked:
+                return False
+            heapq.heappush(self._heap, (now + max(0.0, delay), next(self._seq), item))
+        return True
+
+    def pop_due(self, now: Optional[float] = None) -> List[Any]:
+        """Remove and return every item whose due time has passed (in due order)"""
+        if now is None:
+            now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def time_until_next(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next item is due, or None when nothing is parked"""
+        with self._lock:
+            if not self._heap:
+                return None
+            next_due = self._heap[0][0]
+        if now is None:
+            now = time.time()
+        return max(0.0, next_due - now)
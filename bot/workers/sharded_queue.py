@@ -0,0 +1,222 @@
+"""
+Sharded message queue
+Routes queued messages to per-destination shards so that each destination keeps
+its ordering while unrelated destinations are processed in parallel
+"""
+import time
+import queue
+import zlib
+import logging
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional
+
+from bot.utils.near_duplicate import forget_undelivered
+from constants import MAX_QUEUE_DEPTH, QUEUE_BLOCK_TIMEOUT, OVERFLOW_POLICIES, DEFAULT_OVERFLOW_POLICY
+
+logger = logging.getLogger(__name__)
+
+
+def make_shard_key(dest_chat_id: Optional[str], source_chat_id: str) -> str:
+    """Routing key from raw chat ids (forward mode by destination, record mode by source)"""
+    if dest_chat_id:
+        return f"dest:{dest_chat_id}"
+    return f"source:{source_chat_id}"
+
+
+def get_shard_key(msg_obj) -> str:
+    """Get the routing key of a queued message
+
+    Forward mode routes by destination chat, record mode (no destination)
+    routes by source chat.
+
+    Args:
+        msg_obj: Queued message object
+
+    Returns:
+        Routing key string
+    """
+    return make_shard_key(msg_obj.dest_chat_id, msg_obj.source_chat_id)
+
+
+class ShardedMessageQueue:
+    """A set of FIFO queues, one per worker, with stable key-based routing
+
+    Exposes the subset of the ``queue.Queue`` API used by the handlers
+    (``put`` / ``qsize`` / ``join``) so it can replace a single queue.
+
+    Each shard holds at most ``max_depth`` new entries; ``offer`` applies the
+    watch's overflow policy when a shard is full.
+    """
+
+    def __init__(self, num_shards: int, shards: Optional[list] = None,
+                 max_depth: int = MAX_QUEUE_DEPTH, block_timeout: float = QUEUE_BLOCK_TIMEOUT):
+        if num_shards < 1:
+            raise ValueError("num_shards 必须大于 0")
+        if shards is not None and len(shards) != num_shards:
+            raise ValueError("shards 数量与 num_shards 不一致")
+        # 默认使用内存队列；持久化模式传入 DurableShardQueue 列表
+        self.shards: List[queue.Queue] = shards if shards is not None else [queue.Queue() for _ in range(num_shards)]
+        self.max_depth = max_depth
+        self.block_timeout = block_timeout
+        self._shard_locks = [threading.Lock() for _ in range(num_shards)]
+        self._overflow_lock = threading.Lock()
+        self._overflow_counts: List[Counter] = [Counter() for _ in range(num_shards)]
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shards)
+
+    def shard_index(self, key: str) -> int:
+        """Map a routing key to a shard index (stable across restarts)"""
+        return zlib.crc32(key.encode('utf-8')) % len(self.shards)
+
+    def shard_for(self, msg_obj) -> queue.Queue:
+        """Get the shard queue responsible for a message"""
+        return self.shards[self.shard_index(get_shard_key(msg_obj))]
+
+    def offer(self, msg_obj, policy: Optional[str] = DEFAULT_OVERFLOW_POLICY, block: bool = True) -> bool:
+        """Enqueue a new entry, applying the overflow policy of its watch when the shard is full
+
+        The depth check and the enqueue happen under the shard lock, so
+        concurrent handlers cannot push a shard past ``max_depth``.
+
+        Policies when the target shard is full:
+            block: wait up to ``block_timeout`` for room, then drop the new message
+            drop_oldest: discard the oldest entry of the shard to make room
+            drop_newest: discard the new message
+            spill: accept; the entry is written to disk instead of memory
+
+        Args:
+            msg_obj: Queue entry to enqueue
+            policy: Overflow policy of the watch
+            block: False for callers that must not wait (e.g. the album flush
+                thread); the block policy then spills instead
+
+        Returns:
+            True if the entry was enqueued, False if it was shed
+        """
+        index = self.shard_index(get_shard_key(msg_obj))
+        shard = self.shards[index]
+
+        if policy not in OVERFLOW_POLICIES:
+            logger.warning(f"⚠️ 未知的队列溢出策略: {policy}，使用默认策略 {DEFAULT_OVERFLOW_POLICY}")
+            policy = DEFAULT_OVERFLOW_POLICY
+        if policy == "block" and not block:
+            policy = "spill"
+
+        # block: 等待工作线程腾出空间（阻塞处理器即向上游施加背压）；等待时不持有分片锁
+        deadline = time.monotonic() + self.block_timeout
+        while True:
+            with self._shard_locks[index]:
+                if self.max_depth <= 0 or shard.qsize() < self.max_depth:
+                    shard.put(msg_obj)
+                    return True
+                if policy != "block":
+                    return self._put_full(index, shard, msg_obj, policy)
+                if time.monotonic() >= deadline:
+                    self._record_overflow(index, "block_timeouts")
+                    return False
+            time.sleep(0.05)
+
+    def _put_full(self, index: int, shard, msg_obj, policy: str) -> bool:
+        """Apply a non-blocking overflow policy to a full shard (caller holds the shard lock)"""
+        if policy == "drop_newest":
+            self._record_overflow(index, "dropped_newest")
+            return False
+
+        if policy == "drop_oldest":
+            try:
+                oldest = shard.get_nowait()
+            except queue.Empty:
+                oldest = None
+            if oldest is not None:
+                ack = getattr(shard, 'ack', None)
+                if ack is not None:
+                    ack(oldest)
+                shard.task_done()
+                forget_undelivered(oldest)
+                self._record_overflow(index, "dropped_oldest")
+            shard.put(msg_obj)
+            return True
+
+        # spill: 内存队列写入磁盘；持久化分片本身已落盘，直接接收
+        spill_put = getattr(shard, 'spill_put', None)
+        if spill_put is None:
+            shard.put(msg_obj)
+            return True
+        spill_put(msg_obj)
+        self._record_overflow(index, "spilled")
+        return True
+
+    def _record_overflow(self, index: int, counter: str):
+        with self._overflow_lock:
+            self._overflow_counts[index][counter] += 1
+            total = self._overflow_counts[index][counter]
+        # 避免洪峰时日志刷屏：首次及每100次记录一次
+        if total == 1 or total % 100 == 0:
+            logger.warning(f"⚠️ 分片#{index} 队列已满（{self.max_depth}），{counter} 累计 {total} 条")
+
+    def put(self, msg_obj, block: bool = True, timeout: float = None):
+        """Enqueue a message into its shard without a depth check (retries of entries already admitted)"""
+        self.shard_for(msg_obj).put(msg_obj, block=block, timeout=timeout)
+
+    def qsize(self) -> int:
+        """Total number of queued messages across all shards"""
+        return sum(shard.qsize() for shard in self.shards)
+
+    def join(self):
+        """Block until every shard has processed all of its messages"""
+        for shard in self.shards:
+            shard.join()
+
+    def get_overflow_stats(self, index: Optional[int] = None) -> Dict[str, int]:
+        """Load-shedding counters (dropped_oldest, dropped_newest, block_timeouts, spilled)
+
+        Args:
+            index: Shard index, or None for the total over all shards
+        """
+        counters = ("dropped_oldest", "dropped_newest", "block_timeouts", "spilled")
+        with self._overflow_lock:
+            if index is not None:
+                counts = self._overflow_counts[index]
+            else:
+                counts = sum(self._overflow_counts, Counter())
+            return {name: counts[name] for name in counters}
+
+
+class MessageWorkerPool:
+    """Owns the shard workers and their threads, and aggregates statistics"""
+
+    def __init__(self, message_queue: ShardedMessageQueue, workers: list, threads: list):
+        self.message_queue = message_queue
+        self.workers = workers
+        self.threads = threads
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Per-shard statistics: queue depth, in-flight count, parked retries, throughput and shed counts
+
+        Returns:
+            List of dictionaries, one per shard
+        """
+        stats = []
+        for shard_id, worker in enumerate(self.workers):
+            overflow = self.message_queue.get_overflow_stats(shard_id)
+            stats.append({
+                'shard': shard_id,
+                'depth': self.message_queue.shards[shard_id].qsize(),
+                'in_flight': worker.in_flight,
+                'parked_retries': len(worker.retry_scheduler),
+                'processed': worker.processed_count,
+                'skipped': worker.skipped_count,
+                'failed': worker.failed_count,
+                'throughput': worker.get_throughput(),
+                'dropped': overflow['dropped_oldest'] + overflow['dropped_newest'] + overflow['block_timeouts'],
+                'spilled': overflow['spilled'],
+            })
+        return stats
+
+    def stop(self):
+        """Stop all workers"""
+        for worker in self.workers:
+            worker.stop()
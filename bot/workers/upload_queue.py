@@ -0,0 +1,176 @@
+"""
+Background media upload queue
+Record mode saves media locally and records the note with the local path;
+the files are then pushed to WebDAV by a small pool of uploader threads, so
+slow uploads never block the message workers. Pending uploads live in the
+upload_outbox table and survive restarts; a finished upload switches the
+notes to the remote location in the same transaction that removes it from
+the outbox. Remote files whose last note was deleted are queued in the same
+outbox (under their remote location) and deleted by the same threads.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Iterable, List, Optional
+
+from database import (
+    enqueue_uploads, claim_upload, reschedule_upload, drop_upload, complete_upload, media_location_in_use
+)
+from bot.storage.webdav_client import REMOTE_LOCATION_PREFIX
+from constants import (
+    UPLOAD_WORKERS, UPLOAD_POLL_INTERVAL, UPLOAD_LEASE, UPLOAD_RETRY_BACKOFF, UPLOAD_RETRY_MAX_BACKOFF
+)
+
+logger = logging.getLogger(__name__)
+
+# 取任务在进程内串行（claim_upload 的 SELECT + UPDATE 不会被两个线程同时执行，替换上传队列时也一样）
+_claim_lock = threading.Lock()
+
+
+def is_remote_location(storage_location: str) -> bool:
+    return storage_location.startswith(REMOTE_LOCATION_PREFIX)
+
+
+class UploadQueue:
+    """Bounded pool of uploader threads fed from the persistent outbox"""
+
+    def __init__(self, webdav_client, media_dir: str, num_workers: int = UPLOAD_WORKERS, keep_local: bool = False,
+                 poll_interval: float = UPLOAD_POLL_INTERVAL, lease: float = UPLOAD_LEASE,
+                 retry_backoff: float = UPLOAD_RETRY_BACKOFF, max_backoff: float = UPLOAD_RETRY_MAX_BACKOFF):
+        self.webdav_client = webdav_client
+        self.media_dir = media_dir
+        self.num_workers = num_workers
+        self.keep_local = keep_local
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.uploaded_count = 0
+        self.deleted_count = 0
+        self.failed_count = 0
+        self.running = False
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Condition()
+
+    def start(self) -> "UploadQueue":
+        self.running = True
+        for index in range(self.num_workers):
+            thread = threading.Thread(target=self._run, daemon=True, name=f"MediaUpload-{index}")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self.running = False
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def submit(self, storage_locations: Iterable[str]) -> int:
+        """Queue local media files of a recorded note for upload
+
+        Returns:
+            Number of files added to the outbox
+        """
+        locations = sorted({location for location in storage_locations
+                            if location and not is_remote_location(location)})
+        if not locations:
+            return 0
+        added = enqueue_uploads(locations)
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return added
+
+    def _run(self):
+        while self.running:
+            try:
+                if not self.process_next():
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+            except Exception as e:
+                logger.error(f"❌ 上传线程异常: {e}", exc_info=True)
+                time.sleep(self.poll_interval)
+
+    def process_next(self) -> bool:
+        """Upload (or delete from WebDAV) one due file from the outbox
+
+        Returns:
+            False if nothing was due
+        """
+        with _claim_lock:
+            job = claim_upload(time.time(), self.lease)
+        if job is None:
+            return False
+        job_id, storage_location, attempts = job
+        if is_remote_location(storage_location):
+            return self._delete_remote(job_id, storage_location, attempts)
+        local_path = os.path.join(self.media_dir, storage_location)
+        if not os.path.exists(local_path):
+            logger.warning(f"⚠️ 待上传的媒体文件不存在，已从发件箱移除: {storage_location}")
+            drop_upload(job_id)
+            return True
+
+        error = self._upload(local_path, storage_location)
+        if error is None:
+            switched = complete_upload(job_id, storage_location, REMOTE_LOCATION_PREFIX + storage_location)
+            self.uploaded_count += 1
+            logger.info(f"☁️ 媒体已上传: {storage_location} ({switched} 条笔记已切换到远程位置)")
+            if not self.keep_local:
+                try:
+                    os.remove(local_path)
+                except OSError:
+                    pass
+        else:
+            self._reschedule(job_id, attempts, error, "媒体上传", storage_location)
+        return True
+
+    def _delete_remote(self, job_id: int, storage_location: str, attempts: int) -> bool:
+        # 排队后同一内容又被保存并上传时，远程文件仍在使用
+        if media_location_in_use(storage_location):
+            drop_upload(job_id)
+            return True
+        remote_path = storage_location[len(REMOTE_LOCATION_PREFIX):]
+        error = self._call(self.webdav_client.delete_file, remote_path, rejected="delete rejected")
+        if error is None:
+            drop_upload(job_id)
+            self.deleted_count += 1
+            logger.info(f"🗑️ 远程媒体已删除: {remote_path}")
+        else:
+            self._reschedule(job_id, attempts, error, "远程媒体删除", remote_path)
+        return True
+
+    def _reschedule(self, job_id: int, attempts: int, error: str, action: str, location: str):
+        attempts += 1
+        delay = min(self.retry_backoff * 2 ** (attempts - 1), self.max_backoff)
+        reschedule_upload(job_id, attempts, time.time() + delay, error)
+        self.failed_count += 1
+        logger.warning(f"⚠️ {action}失败（第 {attempts} 次），{delay:.0f} 秒后重试: {location}: {error}")
+
+    def _upload(self, local_path: str, storage_location: str) -> Optional[str]:
+        return self._call(self.webdav_client.upload_file, local_path, storage_location, rejected="upload rejected")
+
+    @staticmethod
+    def _call(method, *args, rejected: str) -> Optional[str]:
+        """Run a WebDAV call; returns None on success or the error text"""
+        try:
+            if method(*args):
+                return None
+            return rejected
+        except Exception as e:
+            return str(e) or type(e).__name__
+
+
+_upload_queue: Optional[UploadQueue] = None
+_upload_queue_lock = threading.Lock()
+
+
+def start_upload_queue(webdav_client, media_dir: str, num_workers: int = UPLOAD_WORKERS,
+                       keep_local: bool = False) -> UploadQueue:
+    """Start the process-wide upload queue (replacing a running one)"""
+    global _upload_queue
+    with _upload_queue_lock:
+        old = _upload_queue
+        _upload_queue = UploadQueue(webdav_client, media_dir, num_workers, keep_local).start()
+    if old is not None:
+        old.stop()
+    return _upload_queue
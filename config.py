@@ -18,6 +18,11 @@ CONFIG_FILE = os.path.join(CONFIG_DIR, 'config.json')
 WATCH_FILE = os.path.join(CONFIG_DIR, 'watch_config.json')
 WEBDAV_CONFIG_FILE = os.path.join(CONFIG_DIR, 'webdav_config.json')
 VIEWER_CONFIG_FILE = os.path.join(CONFIG_DIR, 'viewer_config.json')
+RATE_LIMIT_FILE = os.path.join(CONFIG_DIR, 'rate_limits.json')
+REGEX_QUARANTINE_FILE = os.path.join(CONFIG_DIR, 'regex_quarantine.json')
+QUEUE_DB_FILE = os.path.join(DATA_DIR, 'queue.db')
+QUEUE_SPILL_DB_FILE = os.path.join(DATA_DIR, 'queue_spill.db')
+DELIVERY_LEDGER_DB_FILE = os.path.join(DATA_DIR, 'delivery_ledger.db')
 
 # Ensure directories exist
 os.makedirs(CONFIG_DIR, exist_ok=True)
@@ -25,6 +30,8 @@ os.makedirs(MEDIA_DIR, exist_ok=True)
 
 # Global state
 _monitored_sources: Set[str] = set()
+# 每次监控配置重新加载时递增，内存中的路由快照据此判断是否需要重建
+_watch_config_generation = 0
 
 
 def load_config() -> Dict[str, Any]:
@@ -105,8 +112,9 @@ def build_monitored_sources() -> Set[str]:
 
 def reload_monitored_sources():
     """Reload the monitored sources set (call after config changes)"""
-    global _monitored_sources
+    global _monitored_sources, _watch_config_generation
     _monitored_sources = build_monitored_sources()
+    _watch_config_generation += 1
     logger.info(f"🔄 监控源已更新: {_monitored_sources if _monitored_sources else '无'}")
 
 
@@ -133,6 +141,11 @@ def get_monitored_sources() -> Set[str]:
     return _monitored_sources
 
 
+def get_watch_config_generation() -> int:
+    """Return a counter that changes whenever the watch config is saved or reloaded"""
+    return _watch_config_generation
+
+
 def save_watch_config(config: Dict[str, Any], auto_reload: bool = True):
     """Save watch config to file and optionally reload monitored sources
 
@@ -150,6 +163,10 @@ def save_watch_config(config: Dict[str, Any], auto_reload: bool = True):
 
     logger.info("✅ 配置文件保存成功")
 
+    # 无论是否重载监控源，路由快照都需要在下次使用时重建
+    global _watch_config_generation
+    _watch_config_generation += 1
+
     # Automatically reload monitored sources to keep them in sync
     if auto_reload:
         logger.info("🔄 自动重新加载监控源...")
@@ -236,3 +253,54 @@ def save_viewer_config(config: Dict[str, Any]):
         os.fsync(f.fileno())
 
     logger.info("✅ 观看网站配置文件保存成功")
+
+
+def load_rate_limit_state() -> Dict[str, Any]:
+    """Load learned per-destination send rates from file"""
+    if os.path.exists(RATE_LIMIT_FILE):
+        try:
+            with open(RATE_LIMIT_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"❌ 加载限流状态失败: {e}")
+    return {}
+
+
+def save_rate_limit_state(state: Dict[str, Any]):
+    """Save learned per-destination send rates to file (atomic replace)
+
+    Args:
+        state: Rate limiter state dictionary to save
+    """
+    tmp_file = f"{RATE_LIMIT_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, RATE_LIMIT_FILE)
+    logger.debug(f"💾 限流状态已保存: {len(state.get('destinations', {}))} 个目标")
+
+
+def load_regex_quarantine() -> Dict[str, Any]:
+    """Load quarantined regex patterns from file"""
+    if os.path.exists(REGEX_QUARANTINE_FILE):
+        try:
+            with open(REGEX_QUARANTINE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"❌ 加载正则隔离列表失败: {e}")
+    return {}
+
+
+def save_regex_quarantine(quarantine: Dict[str, Any]):
+    """Save quarantined regex patterns to file (atomic replace)
+
+    Args:
+        quarantine: Pattern -> quarantine details
+    """
+    tmp_file = f"{REGEX_QUARANTINE_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(quarantine, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, REGEX_QUARANTINE_FILE)
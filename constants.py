@@ -5,7 +5,7 @@ Centralized configuration for magic numbers and constants
 
 # Cache sizes (优化：进一步降低缓存大小以减少内存占用)
 MAX_MEDIA_GROUP_CACHE = 50  # 从100降到50，减少媒体组缓存
-MESSAGE_CACHE_CLEANUP_THRESHOLD = 200  # 从300降到200，更早触发清理
+MESSAGE_CACHE_MAX_SIZE = 4000  # 消息去重缓存上限：按 10k 条/秒 × TTL 留出余量，超出时先淘汰最旧条目
 MEDIA_GROUP_CLEANUP_BATCH_SIZE = 25  # 从50降到25，减少批量清理开销
 
 # Peer cache limits (优化：降低Peer缓存大小)
@@ -15,13 +15,73 @@ MAX_FAILED_PEERS = 20  # 从30降到20，减少失败Peer记录
 # Time constants (seconds)
 MESSAGE_CACHE_TTL = 0.2  # 从0.3降到0.2秒，更快过期
 WORKER_STATS_INTERVAL = 20  # 从30秒降到20秒，更频繁清理缓存
-RATE_LIMIT_DELAY = 1.0  # 保持1秒，平衡速度和稳定性
+RATE_LIMIT_DELAY = 1.0  # 保持1秒，平衡速度和稳定性（单个目标的默认发送间隔）
+
+# Adaptive rate limiter (每个目标一个令牌桶 + 账号全局令牌桶)
+RATE_LIMIT_BURST = 3  # 单个目标允许的突发消息数
+GLOBAL_RATE_LIMIT = 20.0  # 账号全局发送速率（条/秒）
+GLOBAL_RATE_LIMIT_BURST = 20
+RATE_LIMIT_MIN_RATE = 1.0 / 60  # 触发 FloodWait 后目标速率的下限（条/秒）
+RATE_LIMIT_RECOVERY_STEP = 0.05  # 每次发送成功后速率恢复的步长（条/秒）
+RATE_LIMIT_SAVE_INTERVAL = 60  # 学习到的速率持久化的最小间隔（秒）
+
+# Worker pool (消息按目标频道分片，每个分片一个工作线程，保证同一目标内的顺序)
+MESSAGE_WORKER_COUNT = 4
+# Message queue storage: "memory" (in-process) or "durable" (SQLite, survives restarts)
+MESSAGE_QUEUE_MODE = "memory"
+
+# Queue backpressure (每个分片的最大深度，达到后按监控任务的 overflow_policy 处理)
+MAX_QUEUE_DEPTH = 5000  # 0 表示不限制
+QUEUE_BLOCK_TIMEOUT = 10.0  # block 策略最长等待时间（秒），超时后丢弃新消息
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "spill")
+DEFAULT_OVERFLOW_POLICY = "block"
+
+# Delivery ledger (持久化的已投递记录，重启或重连后重放的更新不会被再次转发)
+DELIVERY_LEDGER_RETENTION_HOURS = 72  # 投递记录保留时间（小时），0 表示关闭
+DELIVERY_LEDGER_MAX_ENTRIES = 200000  # 最多保留的投递记录数，超出后删除最旧的
+DELIVERY_LEDGER_BLOOM_ERROR_RATE = 0.01  # 布隆过滤器误判率（误判只会多查一次数据库）
+
+# Near-duplicate suppression (监控任务配置 near_duplicate 后，跳过其他来源转载的相同内容)
+NEAR_DUPLICATE_WINDOW = 3600.0  # 默认比较窗口（秒），近似重复只与窗口内的内容比较
+NEAR_DUPLICATE_RETENTION = 86400.0  # 索引保留内容的最长时间（秒），任务配置的窗口不能超过此值
+NEAR_DUPLICATE_MAX_ENTRIES = 10000  # 每个目标最多保留的内容数，超出后淘汰最旧的
+NEAR_DUPLICATE_MAX_DISTANCE = 3  # SimHash 汉明距离不超过此值视为近似重复（64 位）
+NEAR_DUPLICATE_MIN_TEXT_LENGTH = 20  # 去除空白和标点后短于此长度的文本不参与比较
+NEAR_DUPLICATE_MAX_TEXT_LENGTH = 1024  # 只对去除空白和标点后的前若干字符计算 SimHash，限制长文在分发线程上的开销
+
+# Coalesced forwarding (保留来源的连续转发合并为一次 forward_messages 调用)
+COALESCE_WINDOW = 0.3  # 等待同一来源/目标后续消息的时间窗口（秒），0 表示只合并已在队列中的消息，负数关闭合并
+COALESCE_MAX_BATCH = 100  # Telegram forward_messages 单次最多 100 条
+TELEGRAM_MESSAGE_LIMIT = 4096  # 单条文本消息的最大长度（UTF-16 码元），连续的提取结果按此长度合并发送
+
+# Media group fetch cache (同一相册在处理器、工作线程和链式转发中共享一次 get_media_group 结果)
+MEDIA_GROUP_FETCH_CACHE_TTL = 30.0  # 相册内容缓存时间（秒）
+MEDIA_GROUP_FETCH_CACHE_SIZE = 128  # 最多缓存的相册数，超出后淘汰最久未使用的
+MEDIA_GROUP_FETCH_WAIT_TIMEOUT = 15.0  # 等待其他线程正在进行的同一相册请求的最长时间（秒）
+
+# Media group assembly (处理器按 media_group_id 收集相册各部分，静默期后整体入队一次)
+MEDIA_GROUP_ASSEMBLY_QUIET = 0.8  # 最后一个部分到达后等待的静默时间（秒）
+MEDIA_GROUP_ASSEMBLY_MAX_WAIT = 5.0  # 相册从第一部分到达起最长缓冲时间（秒）
+MEDIA_GROUP_FLUSHED_TTL = 120.0  # 已输出相册的记录保留时间，期间迟到的部分会被丢弃（秒）
+
+# Watch routing index (按源频道索引的监控规则快照)
+WATCH_INDEX_MTIME_CHECK_INTERVAL = 2.0  # 检查 watch_config.json 修改时间的最小间隔（秒），用于发现外部修改
+
+# Regex evaluation budget (可能发生灾难性回溯的用户正则放到常驻子进程中限时执行)
+REGEX_EVAL_BUDGET = 0.5  # 单个可疑正则处理一条消息的时间上限（秒），超时的正则被自动隔离
+REGEX_SANDBOX_PROCESSES = 2  # 执行可疑正则的常驻子进程数
+REGEX_SANDBOX_START_TIMEOUT = 10.0  # 子进程启动握手的最长等待时间（秒）
+REGEX_PROBE_LENGTH = 5000  # 添加正则时用于探测回溯的测试文本长度
 
 # Retry configuration
 MAX_RETRIES = 3
 MAX_FLOOD_RETRIES = 3
 OPERATION_TIMEOUT = 30.0
 
+# Delayed retry scheduler (重试消息在堆中等待退避时间，不阻塞工作线程)
+MAX_PARKED_RETRIES = 500  # 每个工作线程最多挂起的重试消息数
+RETRY_JITTER_RATIO = 0.2  # 退避时间随机抖动比例（±20%）
+
 # Backoff configuration
 def get_backoff_time(retry_count: int) -> int:
     """Calculate exponential backoff time: 1s, 2s, 4s"""
@@ -29,6 +89,26 @@ def get_backoff_time(retry_count: int) -> int:
 
 # Media limits
 MAX_MEDIA_PER_GROUP = 9
+MEDIA_DOWNLOAD_CONCURRENCY = 4  # 每个账号同时进行的媒体下载数（记录模式相册各项并发下载）
+MEDIA_DOWNLOAD_TIMEOUT = 60.0  # 单个媒体下载并保存的超时时间（秒），超时的项被跳过
+
+# Media save durability (保存的媒体文件按批 fsync，而不是每个文件单独同步)
+MEDIA_FSYNC_BATCH_SIZE = 32  # 累计多少个文件后同步一次
+MEDIA_FSYNC_INTERVAL = 2.0  # 最早一个未同步文件最多等待的时间（秒）
+
+# WebDAV storage (所有上传共用一个连接池会话，失败按指数退避重试)
+WEBDAV_TIMEOUT = 30  # 单次请求超时（秒）
+WEBDAV_MAX_RETRIES = 3  # 连接错误和 5xx/429 响应的重试次数
+WEBDAV_RETRY_BACKOFF = 0.5  # 第一次重试前的等待时间（秒），之后每次翻倍
+WEBDAV_CHUNK_SIZE = 64 * 1024  # 分块上传的块大小（字节）
+WEBDAV_POOL_SIZE = 8  # 连接池中保持的连接数
+
+# Background media uploads (记录模式先保存本地文件，再由上传线程推送到 WebDAV)
+UPLOAD_WORKERS = 2  # 上传线程数
+UPLOAD_POLL_INTERVAL = 5.0  # 发件箱为空时的轮询间隔（秒）
+UPLOAD_LEASE = 300.0  # 取出的上传任务在此时间内对其他线程隐藏（秒），进程退出后到期重新上传
+UPLOAD_RETRY_BACKOFF = 30.0  # 上传失败后第一次重试的等待时间（秒），之后每次翻倍
+UPLOAD_RETRY_MAX_BACKOFF = 3600.0  # 重试等待时间上限（秒）
 
 # Database deduplication window (seconds)
 DB_DEDUP_WINDOW = 5
@@ -5,9 +5,10 @@ from zoneinfo import ZoneInfo
 import os
 import json
 import logging
-import re
 from contextlib import contextmanager
 from constants import DB_DEDUP_WINDOW
+from bot.utils.magnet import first_magnet, parse_magnet, rewrite_magnets, set_dn, base_dn_text
+from bot.storage.webdav_client import REMOTE_LOCATION_PREFIX
 
 logger = logging.getLogger(__name__)
 
@@ -166,6 +167,48 @@ def init_database():
             ON calibration_tasks(note_id)
         ''')
 
+        # 创建媒体内容寻址存储表（按内容哈希去重，refcount 为引用该文件的笔记数）
+        print("🗂️ 正在创建 media_blobs 表...")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS media_blobs (
+                content_hash TEXT PRIMARY KEY,
+                storage_location TEXT NOT NULL UNIQUE,
+                size INTEGER,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS media_blob_ids (
+                file_unique_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                FOREIGN KEY (content_hash) REFERENCES media_blobs(content_hash) ON DELETE CASCADE
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_media_blob_ids_hash
+            ON media_blob_ids(content_hash)
+        ''')
+        print("✅ media_blobs 表创建成功")
+
+        # 创建媒体上传发件箱（待上传到远程存储的本地文件，以及带 webdav: 前缀的待删除远程文件；失败后按 next_attempt 重试）
+        print("📤 正在创建 upload_outbox 表...")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                storage_location TEXT NOT NULL UNIQUE,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_upload_outbox_next
+            ON upload_outbox(next_attempt)
+        ''')
+        print("✅ upload_outbox 表创建成功")
+
         # 创建自动校准配置表
         print("⚙️ 正在创建 auto_calibration_config 表...")
         cursor.execute('''
@@ -283,17 +326,15 @@ def _extract_magnet_link(message_text):
 
     # 匹配完整的磁力链接格式: magnet:?xt=urn:btih:...（包含所有参数）
     # 匹配到换行、竖线或字符串结束为止（允许空格，因为dn参数中可能有空格）
-    magnet_pattern = r'magnet:\?xt=urn:btih:[a-zA-Z0-9]+(?:[&?][^\n\r|]*)?'
-    match = re.search(magnet_pattern, message_text, re.IGNORECASE)
+    magnet = first_magnet(message_text, to_line_end=True)
 
-    if match:
-        magnet_link = match.group(0).rstrip()
+    if magnet:
+        magnet_link = magnet.link
 
         # 检测是否有 dn 参数
-        if '&dn=' not in magnet_link and '?dn=' not in magnet_link:
+        if magnet.dn is None:
             # 提取开头至第一个 # 之前的内容作为 dn
-            hash_pos = message_text.find('#')
-            dn_text = message_text[:hash_pos].rstrip() if hash_pos != -1 else message_text.rstrip()
+            dn_text = base_dn_text(message_text)
 
             if dn_text:
                 # URL编码dn参数，保留空格和特殊字符
@@ -314,6 +355,8 @@ def add_note(user_id, source_chat_id, source_name, message_text, media_type=None
 
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            # 整个保存过程在一个写事务中：后台上传不会在解析位置和插入笔记之间切换媒体位置
+            cursor.execute('BEGIN IMMEDIATE')
 
             # Check for duplicate media groups
             if media_group_id:
@@ -327,13 +370,22 @@ def add_note(user_id, source_chat_id, source_name, message_text, media_type=None
                 if existing_id:
                     return existing_id
 
-            # Prepare media paths JSON
-            media_paths_json = None
+            # 已上传完成的媒体使用当前的远程位置
             if media_paths:
+                media_paths = _current_media_locations(cursor, media_paths)
                 if media_path is None:
                     media_path = media_paths[0]
+            if media_path:
+                media_path = _current_media_locations(cursor, [media_path])[0]
+
+            # Prepare media paths JSON
+            media_paths_json = None
+            if media_paths:
                 media_paths_json = json.dumps(media_paths, ensure_ascii=False)
 
+            # Take a reference on every content-addressed media file
+            _acquire_media_refs(cursor, media_paths or [media_path])
+
             # Extract magnet link from message text
             magnet_link = _extract_magnet_link(message_text)
 
@@ -554,7 +606,6 @@ def update_note_with_calibrated_dns(note_id, calibrated_results):
     Returns:
         bool: 是否更新成功
     """
-    import re
     from urllib.parse import quote
 
     with get_db_connection() as conn:
@@ -569,24 +620,20 @@ def update_note_with_calibrated_dns(note_id, calibrated_results):
         message_text, old_magnet = row
         updated_text = message_text
 
-        # 更新笔记文本中的每个磁力链接
+        # 更新笔记文本中的每个磁力链接（一次扫描替换所有校准成功的链接）
         if message_text:
+            # 构建新的磁力链接（使用原始文件名，不编码），按 info hash 查找
+            new_magnets = {}
             for result in calibrated_results:
                 if not result.get('success'):
                     continue  # 跳过失败的校准
-
                 info_hash = result['info_hash']
-                filename = result.get('filename', '')
-
-                # 构建新的磁力链接（使用原始文件名，不编码）
-                new_magnet = f"magnet:?xt=urn:btih:{info_hash}&dn={filename}"
-
-                # 在文本中查找并替换该磁力链接
-                # 匹配: magnet:?xt=urn:btih:{hash} 后面跟任意参数直到换行或结束
-                magnet_pattern = rf'magnet:\?xt=urn:btih:{re.escape(info_hash)}(?:[&?][^\n\r]*)?'
+                new_magnets[info_hash.lower()] = f"magnet:?xt=urn:btih:{info_hash}&dn={result.get('filename', '')}"
 
-                # 替换找到的磁力链接
-                updated_text = re.sub(magnet_pattern, new_magnet, updated_text, flags=re.IGNORECASE)
+            if new_magnets:
+                updated_text, _ = rewrite_magnets(
+                    message_text, lambda magnet: new_magnets.get(magnet.info_hash.lower()), to_line_end=True
+                )
 
         # 更新magnet_link字段（使用第一个成功校准的磁力链接）
         new_magnet_link = old_magnet
@@ -597,12 +644,9 @@ def update_note_with_calibrated_dns(note_id, calibrated_results):
                 filename = result.get('filename', '')
                 old_magnet_for_db = result['old_magnet']
 
-                # 移除旧的 dn 参数
-                new_magnet_base = re.sub(r'[&?]dn=[^&]*', '', old_magnet_for_db)
-
-                # 添加URL编码的dn参数（用于存储）
+                # 替换 dn 参数为URL编码的文件名（用于存储）
                 encoded_filename = quote(filename) if filename else ""
-                new_magnet_link = f"{new_magnet_base}&dn={encoded_filename}"
+                new_magnet_link = set_dn(old_magnet_for_db, encoded_filename)
                 new_filename = filename  # 保存用于更新filename字段
                 break  # 只使用第一个成功的
 
@@ -626,8 +670,6 @@ def update_note_with_calibrated_dn(note_id, new_magnet_link, filename):
     Returns:
         bool: 是否更新成功
     """
-    import re
-
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -644,20 +686,19 @@ def update_note_with_calibrated_dn(note_id, new_magnet_link, filename):
 
         if message_text:
             # 提取 info hash（用于匹配磁力链接）
-            info_hash_match = re.search(r'xt=urn:btih:([a-zA-Z0-9]+)', new_magnet_link, re.IGNORECASE)
-            if info_hash_match:
-                info_hash = info_hash_match.group(1)
+            new_magnet = parse_magnet(new_magnet_link)
+            if new_magnet:
+                info_hash = new_magnet.info_hash.lower()
 
                 # 构建用于笔记文本的磁力链接（使用未编码的文件名）
-                text_magnet_base = re.sub(r'[&?]dn=[^&]*', '', new_magnet_link)
-                text_magnet = f"{text_magnet_base}&dn={filename}"
-
-                # 在文本中查找包含该 info hash 的磁力链接（可能有或没有 dn 参数）
-                # 匹配格式: magnet:?xt=urn:btih:{hash}(任意参数直到换行或结束)
-                magnet_pattern = rf'magnet:\?xt=urn:btih:{re.escape(info_hash)}(?:[&?][^\n\r]*)?'
+                text_magnet = set_dn(new_magnet_link, filename)
 
-                # 替换找到的磁力链接（使用未编码版本）
-                updated_text = re.sub(magnet_pattern, text_magnet, message_text, flags=re.IGNORECASE)
+                # 在文本中替换包含该 info hash 的磁力链接（可能有或没有 dn 参数）
+                updated_text, _ = rewrite_magnets(
+                    message_text,
+                    lambda magnet: text_magnet if magnet.info_hash.lower() == info_hash else None,
+                    to_line_end=True
+                )
 
         # 更新数据库：
         # - message_text: 使用未编码的文件名
@@ -694,17 +735,272 @@ def delete_note(note_id):
         # 删除数据库记录
         cursor.execute('DELETE FROM notes WHERE id = ?', (note_id,))
         affected = cursor.rowcount
-    
+
+        # 内容寻址的文件仅在最后一个引用删除后才删除
+        if affected:
+            media_files = _release_media_refs(cursor, media_files)
+        else:
+            media_files = set()
+
     # 删除关联的媒体文件
+    _remove_media_files(media_files)
+    
+    return affected > 0
+
+
+def _remove_media_files(media_files):
     for media_path in media_files:
         try:
+            # 已上传的文件可能保留了本地副本
+            if media_path.startswith(REMOTE_LOCATION_PREFIX):
+                media_path = media_path[len(REMOTE_LOCATION_PREFIX):]
             full_media_path = os.path.join(DATA_DIR, 'media', media_path)
             if os.path.exists(full_media_path):
                 os.remove(full_media_path)
         except Exception as e:
             logger.warning(f"删除媒体文件失败: {e}")
-    
-    return affected > 0
+
+# ==================== 媒体内容寻址存储 ====================
+
+def find_media_blob(file_unique_id=None, content_hash=None):
+    """Storage location of a stored media file, looked up by Telegram file_unique_id or content hash"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if file_unique_id:
+            cursor.execute('''
+                SELECT b.storage_location FROM media_blob_ids i
+                JOIN media_blobs b ON b.content_hash = i.content_hash
+                WHERE i.file_unique_id = ?
+            ''', (file_unique_id,))
+        else:
+            cursor.execute('SELECT storage_location FROM media_blobs WHERE content_hash = ?', (content_hash,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def pin_media_blob(file_unique_id=None, content_hash=None):
+    """Look up a stored media file and take a reference on it
+
+    The reference keeps the blob alive (a concurrent ``delete_note`` cannot
+    remove it) until the caller has saved its note and released the pin with
+    ``release_media_blobs``.
+
+    Returns:
+        (content_hash, storage_location), or None if the file is not stored
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if file_unique_id:
+            cursor.execute('''
+                SELECT b.content_hash, b.storage_location FROM media_blob_ids i
+                JOIN media_blobs b ON b.content_hash = i.content_hash
+                WHERE i.file_unique_id = ?
+            ''', (file_unique_id,))
+        else:
+            cursor.execute('SELECT content_hash, storage_location FROM media_blobs WHERE content_hash = ?',
+                           (content_hash,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute('UPDATE media_blobs SET refcount = refcount + 1 WHERE content_hash = ?', (row[0],))
+    return row
+
+
+def register_media_blob(content_hash, storage_location, size=None, file_unique_id=None, pin=False):
+    """Register a stored media file (and the file_unique_id it was downloaded as)
+
+    With ``pin`` the caller takes a reference that it releases with
+    ``release_media_blobs`` once its note is saved (or was not saved);
+    ``add_note`` takes the note's own references. If the same content was
+    registered concurrently, the existing location is returned.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO media_blobs (content_hash, storage_location, size)
+            VALUES (?, ?, ?)
+        ''', (content_hash, storage_location, size))
+        if pin:
+            cursor.execute('UPDATE media_blobs SET refcount = refcount + 1 WHERE content_hash = ?', (content_hash,))
+        if file_unique_id:
+            cursor.execute('''
+                INSERT OR REPLACE INTO media_blob_ids (file_unique_id, content_hash)
+                VALUES (?, ?)
+            ''', (file_unique_id, content_hash))
+        cursor.execute('SELECT storage_location FROM media_blobs WHERE content_hash = ?', (content_hash,))
+        return cursor.fetchone()[0]
+
+
+def release_media_blobs(content_hashes):
+    """Release pins taken by ``pin_media_blob`` / ``register_media_blob``
+
+    Blobs left without references (no note took one) are removed together
+    with their files.
+
+    Returns:
+        Number of blobs removed
+    """
+    removable = set()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        for content_hash in content_hashes:
+            cursor.execute('UPDATE media_blobs SET refcount = refcount - 1 WHERE content_hash = ?', (content_hash,))
+            cursor.execute('SELECT storage_location, refcount FROM media_blobs WHERE content_hash = ?',
+                           (content_hash,))
+            row = cursor.fetchone()
+            if row and row[1] <= 0:
+                cursor.execute('DELETE FROM media_blob_ids WHERE content_hash = ?', (content_hash,))
+                cursor.execute('DELETE FROM media_blobs WHERE content_hash = ?', (content_hash,))
+                removable.add(row[0])
+        _queue_remote_deletions(cursor, removable)
+    _remove_media_files(removable)
+    return len(removable)
+
+
+def _current_media_locations(cursor, media_paths):
+    """Replace local locations of blobs that were uploaded in the meantime by their remote location"""
+    current = []
+    for path in media_paths:
+        if path and not path.startswith(REMOTE_LOCATION_PREFIX):
+            cursor.execute('SELECT 1 FROM media_blobs WHERE storage_location = ?', (path,))
+            if cursor.fetchone() is None:
+                cursor.execute('SELECT 1 FROM media_blobs WHERE storage_location = ?', (REMOTE_LOCATION_PREFIX + path,))
+                if cursor.fetchone() is not None:
+                    path = REMOTE_LOCATION_PREFIX + path
+        current.append(path)
+    return current
+
+
+def _acquire_media_refs(cursor, media_paths):
+    """Add one reference to each content-addressed file of a note"""
+    for path in set(p for p in media_paths if p):
+        cursor.execute('UPDATE media_blobs SET refcount = refcount + 1 WHERE storage_location = ?', (path,))
+
+
+def _release_media_refs(cursor, media_paths):
+    """Drop one reference from each file of a deleted note
+
+    Returns:
+        The files that can be removed: blobs whose last reference is gone and
+        files that were never content-addressed
+    """
+    removable = set()
+    for path in media_paths:
+        cursor.execute('UPDATE media_blobs SET refcount = refcount - 1 WHERE storage_location = ?', (path,))
+        if not cursor.rowcount:
+            removable.add(path)
+            continue
+        cursor.execute('SELECT content_hash, refcount FROM media_blobs WHERE storage_location = ?', (path,))
+        content_hash, refcount = cursor.fetchone()
+        if refcount <= 0:
+            cursor.execute('DELETE FROM media_blob_ids WHERE content_hash = ?', (content_hash,))
+            cursor.execute('DELETE FROM media_blobs WHERE content_hash = ?', (content_hash,))
+            removable.add(path)
+    _queue_remote_deletions(cursor, removable)
+    return removable
+
+
+def _queue_remote_deletions(cursor, media_paths):
+    """Queue the remote copies of removed files for deletion by the upload queue
+
+    Remote locations never collide with the local locations of pending
+    uploads, so both share the outbox.
+    """
+    cursor.executemany('INSERT OR IGNORE INTO upload_outbox (storage_location) VALUES (?)',
+                       [(path,) for path in media_paths if path.startswith(REMOTE_LOCATION_PREFIX)])
+
+# ==================== 媒体上传发件箱 ====================
+
+def enqueue_uploads(storage_locations):
+    """Add local media files to the upload outbox
+
+    Files already queued are kept as they are; blobs that were uploaded in
+    the meantime are not queued again.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR IGNORE INTO upload_outbox (storage_location)
+            SELECT ? WHERE NOT EXISTS (SELECT 1 FROM media_blobs WHERE storage_location = ?)
+        ''', [(location, REMOTE_LOCATION_PREFIX + location) for location in storage_locations])
+        return cursor.rowcount
+
+
+def claim_upload(now, lease):
+    """Take the oldest due upload and hide it for ``lease`` seconds
+
+    A claimed upload that is neither completed nor rescheduled (the process
+    died) becomes due again when the lease runs out.
+
+    Returns:
+        (job_id, storage_location, attempts), or None if nothing is due
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, storage_location, attempts FROM upload_outbox
+            WHERE next_attempt <= ? ORDER BY next_attempt, id LIMIT 1
+        ''', (now,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute('UPDATE upload_outbox SET next_attempt = ? WHERE id = ?', (now + lease, row[0]))
+    return row
+
+
+def reschedule_upload(job_id, attempts, next_attempt, error):
+    """Record a failed upload attempt"""
+    with get_db_connection() as conn:
+        conn.execute('UPDATE upload_outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?',
+                     (attempts, next_attempt, error, job_id))
+
+
+def media_location_in_use(storage_location):
+    """Whether a media blob is stored at a location (checked before a queued remote deletion)"""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT 1 FROM media_blobs WHERE storage_location = ?', (storage_location,)).fetchone()
+    return row is not None
+
+
+def drop_upload(job_id):
+    """Remove an upload that can never succeed from the outbox"""
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM upload_outbox WHERE id = ?', (job_id,))
+
+
+def complete_upload(job_id, local_location, remote_location):
+    """Switch every note (and the media blob) from the local to the remote location
+
+    Runs in one transaction with the removal of the outbox entry, so a note
+    never points at a location that is half switched.
+
+    Returns:
+        Number of notes switched
+    """
+    local_json = json.dumps(local_location, ensure_ascii=False)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, media_path, media_paths FROM notes
+            WHERE media_path = ? OR instr(media_paths, ?) > 0
+        ''', (local_location, local_json))
+        switched = 0
+        for note_id, media_path, media_paths_json in cursor.fetchall():
+            if media_path == local_location:
+                media_path = remote_location
+            if media_paths_json:
+                try:
+                    media_paths = json.loads(media_paths_json)
+                    media_paths_json = json.dumps([remote_location if path == local_location else path
+                                                   for path in media_paths], ensure_ascii=False)
+                except (json.JSONDecodeError, TypeError):
+                    pass
+            cursor.execute('UPDATE notes SET media_path = ?, media_paths = ? WHERE id = ?',
+                           (media_path, media_paths_json, note_id))
+            switched += 1
+        cursor.execute('UPDATE media_blobs SET storage_location = ? WHERE storage_location = ?',
+                       (remote_location, local_location))
+        # 同一内容删除后又被保存：待删除的旧远程文件已被这次上传覆盖
+        cursor.execute('DELETE FROM upload_outbox WHERE id = ? OR storage_location = ?', (job_id, remote_location))
+    return switched
 
 # ==================== 自动校准功能 ====================
 
@@ -44,7 +44,7 @@ def main():
         bot, acc = initialize_clients()
 
         # 2. 初始化消息队列
-        message_queue, message_worker = initialize_message_queue(acc)
+        message_queue, worker_pool = initialize_message_queue(acc)
 
         # 3. 注册所有处理器
         register_all_handlers(bot, acc, message_queue)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Record-mode album download benchmark
+A fake client injects a fixed latency per download; compares the previous
+one-by-one loop with the download pool at several concurrency limits
+"""
+import sys
+import os
+import time
+import queue
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import MessageWorker
+from bot.workers import download_pool as download_pool_module
+from bot.workers.download_pool import DownloadPool
+from bot.utils.media_group_cache import media_group_cache
+
+ALBUM_SIZE = 9
+LATENCY = 0.25  # 每次下载的往返时间（秒）
+ROUNDS = 3
+
+
+class LatencyClient:
+    def __init__(self, album):
+        self.album = album
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_media_group(self, chat_id, message_id):
+        return self.album
+
+    def download_media(self, file_id, file_name=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(LATENCY)
+        return file_name
+
+
+class FakeStorage:
+    def save_file(self, source_path, filename, keep_local=False):
+        return True, filename
+
+
+def make_album(media_group_id):
+    parts = [SimpleNamespace(id=200 + i, photo=SimpleNamespace(file_id=f"photo-{i}"), video=None,
+                             animation=None, caption=None) for i in range(ALBUM_SIZE)]
+    parts[0].chat = SimpleNamespace(id=-1009)
+    parts[0].media_group_id = media_group_id
+    return parts
+
+
+def sequential_download(worker, album):
+    """The previous loop: download and save each item in turn"""
+    paths = []
+    for idx, msg in enumerate(album):
+        file_name = f"{msg.id}_{idx}.jpg"
+        worker.acc.download_media(msg.photo.file_id, file_name=file_name)
+        success, location = worker.storage_manager.save_file(file_name, file_name, keep_local=False)
+        if success:
+            paths.append(location)
+    return paths
+
+
+def measure(func):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func()
+    return (time.perf_counter() - start) / ROUNDS
+
+
+def run_benchmark():
+    print("=" * 70)
+    print(f"记录模式相册下载测试 (每个相册 {ALBUM_SIZE} 张图片, 每次下载延迟 {LATENCY * 1000:.0f} ms)")
+    print("=" * 70)
+
+    album = make_album("bench-sequential")
+    worker = MessageWorker(queue.Queue(), LatencyClient(album))
+    worker.storage_manager = FakeStorage()
+    baseline = measure(lambda: sequential_download(worker, album))
+    print(f"逐个下载:          {baseline * 1000:8.1f} ms/相册")
+
+    for limit in (2, 4, 9):
+        album = make_album(f"bench-{limit}")
+        client = LatencyClient(album)
+        worker = MessageWorker(queue.Queue(), client)
+        worker.storage_manager = FakeStorage()
+        pool = DownloadPool(max_workers=limit, item_timeout=30)
+        with mock.patch.object(download_pool_module, "_pools", {id(client): pool}):
+            elapsed = measure(lambda: worker._handle_media_group(album[0], None, []))
+        pool.shutdown()
+        media_group_cache.clear()
+        print(f"并发下载 (上限 {limit}):  {elapsed * 1000:8.1f} ms/相册  加速 {baseline / elapsed:.1f}x")
+
+
+if __name__ == '__main__':
+    run_benchmark()
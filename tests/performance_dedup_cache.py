@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Message dedup cache benchmark
+Replays 10k messages/s (with redeliveries) against the previous dict cache
+(f-string keys, full scan plus sort once over the cleanup threshold) and
+the TTL ring keyed by (chat_id, message_id)
+"""
+import sys
+import os
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.dedup import TTLRing
+from constants import MESSAGE_CACHE_TTL, MESSAGE_CACHE_MAX_SIZE
+
+RATE = 10000  # 条/秒
+SECONDS = 10
+DUPLICATE_RATIO = 0.05
+CHATS = 50
+LEGACY_CLEANUP_THRESHOLD = 200  # 旧处理器的 MESSAGE_CACHE_CLEANUP_THRESHOLD
+
+
+class LegacyCache:
+    """The previous processed_messages dict and its handler-side cleanup"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.entries = {}
+
+    def is_processed(self, message_id, chat_id):
+        key = f"{chat_id}_{message_id}"
+        if key in self.entries:
+            if self.clock() - self.entries[key] < MESSAGE_CACHE_TTL:
+                return True
+            del self.entries[key]
+        return False
+
+    def mark(self, message_id, chat_id):
+        self.entries[f"{chat_id}_{message_id}"] = self.clock()
+
+    def cleanup(self):
+        now = self.clock()
+        for key in [k for k, ts in self.entries.items() if now - ts > MESSAGE_CACHE_TTL]:
+            del self.entries[key]
+        if len(self.entries) > LEGACY_CLEANUP_THRESHOLD:
+            for key, _ in sorted(self.entries.items(), key=lambda x: x[1])[:len(self.entries) // 2]:
+                del self.entries[key]
+
+    def check_and_mark(self, message_id, chat_id):
+        if self.is_processed(message_id, chat_id):
+            return True
+        self.mark(message_id, chat_id)
+        if len(self.entries) > LEGACY_CLEANUP_THRESHOLD:
+            self.cleanup()
+        return False
+
+
+class SimClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_stream():
+    """(arrival time, chat_id, message_id); redeliveries arrive within the TTL"""
+    rng = random.Random(7)
+    stream = []
+    next_ids = [1] * CHATS
+    for i in range(RATE * SECONDS):
+        at = i / RATE
+        if stream and rng.random() < DUPLICATE_RATIO:
+            # 重复投递：重放最近 TTL 内的某条消息
+            window = int(RATE * MESSAGE_CACHE_TTL * 0.5)
+            _, chat_id, message_id = stream[-rng.randint(1, min(window, len(stream)))]
+        else:
+            chat = rng.randrange(CHATS)
+            chat_id, message_id = -1001000000000 - chat, next_ids[chat]
+            next_ids[chat] += 1
+        stream.append((at, chat_id, message_id))
+    return stream
+
+
+def replay(stream, check_and_mark, clock):
+    duplicates = 0
+    start = time.perf_counter()
+    for at, chat_id, message_id in stream:
+        clock.now = at
+        if check_and_mark(message_id, chat_id):
+            duplicates += 1
+    return time.perf_counter() - start, duplicates
+
+
+def run_benchmark():
+    stream = build_stream()
+    expected = len(stream) - len(set((c, m) for _, c, m in stream))
+
+    print("=" * 70)
+    print(f"消息去重缓存测试 ({RATE} 条/秒 × {SECONDS} 秒, 重复投递 {DUPLICATE_RATIO:.0%}, TTL {MESSAGE_CACHE_TTL}s)")
+    print("=" * 70)
+
+    legacy_clock = SimClock()
+    legacy = LegacyCache(legacy_clock)
+    ring_clock = SimClock()
+    ring = TTLRing(MESSAGE_CACHE_TTL, MESSAGE_CACHE_MAX_SIZE, clock=ring_clock)
+
+    cases = [
+        ("旧实现 (字符串键 + 扫描排序)", lambda m, c: legacy.check_and_mark(m, c), legacy_clock),
+        ("TTL环 (元组键)", lambda m, c: ring.check_and_add((c, m)), ring_clock),
+    ]
+    for name, func, clock in cases:
+        elapsed, duplicates = replay(stream, func, clock)
+        per_op = elapsed / len(stream)
+        print(f"{name}:")
+        print(f"  {per_op * 1e6:6.2f} µs/条, 最大吞吐 {1 / per_op:10.0f} 条/秒")
+        print(f"  拦截重复 {duplicates}/{expected}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
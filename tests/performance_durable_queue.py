@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Durable queue benchmark
+Measures enqueue and claim+ack throughput of the SQLite-backed queue and
+compares it with the in-memory queue.Queue
+"""
+import time
+import sys
+import os
+import queue
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import Message
+from bot.workers.durable_queue import DurableQueueStore, DurableShardQueue
+
+
+def make_message(i):
+    return Message(
+        user_id="1",
+        watch_key="watch",
+        message=None,
+        watch_data=None,
+        source_chat_id="-1002",
+        dest_chat_id="-1001",
+        message_text="",
+        message_id=i
+    )
+
+
+def bench_memory(count):
+    q = queue.Queue()
+    start = time.perf_counter()
+    for i in range(count):
+        q.put(make_message(i))
+    enqueue_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(count):
+        q.get_nowait()
+        q.task_done()
+    drain_time = time.perf_counter() - start
+    return enqueue_time, drain_time
+
+
+def bench_durable(count, db_path):
+    shard = DurableShardQueue(DurableQueueStore(db_path), 0)
+    start = time.perf_counter()
+    for i in range(count):
+        shard.put(make_message(i))
+    enqueue_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(count):
+        shard.ack(shard.get(block=False))
+    drain_time = time.perf_counter() - start
+    return enqueue_time, drain_time
+
+
+def run_benchmark(count=5000):
+    print("=" * 70)
+    print(f"持久化队列性能测试 ({count} 条消息)")
+    print("=" * 70)
+
+    mem_enqueue, mem_drain = bench_memory(count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_enqueue, db_drain = bench_durable(count, os.path.join(tmp_dir, 'queue.db'))
+
+    print(f"内存队列   入队: {count / mem_enqueue:>10.0f} 条/秒   出队: {count / mem_drain:>10.0f} 条/秒")
+    print(f"持久化队列 入队: {count / db_enqueue:>10.0f} 条/秒   取出+确认: {count / db_drain:>10.0f} 条/秒")
+    print()
+    print("说明: Telegram 发送速率约为每目标 1 条/秒，持久化队列的开销远低于发送耗时")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Filter engine benchmark
+Compares the per-call filter functions (check_whitelist/check_blacklist and
+the regex checks) with the compiled filter engine for one watch with 500
+keywords and 100 regexes
+"""
+import sys
+import os
+import time
+import random
+import string
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.filters import check_whitelist, check_blacklist, check_whitelist_regex, check_blacklist_regex
+from bot.filters.engine import CompiledFilter, get_filter_backend
+
+KEYWORD_COUNT = 500
+REGEX_COUNT = 100
+MESSAGE_COUNT = 2000
+
+
+def random_word(rng, length):
+    return "".join(rng.choices(string.ascii_lowercase, k=length))
+
+
+def build_rule(rng):
+    keywords = [random_word(rng, rng.randint(4, 10)) for _ in range(KEYWORD_COUNT)]
+    patterns = [r"[A-Z]{3}-%d\b" % i for i in range(REGEX_COUNT // 2)]
+    patterns += [r"\b%s\d{2,4}\b" % random_word(rng, 5) for _ in range(REGEX_COUNT - len(patterns))]
+    # 白名单/黑名单各占一半
+    half_kw = KEYWORD_COUNT // 2
+    half_re = REGEX_COUNT // 2
+    return {
+        "whitelist": keywords[:half_kw],
+        "blacklist": keywords[half_kw:],
+        "whitelist_regex": patterns[:half_re],
+        "blacklist_regex": patterns[half_re:],
+    }
+
+
+def build_messages(rng, rule):
+    messages = []
+    for i in range(MESSAGE_COUNT):
+        words = [random_word(rng, rng.randint(3, 8)) for _ in range(40)]
+        if i % 2 == 0:
+            words += [rng.choice(rule["whitelist"]), "ABC-%d" % rng.randrange(REGEX_COUNT // 2)]
+        if i % 10 == 0:
+            words.append(rng.choice(rule["blacklist"]))
+        messages.append("【频道消息】" + " ".join(words) + " 1080p 磁力链接 " + "内容" * 20)
+    return messages
+
+
+def legacy_passes(text, rule):
+    if check_blacklist(text, rule["blacklist"]) or check_blacklist_regex(text, rule["blacklist_regex"]):
+        return False
+    return check_whitelist(text, rule["whitelist"]) and check_whitelist_regex(text, rule["whitelist_regex"])
+
+
+def measure(func, messages):
+    start = time.perf_counter()
+    results = [func(text) for text in messages]
+    return time.perf_counter() - start, results
+
+
+def run_benchmark():
+    print("=" * 70)
+    print(f"过滤引擎测试 ({KEYWORD_COUNT} 个关键词, {REGEX_COUNT} 个正则, {MESSAGE_COUNT} 条消息)")
+    print(f"关键词后端: {get_filter_backend()}")
+    print("=" * 70)
+
+    rng = random.Random(42)
+    rule = build_rule(rng)
+    messages = build_messages(rng, rule)
+
+    # 旧函数在热路径上逐条记录日志，这里关闭日志只比较匹配本身
+    logging.disable(logging.CRITICAL)
+
+    start = time.perf_counter()
+    compiled = CompiledFilter(rule["whitelist"], rule["blacklist"], rule["whitelist_regex"], rule["blacklist_regex"])
+    compile_time = time.perf_counter() - start
+
+    legacy_time, legacy_results = measure(lambda text: legacy_passes(text, rule), messages)
+    engine_time, engine_results = measure(compiled.passes, messages)
+    assert legacy_results == engine_results, "结果不一致"
+
+    print(f"旧函数:   {legacy_time * 1e6 / MESSAGE_COUNT:10.1f} µs/条")
+    print(f"编译引擎: {engine_time * 1e6 / MESSAGE_COUNT:10.1f} µs/条 (编译一次 {compile_time * 1000:.1f} ms)")
+    print(f"加速: {legacy_time / engine_time:.1f}x, 通过 {sum(engine_results)}/{MESSAGE_COUNT}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
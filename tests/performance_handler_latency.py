@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Auto-forward handler latency benchmark
+Measures how long the Pyrogram update handler holds the dispatcher per
+update: the previous handler (watch_config.json read, peer resolution via
+get_chat for source and every destination) versus the current handler
+(in-memory routing snapshot, peers resolved later by the worker)
+"""
+import sys
+import os
+import json
+import time
+import tempfile
+import statistics
+from types import SimpleNamespace
+
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ['DATA_DIR'] = _tmp_dir.name
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.INFO)
+
+from config import WATCH_FILE, load_watch_config, save_watch_config
+from bot.handlers.auto_forward import create_auto_forward_handler
+from bot.workers import Message
+
+SOURCE_COUNT = 20
+WATCHES_PER_SOURCE = 3
+PEER_RTT = 0.02  # 模拟 get_chat 的网络往返时间（秒）
+LEGACY_UPDATES = 200
+CURRENT_UPDATES = 5000
+
+
+class FakeAcc:
+    def on_message(self, *args):
+        return lambda func: func
+
+    def get_chat(self, chat_id):
+        time.sleep(PEER_RTT)
+        return SimpleNamespace(title="Chat", first_name=None, username=None, is_bot=False)
+
+
+class NullQueue:
+    def offer(self, msg_obj, policy=None, block=True):
+        return True
+
+    def put(self, msg_obj):
+        pass
+
+    def qsize(self):
+        return 0
+
+
+def build_watch_config():
+    config = {}
+    for user in range(SOURCE_COUNT):
+        watches = {}
+        for i in range(WATCHES_PER_SOURCE):
+            watches[f"watch_{i}"] = {
+                "source": str(-1001000000000 - user),
+                "dest": str(-1002000000000 - user * 10 - i),
+                "whitelist": ["keyword"],
+                "forward_mode": "full",
+            }
+        config[str(user)] = watches
+    return config
+
+
+def make_update(i):
+    chat = SimpleNamespace(id=-1001000000000 - (i % SOURCE_COUNT), title="Source", username=None)
+    return SimpleNamespace(id=10_000_000 + i, chat=chat, media_group_id=None, photo=None, video=None,
+                           animation=None, document=None, text=f"keyword {i}", caption=None, outgoing=False)
+
+
+def legacy_handler(acc, message_queue, message):
+    """Per-update work done by the handler before the routing snapshot"""
+    source_chat_id = str(message.chat.id)
+    acc.get_chat(int(source_chat_id))  # cache_peer_if_needed(源频道)
+    message_text = message.text or message.caption or ""
+    for user_id, watches in load_watch_config().items():
+        for watch_key, watch_data in watches.items():
+            if str(watch_data.get("source", "")) != source_chat_id:
+                continue
+            dest_chat_id = watch_data.get("dest")
+            acc.get_chat(int(dest_chat_id))  # cache_peer_if_needed(目标频道)
+            message_queue.put(Message.from_pyrogram(user_id, watch_key, message, watch_data, source_chat_id,
+                                                    dest_chat_id, message_text))
+
+
+def measure(handle, count):
+    durations = []
+    for i in range(count):
+        update = make_update(i)
+        start = time.perf_counter()
+        handle(update)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {
+        "mean": statistics.mean(durations),
+        "p50": durations[len(durations) // 2],
+        "p99": durations[int(len(durations) * 0.99) - 1],
+    }
+
+
+def run_benchmark():
+    print("=" * 70)
+    print(f"消息处理器占用时间测试 ({SOURCE_COUNT} 个源, 每源 {WATCHES_PER_SOURCE} 个任务, "
+          f"模拟 get_chat 往返 {PEER_RTT * 1000:.0f}ms)")
+    print("=" * 70)
+
+    save_watch_config(build_watch_config())
+    print(f"配置文件: {WATCH_FILE}")
+
+    acc = FakeAcc()
+    message_queue = NullQueue()
+    legacy = measure(lambda update: legacy_handler(acc, message_queue, update), LEGACY_UPDATES)
+    handler = create_auto_forward_handler(acc, message_queue)
+    current = measure(lambda update: handler(acc, update), CURRENT_UPDATES)
+
+    for name, stats in (("旧处理器 (读取配置 + get_chat)", legacy), ("新处理器 (内存路由快照)", current)):
+        print(f"{name:<28} 平均 {stats['mean'] * 1e6:10.1f} µs  "
+              f"p50 {stats['p50'] * 1e6:10.1f} µs  p99 {stats['p99'] * 1e6:10.1f} µs")
+    print(f"平均占用时间降低: {legacy['mean'] / current['mean']:.0f}x")
+
+
+if __name__ == '__main__':
+    try:
+        run_benchmark()
+    finally:
+        _tmp_dir.cleanup()
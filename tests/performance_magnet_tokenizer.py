@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Magnet tokenizer benchmark
+Compares the previous per-call-site handling of magnet-heavy posts (findall
+plus one str.replace per link for DN completion, one re.sub per info hash
+for calibration) with the shared single-pass tokenizer
+"""
+import sys
+import os
+import re
+import time
+import random
+import string
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.magnet import fill_missing_dn, find_magnets, rewrite_magnets
+
+MAGNETS_PER_POST = 200
+POSTS = 20
+ROUNDS = 5
+TRACKERS = "&tr=udp%3A%2F%2Ftracker.opentrackr.org%3A1337%2Fannounce&tr=udp%3A%2F%2Fopen.stealth.si%3A80"
+
+
+def build_post(rng):
+    lines = ["【合集】" + "".join(rng.choices(string.ascii_letters, k=30)) + " #合集 #1080p"]
+    for i in range(MAGNETS_PER_POST):
+        info_hash = "".join(rng.choices("0123456789abcdef", k=40))
+        dn = f"&dn=Episode.{i:03d}.1080p.mkv" if i % 3 == 0 else ""
+        lines.append(f"第{i + 1}集 magnet:?xt=urn:btih:{info_hash}{dn}{TRACKERS}")
+    return "\n".join(lines)
+
+
+def legacy_fill_dn(message_text):
+    magnets = re.findall(r'magnet:\?xt=urn:btih:[a-zA-Z0-9]+(?:[&?][^\s\n\r|]*)?', message_text)
+    if not magnets:
+        return message_text
+    hash_pos = message_text.find('#')
+    base = message_text[:hash_pos].rstrip() if hash_pos != -1 else message_text.rstrip()
+    if not base or base in magnets:
+        return message_text
+    processed_text = message_text
+    count = 0
+    for magnet_link in magnets:
+        if '&dn=' not in magnet_link and '?dn=' not in magnet_link:
+            count += 1
+            dn_text = f"{base}-{count}" if len(magnets) > 1 else base
+            processed_text = processed_text.replace(magnet_link, f"{magnet_link}&dn={dn_text}")
+    return processed_text
+
+
+def legacy_calibrate(message_text, results):
+    for info_hash, filename in results:
+        pattern = rf'magnet:\?xt=urn:btih:{re.escape(info_hash)}(?:[&?][^\n\r]*)?'
+        message_text = re.sub(pattern, f"magnet:?xt=urn:btih:{info_hash}&dn={filename}", message_text,
+                              flags=re.IGNORECASE)
+    return message_text
+
+
+def tokenizer_calibrate(message_text, results):
+    new_magnets = dict((info_hash.lower(), f"magnet:?xt=urn:btih:{info_hash}&dn={filename}")
+                       for info_hash, filename in results)
+    return rewrite_magnets(message_text, lambda magnet: new_magnets.get(magnet.info_hash.lower()),
+                           to_line_end=True)[0]
+
+
+def measure(func, posts):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for post in posts:
+            func(post)
+    return (time.perf_counter() - start) / (ROUNDS * len(posts))
+
+
+def run_benchmark():
+    rng = random.Random(1)
+    posts = [build_post(rng) for _ in range(POSTS)]
+    size_kb = sum(len(post) for post in posts) / len(posts) / 1024
+    calibration = dict((post, [(m.info_hash, f"file-{i}.mkv") for i, m in enumerate(find_magnets(post))])
+                       for post in posts)
+
+    print("=" * 70)
+    print(f"磁力链接解析测试 (每条消息 {MAGNETS_PER_POST} 条磁力链接, 约 {size_kb:.1f} KB)")
+    print("=" * 70)
+
+    for post in posts:
+        assert fill_missing_dn(post)[0] == legacy_fill_dn(post), "DN补全结果不一致"
+
+    cases = [
+        ("DN补全", legacy_fill_dn, lambda post: fill_missing_dn(post)[0]),
+        ("校准替换", lambda post: legacy_calibrate(post, calibration[post]),
+         lambda post: tokenizer_calibrate(post, calibration[post])),
+    ]
+    for name, legacy, tokenizer in cases:
+        legacy_time = measure(legacy, posts)
+        tokenizer_time = measure(tokenizer, posts)
+        print(f"{name}:")
+        print(f"  旧实现:   {legacy_time * 1000:8.2f} ms/条  ({size_kb / 1024 / legacy_time:7.1f} MB/s)")
+        print(f"  分词器:   {tokenizer_time * 1000:8.2f} ms/条  ({size_kb / 1024 / tokenizer_time:7.1f} MB/s)")
+        print(f"  加速: {legacy_time / tokenizer_time:.1f}x")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Record-mode media save benchmark
+Photo-heavy record mode: every downloaded photo is saved into the media
+directory. Compares the previous copy (shutil.copy2) with the rename-based
+save path, with per-file and batched fsync, and reports the bytes written.
+"""
+import sys
+import os
+import time
+import shutil
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.storage import webdav_client as webdav_client_module
+from bot.storage.webdav_client import StorageManager
+
+PHOTO_COUNT = 300
+PHOTO_SIZE = 200 * 1024  # 典型的 Telegram 压缩图片大小
+
+
+def write_bytes() -> int:
+    """Bytes this process passed to write()-like calls (/proc/self/io wchar), 0 if unavailable"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def make_downloads(media_dir):
+    payload = os.urandom(PHOTO_SIZE)
+    paths = []
+    for i in range(PHOTO_COUNT):
+        path = os.path.join(media_dir, f"{1000 + i}_20240101_000000.jpg")
+        with open(path, 'wb') as f:
+            f.write(payload)
+        paths.append(path)
+    return paths
+
+
+def copy_save(storage, downloads, fsync_each=False):
+    """The previous save path: copy every download into media_dir"""
+    for i, source in enumerate(downloads):
+        dest_path = os.path.join(storage.media_dir, f"saved_{i}.jpg")
+        shutil.copy2(source, dest_path)
+        if fsync_each:
+            fd = os.open(dest_path, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+
+
+def rename_save(storage, downloads, batch_size=None):
+    """The new save path; batch_size None skips fsync altogether"""
+    with mock.patch.object(webdav_client_module, "MEDIA_FSYNC_BATCH_SIZE", batch_size or PHOTO_COUNT + 1), \
+            mock.patch.object(webdav_client_module, "MEDIA_FSYNC_INTERVAL", 3600):
+        for i, source in enumerate(downloads):
+            storage.save_file(source, f"blobs/{i % 256:02x}/{i}.jpg")
+        if batch_size:
+            storage.flush()
+
+
+def run_case(label, func):
+    media_dir = tempfile.mkdtemp()
+    try:
+        storage = StorageManager(media_dir)
+        downloads = make_downloads(media_dir)
+        written = write_bytes()
+        start = time.perf_counter()
+        func(storage, downloads)
+        elapsed = time.perf_counter() - start
+        written = write_bytes() - written
+        print(f"{elapsed * 1000:9.1f} ms  {elapsed / PHOTO_COUNT * 1e6:8.1f} µs/张  "
+              f"写入 {written / 1024 / 1024:6.1f} MB  {label}")
+        return elapsed
+    finally:
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+
+def run_benchmark():
+    print("=" * 70)
+    print(f"记录模式媒体保存测试 ({PHOTO_COUNT} 张图片, 每张 {PHOTO_SIZE // 1024} KB)")
+    print("=" * 70)
+
+    baseline = run_case("复制 (copy2)", copy_save)
+    copied_synced = run_case("复制 + 每张 fsync", lambda s, d: copy_save(s, d, fsync_each=True))
+    renamed = run_case("重命名 (不 fsync)", rename_save)
+    per_file = run_case("重命名 + 每张 fsync", lambda s, d: rename_save(s, d, batch_size=1))
+    batched = run_case("重命名 + 批量 fsync", lambda s, d: rename_save(s, d, batch_size=32))
+
+    print("-" * 70)
+    print(f"重命名相对复制: {baseline / renamed:.1f}x")
+    print(f"重命名 + 批量 fsync 相对复制 + 每张 fsync: {copied_synced / batched:.1f}x")
+    print(f"批量 fsync 相对逐张 fsync: {per_file / batched:.1f}x")
+
+
+if __name__ == '__main__':
+    run_benchmark()
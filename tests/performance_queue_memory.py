@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Queue entry memory benchmark
+Compares the memory held by 100k queued messages using the previous entry
+layout (dataclass holding the Pyrogram message and a per-message copy of the
+watch config) with the compact slotted Message entry
+"""
+import sys
+import os
+import gc
+import json
+import time
+import datetime
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrogram import types, enums
+
+from bot.workers import Message
+
+ITEM_COUNT = 100_000
+
+WATCH_CONFIG_JSON = json.dumps({
+    "source": "-1001234567890",
+    "dest": "-1009876543210",
+    "record_mode": False,
+    "forward_mode": "full",
+    "whitelist": ["keyword1", "keyword2", "keyword3"],
+    "blacklist": ["spam", "ads"],
+    "whitelist_regex": [r"\d{4}-\d{2}"],
+    "blacklist_regex": [],
+    "extract_patterns": [],
+    "preserve_forward_source": False,
+    "append_dn_to_magnet": True,
+})
+
+
+@dataclass
+class LegacyMessage:
+    """Queue entry layout before the compact entry"""
+    user_id: str
+    watch_key: str
+    message: Any
+    watch_data: Dict[str, Any]
+    source_chat_id: str
+    dest_chat_id: Optional[str]
+    message_text: str
+    timestamp: float = field(default_factory=time.time)
+    retry_count: int = 0
+    media_group_key: Optional[str] = None
+
+
+def make_pyrogram_message(i, text):
+    """Build a Pyrogram message roughly like one parsed from an update"""
+    now = datetime.datetime.now()
+    chat = types.Chat(id=-1001234567890, type=enums.ChatType.CHANNEL, title="Benchmark Channel",
+                      username="benchmark_channel")
+    photo = None
+    if i % 3 == 0:
+        photo = types.Photo(file_id="AgACAgUAAxkBAAI" + "x" * 64, file_unique_id="AQADx" + str(i),
+                            width=1280, height=720, file_size=123456, date=now)
+    return types.Message(id=i, chat=chat, sender_chat=chat, date=now, caption=text if photo else None,
+                         text=None if photo else text, photo=photo, views=100, outgoing=False)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    gc.collect()
+    return current, elapsed
+
+
+def build_legacy(texts):
+    items = []
+    for i, text in enumerate(texts):
+        message = make_pyrogram_message(i, text)
+        items.append(LegacyMessage(
+            user_id="123456",
+            watch_key="watch_1",
+            message=message,
+            watch_data=json.loads(WATCH_CONFIG_JSON),  # load_watch_config() 每条消息重新加载
+            source_chat_id=str(message.chat.id),
+            dest_chat_id="-1009876543210",
+            message_text=text
+        ))
+    return items
+
+
+def build_compact(texts):
+    items = []
+    for i, text in enumerate(texts):
+        message = make_pyrogram_message(i, text)
+        items.append(Message.from_pyrogram(
+            user_id="123456",
+            watch_key="watch_1",
+            message=message,
+            watch_data=json.loads(WATCH_CONFIG_JSON),
+            source_chat_id=str(message.chat.id),
+            dest_chat_id="-1009876543210",
+            message_text=text
+        ))
+    return items
+
+
+def run_benchmark(count=ITEM_COUNT):
+    print("=" * 70)
+    print(f"队列条目内存测试 ({count} 条排队消息)")
+    print("=" * 70)
+
+    # 文本在两种实现中相同，预先生成以免计入差异
+    texts = [f"消息 {i} keyword1 " + "内容" * 60 for i in range(count)]
+
+    legacy_bytes, legacy_time = measure(lambda: build_legacy(texts))
+    compact_bytes, compact_time = measure(lambda: build_compact(texts))
+
+    print(f"旧条目 (dataclass + Pyrogram消息 + 配置字典): {legacy_bytes / 1024 / 1024:8.1f} MB "
+          f"({legacy_bytes / count:6.0f} 字节/条, 构建 {legacy_time:.2f}s)")
+    print(f"新条目 (__slots__ + 共享 WatchRule):          {compact_bytes / 1024 / 1024:8.1f} MB "
+          f"({compact_bytes / count:6.0f} 字节/条, 构建 {compact_time:.2f}s)")
+    print(f"内存减少: {(1 - compact_bytes / legacy_bytes) * 100:.1f}%")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for copying media albums with a single copy_media_group call
+"""
+import sys
+import os
+import queue
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker, Message
+
+SOURCE = "-1002"
+DEST = "-1001"
+
+
+class AlbumClient:
+    def __init__(self, fail_group=False):
+        self.calls = []
+        self.fail_group = fail_group
+
+    def copy_media_group(self, chat_id, from_chat_id, message_id, captions=None):
+        self.calls.append(("copy_media_group", chat_id, from_chat_id, message_id, captions))
+        if self.fail_group:
+            raise ValueError("Message with this type can't be copied.")
+        return [SimpleNamespace(id=500 + i) for i in range(10)]
+
+    def copy_message(self, chat_id, from_chat_id, message_id, caption=None):
+        self.calls.append(("copy_message", chat_id, from_chat_id, message_id, caption))
+        return SimpleNamespace(id=600)
+
+    def get_media_group(self, chat_id, message_id):
+        self.calls.append(("get_media_group", chat_id, message_id))
+        return []
+
+
+def make_album_entry(text, **watch):
+    watch_data = dict({"source": SOURCE, "dest": DEST}, **watch)
+    return Message(
+        user_id="1", watch_key="watch", message=None, watch_data=watch_data,
+        source_chat_id=SOURCE, dest_chat_id=DEST, message_text=text,
+        message_id=42, media_group_id="777", media_kind="photo"
+    )
+
+
+class TestAlbumCopy(unittest.TestCase):
+
+    def make_worker(self, client):
+        worker = MessageWorker(queue.Queue(), client)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        return worker
+
+    def test_copy_album_is_one_call(self):
+        client = AlbumClient()
+        result = self.make_worker(client).process_message(make_album_entry("album"))
+        self.assertEqual(result, "success")
+        self.assertEqual(client.calls, [("copy_media_group", int(DEST), int(SOURCE), 42, None)])
+
+    def test_modified_caption_applies_to_first_item_only(self):
+        client = AlbumClient()
+        text = "Title #tag magnet:?xt=urn:btih:abcdef0123456789"
+        result = self.make_worker(client).process_message(make_album_entry(text, append_dn_to_magnet=True))
+        self.assertEqual(result, "success")
+        self.assertEqual(len(client.calls), 1)
+        name, _, _, _, captions = client.calls[0]
+        self.assertEqual(name, "copy_media_group")
+        # 列表形式只替换第一条媒体的 caption，其余保持原样
+        self.assertEqual(len(captions), 1)
+        self.assertIn("&dn=Title", captions[0])
+
+    def test_falls_back_to_single_copy_without_item_loop(self):
+        client = AlbumClient(fail_group=True)
+        text = "Title #tag magnet:?xt=urn:btih:abcdef0123456789"
+        result = self.make_worker(client).process_message(make_album_entry(text, append_dn_to_magnet=True))
+        self.assertEqual(result, "success")
+        self.assertEqual([call[0] for call in client.calls], ["copy_media_group", "copy_message"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
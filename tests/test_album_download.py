@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests for concurrent album downloads in record mode
+"""
+import sys
+import os
+import time
+import queue
+import random
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import MessageWorker
+from bot.workers import download_pool as download_pool_module
+from bot.workers.download_pool import DownloadPool
+from bot.utils.media_group_cache import media_group_cache
+
+
+class LatencyClient:
+    """Fake client whose downloads take a given time and track concurrency"""
+
+    def __init__(self, album, latencies):
+        self.album = album
+        self.latencies = latencies
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def get_media_group(self, chat_id, message_id):
+        return self.album
+
+    def download_media(self, file_id, file_name=None):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.latencies.get(file_id, 0.02))
+        finally:
+            with self._lock:
+                self.active -= 1
+        return file_name
+
+
+class FakeStorage:
+    def __init__(self):
+        self.saved = []
+
+    def save_file(self, source_path, filename, keep_local=False):
+        self.saved.append(filename)
+        return True, f"stored/{filename}"
+
+
+def make_album(count, media_group_id):
+    parts = []
+    for i in range(count):
+        photo = SimpleNamespace(file_id=f"photo-{i}")
+        parts.append(SimpleNamespace(id=100 + i, photo=photo, video=None, animation=None,
+                                     caption="album caption" if i == 0 else None))
+    first = parts[0]
+    first.chat = SimpleNamespace(id=-1009)
+    first.media_group_id = media_group_id
+    return parts
+
+
+class TestDownloadPool(unittest.TestCase):
+
+    def test_results_keep_task_order(self):
+        pool = DownloadPool(max_workers=4, item_timeout=5)
+        delays = [random.uniform(0, 0.05) for _ in range(12)]
+
+        def task(delay, value):
+            return lambda item: (time.sleep(delay), value)[1]
+
+        self.assertEqual(pool.run_ordered([task(d, i) for i, d in enumerate(delays)]), list(range(12)))
+
+    def test_slow_and_failing_items_are_skipped(self):
+        pool = DownloadPool(max_workers=2, item_timeout=0.2)
+        abandoned = []
+
+        def slow(item):
+            time.sleep(0.5)
+            abandoned.append(item.abandoned)
+            return "late"
+
+        def failing(item):
+            raise RuntimeError("boom")
+
+        results = pool.run_ordered([lambda item: "a", slow, failing, lambda item: "d"])
+        self.assertEqual(results, ["a", None, None, "d"])
+        time.sleep(0.4)
+        self.assertEqual(abandoned, [True])
+
+    def test_late_result_of_abandoned_item_is_discarded(self):
+        pool = DownloadPool(max_workers=2, item_timeout=0.2)
+        discarded = queue.Queue()
+
+        def slow(item):
+            time.sleep(0.4)
+            return "late"
+
+        results = pool.run_ordered([slow, lambda item: "b"], discard=discarded.put)
+        self.assertEqual(results, [None, "b"])
+        self.assertEqual(discarded.get(timeout=2), "late")
+
+
+class TestAlbumDownload(unittest.TestCase):
+
+    def run_album(self, client, media_group_id, max_workers=4):
+        worker = MessageWorker(queue.Queue(), client)
+        worker.storage_manager = FakeStorage()
+        pool = DownloadPool(max_workers=max_workers, item_timeout=5)
+        with mock.patch.object(download_pool_module, "_pools", {id(client): pool}):
+            return worker._handle_media_group(client.album[0], None, []), worker.storage_manager
+
+    def tearDown(self):
+        media_group_cache.clear()
+
+    def test_album_order_and_concurrency_limit(self):
+        album = make_album(8, "mg-order")
+        # 前面的项更慢，完成顺序与相册顺序相反
+        latencies = {f"photo-{i}": 0.1 - i * 0.01 for i in range(8)}
+        client = LatencyClient(album, latencies)
+        (media_type, media_path, media_paths, caption), storage = self.run_album(client, "mg-order", max_workers=3)
+
+        self.assertEqual(media_type, "photo")
+        self.assertEqual(caption, "album caption")
+        self.assertEqual([path.split("_")[1] for path in media_paths], [str(i) for i in range(8)])
+        self.assertEqual(media_path, media_paths[0])
+        self.assertEqual(client.peak, 3)
+
+    def test_album_limited_to_max_media(self):
+        album = make_album(12, "mg-limit")
+        client = LatencyClient(album, {})
+        (_, _, media_paths, _), _ = self.run_album(client, "mg-limit")
+        self.assertEqual(len(media_paths), 9)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Tests for coalescing consecutive forwards into one forward_messages call
+"""
+import sys
+import os
+import queue
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker, Message
+from bot.workers.durable_queue import DurableQueueStore, DurableShardQueue
+
+SOURCE = "-1002"
+DEST = "-1001"
+WATCH = {"source": SOURCE, "dest": DEST, "preserve_forward_source": True, "blacklist": ["spam"]}
+
+
+class FakeClient:
+    def __init__(self, fail_batches=False, omit=(), keep_origin=False):
+        self.calls = []
+        self.fail_batches = fail_batches
+        self.omit = omit
+        self.keep_origin = keep_origin
+
+    def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.calls.append((chat_id, from_chat_id, message_ids))
+        if isinstance(message_ids, list):
+            if self.fail_batches and len(message_ids) > 1:
+                raise RuntimeError("batch rejected")
+            forwarded = [SimpleNamespace(id=1000 + i) for i in message_ids if i not in self.omit]
+            if self.keep_origin:
+                for msg in forwarded:
+                    msg.forward_from_message_id = msg.id - 1000
+            return forwarded
+        return SimpleNamespace(id=1000 + message_ids)
+
+
+def make_entry(message_id, text="news", source=SOURCE, dest=DEST, watch=WATCH):
+    return Message(
+        user_id="1", watch_key="watch", message=None, watch_data=dict(watch, source=source, dest=dest),
+        source_chat_id=source, dest_chat_id=dest, message_text=text, message_id=message_id
+    )
+
+
+class TestCoalescedForward(unittest.TestCase):
+
+    def make_worker(self, client=None):
+        worker = MessageWorker(queue.Queue(), client or FakeClient(), coalesce_window=0)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        return worker
+
+    def collect(self, worker, entries):
+        for entry in entries:
+            worker.message_queue.put(entry)
+        return worker._collect_batch(worker.message_queue.get_nowait())
+
+    def test_burst_goes_out_as_one_call(self):
+        worker = self.make_worker()
+        batch = self.collect(worker, [make_entry(i) for i in range(20)])
+        self.assertEqual(len(batch), 20)
+
+        results = worker._process_batch(batch)
+        self.assertEqual(worker.acc.calls, [(int(DEST), int(SOURCE), list(range(20)))])
+        self.assertEqual([r for _, r in results], ["success"] * 20)
+
+    def test_filters_still_apply_per_item(self):
+        worker = self.make_worker()
+        entries = [make_entry(0), make_entry(1, text="spam offer"), make_entry(2)]
+        results = dict((m.message_id, r) for m, r in worker._process_batch(self.collect(worker, entries)))
+        self.assertEqual(results, {0: "success", 1: "skip", 2: "success"})
+        self.assertEqual(worker.acc.calls[0][2], [0, 2])
+
+    def test_batch_capped_at_telegram_limit(self):
+        worker = self.make_worker()
+        batch = self.collect(worker, [make_entry(i) for i in range(150)])
+        self.assertEqual(len(batch), 100)
+
+    def test_other_destinations_are_stashed_in_order(self):
+        worker = self.make_worker()
+        other = make_entry(50, dest="-1003")
+        batch = self.collect(worker, [make_entry(0), other, make_entry(1)])
+        self.assertEqual([m.message_id for m in batch], [0, 1])
+        self.assertEqual(list(worker._stash), [other])
+
+    def test_unmergeable_entry_for_same_destination_ends_batch(self):
+        worker = self.make_worker()
+        other_source = make_entry(7, source="-1004")
+        batch = self.collect(worker, [make_entry(0), other_source, make_entry(1)])
+        self.assertEqual([m.message_id for m in batch], [0])
+        self.assertEqual(list(worker._stash), [other_source])
+
+    def test_copy_mode_is_not_coalesced(self):
+        worker = self.make_worker()
+        copy_watch = dict(WATCH, preserve_forward_source=False)
+        batch = self.collect(worker, [make_entry(i, watch=copy_watch) for i in range(3)])
+        self.assertEqual(len(batch), 1)
+
+    def test_failed_batch_falls_back_to_single_forwards(self):
+        worker = self.make_worker(FakeClient(fail_batches=True))
+        results = worker._process_batch(self.collect(worker, [make_entry(i) for i in range(3)]))
+        self.assertEqual([r for _, r in results], ["success"] * 3)
+        self.assertEqual([call[2] for call in worker.acc.calls[1:]], [0, 1, 2])
+
+    def test_omitted_messages_are_skipped_and_triggers_follow_sources(self):
+        worker = self.make_worker(FakeClient(omit=(1,), keep_origin=True))
+        triggered = []
+        worker._trigger_dest_monitoring = lambda dest, forwarded_id, text: triggered.append((forwarded_id, text))
+        entries = [make_entry(i, text=f"news {i}") for i in range(3)]
+        results = dict((m.message_id, r) for m, r in worker._process_batch(self.collect(worker, entries)))
+        self.assertEqual(results, {0: "success", 1: "skip", 2: "success"})
+        self.assertEqual(triggered, [(1000, "news 0"), (1002, "news 2")])
+
+    def test_omitted_messages_without_origin_are_not_paired_by_position(self):
+        worker = self.make_worker(FakeClient(omit=(1,)))
+        triggered = []
+        worker._trigger_dest_monitoring = lambda dest, forwarded_id, text: triggered.append((forwarded_id, text))
+        results = worker._process_batch(self.collect(worker, [make_entry(i) for i in range(3)]))
+        self.assertEqual([r for _, r in results], ["skip"] * 3)
+        self.assertEqual(triggered, [])
+
+    def test_every_taken_entry_is_acked_when_batch_raises(self):
+        worker = self.make_worker()
+        for i in range(3):
+            worker.message_queue.put(make_entry(i))
+
+        def fail(batch):
+            worker.running = False
+            raise RuntimeError("boom")
+
+        worker._process_batch = fail
+        worker.running = True
+        worker.run()
+        self.assertEqual(worker.message_queue.unfinished_tasks, 0)
+
+
+class TestDurableCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = DurableQueueStore(os.path.join(self.tmp_dir.name, 'queue.db'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_burst_is_coalesced_and_acked(self):
+        worker = MessageWorker(DurableShardQueue(self.store, 0), FakeClient(), coalesce_window=0)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        for i in range(5):
+            worker.message_queue.put(make_entry(i))
+
+        batch = worker._collect_batch(worker.message_queue.get(timeout=0.1))
+        self.assertEqual([m.message_id for m in batch], list(range(5)))
+        for msg_obj, result in worker._process_batch(batch):
+            self.assertEqual(result, "success")
+            worker._ack(msg_obj)
+        self.assertEqual(worker.acc.calls, [(int(DEST), int(SOURCE), list(range(5)))])
+        self.assertEqual(self.store.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
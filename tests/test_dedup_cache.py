@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for the TTL ring used for message deduplication
+"""
+import sys
+import os
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.dedup import TTLRing, check_and_mark_message, is_message_processed, mark_message_processed
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLRing(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ring = TTLRing(ttl=1.0, max_size=100, clock=self.clock)
+
+    def test_duplicate_within_ttl(self):
+        self.assertFalse(self.ring.check_and_add((1, 10)))
+        self.assertTrue(self.ring.check_and_add((1, 10)))
+        self.assertFalse(self.ring.check_and_add((2, 10)))
+
+    def test_keys_expire_in_order(self):
+        for i in range(5):
+            self.ring.add((1, i))
+            self.clock.now += 0.3
+        # 已过去 1.5 秒：前两个键的 TTL 已到（第一个在写入第五个键时已被淘汰）
+        self.assertEqual(self.ring.expire(), 1)
+        self.assertEqual(len(self.ring), 3)
+        self.assertNotIn((1, 1), self.ring)
+        self.assertIn((1, 2), self.ring)
+
+    def test_expired_key_is_new_again(self):
+        self.ring.add((1, 1))
+        self.clock.now += 1.0
+        self.assertNotIn((1, 1), self.ring)
+        self.assertFalse(self.ring.check_and_add((1, 1)))
+
+    def test_readding_restarts_ttl(self):
+        self.ring.add((1, 1))
+        self.clock.now += 0.8
+        self.ring.add((1, 1))
+        self.clock.now += 0.5
+        # 旧的环记录到期时不能删除刷新后的键
+        self.assertEqual(self.ring.expire(), 0)
+        self.assertIn((1, 1), self.ring)
+
+    def test_size_is_bounded(self):
+        ring = TTLRing(ttl=60.0, max_size=10, clock=self.clock)
+        for i in range(25):
+            ring.add((1, i))
+        self.assertEqual(len(ring), 10)
+        self.assertNotIn((1, 14), ring)
+        self.assertIn((1, 15), ring)
+
+    def test_concurrent_check_and_add_admits_once(self):
+        ring = TTLRing(ttl=60.0, max_size=10000)
+        admitted = []
+
+        def worker():
+            admitted.append(sum(not ring.check_and_add((7, i)) for i in range(1000)))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sum(admitted), 1000)
+
+
+class TestMessageDedup(unittest.TestCase):
+
+    def test_module_helpers_share_one_cache(self):
+        self.assertFalse(check_and_mark_message(501, -100501))
+        self.assertTrue(is_message_processed(501, -100501))
+        self.assertTrue(check_and_mark_message(501, -100501))
+        mark_message_processed(502, -100501)
+        self.assertTrue(check_and_mark_message(502, -100501))
+        self.assertFalse(is_message_processed(501, -100502))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
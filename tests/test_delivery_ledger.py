@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent delivery ledger
+"""
+import sys
+import os
+import time
+import queue
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker, Message, DeliveryLedger
+from bot.workers.delivery_ledger import BloomFilter, delivery_key
+
+SOURCE = "-1002"
+DEST = "-1001"
+WATCH = {"source": SOURCE, "dest": DEST, "preserve_forward_source": True}
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.calls.append(message_ids)
+        if isinstance(message_ids, list):
+            return [SimpleNamespace(id=1000 + i) for i in message_ids]
+        return SimpleNamespace(id=1000 + message_ids)
+
+
+def make_entry(message_id, watch_key="watch"):
+    return Message(
+        user_id="1", watch_key=watch_key, message=None, watch_data=dict(WATCH),
+        source_chat_id=SOURCE, dest_chat_id=DEST, message_text="news", message_id=message_id
+    )
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [(-100, i, "1", "w") for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate_near_target(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add((-100, i, "1", "w"))
+        false_positives = sum((-200, i, "1", "w") in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestDeliveryLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "ledger.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_records_survive_reopen(self):
+        ledger = DeliveryLedger(self.db_path, retention=3600, max_entries=100)
+        ledger.record((-1002, 5, "1", "watch"))
+        reopened = DeliveryLedger(self.db_path, retention=3600, max_entries=100)
+        self.assertTrue(reopened.was_delivered((-1002, 5, "1", "watch")))
+        self.assertFalse(reopened.was_delivered((-1002, 5, "1", "other")))
+        self.assertFalse(reopened.was_delivered((-1002, 6, "1", "watch")))
+
+    def test_unknown_keys_skip_the_database(self):
+        ledger = DeliveryLedger(self.db_path, retention=3600, max_entries=1000)
+        for i in range(100):
+            ledger.was_delivered((-1002, i, "1", "watch"))
+        self.assertEqual(ledger.db_lookups, 0)
+        self.assertEqual(ledger.bloom_negatives, 100)
+
+    def test_expired_records_are_pruned(self):
+        ledger = DeliveryLedger(self.db_path, retention=3600, max_entries=100)
+        ledger.record((-1002, 1, "1", "watch"))
+        ledger._connect().execute("UPDATE deliveries SET delivered_at = ?", (time.time() - 7200,))
+        self.assertFalse(ledger.was_delivered((-1002, 1, "1", "watch")))
+        self.assertEqual(ledger.prune(), 1)
+        self.assertEqual(len(ledger), 0)
+
+    def test_oldest_records_beyond_limit_are_pruned(self):
+        ledger = DeliveryLedger(self.db_path, retention=3600, max_entries=10)
+        for i in range(15):
+            ledger.record((-1002, i, "1", "watch"))
+            ledger._connect().execute("UPDATE deliveries SET delivered_at = ? WHERE message_id = ?",
+                                      (time.time() - 100 + i, i))
+        ledger.prune()
+        self.assertEqual(len(ledger), 10)
+        self.assertFalse(ledger.was_delivered((-1002, 4, "1", "watch")))
+        self.assertTrue(ledger.was_delivered((-1002, 5, "1", "watch")))
+
+    def test_bloom_is_rebuilt_when_saturated(self):
+        ledger = DeliveryLedger(self.db_path, retention=3600, max_entries=10)
+        for i in range(25):
+            ledger.record((-1002, i, "1", "watch"))
+        ledger.prune()
+        self.assertLessEqual(ledger._bloom.count, 10)
+        self.assertTrue(ledger.was_delivered((-1002, 24, "1", "watch")))
+
+
+class TestWorkerConsultsLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ledger = DeliveryLedger(os.path.join(self.tmp_dir, "ledger.db"), retention=3600, max_entries=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_worker(self):
+        worker = MessageWorker(queue.Queue(), FakeClient(), coalesce_window=0, delivery_ledger=self.ledger)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        return worker
+
+    def run_queue(self, worker, entries):
+        for entry in entries:
+            worker.message_queue.put(entry)
+        worker.running = True
+
+        def stop_when_drained(*_):
+            if worker.message_queue.empty() and not worker._stash:
+                worker.running = False
+
+        original = worker._finish_message
+
+        def finish(msg_obj, result):
+            original(msg_obj, result)
+            stop_when_drained()
+
+        worker._finish_message = finish
+        worker.run()
+
+    def test_replayed_updates_are_not_forwarded_again(self):
+        worker = self.make_worker()
+        self.run_queue(worker, [make_entry(1), make_entry(2)])
+        self.assertEqual(worker.acc.calls, [[1, 2]])
+        self.assertTrue(self.ledger.was_delivered(delivery_key(make_entry(1))))
+
+        # 模拟重启：新的工作线程收到重放的更新
+        restarted = self.make_worker()
+        self.run_queue(restarted, [make_entry(1), make_entry(2), make_entry(3)])
+        self.assertEqual(restarted.acc.calls, [3])
+        self.assertEqual(restarted.skipped_count, 2)
+
+    def test_ledger_is_per_watch(self):
+        worker = self.make_worker()
+        self.run_queue(worker, [make_entry(1)])
+        self.run_queue(worker, [make_entry(1, watch_key="second")])
+        self.assertEqual(worker.acc.calls, [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite-backed durable message queue
+"""
+import sys
+import os
+import queue
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import MessageWorker, Message, UnrecoverableError, ShardedMessageQueue
+from bot.workers.durable_queue import DurableQueueStore, DurableShardQueue, STATUS_CLAIMED
+
+
+def make_message(message_id, dest="-1001", source="-1002"):
+    return Message(
+        user_id="1",
+        watch_key="watch",
+        message=object(),
+        watch_data={"dest": dest},
+        source_chat_id=source,
+        dest_chat_id=dest,
+        message_text="hello",
+        message_id=message_id
+    )
+
+
+class TestDurableQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'queue.db')
+        self.store = DurableQueueStore(self.db_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_fifo_claim_and_ack(self):
+        shard = DurableShardQueue(self.store, 0)
+        first = make_message(10)
+        shard.put(first)
+        shard.put(make_message(11))
+        self.assertEqual(shard.qsize(), 2)
+
+        claimed = shard.get(timeout=0.1)
+        self.assertIs(claimed, first)  # 本进程入队的消息无需重新获取
+        self.assertEqual(shard.qsize(), 1)
+
+        shard.ack(claimed)
+        self.assertEqual(self.store.count(0), 1)
+        self.assertEqual(shard.get(timeout=0.1).message_id, 11)
+        with self.assertRaises(queue.Empty):
+            shard.get(timeout=0.05)
+
+    def test_descriptor_survives_restart(self):
+        shard = DurableShardQueue(self.store, 0)
+        shard.put(make_message(42))
+        shard.get(timeout=0.1)  # 已取出但未确认，模拟处理中崩溃
+        self.assertEqual(self.store.count(0, STATUS_CLAIMED), 1)
+
+        restarted = DurableQueueStore(self.db_path)
+        self.assertEqual(restarted.recover(num_shards=1), 1)
+        recovered = DurableShardQueue(restarted, 0).get(timeout=0.1)
+        self.assertIsNone(recovered.message)
+        self.assertIsNone(recovered.watch_data)
+        self.assertEqual(recovered.message_id, 42)
+        self.assertEqual(recovered.source_chat_id, "-1002")
+        self.assertEqual(recovered.dest_chat_id, "-1001")
+
+    def test_retry_keeps_live_object_and_count(self):
+        shard = DurableShardQueue(self.store, 0)
+        msg_obj = make_message(7)
+        shard.put(msg_obj)
+        claimed = shard.get(timeout=0.1)
+        claimed.retry_count = 2
+        shard.put(claimed)
+
+        again = shard.get(timeout=0.1)
+        self.assertIs(again, msg_obj)
+        self.assertEqual(again.queue_id, claimed.queue_id)
+        self.assertEqual(self.store.count(), 1)
+
+        restarted = DurableQueueStore(self.db_path)
+        restarted.recover(num_shards=1)
+        self.assertEqual(DurableShardQueue(restarted, 0).get(timeout=0.1).retry_count, 2)
+
+    def test_recover_remaps_removed_shards(self):
+        DurableShardQueue(self.store, 5).put(make_message(1))
+        self.store.recover(num_shards=2)
+        self.assertEqual(self.store.count(5 % 2), 1)
+        self.assertEqual(self.store.count(5), 0)
+
+    def test_sharded_queue_with_durable_shards(self):
+        shards = [DurableShardQueue(self.store, i) for i in range(3)]
+        message_queue = ShardedMessageQueue(3, shards=shards)
+        for i in range(6):
+            message_queue.put(make_message(i, dest=f"-100{i % 2}"))
+        self.assertEqual(message_queue.qsize(), 6)
+        with self.assertRaises(ValueError):
+            ShardedMessageQueue(2, shards=shards)
+
+
+class FakeClient:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def get_messages(self, chat_id, message_id):
+        return self.messages.get((chat_id, message_id))
+
+
+class TestWorkerRehydration(unittest.TestCase):
+
+    def descriptor(self):
+        return Message(
+            user_id="1", watch_key="watch", message=None, watch_data=None,
+            source_chat_id="-1002", dest_chat_id="-1001", message_text="",
+            message_id=5, queue_id=1
+        )
+
+    def test_rehydrate_message_and_watch(self):
+        original = SimpleNamespace(id=5, text=None, caption="caption", media_group_id=None, empty=False,
+                                   photo=object(), chat=SimpleNamespace(id=-1002, title="Source", username=None))
+        worker = MessageWorker(queue.Queue(), FakeClient({(-1002, 5): original}))
+        watch_config = {"1": {"watch": {"dest": "-1001"}}}
+        with mock.patch('bot.workers.message_worker.load_watch_config', return_value=watch_config):
+            msg_obj = self.descriptor()
+            worker._rehydrate_message(msg_obj)
+        self.assertIs(msg_obj.message, original)
+        self.assertEqual(msg_obj.watch_data, {"dest": "-1001"})
+        self.assertEqual(msg_obj.message_text, "caption")
+        self.assertEqual(msg_obj.media_kind, "photo")
+        self.assertEqual(msg_obj.source_name, "Source")
+
+    def test_deleted_source_message_is_unrecoverable(self):
+        worker = MessageWorker(queue.Queue(), FakeClient({}))
+        with mock.patch('bot.workers.message_worker.load_watch_config',
+                        return_value={"1": {"watch": {"dest": "-1001"}}}):
+            with self.assertRaises(UnrecoverableError):
+                worker._rehydrate_message(self.descriptor())
+
+    def test_deleted_watch_is_unrecoverable(self):
+        worker = MessageWorker(queue.Queue(), FakeClient({}))
+        with mock.patch('bot.workers.message_worker.load_watch_config', return_value={}):
+            with self.assertRaises(UnrecoverableError):
+                worker._rehydrate_message(self.descriptor())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
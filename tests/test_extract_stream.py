@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming extraction and packing extracts into as few messages as possible
+"""
+import sys
+import os
+import queue
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.filters import extract_content, iter_extracted, pack_texts
+from bot.filters.extract import message_length
+from bot.services.watch_index import WatchIndex
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker, Message
+from bot.workers import message_worker as message_worker_module
+
+SOURCE = "-1002"
+DEST = "-1001"
+WATCH = {"source": SOURCE, "dest": DEST, "forward_mode": "extract",
+         "extract_patterns": [r"code-\d+"], "blacklist": ["spam"]}
+
+
+class FakeClient:
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.sent = []
+        self.fail_on = fail_on
+
+    def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.calls.append((chat_id, from_chat_id, message_ids))
+        return SimpleNamespace(id=1000 + message_ids)
+
+    def send_message(self, chat_id, text):
+        if self.fail_on and self.fail_on in text:
+            raise RuntimeError("send failed")
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(id=len(self.sent))
+
+
+def make_entry(message_id, text, dest=DEST, watch=WATCH):
+    return Message(
+        user_id="1", watch_key="watch", message=None, watch_data=dict(watch, dest=dest),
+        source_chat_id=SOURCE, dest_chat_id=dest, message_text=text, message_id=message_id
+    )
+
+
+class TestStreamingExtract(unittest.TestCase):
+
+    def test_matches_keep_first_seen_order(self):
+        text = "b-2 a-1 b-2 c-3 a-1"
+        self.assertEqual(list(iter_extracted(text, [r"[a-c]-\d"])), ["b-2", "a-1", "c-3"])
+        self.assertEqual(extract_content(text, [r"[a-c]-\d"]), "b-2\na-1\nc-3")
+
+    def test_duplicates_across_patterns_are_dropped(self):
+        text = "id 42 and code 42x"
+        self.assertEqual(extract_content(text, [r"\d+", r"(\d+)x"]), "42")
+
+    def test_empty_matches_are_skipped(self):
+        self.assertEqual(extract_content("abc", [r"x*"]), "")
+
+    def test_dn_completed_only_on_magnets(self):
+        text = "Title #tag\nmagnet:?xt=urn:btih:" + "a" * 40 + " code-1"
+        result = extract_content(text, [r"magnet:\S+", r"code-\d+"])
+        self.assertEqual(result, "magnet:?xt=urn:btih:" + "a" * 40 + "&dn=Title-1\ncode-1")
+
+    def test_dn_not_added_to_text_mentioning_magnet(self):
+        text = "Title #tag\nmagnet: none yet\nmagnet:?xt=urn:btih:" + "b" * 40 + "&dn=Named"
+        result = extract_content(text, [r"magnet:.*"])
+        self.assertEqual(result, "magnet: none yet\nmagnet:?xt=urn:btih:" + "b" * 40 + "&dn=Named")
+
+
+class TestPackTexts(unittest.TestCase):
+
+    def test_consecutive_texts_share_a_message(self):
+        packed = pack_texts(["a" * 10, "b" * 10, "c" * 5], limit=22)
+        self.assertEqual(packed, [("a" * 10 + "\n" + "b" * 10, (0, 1)), ("c" * 5, (2,))])
+
+    def test_long_text_is_split_on_lines(self):
+        text = "\n".join(["x" * 8] * 5)
+        packed = pack_texts([text], limit=20)
+        self.assertEqual([chunk for chunk, _ in packed], ["x" * 8 + "\n" + "x" * 8] * 2 + ["x" * 8])
+        self.assertTrue(all(owners == (0,) for _, owners in packed))
+
+    def test_overlong_line_is_cut(self):
+        packed = pack_texts(["y" * 25], limit=10)
+        self.assertEqual([chunk for chunk, _ in packed], ["y" * 10, "y" * 10, "y" * 5])
+
+    def test_long_text_gets_messages_of_its_own(self):
+        packed = pack_texts(["a" * 5, "x" * 8 + "\n" + "x" * 8, "b" * 5], limit=15)
+        self.assertEqual(packed, [("a" * 5, (0,)), ("x" * 8, (1,)), ("x" * 8, (1,)), ("b" * 5, (2,))])
+
+    def test_limit_counts_utf16_units(self):
+        emoji = "\U0001F600"
+        self.assertEqual(message_length(emoji), 2)
+        packed = pack_texts([emoji * 3], limit=4)
+        self.assertEqual([chunk for chunk, _ in packed], [emoji * 2, emoji])
+
+
+class TestExtractBatch(unittest.TestCase):
+
+    def make_worker(self, client=None):
+        worker = MessageWorker(queue.Queue(), client or FakeClient(), coalesce_window=0)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        return worker
+
+    def collect(self, worker, entries):
+        for entry in entries:
+            worker.message_queue.put(entry)
+        return worker._collect_batch(worker.message_queue.get_nowait())
+
+    def test_burst_is_packed_into_one_message(self):
+        worker = self.make_worker()
+        batch = self.collect(worker, [make_entry(i, f"post code-{i}") for i in range(30)])
+        self.assertEqual(len(batch), 30)
+
+        results = worker._process_batch(batch)
+        self.assertEqual(worker.acc.sent, [(int(DEST), "\n".join(f"code-{i}" for i in range(30)))])
+        self.assertEqual([r for _, r in results], ["success"] * 30)
+
+    def test_filtered_and_empty_entries(self):
+        worker = self.make_worker()
+        entries = [make_entry(0, "code-0"), make_entry(1, "spam code-1"), make_entry(2, "nothing")]
+        results = dict((m.message_id, r) for m, r in worker._process_batch(self.collect(worker, entries)))
+        self.assertEqual(results, {0: "success", 1: "skip", 2: "success"})
+        self.assertEqual(worker.acc.sent, [(int(DEST), "code-0")])
+
+    def test_other_destination_is_not_merged(self):
+        worker = self.make_worker()
+        other = make_entry(9, "code-9", dest="-1003")
+        batch = self.collect(worker, [make_entry(0, "code-0"), other, make_entry(1, "code-1")])
+        self.assertEqual([m.message_id for m in batch], [0, 1])
+        self.assertEqual(list(worker._stash), [other])
+
+    def test_failed_chunk_retries_only_its_entries(self):
+        worker = self.make_worker(FakeClient(fail_on="code-7"))
+        long_line = "code-" + "1" * 4088
+        entries = [make_entry(0, long_line), make_entry(1, "code-7")]
+        results = dict((m.message_id, r) for m, r in worker._process_batch(self.collect(worker, entries)))
+        self.assertEqual(results, {0: "success", 1: "retry"})
+        self.assertEqual(worker.acc.sent, [(int(DEST), long_line)])
+
+    def test_multi_chunk_entry_failing_first_chunk_is_retried_whole(self):
+        worker = self.make_worker(FakeClient(fail_on="code-0001"))
+        long_text = "\n".join(f"code-{i:04d}" for i in range(1, 500))
+        entries = [make_entry(0, "code-0"), make_entry(1, long_text), make_entry(2, "code-9")]
+        results = dict((m.message_id, r) for m, r in worker._process_batch(self.collect(worker, entries)))
+        self.assertEqual(results, {0: "success", 1: "retry", 2: "success"})
+        # 失败条目的后续分段不再发送，重试时不会重复
+        self.assertEqual(worker.acc.sent, [(int(DEST), "code-0"), (int(DEST), "code-9")])
+
+    def test_multi_chunk_entry_failing_later_chunk_is_not_resent(self):
+        worker = self.make_worker(FakeClient(fail_on="code-0499"))
+        long_text = "\n".join(f"code-{i:04d}" for i in range(1, 500))
+        entries = [make_entry(0, "code-0"), make_entry(1, long_text)]
+        results = dict((m.message_id, r) for m, r in worker._process_batch(self.collect(worker, entries)))
+        self.assertEqual(results, {0: "success", 1: "success"})
+        self.assertEqual(len(worker.acc.sent), 2)
+        self.assertTrue(worker.acc.sent[1][1].startswith("code-0001\n"))
+
+    def test_changed_rule_is_used_for_filtering_and_extraction(self):
+        worker = self.make_worker()
+        entries = [make_entry(0, "code-0 id-0"), make_entry(1, "code-1 id-1 spam")]
+        batch = self.collect(worker, entries)
+        changed = dict(WATCH, extract_patterns=[r"id-\d+"], blacklist=[])
+        index = WatchIndex.build({"1": {"watch": changed}})
+        with mock.patch.object(message_worker_module, "get_watch_index", return_value=index):
+            results = dict((m.message_id, r) for m, r in worker._process_batch(batch))
+        self.assertEqual(results, {0: "success", 1: "success"})
+        self.assertEqual(worker.acc.sent, [(int(DEST), "id-0\nid-1")])
+
+    def test_entry_switched_out_of_extract_mode_is_processed_alone(self):
+        worker = self.make_worker()
+        batch = self.collect(worker, [make_entry(0, "code-0"), make_entry(1, "code-1")])
+        index = WatchIndex.build({"1": {"watch": dict(WATCH, forward_mode="full", preserve_forward_source=True)}})
+        with mock.patch.object(message_worker_module, "get_watch_index", return_value=index):
+            results = worker._process_batch(batch)
+        self.assertEqual([r for _, r in results], ["success", "success"])
+        self.assertEqual(worker.acc.sent, [])
+        self.assertEqual([message_ids for _, _, message_ids in worker.acc.calls], [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Tests for the compiled filter engine
+Verifies it gives the same verdicts as the per-call filter functions
+"""
+import sys
+import os
+import random
+import logging
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.filters import check_whitelist, check_blacklist, check_whitelist_regex, check_blacklist_regex
+from bot.filters import engine
+from bot.filters.engine import CompiledFilter, KeywordMatcher, RegexSet
+
+
+def legacy_passes(text, whitelist, blacklist, whitelist_regex, blacklist_regex):
+    if check_blacklist(text, blacklist) or check_blacklist_regex(text, blacklist_regex):
+        return False
+    return check_whitelist(text, whitelist) and check_whitelist_regex(text, whitelist_regex)
+
+
+class TestKeywordMatcher(unittest.TestCase):
+
+    def test_case_insensitive(self):
+        matcher = KeywordMatcher(["Hello", "世界"])
+        self.assertEqual(matcher.find("say hello there"), "Hello")
+        self.assertEqual(matcher.find("你好世界"), "世界")
+        self.assertIsNone(matcher.find("nothing"))
+
+    def test_empty_keyword_matches_everything(self):
+        self.assertEqual(KeywordMatcher(["abc", ""]).find("xyz"), "")
+
+    def test_substring_fallback(self):
+        original = engine.ahocorasick
+        engine.ahocorasick = None
+        try:
+            matcher = KeywordMatcher(["foo", "bar"])
+            self.assertEqual(matcher.find("xxbarxx"), "bar")
+            self.assertEqual(engine.get_filter_backend(), "substring")
+        finally:
+            engine.ahocorasick = original
+
+    def test_automaton_backend(self):
+        if engine.ahocorasick is None:
+            self.skipTest("pyahocorasick not installed")
+        matcher = KeywordMatcher(["foo", "bar"])
+        self.assertIsNotNone(matcher._automaton)
+        self.assertIn(matcher.find("xxbarxxfoo"), ("foo", "bar"))
+
+
+class TestRegexSet(unittest.TestCase):
+
+    def test_merged_patterns_report_the_match(self):
+        regex_set = RegexSet([r"\d{4}", r"^abc", r"xyz$"])
+        self.assertIsNotNone(regex_set._merged)
+        self.assertEqual(regex_set.find("abc"), r"^abc")
+        self.assertEqual(regex_set.find("1 xyz"), r"xyz$")
+        self.assertIsNone(regex_set.find("xyz 1"))
+
+    def test_backreference_kept_standalone(self):
+        regex_set = RegexSet([r"(a)\1", r"(b)c"])
+        self.assertEqual(regex_set.find("aa"), r"(a)\1")
+        self.assertIsNone(regex_set.find("ab"))
+        self.assertEqual(len(regex_set._standalone), 1)
+
+    def test_global_flag_kept_standalone(self):
+        regex_set = RegexSet([r"(?i)hello", r"World"])
+        self.assertTrue(regex_set.search("HELLO"))
+        self.assertFalse(regex_set.search("world"))
+
+    def test_invalid_pattern_never_matches(self):
+        logging.disable(logging.WARNING)
+        try:
+            regex_set = RegexSet(["(", "ok"])
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTrue(regex_set)
+        self.assertIsNone(regex_set.find("("))
+        self.assertFalse(RegexSet(["("]).search("anything"))
+
+
+class TestCompiledFilter(unittest.TestCase):
+
+    def test_blacklist_has_priority(self):
+        compiled = CompiledFilter(whitelist=["news"], blacklist=["ad"])
+        result = compiled.evaluate("news ad")
+        self.assertFalse(result.passed)
+        self.assertEqual((result.stage, result.matched), ("blacklist", "ad"))
+        self.assertTrue(compiled.passes("NEWS only"))
+        self.assertEqual(compiled.evaluate("weather").stage, "whitelist")
+
+    def test_none_text(self):
+        self.assertTrue(CompiledFilter().passes(None))
+        self.assertFalse(CompiledFilter(whitelist=["a"]).passes(None))
+
+    def test_matches_legacy_functions(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        rng = random.Random(7)
+        vocabulary = ["Alpha", "beta", "GAMMA", "磁力", "下载", "spam", "1080p", "x264"]
+        patterns = [r"\d{3,4}p", r"^\[", r"x26[45]", r"(\w)\1", r"磁力.*链接", r"(?i)SPAM"]
+        for _ in range(300):
+            whitelist = rng.sample(vocabulary, rng.randint(0, 3))
+            blacklist = rng.sample(vocabulary, rng.randint(0, 2))
+            whitelist_regex = rng.sample(patterns, rng.randint(0, 2))
+            blacklist_regex = rng.sample(patterns, rng.randint(0, 2))
+            text = " ".join(rng.choice(vocabulary + ["[新片]", "720p", "aa", "链接", "foo"]) for _ in range(6))
+            compiled = CompiledFilter(whitelist, blacklist, whitelist_regex, blacklist_regex)
+            self.assertEqual(
+                compiled.passes(text),
+                legacy_passes(text, whitelist, blacklist, whitelist_regex, blacklist_regex),
+                (text, whitelist, blacklist, whitelist_regex, blacklist_regex)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
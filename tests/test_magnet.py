@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared magnet link tokenizer
+"""
+import sys
+import os
+import re
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.magnet import (
+    find_magnets, first_magnet, parse_magnet, rewrite_magnets, fill_missing_dn, set_dn, base_dn_text
+)
+from bot.workers import MessageWorker
+
+HASH_A = "a" * 40
+HASH_B = "B" * 40
+
+
+def legacy_append_dn(message_text):
+    """The worker's previous implementation (findall + one str.replace per link)"""
+    magnets = re.findall(r'magnet:\?xt=urn:btih:[a-zA-Z0-9]+(?:[&?][^\s\n\r|]*)?', message_text)
+    if not magnets:
+        return message_text
+    hash_pos = message_text.find('#')
+    base = message_text[:hash_pos].rstrip() if hash_pos != -1 else message_text.rstrip()
+    if not base or base in magnets:
+        return message_text
+    processed_text = message_text
+    count = 0
+    for magnet_link in magnets:
+        if '&dn=' not in magnet_link and '?dn=' not in magnet_link:
+            count += 1
+            dn_text = f"{base}-{count}" if len(magnets) > 1 else base
+            processed_text = processed_text.replace(magnet_link, f"{magnet_link}&dn={dn_text}")
+    return processed_text
+
+
+class TestTokenizer(unittest.TestCase):
+
+    def test_structured_magnets(self):
+        text = f"Movie #tag\nmagnet:?xt=urn:btih:{HASH_A}&dn=Some%20File&tr=udp://x | magnet:?xt=urn:btih:{HASH_B}\n"
+        first, second = find_magnets(text)
+        self.assertEqual(first.info_hash, HASH_A)
+        self.assertEqual(first.dn, "Some%20File")
+        self.assertEqual(text[first.start:first.end], first.link)
+        self.assertEqual(second.info_hash, HASH_B)
+        self.assertIsNone(second.dn)
+
+    def test_boundary_modes(self):
+        text = f"magnet:?xt=urn:btih:{HASH_A}&dn=My File  \nnext line"
+        self.assertEqual(first_magnet(text).dn, "My")
+        line = first_magnet(text, to_line_end=True)
+        self.assertEqual(line.dn, "My File")
+        self.assertEqual(line.link, f"magnet:?xt=urn:btih:{HASH_A}&dn=My File")
+
+    def test_case_insensitive_scheme(self):
+        self.assertEqual(parse_magnet(f"MAGNET:?xt=urn:btih:{HASH_A}").info_hash, HASH_A)
+        self.assertIsNone(parse_magnet("http://example.com"))
+        self.assertEqual(find_magnets(None), [])
+
+    def test_set_dn(self):
+        self.assertEqual(set_dn(f"magnet:?xt=urn:btih:{HASH_A}&dn=old&tr=x", "new"),
+                         f"magnet:?xt=urn:btih:{HASH_A}&tr=x&dn=new")
+        self.assertEqual(base_dn_text("Title  #tag #more"), "Title")
+
+    def test_rewrite_in_one_pass(self):
+        text = f"x magnet:?xt=urn:btih:{HASH_A} y magnet:?xt=urn:btih:{HASH_B}&dn=b z"
+        new_text, replaced = rewrite_magnets(text, lambda m: "[A]" if m.info_hash == HASH_A else None)
+        self.assertEqual(replaced, 1)
+        self.assertEqual(new_text, f"x [A] y magnet:?xt=urn:btih:{HASH_B}&dn=b z")
+
+    def test_fill_missing_dn_matches_legacy(self):
+        texts = [
+            f"Title #tag\nmagnet:?xt=urn:btih:{HASH_A}",
+            f"Title #tag\nmagnet:?xt=urn:btih:{HASH_A}\nmagnet:?xt=urn:btih:{HASH_B}&dn=b\nmagnet:?xt=urn:btih:{HASH_B}C",
+            f"magnet:?xt=urn:btih:{HASH_A}",
+            "no links here",
+            f"#only tags magnet:?xt=urn:btih:{HASH_A}",
+        ]
+        worker = MessageWorker.__new__(MessageWorker)
+        for text in texts:
+            self.assertEqual(worker._append_dn_to_magnets(text), legacy_append_dn(text), text)
+            self.assertEqual(fill_missing_dn(text)[0], legacy_append_dn(text), text)
+
+    def test_link_that_prefixes_another_is_completed_once(self):
+        # 旧实现用 str.replace，前缀相同的两条链接会被重复补全
+        text = f"Title #tag\nmagnet:?xt=urn:btih:{HASH_A}\nmagnet:?xt=urn:btih:{HASH_A}&tr=x"
+        new_text, count = fill_missing_dn(text)
+        self.assertEqual(count, 2)
+        self.assertEqual(new_text, f"Title #tag\nmagnet:?xt=urn:btih:{HASH_A}&dn=Title-1\n"
+                                   f"magnet:?xt=urn:btih:{HASH_A}&tr=x&dn=Title-2")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Tests for assembling album parts in the auto-forward handler
+"""
+import sys
+import os
+import queue
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.handlers import auto_forward as auto_forward_module
+from bot.services.media_group_assembler import MediaGroupAssembler
+from bot.services.watch_index import WatchIndex
+from bot.utils.media_group_cache import media_group_cache
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker
+
+SOURCE = -1002
+DEST = "-1001"
+
+
+def make_part(message_id, media_group_id="album", caption=None, chat_id=SOURCE):
+    chat = SimpleNamespace(id=chat_id, title="Source", username=None)
+    return SimpleNamespace(id=message_id, chat=chat, media_group_id=media_group_id, photo=object(),
+                           video=None, animation=None, document=None, text=None, caption=caption,
+                           outgoing=False)
+
+
+class TestMediaGroupAssembler(unittest.TestCase):
+
+    def setUp(self):
+        media_group_cache.clear()
+        self.flushed = []
+
+    def make_assembler(self, **kwargs):
+        return MediaGroupAssembler(self.flushed.append, **kwargs)
+
+    def test_parts_flush_once_in_order_after_quiet_period(self):
+        assembler = self.make_assembler(quiet_period=10, max_wait=100)
+        for message_id in (12, 10, 11):
+            assembler.add(make_part(message_id))
+        now = time.monotonic()
+        self.assertEqual(assembler.flush_due(now), 0)
+        self.assertEqual(assembler.flush_due(now + 11), 1)
+        self.assertEqual([[p.id for p in parts] for parts in self.flushed], [[10, 11, 12]])
+
+    def test_max_wait_bounds_a_trickling_album(self):
+        assembler = self.make_assembler(quiet_period=10, max_wait=20)
+        assembler.add(make_part(1))
+        self.assertEqual(assembler.flush_due(time.monotonic() + 21), 1)
+
+    def test_late_part_is_merged_into_the_cache(self):
+        assembler = self.make_assembler(quiet_period=10, max_wait=100)
+        assembler.add(make_part(1))
+        assembler.flush_all()
+        self.assertTrue(media_group_cache.is_complete(SOURCE, "album"))
+        self.assertFalse(assembler.add(make_part(2)))
+        self.assertEqual(len(self.flushed), 1)
+        self.assertEqual(assembler.late_parts, 1)
+        # 迟到的部分并入缓存，组装结果标记为不完整
+        self.assertFalse(media_group_cache.is_complete(SOURCE, "album"))
+        self.assertEqual([p.id for p in media_group_cache.get(SOURCE, "album")], [1, 2])
+
+    def test_albums_are_kept_apart(self):
+        assembler = self.make_assembler(quiet_period=10, max_wait=100)
+        assembler.add(make_part(1, media_group_id="a"))
+        assembler.add(make_part(2, media_group_id="b"))
+        assembler.add(make_part(3, media_group_id="a", chat_id=-1003))
+        self.assertEqual(assembler.flush_all(), 3)
+
+    def test_flush_primes_media_group_cache(self):
+        assembler = self.make_assembler(quiet_period=10, max_wait=100)
+        assembler.add(make_part(1))
+        assembler.add(make_part(2))
+        assembler.flush_all()
+        self.assertEqual([p.id for p in media_group_cache.get(SOURCE, "album")], [1, 2])
+
+    def test_background_thread_flushes(self):
+        assembler = self.make_assembler(quiet_period=0.05, max_wait=1)
+        assembler.add(make_part(1))
+        deadline = time.monotonic() + 2
+        while not self.flushed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.flushed), 1)
+
+
+class FakeQueue:
+    def __init__(self):
+        self.items = []
+        self.blocking = []
+
+    def offer(self, msg_obj, policy=None, block=True):
+        self.items.append(msg_obj)
+        self.blocking.append(block)
+        return True
+
+    def qsize(self):
+        return len(self.items)
+
+
+class FakeAcc:
+    def __init__(self):
+        self.calls = []
+
+    def on_message(self, *args):
+        return lambda func: func
+
+    def get_media_group(self, chat_id, message_id):
+        self.calls.append(("get_media_group", chat_id, message_id))
+        return []
+
+    def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.calls.append(("forward_messages", chat_id, from_chat_id, message_ids))
+        return [SimpleNamespace(id=900 + i) for i in range(len(message_ids))]
+
+
+class TestHandlerAssembly(unittest.TestCase):
+
+    def setUp(self):
+        media_group_cache.clear()
+        watch_config = {"1": {"watch": {"source": str(SOURCE), "dest": DEST, "preserve_forward_source": True}}}
+        patch = mock.patch.object(auto_forward_module, "get_watch_index", return_value=WatchIndex.build(watch_config))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_album_becomes_one_entry_without_api_calls(self):
+        acc = FakeAcc()
+        message_queue = FakeQueue()
+        handler = auto_forward_module.create_auto_forward_handler(acc, message_queue)
+        handler.assembler.quiet_period = 60
+
+        handler(acc, make_part(5001))
+        handler(acc, make_part(5000, caption="album caption"))
+        handler(acc, make_part(5002))
+        self.assertEqual(message_queue.items, [])
+        handler.assembler.flush_all()
+
+        self.assertEqual(len(message_queue.items), 1)
+        entry = message_queue.items[0]
+        self.assertEqual(entry.message_id, 5000)
+        self.assertEqual(entry.message_text, "album caption")
+        self.assertEqual(entry.album_ids, (5000, 5001, 5002))
+        self.assertEqual(acc.calls, [])
+        # 组装线程不在满队列上等待
+        self.assertEqual(message_queue.blocking, [False])
+
+        # worker 直接使用组装好的ID转发，不再请求 get_media_group
+        worker = MessageWorker(queue.Queue(), acc)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        self.assertEqual(worker.process_message(entry), "success")
+        self.assertEqual(acc.calls, [("forward_messages", int(DEST), SOURCE, [5000, 5001, 5002])])
+
+    def test_late_part_is_forwarded_with_its_album(self):
+        acc = FakeAcc()
+        message_queue = FakeQueue()
+        handler = auto_forward_module.create_auto_forward_handler(acc, message_queue)
+        handler.assembler.quiet_period = 60
+
+        handler(acc, make_part(6000, caption="album caption"))
+        handler(acc, make_part(6001))
+        handler.assembler.flush_all()
+        handler(acc, make_part(6002))
+        (entry,) = message_queue.items
+        self.assertEqual(entry.album_ids, (6000, 6001))
+
+        worker = MessageWorker(queue.Queue(), acc)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        self.assertEqual(worker.process_message(entry), "success")
+        self.assertEqual(acc.calls, [("forward_messages", int(DEST), SOURCE, [6000, 6001, 6002])])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared get_media_group cache
+"""
+import sys
+import os
+import queue
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils import media_group_cache as cache_module
+from bot.utils.media_group_cache import MediaGroupCache
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker, MessageRef
+
+SOURCE = -1002
+DEST = -1001
+
+
+class GroupClient:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.fetches = 0
+        self.forwards = []
+        self._lock = threading.Lock()
+
+    def get_media_group(self, chat_id, message_id):
+        with self._lock:
+            self.fetches += 1
+        time.sleep(self.delay)
+        return [SimpleNamespace(id=message_id + i, caption="cap" if i == 0 else None, text=None) for i in range(3)]
+
+    def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.forwards.append((chat_id, from_chat_id, message_ids))
+        return [SimpleNamespace(id=900 + i) for i in range(len(message_ids))]
+
+
+class TestMediaGroupCache(unittest.TestCase):
+
+    def test_second_lookup_is_a_hit(self):
+        cache = MediaGroupCache(ttl=10, max_size=4)
+        client = GroupClient()
+        fetch = lambda: client.get_media_group(SOURCE, 10)
+        first = cache.get_or_fetch(SOURCE, "g1", fetch)
+        second = cache.get_or_fetch(str(SOURCE), "g1", fetch)
+        self.assertEqual([m.id for m in first], [m.id for m in second])
+        self.assertEqual(client.fetches, 1)
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_entries_expire(self):
+        cache = MediaGroupCache(ttl=0.05, max_size=4)
+        cache.put(SOURCE, "g1", [SimpleNamespace(id=1)])
+        self.assertIsNotNone(cache.get(SOURCE, "g1"))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(SOURCE, "g1"))
+
+    def test_size_bounded_lru(self):
+        cache = MediaGroupCache(ttl=10, max_size=2)
+        cache.put(SOURCE, "a", [1])
+        cache.put(SOURCE, "b", [2])
+        cache.get(SOURCE, "a")
+        cache.put(SOURCE, "c", [3])
+        self.assertIsNone(cache.get(SOURCE, "b"))
+        self.assertEqual(cache.get(SOURCE, "a"), [1])
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def test_concurrent_requests_share_one_fetch(self):
+        cache = MediaGroupCache(ttl=10, max_size=4)
+        client = GroupClient(delay=0.1)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                cache.get_or_fetch(SOURCE, "g1", lambda: client.get_media_group(SOURCE, 10))))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(client.fetches, 1)
+        self.assertEqual(len(results), 5)
+
+    def test_failed_fetch_is_not_cached(self):
+        cache = MediaGroupCache(ttl=10, max_size=4)
+
+        def failing():
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            cache.get_or_fetch(SOURCE, "g1", failing)
+        self.assertEqual(cache.get_or_fetch(SOURCE, "g1", lambda: [1]), [1])
+
+
+class TestSharedAcrossPaths(unittest.TestCase):
+
+    def setUp(self):
+        cache_module.media_group_cache.clear()
+
+    def test_handler_and_worker_share_one_fetch(self):
+        client = GroupClient()
+        # 处理器获取 caption
+        album = cache_module.get_media_group(client, SOURCE, 10, "555")
+        self.assertEqual(album[0].caption, "cap")
+
+        # 工作线程保留来源转发同一相册
+        worker = MessageWorker(queue.Queue(), client)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        ref = MessageRef(SOURCE, 10, "555", "photo")
+        worker._forward_with_source(ref, DEST)
+
+        self.assertEqual(client.fetches, 1)
+        self.assertEqual(client.forwards, [(DEST, SOURCE, [10, 11, 12])])
+        self.assertEqual(cache_module.get_media_group_cache_stats()["hits"], 1)
+
+    def test_without_media_group_id_falls_through(self):
+        client = GroupClient()
+        cache_module.get_media_group(client, SOURCE, 10)
+        cache_module.get_media_group(client, SOURCE, 10)
+        self.assertEqual(client.fetches, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
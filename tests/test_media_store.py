@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed media store
+"""
+import sys
+import os
+import queue
+import shutil
+import tempfile
+import contextlib
+import io
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from bot.workers import MessageWorker
+from bot.workers import message_worker as message_worker_module
+from bot.workers import download_pool as download_pool_module
+from bot.workers.download_pool import DownloadPool
+from bot.storage.media_store import file_content_hash, blob_location
+from bot.utils.media_group_cache import media_group_cache
+
+CONTENT = {"photo-a": b"\xff\xd8 first image", "photo-a2": b"\xff\xd8 first image", "photo-b": b"\xff\xd8 second"}
+
+
+class FileClient:
+    """Fake client that writes the bytes of each file_id to the requested path"""
+
+    def __init__(self, album=None):
+        self.album = album
+        self.downloads = []
+
+    def get_media_group(self, chat_id, message_id):
+        return self.album
+
+    def download_media(self, file_id, file_name=None):
+        self.downloads.append(file_id)
+        with open(file_name, 'wb') as f:
+            f.write(CONTENT[file_id])
+        return file_name
+
+
+class CopyStorage:
+    def __init__(self, media_dir):
+        self.media_dir = media_dir
+        self.saved = []
+
+    def save_file(self, source_path, filename, keep_local=False):
+        dest_path = os.path.join(self.media_dir, filename)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copyfile(source_path, dest_path)
+        self.saved.append(filename)
+        return True, filename
+
+
+def make_photo(message_id, file_id, file_unique_id, media_group_id=None):
+    photo = SimpleNamespace(file_id=file_id, file_unique_id=file_unique_id)
+    return SimpleNamespace(id=message_id, photo=photo, video=None, animation=None, caption=None,
+                           chat=SimpleNamespace(id=-1009), media_group_id=media_group_id)
+
+
+class MediaStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.media_dir = os.path.join(self.temp_dir, 'media')
+        os.makedirs(self.media_dir)
+        for patcher in (mock.patch.object(database, 'DATA_DIR', self.temp_dir),
+                        mock.patch.object(database, 'DATABASE_FILE', os.path.join(self.temp_dir, 'notes.db')),
+                        mock.patch.object(message_worker_module, 'MEDIA_DIR', self.media_dir),
+                        mock.patch.object(message_worker_module, 'load_webdav_config', return_value={})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.init_database()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_worker(self, client):
+        worker = MessageWorker(queue.Queue(), client)
+        worker.storage_manager = CopyStorage(self.media_dir)
+        return worker
+
+    def refcount(self, location):
+        with database.get_db_connection() as conn:
+            row = conn.execute('SELECT refcount FROM media_blobs WHERE storage_location = ?', (location,)).fetchone()
+        return row[0] if row else None
+
+
+class TestMediaStore(MediaStoreTestCase):
+
+    def test_repeat_sighting_skips_download(self):
+        client = FileClient()
+        worker = self.make_worker(client)
+        _, first, _ = worker._handle_single_photo(make_photo(1, "photo-a", "UA"), [])
+        _, second, _ = worker._handle_single_photo(make_photo(2, "photo-a", "UA"), [])
+
+        self.assertEqual(first, second)
+        self.assertEqual(client.downloads, ["photo-a"])
+        self.assertEqual(first, blob_location(file_content_hash(os.path.join(self.media_dir, first))))
+        # 只剩内容寻址的文件，临时下载已删除
+        self.assertEqual(os.listdir(self.media_dir), ["blobs"])
+
+    def test_same_content_is_stored_once(self):
+        client = FileClient()
+        worker = self.make_worker(client)
+        _, first, _ = worker._handle_single_photo(make_photo(1, "photo-a", "UA"), [])
+        _, second, _ = worker._handle_single_photo(make_photo(2, "photo-a2", "UA2"), [])
+        _, third, _ = worker._handle_single_photo(make_photo(3, "photo-a2", "UA2"), [])
+
+        self.assertEqual(first, second)
+        self.assertEqual(third, first)
+        self.assertEqual(client.downloads, ["photo-a", "photo-a2"])
+        self.assertEqual(len(worker.storage_manager.saved), 1)
+
+    def test_albums_share_blobs(self):
+        album = [make_photo(10, "photo-a", "UA", "mg-1"), make_photo(11, "photo-b", "UB", "mg-1")]
+        client = FileClient(album)
+        worker = self.make_worker(client)
+        worker._handle_single_photo(make_photo(1, "photo-a", "UA"), [])
+        pool = DownloadPool(max_workers=2, item_timeout=5)
+        self.addCleanup(pool.shutdown)
+        self.addCleanup(media_group_cache.clear)
+        pins = []
+        with mock.patch.object(download_pool_module, "_pools", {id(client): pool}):
+            _, _, media_paths, _ = worker._handle_media_group(album[0], None, pins)
+
+        self.assertEqual(len(media_paths), 2)
+        self.assertEqual(client.downloads, ["photo-a", "photo-b"])
+        # 每一项的引用随结果返回给工作线程
+        self.assertEqual(len(pins), 2)
+
+
+class TestReferenceCounting(MediaStoreTestCase):
+
+    def add_note(self, text, media_paths):
+        return database.add_note(user_id=1, source_chat_id="-1009", source_name="Source", message_text=text,
+                                 media_type="photo", media_paths=media_paths)
+
+    def test_blob_removed_with_last_reference(self):
+        worker = self.make_worker(FileClient())
+        pins = []
+        _, location, _ = worker._handle_single_photo(make_photo(1, "photo-a", "UA"), pins)
+        blob_path = os.path.join(self.media_dir, location)
+        # 保存笔记之前由工作线程持有引用
+        self.assertEqual(self.refcount(location), 1)
+
+        first = self.add_note("first post", [location])
+        second = self.add_note("second post", [location])
+        worker._release_media_pins(pins)
+        self.assertEqual(self.refcount(location), 2)
+
+        self.assertTrue(database.delete_note(first))
+        self.assertTrue(os.path.exists(blob_path))
+        self.assertEqual(self.refcount(location), 1)
+
+        self.assertTrue(database.delete_note(second))
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertIsNone(database.find_media_blob(file_unique_id="UA"))
+        self.assertIsNone(database.find_media_blob(content_hash=location.split("/")[-1].split(".")[0]))
+
+    def test_duplicate_paths_in_one_note_count_once(self):
+        worker = self.make_worker(FileClient())
+        pins = []
+        _, location, _ = worker._handle_single_photo(make_photo(1, "photo-a", "UA"), pins)
+        note_id = self.add_note("album", [location, location])
+        worker._release_media_pins(pins)
+        self.assertEqual(self.refcount(location), 1)
+        database.delete_note(note_id)
+        self.assertIsNone(self.refcount(location))
+
+    def test_legacy_files_are_still_deleted(self):
+        legacy_path = os.path.join(self.media_dir, "5_20240101_000000.jpg")
+        with open(legacy_path, 'wb') as f:
+            f.write(b"old")
+        note_id = self.add_note("legacy", ["5_20240101_000000.jpg"])
+        database.delete_note(note_id)
+        self.assertFalse(os.path.exists(legacy_path))
+
+
+class TestRecordModePins(MediaStoreTestCase):
+
+    def blob_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.media_dir)
+                      for root, _, names in os.walk(os.path.join(self.media_dir, "blobs")) for name in names)
+
+    def record(self, worker, message_id, file_id, file_unique_id, text="caption"):
+        message = make_photo(message_id, file_id, file_unique_id)
+        message.chat.title, message.chat.username = "Source", None
+        return worker._handle_record_mode(message, "1", "-1009", text, "full", None)
+
+    def test_saved_note_owns_the_blob(self):
+        worker = self.make_worker(FileClient())
+        self.assertEqual(self.record(worker, 1, "photo-a", "UA"), "success")
+        location = database.find_media_blob(file_unique_id="UA")
+        self.assertEqual(self.refcount(location), 1)
+
+    def test_duplicate_note_leaves_no_ownerless_blob(self):
+        worker = self.make_worker(FileClient())
+        self.record(worker, 1, "photo-a", "UA", text="same text")
+        location = database.find_media_blob(file_unique_id="UA")
+        # 重复的笔记直接返回已有记录，新下载的内容不产生额外引用
+        self.record(worker, 2, "photo-b", "UB", text="same text")
+        self.assertEqual(self.refcount(location), 1)
+        self.assertIsNone(database.find_media_blob(file_unique_id="UB"))
+        self.assertEqual(self.blob_files(), [location])
+
+    def test_failed_note_releases_the_blob(self):
+        worker = self.make_worker(FileClient())
+        with mock.patch.object(message_worker_module, "add_note", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                self.record(worker, 1, "photo-a", "UA")
+        self.assertIsNone(database.find_media_blob(file_unique_id="UA"))
+        self.assertEqual(self.blob_files(), [])
+
+    def test_pinned_blob_survives_concurrent_delete(self):
+        worker = self.make_worker(FileClient())
+        self.record(worker, 1, "photo-a", "UA", text="first")
+        (note,) = database.get_notes(user_id=1)
+        note_id = note['id']
+        location = database.find_media_blob(file_unique_id="UA")
+        real_add_note = message_worker_module.add_note
+
+        def delete_then_add(**kwargs):
+            # 查找到已保存的文件之后、保存笔记之前，唯一引用它的笔记被删除
+            database.delete_note(note_id)
+            return real_add_note(**kwargs)
+
+        with mock.patch.object(message_worker_module, "add_note", side_effect=delete_then_add):
+            self.record(worker, 2, "photo-a", "UA", text="second")
+        self.assertEqual(self.refcount(location), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.media_dir, location)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
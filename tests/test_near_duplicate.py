@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Tests for near-duplicate suppression of reposts across sources
+"""
+import sys
+import os
+import time
+import queue
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.handlers import auto_forward as auto_forward_module
+from bot.services.watch_index import WatchIndex
+from bot.utils import near_duplicate as near_duplicate_module
+from bot.workers import MessageWorker
+from bot.utils.near_duplicate import NearDuplicateIndex, simhash, hamming_distance, media_unique_ids
+
+POST = ("【新片速递】某某电影 2024 1080p 中英双字 完整版 资源已更新，"
+        "下载地址见下方链接，欢迎转发分享 magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567")
+REPOST = ("【新片速递】 某某电影 2024 1080P 中英双字 完整版！资源已更新，"
+          "下载地址见下方链接，欢迎转发分享 magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567")
+OTHER = ("今日天气预报：多云转晴，最高气温二十五度，最低气温十六度，"
+         "东南风三到四级，空气质量良好，适宜户外活动，出门记得带伞以防阵雨")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_message(message_id, chat_id, text=None, photo_id=None, media_group_id=None):
+    chat = SimpleNamespace(id=chat_id, title="Source", username=None)
+    photo = SimpleNamespace(file_unique_id=photo_id) if photo_id else None
+    return SimpleNamespace(id=message_id, chat=chat, media_group_id=media_group_id, photo=photo, video=None,
+                           animation=None, document=None, text=None if photo else text,
+                           caption=text if photo else None, outgoing=False)
+
+
+class TestSimHash(unittest.TestCase):
+
+    def test_reposts_are_close_and_other_posts_far(self):
+        self.assertLessEqual(hamming_distance(simhash(POST), simhash(REPOST)), 3)
+        self.assertGreater(hamming_distance(simhash(POST), simhash(OTHER)), 3)
+
+    def test_short_texts_are_not_fingerprinted(self):
+        self.assertIsNone(simhash("ok"))
+        self.assertIsNone(simhash(None))
+
+    def test_only_the_leading_text_is_fingerprinted(self):
+        body = (POST * 20)[:1200]
+        self.assertEqual(simhash(body + OTHER * 5), simhash(body))
+
+    def test_media_unique_ids(self):
+        parts = [make_message(1, -1, photo_id="A"), make_message(2, -1, text="no media"),
+                 make_message(3, -1, photo_id="B")]
+        self.assertEqual(media_unique_ids(parts), ("A", "B"))
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.index = NearDuplicateIndex(retention=3600, max_entries=100, clock=self.clock)
+
+    def test_text_repost_from_other_source(self):
+        self.assertIsNone(self.index.check_and_add(simhash(POST), (), ("-1", 10), window=600))
+        self.assertEqual(self.index.check_and_add(simhash(REPOST), (), ("-2", 77), window=600), ("-1", 10))
+        self.assertIsNone(self.index.check_and_add(simhash(OTHER), (), ("-2", 78), window=600))
+
+    def test_same_message_for_another_watch_is_not_a_duplicate(self):
+        self.index.check_and_add(simhash(POST), (), ("-1", 10), window=600)
+        self.assertIsNone(self.index.check_and_add(simhash(POST), (), ("-1", 10), window=600))
+
+    def test_window_is_per_lookup(self):
+        self.index.check_and_add(simhash(POST), (), ("-1", 10), window=600)
+        self.clock.now += 900
+        self.assertIsNone(self.index.check_and_add(simhash(REPOST), (), ("-2", 77), window=600))
+        self.assertEqual(self.index.check_and_add(simhash(REPOST), (), ("-3", 5), window=1200), ("-1", 10))
+
+    def test_media_needs_every_file_seen(self):
+        self.index.check_and_add(None, ("A", "B"), ("-1", 10), window=600)
+        self.assertEqual(self.index.check_and_add(None, ("B", "A"), ("-2", 20), window=600), ("-1", 10))
+        self.assertIsNone(self.index.check_and_add(None, ("A", "C"), ("-2", 21), window=600))
+
+    def test_entries_expire(self):
+        self.index.check_and_add(simhash(POST), ("A",), ("-1", 10), window=600)
+        self.clock.now += 3601
+        self.assertIsNone(self.index.check_and_add(simhash(OTHER), (), ("-2", 11), window=3600))
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index._media, {})
+
+    def test_size_is_bounded(self):
+        index = NearDuplicateIndex(retention=3600, max_entries=5, clock=self.clock)
+        for i in range(8):
+            index.check_and_add(None, (f"file-{i}",), ("-1", i), window=600)
+        self.assertEqual(len(index), 5)
+        self.assertIsNone(index.check_and_add(None, ("file-0",), ("-2", 1), window=600))
+
+    def test_check_does_not_record(self):
+        self.assertIsNone(self.index.check(simhash(POST), (), ("-1", 10), window=600))
+        self.assertIsNone(self.index.check(simhash(REPOST), (), ("-2", 77), window=600))
+        self.assertEqual(len(self.index), 0)
+
+    def test_discarded_post_no_longer_blocks_reposts(self):
+        self.index.check_and_add(simhash(POST), ("A",), ("-1", 10), window=600)
+        self.assertTrue(self.index.discard(("-1", 10)))
+        self.assertFalse(self.index.discard(("-1", 10)))
+        self.assertIsNone(self.index.check_and_add(simhash(REPOST), ("A",), ("-2", 77), window=600))
+        self.assertEqual(self.index._media["A"].origin, ("-2", 77))
+
+    def test_discard_removes_one_entry_per_call(self):
+        # 同一条消息经两个任务发往同一目标
+        self.index.add(simhash(POST), (), ("-1", 10))
+        self.index.add(simhash(POST), (), ("-1", 10))
+        self.assertTrue(self.index.discard(("-1", 10)))
+        self.assertEqual(len(self.index), 1)
+        self.assertTrue(self.index.discard(("-1", 10)))
+        self.assertFalse(self.index.discard(("-1", 10)))
+        self.assertEqual(len(self.index), 0)
+
+    def test_lookup_takes_microseconds(self):
+        index = NearDuplicateIndex(retention=3600, max_entries=10000)
+        fingerprints = [simhash(f"{OTHER} 第{i}条 {i * 7919}") for i in range(2000)]
+        for i, fingerprint in enumerate(fingerprints):
+            index.check_and_add(fingerprint, (), ("-1", i), window=3600)
+        probe = simhash(POST)
+        start = time.perf_counter()
+        for i in range(1000):
+            index._find(probe, (), ("-2", i), 0.0)
+        self.assertLess((time.perf_counter() - start) / 1000, 0.001)
+
+
+class TestHandlerSuppression(unittest.TestCase):
+
+    message_ids = iter(range(52001, 53000))
+
+    def setUp(self):
+        patcher = mock.patch.object(near_duplicate_module, "_indexes", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def deliver(self, config, messages, admit=lambda *args: True):
+        items = []
+
+        def offer(msg_obj, policy=None, block=True):
+            if not admit(msg_obj, policy):
+                return False
+            items.append(msg_obj)
+            return True
+
+        message_queue = SimpleNamespace(offer=offer, qsize=lambda: len(items))
+        acc = SimpleNamespace(on_message=lambda *args: (lambda func: func))
+        with mock.patch.object(auto_forward_module, "get_watch_index", return_value=WatchIndex.build(config)):
+            handler = auto_forward_module.create_auto_forward_handler(acc, message_queue)
+            for message in messages:
+                handler(None, message)
+        return items
+
+    def test_repost_across_sources_is_dropped_before_enqueue(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010", "near_duplicate": True},
+            "b": {"source": "-1012", "dest": "-1010", "near_duplicate": {"window": 600}},
+        }}
+        items = self.deliver(config, [
+            make_message(next(self.message_ids), -1011, POST),
+            make_message(next(self.message_ids), -1012, REPOST),
+            make_message(next(self.message_ids), -1012, OTHER),
+        ])
+        self.assertEqual([m.source_chat_id for m in items], ["-1011", "-1012"])
+        self.assertEqual(items[1].message_text, OTHER)
+
+    def test_disabled_watch_keeps_reposts(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010"},
+            "b": {"source": "-1012", "dest": "-1010"},
+        }}
+        items = self.deliver(config, [make_message(next(self.message_ids), -1011, POST),
+                                      make_message(next(self.message_ids), -1012, REPOST)])
+        self.assertEqual(len(items), 2)
+
+    def test_same_photo_reposted(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010", "near_duplicate": True},
+            "b": {"source": "-1012", "dest": "-1010", "near_duplicate": True},
+        }}
+        items = self.deliver(config, [make_message(next(self.message_ids), -1011, "图", photo_id="P1"),
+                                      make_message(next(self.message_ids), -1012, "新配文", photo_id="P1")])
+        self.assertEqual(len(items), 1)
+
+    def test_post_dropped_by_full_queue_does_not_block_repost(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010", "near_duplicate": True, "overflow_policy": "drop_newest"},
+            "b": {"source": "-1012", "dest": "-1010", "near_duplicate": True},
+        }}
+        # 第一条到达时队列已满被丢弃
+        admitted = iter([False, True])
+        items = self.deliver(config, [make_message(next(self.message_ids), -1011, POST),
+                                      make_message(next(self.message_ids), -1012, REPOST)],
+                             admit=lambda *args: next(admitted))
+        self.assertEqual([m.source_chat_id for m in items], ["-1012"])
+
+    def test_failed_delivery_does_not_block_repost(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010", "near_duplicate": True},
+            "b": {"source": "-1012", "dest": "-1010", "near_duplicate": True},
+        }}
+        (first,) = self.deliver(config, [make_message(next(self.message_ids), -1011, POST)])
+        worker = MessageWorker(queue.Queue(), None)
+        first.retry_count = worker.max_retries
+        worker._finish_message(first, "retry")
+
+        items = self.deliver(config, [make_message(next(self.message_ids), -1012, REPOST)])
+        self.assertEqual([m.source_chat_id for m in items], ["-1012"])
+
+    def test_delivered_post_still_blocks_repost(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010", "near_duplicate": True},
+            "b": {"source": "-1012", "dest": "-1010", "near_duplicate": True},
+        }}
+        (first,) = self.deliver(config, [make_message(next(self.message_ids), -1011, POST)])
+        MessageWorker(queue.Queue(), None)._finish_message(first, "success")
+        self.assertEqual(self.deliver(config, [make_message(next(self.message_ids), -1012, REPOST)]), [])
+
+    def test_skipped_replay_keeps_blocking_repost(self):
+        config = {"1": {
+            "a": {"source": "-1011", "dest": "-1010", "near_duplicate": True},
+            "b": {"source": "-1012", "dest": "-1010", "near_duplicate": True},
+        }}
+        (first,) = self.deliver(config, [make_message(next(self.message_ids), -1011, POST)])
+        # 投递记录判定已投递过（重放）时结果为跳过，原帖仍在目标中
+        MessageWorker(queue.Queue(), None)._finish_message(first, "skip")
+        self.assertEqual(self.deliver(config, [make_message(next(self.message_ids), -1012, REPOST)]), [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
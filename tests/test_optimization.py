@@ -32,7 +32,7 @@ class TestConstants(unittest.TestCase):
     def test_constants_exist(self):
         """Verify all constants are defined"""
         self.assertIsNotNone(constants.MAX_MEDIA_GROUP_CACHE)
-        self.assertIsNotNone(constants.MESSAGE_CACHE_CLEANUP_THRESHOLD)
+        self.assertIsNotNone(constants.MESSAGE_CACHE_MAX_SIZE)
         self.assertIsNotNone(constants.MEDIA_GROUP_CLEANUP_BATCH_SIZE)
         self.assertIsNotNone(constants.MESSAGE_CACHE_TTL)
         self.assertIsNotNone(constants.WORKER_STATS_INTERVAL)
@@ -46,7 +46,7 @@ class TestConstants(unittest.TestCase):
     def test_constants_types(self):
         """Verify constants have correct types"""
         self.assertIsInstance(constants.MAX_MEDIA_GROUP_CACHE, int)
-        self.assertIsInstance(constants.MESSAGE_CACHE_CLEANUP_THRESHOLD, int)
+        self.assertIsInstance(constants.MESSAGE_CACHE_MAX_SIZE, int)
         self.assertIsInstance(constants.MEDIA_GROUP_CLEANUP_BATCH_SIZE, int)
         self.assertIsInstance(constants.MESSAGE_CACHE_TTL, (int, float))
         self.assertIsInstance(constants.WORKER_STATS_INTERVAL, (int, float))
@@ -60,7 +60,7 @@ class TestConstants(unittest.TestCase):
     def test_constants_values(self):
         """Verify constants have reasonable values"""
         self.assertGreater(constants.MAX_MEDIA_GROUP_CACHE, 0)
-        self.assertGreater(constants.MESSAGE_CACHE_CLEANUP_THRESHOLD, 0)
+        self.assertGreater(constants.MESSAGE_CACHE_MAX_SIZE, 0)
         self.assertGreater(constants.MEDIA_GROUP_CLEANUP_BATCH_SIZE, 0)
         self.assertGreater(constants.MESSAGE_CACHE_TTL, 0)
         self.assertGreater(constants.WORKER_STATS_INTERVAL, 0)
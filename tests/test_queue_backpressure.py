@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Tests for bounded shards and per-watch overflow policies
+"""
+import sys
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import Message, ShardedMessageQueue
+from bot.workers.durable_queue import DurableQueueStore, DurableShardQueue, SpillableShardQueue
+
+DEST = "-1001"
+SOURCE = "-1002"
+
+
+def make_message(message_id):
+    return Message(
+        user_id="1",
+        watch_key="watch",
+        message=None,
+        watch_data={"source": SOURCE, "dest": DEST},
+        source_chat_id=SOURCE,
+        dest_chat_id=DEST,
+        message_text=f"text {message_id}",
+        message_id=message_id
+    )
+
+
+def fill(message_queue, count, policy):
+    for i in range(count):
+        message_queue.offer(make_message(i), policy)
+
+
+def drain(shard):
+    items = []
+    while True:
+        try:
+            msg_obj = shard.get_nowait()
+        except queue.Empty:
+            return items
+        items.append(msg_obj.message_id)
+        getattr(shard, 'ack', lambda m: None)(msg_obj)
+        shard.task_done()
+
+
+class TestOverflowPolicies(unittest.TestCase):
+
+    def test_drop_newest(self):
+        message_queue = ShardedMessageQueue(1, max_depth=3)
+        fill(message_queue, 5, "drop_newest")
+        self.assertEqual(drain(message_queue.shards[0]), [0, 1, 2])
+        self.assertEqual(message_queue.get_overflow_stats()["dropped_newest"], 2)
+
+    def test_drop_oldest(self):
+        message_queue = ShardedMessageQueue(1, max_depth=3)
+        fill(message_queue, 5, "drop_oldest")
+        self.assertEqual(drain(message_queue.shards[0]), [2, 3, 4])
+        self.assertEqual(message_queue.get_overflow_stats()["dropped_oldest"], 2)
+
+    def test_block_times_out_then_sheds(self):
+        message_queue = ShardedMessageQueue(1, max_depth=2, block_timeout=0.2)
+        fill(message_queue, 2, "block")
+        start = time.monotonic()
+        self.assertFalse(message_queue.offer(make_message(2), "block"))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(message_queue.get_overflow_stats(0)["block_timeouts"], 1)
+
+    def test_block_waits_for_room(self):
+        message_queue = ShardedMessageQueue(1, max_depth=2, block_timeout=5)
+        fill(message_queue, 2, "block")
+        shard = message_queue.shards[0]
+        threading.Timer(0.2, lambda: (shard.get_nowait(), shard.task_done())).start()
+        self.assertTrue(message_queue.offer(make_message(2), "block"))
+        self.assertEqual(message_queue.get_overflow_stats()["block_timeouts"], 0)
+
+    def test_non_blocking_caller_does_not_wait(self):
+        message_queue = ShardedMessageQueue(1, max_depth=2, block_timeout=5)
+        fill(message_queue, 2, "block")
+        start = time.monotonic()
+        self.assertTrue(message_queue.offer(make_message(2), "block", block=False))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(drain(message_queue.shards[0]), [0, 1, 2])
+
+    def test_concurrent_offers_respect_max_depth(self):
+        for policy in ("drop_newest", "drop_oldest"):
+            message_queue = ShardedMessageQueue(1, max_depth=5)
+            barrier = threading.Barrier(8)
+
+            def offer_many(base):
+                barrier.wait()
+                for i in range(200):
+                    message_queue.offer(make_message(base + i), policy)
+
+            threads = [threading.Thread(target=offer_many, args=(n * 1000,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(message_queue.qsize(), 5, policy)
+
+    def test_unbounded_when_max_depth_zero(self):
+        message_queue = ShardedMessageQueue(1, max_depth=0)
+        fill(message_queue, 50, "drop_newest")
+        self.assertEqual(message_queue.qsize(), 50)
+
+
+class TestSpill(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'spill.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_queue(self, max_depth=3):
+        store = DurableQueueStore(self.db_path)
+        store.recover(1)
+        shard = SpillableShardQueue(DurableShardQueue(store, 0))
+        return ShardedMessageQueue(1, shards=[shard], max_depth=max_depth)
+
+    def test_spill_keeps_fifo_and_bounds_memory(self):
+        message_queue = self.make_queue()
+        fill(message_queue, 8, "spill")
+        shard = message_queue.shards[0]
+        self.assertEqual(shard.memory_size(), 3)
+        self.assertEqual(shard.qsize(), 8)
+        self.assertEqual(message_queue.get_overflow_stats()["spilled"], 5)
+
+        # 磁盘上仍有条目时，新条目也进入磁盘以保持顺序
+        shard.get_nowait()
+        shard.task_done()
+        message_queue.offer(make_message(8), "spill")
+        self.assertEqual(shard.memory_size(), 2)
+        self.assertEqual(drain(shard), [1, 2, 3, 4, 5, 6, 7, 8])
+        shard.join()
+
+    def test_spilled_entries_are_descriptors(self):
+        message_queue = self.make_queue(max_depth=1)
+        fill(message_queue, 2, "spill")
+        shard = message_queue.shards[0]
+        self.assertIsNotNone(shard.get_nowait().rule)
+        spilled = shard.get_nowait()
+        self.assertIsNone(spilled.rule)
+        self.assertEqual(spilled.message_id, 1)
+
+    def test_spilled_entries_survive_restart(self):
+        fill(self.make_queue(max_depth=1), 4, "spill")
+        restarted = self.make_queue(max_depth=1)
+        self.assertEqual(drain(restarted.shards[0]), [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
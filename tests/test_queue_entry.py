@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for compact queue entries and interned watch rules
+"""
+import sys
+import os
+import json
+import queue
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.watch_rules import intern_watch_rule
+from bot.workers import MessageWorker, Message
+
+WATCH = {"source": "-1002", "dest": "-1001", "whitelist": ["hello"], "forward_mode": "full"}
+
+
+def make_pyrogram_message(message_id=5, photo=None, media_group_id=None):
+    chat = SimpleNamespace(id=-1002, title="Source", username=None)
+    return SimpleNamespace(id=message_id, chat=chat, photo=photo, video=None, animation=None,
+                           document=None, media_group_id=media_group_id, text="hello", caption=None)
+
+
+class TestWatchRules(unittest.TestCase):
+
+    def test_equal_configs_share_one_rule(self):
+        first = intern_watch_rule(json.loads(json.dumps(WATCH)))
+        second = intern_watch_rule(json.loads(json.dumps(WATCH)))
+        self.assertIs(first, second)
+        self.assertEqual(first.whitelist, ("hello",))
+        self.assertFalse(first.record_mode)
+
+    def test_changed_config_gets_new_rule(self):
+        first = intern_watch_rule(dict(WATCH))
+        changed = intern_watch_rule(dict(WATCH, whitelist=["bye"]))
+        self.assertIsNot(first, changed)
+        self.assertIsNone(intern_watch_rule(None))
+
+
+class TestCompactMessage(unittest.TestCase):
+
+    def test_from_pyrogram_drops_message_object(self):
+        msg_obj = Message.from_pyrogram("1", "watch", make_pyrogram_message(photo=object(), media_group_id=99),
+                                        dict(WATCH), "-1002", "-1001", "hello")
+        self.assertIsNone(msg_obj.message)
+        self.assertEqual(msg_obj.message_id, 5)
+        self.assertEqual(msg_obj.media_kind, "photo")
+        self.assertEqual(msg_obj.media_group_id, "99")
+        self.assertEqual(msg_obj.source_name, "Source")
+        self.assertEqual(msg_obj.watch_data, WATCH)
+        self.assertFalse(hasattr(msg_obj, '__dict__'))
+
+    def test_forward_does_not_refetch_message(self):
+        calls = []
+
+        class Client:
+            def get_messages(self, *args):
+                calls.append(("get_messages", args))
+
+            def copy_message(self, dest_id, chat_id, message_id):
+                calls.append(("copy_message", (dest_id, chat_id, message_id)))
+                return SimpleNamespace(id=77)
+
+        worker = MessageWorker(queue.Queue(), Client())
+        msg_obj = Message.from_pyrogram("1", "watch", make_pyrogram_message(), dict(WATCH),
+                                        "-1002", "-1001", "hello")
+        self.assertEqual(worker.process_message(msg_obj), "success")
+        self.assertEqual(calls, [("copy_message", (-1001, -1002, 5))])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the adaptive per-destination token-bucket rate limiter
+"""
+import sys
+import os
+import time
+import queue
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from pyrogram.errors import FloodWait
+from bot.utils.rate_limiter import TokenBucket, AdaptiveRateLimiter
+from bot.workers import MessageWorker
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=2.0, capacity=3, now=0.0)
+        self.assertEqual([bucket.reserve(0.0) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.reserve(0.0), 0.5)
+        self.assertAlmostEqual(bucket.reserve(0.0), 1.0)
+
+    def test_refill_capped_at_capacity(self):
+        bucket = TokenBucket(rate=1.0, capacity=2, now=0.0)
+        bucket.reserve(0.0)
+        bucket.reserve(0.0)
+        bucket.reserve(100.0)
+        self.assertAlmostEqual(bucket.tokens, 1.0)
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+
+    def make_limiter(self, **kwargs):
+        kwargs.setdefault('persist', False)
+        return AdaptiveRateLimiter(default_rate=1.0, burst=2, global_rate=100, global_burst=100, **kwargs)
+
+    def test_destinations_are_independent(self):
+        limiter = self.make_limiter()
+        self.assertEqual(limiter.reserve("a"), 0.0)
+        self.assertEqual(limiter.reserve("a"), 0.0)
+        self.assertGreater(limiter.reserve("a"), 0.5)
+        # 其他目标不受影响
+        self.assertEqual(limiter.reserve("b"), 0.0)
+
+    def test_global_bucket_applies_to_all(self):
+        limiter = AdaptiveRateLimiter(default_rate=100, burst=100, global_rate=1.0, global_burst=1, persist=False)
+        self.assertEqual(limiter.reserve("a"), 0.0)
+        self.assertGreater(limiter.reserve("b"), 0.5)
+
+    def test_flood_wait_slows_only_affected_destination(self):
+        limiter = self.make_limiter()
+        limiter.report_flood_wait("a", 10)
+        self.assertLess(limiter.get_rate("a"), 1.0)
+        self.assertEqual(limiter.get_rate("b"), 1.0)
+        self.assertGreaterEqual(limiter.reserve("a"), 9.0)
+        self.assertEqual(limiter.reserve("b"), 0.0)
+
+    def test_rate_recovers_on_success(self):
+        limiter = self.make_limiter()
+        limiter.report_flood_wait("a", 4)
+        lowered = limiter.get_rate("a")
+        limiter.report_success("a")
+        self.assertGreater(limiter.get_rate("a"), lowered)
+        for _ in range(100):
+            limiter.report_success("a")
+        self.assertEqual(limiter.get_rate("a"), 1.0)
+        self.assertNotIn("a", limiter.get_stats())
+
+    def test_learned_rates_persist_across_restarts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with mock.patch.object(config, 'RATE_LIMIT_FILE', os.path.join(tmp_dir, 'rate_limits.json')):
+                limiter = self.make_limiter(persist=True)
+                limiter.report_flood_wait("-100123", 8)
+                learned = limiter.get_rate("-100123")
+
+                restarted = self.make_limiter(persist=True)
+                self.assertAlmostEqual(restarted.get_rate("-100123"), learned, places=5)
+                self.assertEqual(restarted.get_rate("-100999"), 1.0)
+
+
+class TestWorkerFloodWaitLearning(unittest.TestCase):
+
+    def test_flood_wait_reported_to_limiter(self):
+        worker = MessageWorker(queue.Queue(), None)
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=50, burst=5, persist=False)
+        calls = []
+
+        def operation():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise FloodWait(value=0)
+            return "sent"
+
+        result = worker._execute_with_flood_retry("测试发送", operation, rate_limit_key="-1001")
+        self.assertEqual(result, "sent")
+        self.assertEqual(len(calls), 2)
+        self.assertLess(worker.rate_limiter.get_rate("-1001"), 50)
+        self.assertEqual(worker.rate_limiter.get_rate("-1002"), 50)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
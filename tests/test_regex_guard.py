@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for guarded regex evaluation (time budget, quarantine, validation)
+"""
+import sys
+import os
+import re
+import time
+import logging
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.filters import regex_guard
+from bot.filters import extract_content
+from bot.filters.engine import CompiledFilter
+from bot.filters.regex_guard import GuardedPattern, RegexSandbox, is_risky, validate_pattern
+
+CATASTROPHIC = r"(a+)+$"
+EVIL_TEXT = "a" * 40 + "!"
+
+
+class TestRiskClassification(unittest.TestCase):
+
+    def test_risky_patterns(self):
+        for pattern in (r"(a+)+$", r"(\w*\s?)*$", r"(a|aa)+", r"(.*,){10}", r"((a+)b)+"):
+            self.assertTrue(is_risky(pattern), pattern)
+
+    def test_plain_patterns(self):
+        for pattern in (r"\d{3,4}p", r"(?:abc)+", r"(x26[45])", r"([a+])+", r"(ab){1}", r"(a)\1", r"磁力.*链接", r"https?://\S+"):
+            self.assertFalse(is_risky(pattern), pattern)
+        self.assertEqual(GuardedPattern(r"\d+p").mode, regex_guard.MODE_RE)
+
+
+@unittest.skipUnless(regex_guard.SANDBOX_AVAILABLE, "sandbox needs POSIX pipes")
+class TestSandbox(unittest.TestCase):
+
+    def setUp(self):
+        self.sandbox = RegexSandbox(processes=1, budget=0.3)
+        self.addCleanup(self.sandbox.shutdown)
+        self.save = mock.Mock()
+        self.notified = threading.Event()
+        self.listener = mock.Mock(side_effect=lambda pattern, details: self.notified.set())
+        for target, value in (("sandbox", self.sandbox), ("re2", None), ("_quarantine", {}),
+                              ("save_regex_quarantine", self.save), ("_quarantine_listener", self.listener)):
+            patch = mock.patch.object(regex_guard, target, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        regex_guard.guard_pattern.cache_clear()
+        self.addCleanup(regex_guard.guard_pattern.cache_clear)
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_results_match_re(self):
+        guarded = GuardedPattern(r"(ab|cd)+(x)")
+        self.assertEqual(guarded.mode, regex_guard.MODE_SANDBOX)
+        self.assertTrue(guarded.search("zz abcdx"))
+        self.assertFalse(guarded.search("abcd"))
+        self.assertEqual(guarded.findall("abx cdx"), re.findall(r"(ab|cd)+(x)", "abx cdx"))
+
+    def test_budget_exceeded_quarantines_pattern(self):
+        guarded = GuardedPattern(CATASTROPHIC)
+        start = time.monotonic()
+        self.assertFalse(guarded.search(EVIL_TEXT))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(guarded.mode, regex_guard.MODE_QUARANTINED)
+        self.assertTrue(regex_guard.is_quarantined(CATASTROPHIC))
+        self.save.assert_called_once()
+        self.assertIn(CATASTROPHIC, self.save.call_args[0][0])
+
+        # 通知在后台线程中发送
+        self.assertTrue(self.notified.wait(2))
+        self.listener.assert_called_once()
+        self.assertEqual(self.listener.call_args[0][0], CATASTROPHIC)
+
+        # 隔离后不再执行，也不再影响其他规则对象
+        self.assertFalse(GuardedPattern(CATASTROPHIC).search("aaa"))
+        self.assertEqual(self.sandbox.timeouts, 1)
+
+    def test_sandbox_recovers_after_timeout(self):
+        self.assertFalse(GuardedPattern(CATASTROPHIC).search(EVIL_TEXT))
+        self.assertTrue(GuardedPattern(r"(ab|cd)+").search("abcd"))
+
+    def test_compiled_filter_stays_responsive(self):
+        compiled = CompiledFilter(blacklist_regex=[CATASTROPHIC, r"spam"], whitelist_regex=[r"(\d+)+x", r"news"])
+        self.assertFalse(compiled.passes("spam"))
+        self.assertTrue(compiled.passes(EVIL_TEXT + " news"))
+        self.assertTrue(compiled.passes("12x"))
+
+    def test_in_process_evaluation_leaves_sandboxed_patterns_to_the_worker(self):
+        compiled = CompiledFilter(blacklist_regex=[r"(ab|cd)+x", r"spam"])
+        self.assertEqual(compiled.evaluate_in_process("spam").stage, "blacklist_regex")
+        self.assertIsNone(compiled.evaluate_in_process("abx"))
+        self.assertEqual(self.sandbox.calls, 0)
+        self.assertFalse(compiled.evaluate("abx").passed)
+        self.assertTrue(CompiledFilter(whitelist_regex=[r"(\d+)+x", r"news"]).evaluate_in_process("news").passed)
+
+    def test_quarantine_invalidates_verdicts(self):
+        compiled = CompiledFilter(blacklist_regex=[CATASTROPHIC], version="v1")
+        verdict = compiled.evaluate("ok")
+        self.assertEqual(verdict.version, compiled.verdict_version())
+        compiled.evaluate(EVIL_TEXT)
+        self.assertTrue(regex_guard.is_quarantined(CATASTROPHIC))
+        self.assertNotEqual(verdict.version, compiled.verdict_version())
+        self.assertEqual(CompiledFilter(blacklist_regex=[r"spam"], version="v1").verdict_version(), "v1")
+
+    def test_extract_uses_guard(self):
+        self.assertEqual(extract_content(EVIL_TEXT, [CATASTROPHIC]), "")
+        self.assertEqual(sorted(extract_content("k1 k2", [r"(k\d)+"]).split("\n")), ["k1", "k2"])
+
+    def test_validate_rejects_catastrophic_pattern(self):
+        with self.assertRaises(re.error):
+            validate_pattern(r"(\w+\s?)+$")
+        with self.assertRaises(re.error):
+            validate_pattern("(")
+        validate_pattern(r"(ab|cd)+x")
+        validate_pattern(r"\d{3,4}p")
+        self.assertFalse(regex_guard.is_quarantined(r"(\w+\s?)+$"))
+
+    def test_validate_rejects_quarantined_pattern(self):
+        regex_guard.quarantine_pattern(r"(x+)+y", "timeout", 100)
+        with self.assertRaises(re.error):
+            validate_pattern(r"(x+)+y")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
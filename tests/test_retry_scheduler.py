@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for the delayed retry scheduler and non-blocking worker retries
+"""
+import sys
+import os
+import time
+import queue
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import MessageWorker
+from bot.workers.retry_scheduler import RetryScheduler
+
+
+class FakeItem:
+    def __init__(self, name, fail_times=0):
+        self.name = name
+        self.fail_times = fail_times
+        self.retry_count = 0
+        self.dest_chat_id = "-1001"
+        self.source_chat_id = "-1002"
+        self.message = object()
+        self.enqueued_at = time.time()
+
+
+class FlakyWorker(MessageWorker):
+    """Worker whose items fail a configurable number of times"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done = {}
+
+    def process_message(self, msg_obj):
+        if msg_obj.retry_count < msg_obj.fail_times:
+            return "retry"
+        self.done[msg_obj.name] = time.time() - msg_obj.enqueued_at
+        return "success"
+
+
+class TestRetryScheduler(unittest.TestCase):
+
+    def test_pop_due_in_due_order(self):
+        scheduler = RetryScheduler(jitter_ratio=0)
+        scheduler.schedule("late", 2.0, now=100.0)
+        scheduler.schedule("early", 1.0, now=100.0)
+        self.assertEqual(scheduler.pop_due(now=100.5), [])
+        self.assertEqual(scheduler.pop_due(now=101.0), ["early"])
+        self.assertEqual(scheduler.pop_due(now=105.0), ["late"])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_time_until_next(self):
+        scheduler = RetryScheduler(jitter_ratio=0)
+        self.assertIsNone(scheduler.time_until_next())
+        scheduler.schedule("a", 3.0, now=10.0)
+        self.assertAlmostEqual(scheduler.time_until_next(now=11.0), 2.0)
+        self.assertEqual(scheduler.time_until_next(now=20.0), 0.0)
+
+    def test_jitter_bounds(self):
+        scheduler = RetryScheduler(jitter_ratio=0.2)
+        for _ in range(200):
+            scheduler.schedule("x", 10.0, now=0.0)
+        dues = [entry[0] for entry in scheduler._heap]
+        self.assertGreaterEqual(min(dues), 8.0)
+        self.assertLessEqual(max(dues), 12.0)
+        self.assertGreater(max(dues) - min(dues), 0.5)
+
+    def test_max_parked(self):
+        scheduler = RetryScheduler(max_parked=2)
+        self.assertTrue(scheduler.schedule("a", 1))
+        self.assertTrue(scheduler.schedule("b", 1))
+        self.assertFalse(scheduler.schedule("c", 1))
+        self.assertEqual(len(scheduler), 2)
+
+
+class TestNonBlockingRetry(unittest.TestCase):
+
+    def test_healthy_messages_not_delayed_by_backoff(self):
+        q = queue.Queue()
+        worker = FlakyWorker(q, None, max_retries=3)
+        thread = threading.Thread(target=worker.run, daemon=True)
+        thread.start()
+        try:
+            # 失败消息的退避为 1s / 2s，健康消息不应等待
+            q.put(FakeItem("flaky", fail_times=2))
+            for i in range(20):
+                q.put(FakeItem(f"ok-{i}"))
+
+            deadline = time.time() + 6
+            while time.time() < deadline and "flaky" not in worker.done:
+                time.sleep(0.05)
+
+            healthy = [worker.done[f"ok-{i}"] for i in range(20)]
+            self.assertLess(max(healthy), 0.5)
+            self.assertIn("flaky", worker.done)
+            self.assertGreater(worker.done["flaky"], 2.0)
+            self.assertEqual(worker.retry_count, 2)
+            self.assertEqual(worker.failed_count, 0)
+        finally:
+            worker.stop()
+            thread.join(timeout=3)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for the sharded message queue and worker pool
+"""
+import sys
+import os
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.workers import MessageWorker, ShardedMessageQueue, MessageWorkerPool, get_shard_key
+
+
+class FakeItem:
+    """Minimal queued item (only routing fields are needed)"""
+
+    def __init__(self, dest_chat_id, source_chat_id="-1001", seq=0):
+        self.dest_chat_id = dest_chat_id
+        self.source_chat_id = source_chat_id
+        self.seq = seq
+        self.retry_count = 0
+        self.message = None
+
+
+class RecordingWorker(MessageWorker):
+    """Worker that records processing order instead of calling Telegram"""
+
+    def __init__(self, *args, slow_dest=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slow_dest = slow_dest
+        self.handled = []
+
+    def process_message(self, msg_obj):
+        if msg_obj.dest_chat_id == self.slow_dest:
+            time.sleep(0.5)
+        self.handled.append((msg_obj.dest_chat_id, msg_obj.seq, time.time()))
+        return "success"
+
+
+def start_pool(num_shards, slow_dest=None):
+    sharded = ShardedMessageQueue(num_shards)
+    workers = [RecordingWorker(shard, None, shard_id=i, slow_dest=slow_dest)
+               for i, shard in enumerate(sharded.shards)]
+    threads = [threading.Thread(target=w.run, daemon=True) for w in workers]
+    for t in threads:
+        t.start()
+    return sharded, MessageWorkerPool(sharded, workers, threads)
+
+
+class TestShardRouting(unittest.TestCase):
+
+    def test_shard_key_uses_dest_then_source(self):
+        self.assertEqual(get_shard_key(FakeItem("-100200")), "dest:-100200")
+        self.assertEqual(get_shard_key(FakeItem(None, "-100300")), "source:-100300")
+
+    def test_same_key_same_shard(self):
+        sharded = ShardedMessageQueue(8)
+        first = sharded.shard_for(FakeItem("-100200", seq=1))
+        for seq in range(20):
+            self.assertIs(sharded.shard_for(FakeItem("-100200", seq=seq)), first)
+
+    def test_routing_is_stable_across_instances(self):
+        a = ShardedMessageQueue(8)
+        b = ShardedMessageQueue(8)
+        for dest in ("-1001", "-1002", "me", "12345"):
+            self.assertEqual(a.shard_index(f"dest:{dest}"), b.shard_index(f"dest:{dest}"))
+
+    def test_invalid_shard_count(self):
+        with self.assertRaises(ValueError):
+            ShardedMessageQueue(0)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_per_destination_order_preserved(self):
+        sharded, pool = start_pool(4)
+        try:
+            for seq in range(30):
+                for dest in ("-1001", "-1002", "-1003"):
+                    sharded.put(FakeItem(dest, seq=seq))
+            sharded.join()
+            handled = [h for w in pool.workers for h in w.handled]
+            for dest in ("-1001", "-1002", "-1003"):
+                seqs = [seq for d, seq, _ in handled if d == dest]
+                self.assertEqual(seqs, list(range(30)))
+        finally:
+            pool.stop()
+
+    def test_slow_destination_does_not_block_others(self):
+        sharded, pool = start_pool(4, slow_dest="slow")
+        fast_dest = next(d for d in (str(i) for i in range(100))
+                         if sharded.shard_for(FakeItem(d)) is not sharded.shard_for(FakeItem("slow")))
+        try:
+            start = time.time()
+            sharded.put(FakeItem("slow"))
+            sharded.put(FakeItem("slow"))
+            sharded.put(FakeItem(fast_dest))
+            deadline = time.time() + 2
+            while time.time() < deadline:
+                handled = [h for w in pool.workers for h in w.handled if h[0] == fast_dest]
+                if handled:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(handled)
+            self.assertLess(handled[0][2] - start, 0.4)
+            sharded.join()
+        finally:
+            pool.stop()
+
+    def test_stats_reported_per_shard(self):
+        sharded, pool = start_pool(3)
+        try:
+            for seq in range(10):
+                sharded.put(FakeItem(str(seq), seq=seq))
+            sharded.join()
+            stats = pool.get_stats()
+            self.assertEqual([s['shard'] for s in stats], [0, 1, 2])
+            self.assertEqual(sum(s['processed'] for s in stats), 10)
+            for s in stats:
+                self.assertEqual(s['depth'], 0)
+                self.assertEqual(s['in_flight'], 0)
+                self.assertIn('throughput', s)
+        finally:
+            pool.stop()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for StorageManager.save_file: rename/hardlink placement and batched fsync
+"""
+import sys
+import os
+import errno
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.storage import webdav_client as webdav_client_module
+from bot.storage.webdav_client import StorageManager
+
+
+class FakeWebDAV:
+    def __init__(self):
+        self.uploads = []
+
+    def upload_file(self, local_path, remote_path):
+        with open(local_path, 'rb') as f:
+            self.uploads.append((remote_path, f.read()))
+        return True
+
+
+class TestSaveFile(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.media_dir = os.path.join(self.temp_dir, 'media')
+        self.storage = StorageManager(self.media_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def download(self, name, data=b"photo bytes"):
+        path = os.path.join(self.media_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self, location):
+        with open(os.path.join(self.media_dir, location), 'rb') as f:
+            return f.read()
+
+    def test_same_filesystem_is_renamed(self):
+        source = self.download("1_20240101.jpg")
+        inode = os.stat(source).st_ino
+        self.assertEqual(self.storage.save_file(source, "blobs/ab/abc.jpg"), (True, "blobs/ab/abc.jpg"))
+        self.assertFalse(os.path.exists(source))
+        self.assertEqual(os.stat(os.path.join(self.media_dir, "blobs/ab/abc.jpg")).st_ino, inode)
+
+    def test_keep_source_hard_links(self):
+        source = self.download("1_20240101.jpg")
+        self.assertEqual(self.storage.save_file(source, "copy.jpg", keep_source=True), (True, "copy.jpg"))
+        self.assertTrue(os.path.exists(source))
+        self.assertEqual(os.stat(os.path.join(self.media_dir, "copy.jpg")).st_ino, os.stat(source).st_ino)
+
+    def test_same_path_is_left_in_place(self):
+        source = self.download("1_20240101.jpg")
+        self.assertEqual(self.storage.save_file(source, "1_20240101.jpg"), (True, "1_20240101.jpg"))
+        self.assertEqual(self.read("1_20240101.jpg"), b"photo bytes")
+
+    def test_cross_filesystem_is_streamed(self):
+        source = self.download("1_20240101.jpg")
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if src == source:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return real_replace(src, dst)
+
+        with mock.patch.object(webdav_client_module.os, "replace", side_effect=replace):
+            self.assertEqual(self.storage.save_file(source, "moved.jpg"), (True, "moved.jpg"))
+        self.assertEqual(self.read("moved.jpg"), b"photo bytes")
+        self.assertFalse(os.path.exists(source))
+        self.assertEqual(sorted(os.listdir(self.media_dir)), ["moved.jpg"])
+
+    def test_missing_source_fails(self):
+        self.assertEqual(self.storage.save_file(os.path.join(self.media_dir, "gone.jpg"), "x.jpg"), (False, None))
+
+    def test_webdav_upload_and_keep_local(self):
+        webdav = FakeWebDAV()
+        storage = StorageManager(self.media_dir, webdav)
+        self.assertEqual(storage.save_file(self.download("a.jpg", b"A"), "remote_a.jpg"), (True, "remote_a.jpg"))
+        self.assertEqual(storage.save_file(self.download("b.jpg", b"B"), "remote_b.jpg", keep_local=True),
+                         (True, "remote_b.jpg"))
+        self.assertEqual(webdav.uploads, [("remote_a.jpg", b"A"), ("remote_b.jpg", b"B")])
+        self.assertEqual(os.listdir(self.media_dir), ["remote_b.jpg"])
+
+
+class TestBatchedFsync(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage = StorageManager(self.temp_dir)
+        for patcher in (mock.patch.object(webdav_client_module, "MEDIA_FSYNC_BATCH_SIZE", 3),
+                        mock.patch.object(webdav_client_module, "MEDIA_FSYNC_INTERVAL", 3600)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def save(self, index):
+        source = os.path.join(self.temp_dir, f"download_{index}")
+        with open(source, 'wb') as f:
+            f.write(b"x")
+        self.storage.save_file(source, f"blobs/{index % 2}/{index}.jpg")
+
+    def test_files_are_synced_per_batch(self):
+        with mock.patch.object(webdav_client_module, "_fsync_path") as fsync:
+            self.save(0)
+            self.save(1)
+            self.assertEqual(fsync.call_count, 0)
+            self.save(2)
+            synced = [call.args[0] for call in fsync.call_args_list]
+        # 3 个文件 + 2 个目录，每个目录只同步一次
+        self.assertEqual(len(synced), 5)
+        self.assertEqual(sorted(os.path.basename(p) for p in synced[3:]), ["0", "1"])
+
+    def test_flush_syncs_remaining_files(self):
+        with mock.patch.object(webdav_client_module, "_fsync_path") as fsync:
+            self.save(0)
+            self.storage.flush()
+            self.assertEqual(fsync.call_count, 2)
+            self.storage.flush()
+            self.assertEqual(fsync.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
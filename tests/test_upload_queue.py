@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Tests for the background media upload queue and its persistent outbox
+"""
+import sys
+import os
+import io
+import time
+import json
+import queue
+import shutil
+import tempfile
+import threading
+import contextlib
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from bot.workers import MessageWorker, UploadQueue
+from bot.workers import message_worker as message_worker_module
+from bot.storage.webdav_client import StorageManager, REMOTE_LOCATION_PREFIX
+
+
+class FakeWebDAV:
+    """Records uploads and deletions; the first ``failures`` calls raise"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.uploads = []
+        self.deletions = []
+        self._lock = threading.Lock()
+
+    def upload_file(self, local_path, remote_path):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise IOError("connection reset")
+            with open(local_path, 'rb') as f:
+                self.uploads.append((remote_path, f.read()))
+        return True
+
+    def delete_file(self, remote_path):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise IOError("connection reset")
+            self.deletions.append(remote_path)
+        return True
+
+    def get_file_url(self, remote_path):
+        return f"https://dav.example/telegram_media/{remote_path}"
+
+
+class UploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.media_dir = os.path.join(self.temp_dir, 'media')
+        os.makedirs(self.media_dir)
+        for patcher in (mock.patch.object(database, 'DATA_DIR', self.temp_dir),
+                        mock.patch.object(database, 'DATABASE_FILE', os.path.join(self.temp_dir, 'notes.db'))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.init_database()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def local_file(self, location, data=b"photo"):
+        path = os.path.join(self.media_dir, location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def add_note(self, text, media_paths):
+        return database.add_note(user_id=1, source_chat_id="-1009", source_name="Source", message_text=text,
+                                 media_type="photo", media_paths=media_paths)
+
+    def note_paths(self, note_id):
+        note = database.get_note_by_id(note_id)
+        return note['media_path'], note['media_paths']
+
+    def outbox(self):
+        with database.get_db_connection() as conn:
+            return conn.execute('SELECT storage_location, attempts FROM upload_outbox ORDER BY id').fetchall()
+
+
+class TestUploadQueue(UploadTestCase):
+
+    def test_upload_switches_notes_to_remote_location(self):
+        self.local_file("blobs/aa/a.jpg", b"A")
+        self.local_file("blobs/bb/b.jpg", b"B")
+        database.register_media_blob("a" * 64, "blobs/aa/a.jpg")
+        album = self.add_note("album", ["blobs/aa/a.jpg", "blobs/bb/b.jpg"])
+        single = self.add_note("single", ["blobs/aa/a.jpg"])
+
+        webdav = FakeWebDAV()
+        uploads = UploadQueue(webdav, self.media_dir)
+        self.assertEqual(uploads.submit(["blobs/aa/a.jpg", "blobs/bb/b.jpg", "blobs/aa/a.jpg"]), 2)
+        while uploads.process_next():
+            pass
+
+        self.assertEqual(sorted(webdav.uploads), [("blobs/aa/a.jpg", b"A"), ("blobs/bb/b.jpg", b"B")])
+        remote_a, remote_b = REMOTE_LOCATION_PREFIX + "blobs/aa/a.jpg", REMOTE_LOCATION_PREFIX + "blobs/bb/b.jpg"
+        self.assertEqual(self.note_paths(album), (remote_a, [remote_a, remote_b]))
+        self.assertEqual(self.note_paths(single), (remote_a, [remote_a]))
+        self.assertEqual(database.find_media_blob(content_hash="a" * 64), remote_a)
+        self.assertEqual(self.outbox(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.media_dir, "blobs/aa/a.jpg")))
+
+    def test_note_saved_after_upload_gets_remote_location(self):
+        self.local_file("blobs/aa/a.jpg", b"A")
+        database.register_media_blob("a" * 64, "blobs/aa/a.jpg")
+        earlier = self.add_note("earlier", ["blobs/aa/a.jpg"])
+        uploads = UploadQueue(FakeWebDAV(), self.media_dir)
+        uploads.submit(["blobs/aa/a.jpg"])
+        uploads.process_next()
+
+        # 记录模式在上传完成前查到的仍是本地位置
+        later = self.add_note("later", ["blobs/aa/a.jpg"])
+        remote_a = REMOTE_LOCATION_PREFIX + "blobs/aa/a.jpg"
+        self.assertEqual(self.note_paths(later), (remote_a, [remote_a]))
+        self.assertEqual(self.note_paths(earlier), (remote_a, [remote_a]))
+        with database.get_db_connection() as conn:
+            refcount = conn.execute('SELECT refcount FROM media_blobs WHERE content_hash = ?', ("a" * 64,)).fetchone()
+        self.assertEqual(refcount, (2,))
+        # 已上传的文件不会再次加入发件箱
+        self.assertEqual(uploads.submit(["blobs/aa/a.jpg"]), 0)
+        self.assertEqual(self.outbox(), [])
+
+    def test_failed_upload_is_retried_from_outbox(self):
+        self.local_file("photo.jpg")
+        note_id = self.add_note("retry", ["photo.jpg"])
+        webdav = FakeWebDAV(failures=1)
+        uploads = UploadQueue(webdav, self.media_dir, retry_backoff=3600)
+        uploads.submit(["photo.jpg"])
+
+        self.assertTrue(uploads.process_next())
+        self.assertEqual(self.outbox(), [("photo.jpg", 1)])
+        self.assertEqual(self.note_paths(note_id), ("photo.jpg", ["photo.jpg"]))
+        # 退避时间未到
+        self.assertFalse(uploads.process_next())
+
+        # 重启后的新队列在到期后重新上传
+        with database.get_db_connection() as conn:
+            conn.execute('UPDATE upload_outbox SET next_attempt = 0')
+        restarted = UploadQueue(webdav, self.media_dir)
+        self.assertTrue(restarted.process_next())
+        self.assertEqual(self.outbox(), [])
+        self.assertEqual(self.note_paths(note_id)[0], REMOTE_LOCATION_PREFIX + "photo.jpg")
+
+    def test_claimed_upload_is_hidden_until_lease_expires(self):
+        self.local_file("photo.jpg")
+        database.enqueue_uploads(["photo.jpg"])
+        now = time.time()
+        self.assertIsNotNone(database.claim_upload(now, 300))
+        self.assertIsNone(database.claim_upload(now + 10, 300))
+        self.assertIsNotNone(database.claim_upload(now + 301, 300))
+
+    def test_missing_local_file_is_dropped(self):
+        database.enqueue_uploads(["gone.jpg"])
+        uploads = UploadQueue(FakeWebDAV(), self.media_dir)
+        self.assertTrue(uploads.process_next())
+        self.assertEqual(self.outbox(), [])
+
+    def test_keep_local_copy_is_served_first(self):
+        self.local_file("photo.jpg")
+        uploads = UploadQueue(FakeWebDAV(), self.media_dir, keep_local=True)
+        uploads.submit(["photo.jpg"])
+        uploads.process_next()
+
+        storage = StorageManager(self.media_dir, FakeWebDAV())
+        remote = REMOTE_LOCATION_PREFIX + "photo.jpg"
+        self.assertEqual(storage.get_file_path(remote), os.path.join(self.media_dir, "photo.jpg"))
+        os.remove(os.path.join(self.media_dir, "photo.jpg"))
+        self.assertEqual(storage.get_file_path(remote), "https://dav.example/telegram_media/photo.jpg")
+
+    def test_uploader_threads_drain_outbox(self):
+        for i in range(6):
+            self.local_file(f"{i}.jpg")
+        webdav = FakeWebDAV()
+        uploads = UploadQueue(webdav, self.media_dir, num_workers=2, poll_interval=0.05).start()
+        self.addCleanup(uploads.stop)
+        uploads.submit([f"{i}.jpg" for i in range(6)])
+        deadline = time.time() + 5
+        while self.outbox() and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.outbox(), [])
+        self.assertEqual(len(webdav.uploads), 6)
+
+
+class TestRemoteDeletion(UploadTestCase):
+
+    def upload_blob(self, webdav):
+        self.local_file("blobs/aa/a.jpg", b"A")
+        database.register_media_blob("a" * 64, "blobs/aa/a.jpg")
+        first = self.add_note("first", ["blobs/aa/a.jpg"])
+        second = self.add_note("second", ["blobs/aa/a.jpg"])
+        uploads = UploadQueue(webdav, self.media_dir, retry_backoff=3600)
+        uploads.submit(["blobs/aa/a.jpg"])
+        uploads.process_next()
+        return uploads, first, second
+
+    def test_last_note_deleted_removes_remote_blob(self):
+        webdav = FakeWebDAV()
+        uploads, first, second = self.upload_blob(webdav)
+        remote_a = REMOTE_LOCATION_PREFIX + "blobs/aa/a.jpg"
+
+        database.delete_note(first)
+        self.assertEqual(self.outbox(), [])
+        database.delete_note(second)
+        self.assertEqual(self.outbox(), [(remote_a, 0)])
+
+        self.assertTrue(uploads.process_next())
+        self.assertEqual(webdav.deletions, ["blobs/aa/a.jpg"])
+        self.assertEqual(self.outbox(), [])
+        self.assertEqual(uploads.deleted_count, 1)
+
+    def test_failed_deletion_is_retried(self):
+        webdav = FakeWebDAV()
+        uploads, first, second = self.upload_blob(webdav)
+        database.delete_note(first)
+        database.delete_note(second)
+
+        webdav.failures = 1
+        self.assertTrue(uploads.process_next())
+        self.assertEqual(self.outbox(), [(REMOTE_LOCATION_PREFIX + "blobs/aa/a.jpg", 1)])
+        with database.get_db_connection() as conn:
+            conn.execute('UPDATE upload_outbox SET next_attempt = 0')
+        self.assertTrue(uploads.process_next())
+        self.assertEqual(webdav.deletions, ["blobs/aa/a.jpg"])
+        self.assertEqual(self.outbox(), [])
+
+    def test_released_pin_removes_remote_blob(self):
+        webdav = FakeWebDAV()
+        uploads, first, second = self.upload_blob(webdav)
+        database.pin_media_blob(content_hash="a" * 64)
+        database.delete_note(first)
+        database.delete_note(second)
+        self.assertEqual(self.outbox(), [])
+
+        database.release_media_blobs(["a" * 64])
+        uploads.process_next()
+        self.assertEqual(webdav.deletions, ["blobs/aa/a.jpg"])
+
+    def test_blob_stored_again_is_not_deleted(self):
+        webdav = FakeWebDAV()
+        uploads, first, second = self.upload_blob(webdav)
+        database.delete_note(first)
+        database.delete_note(second)
+
+        # 删除执行前同一内容又被保存并上传
+        remote_a = REMOTE_LOCATION_PREFIX + "blobs/aa/a.jpg"
+        database.register_media_blob("a" * 64, remote_a)
+        self.assertTrue(uploads.process_next())
+        self.assertEqual(webdav.deletions, [])
+        self.assertEqual(self.outbox(), [])
+
+
+class TestRecordModeSubmitsUploads(UploadTestCase):
+
+    def test_note_is_recorded_locally_and_queued(self):
+        class PhotoClient:
+            def download_media(self, file_id, file_name=None):
+                with open(file_name, 'wb') as f:
+                    f.write(b"record mode photo")
+                return file_name
+
+        upload_queue = mock.Mock()
+        with mock.patch.object(message_worker_module, 'MEDIA_DIR', self.media_dir), \
+                mock.patch.object(message_worker_module, 'load_webdav_config', return_value={}):
+            worker = MessageWorker(queue.Queue(), PhotoClient(), upload_queue=upload_queue)
+            self.assertIsNone(worker.storage_manager.webdav_client)
+            message = SimpleNamespace(id=7, media_group_id=None, video=None, animation=None,
+                                      photo=SimpleNamespace(file_id="f", file_unique_id="U7"),
+                                      chat=SimpleNamespace(title="Source", username=None))
+            self.assertEqual(worker._handle_record_mode(message, "1", "-1009", "caption", "full", None), "success")
+
+        (locations,), _ = upload_queue.submit.call_args
+        with database.get_db_connection() as conn:
+            media_path, media_paths = conn.execute('SELECT media_path, media_paths FROM notes').fetchone()
+        self.assertEqual(locations, [media_path])
+        self.assertEqual(json.loads(media_paths), [media_path])
+        self.assertTrue(os.path.exists(os.path.join(self.media_dir, media_path)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory routing snapshot used by the auto-forward handler
+"""
+import sys
+import os
+import json
+import queue
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.handlers import auto_forward as auto_forward_module
+from bot.services import watch_index as watch_index_module
+from bot.services.watch_index import WatchIndex
+from bot.utils.rate_limiter import AdaptiveRateLimiter
+from bot.workers import MessageWorker
+from bot.workers import message_worker as message_worker_module
+
+SOURCE = "-1002"
+WATCH_CONFIG = {
+    "1": {
+        "forward": {"source": SOURCE, "dest": "-1001", "overflow_policy": "drop_newest"},
+        "record": {"source": SOURCE, "dest": "-1001", "record_mode": True},
+    },
+    "2": {
+        "other": {"source": "-1005", "dest": "me"},
+    },
+}
+
+
+def make_message(message_id, chat_id=int(SOURCE), text="hello"):
+    chat = SimpleNamespace(id=chat_id, title="Source", username=None)
+    return SimpleNamespace(id=message_id, chat=chat, media_group_id=None, photo=None, video=None,
+                           animation=None, document=None, text=text, caption=None, outgoing=False)
+
+
+class RecordingQueue:
+    def __init__(self):
+        self.items = []
+
+    def offer(self, msg_obj, policy=None, block=True):
+        self.items.append((msg_obj, policy))
+        return True
+
+    def qsize(self):
+        return len(self.items)
+
+
+class NoNetworkAcc:
+    """Fails the test if the handler touches the client beyond registering itself"""
+
+    def on_message(self, *args):
+        return lambda func: func
+
+    def __getattr__(self, name):
+        raise AssertionError(f"handler called acc.{name}")
+
+
+class TestWatchIndex(unittest.TestCase):
+
+    def test_routes_grouped_by_source(self):
+        index = WatchIndex.build(WATCH_CONFIG)
+        routes = index.routes_for(SOURCE)
+        self.assertEqual(sorted(route.watch_key for route in routes), ["forward", "record"])
+        by_key = dict((route.watch_key, route) for route in routes)
+        self.assertEqual(by_key["forward"].dest_chat_id, "-1001")
+        self.assertEqual(by_key["forward"].overflow_policy, "drop_newest")
+        self.assertIsNone(by_key["record"].dest_chat_id)
+        self.assertEqual(index.routes_for("-9999"), ())
+        self.assertEqual(len(index), 3)
+
+    def test_snapshot_rebuilt_only_after_reload(self):
+        generation = [1]
+        with mock.patch.object(watch_index_module, "load_watch_config", return_value=WATCH_CONFIG) as load, \
+                mock.patch.object(watch_index_module, "get_watch_config_generation", side_effect=lambda: generation[0]):
+            first = watch_index_module.get_watch_index()
+            self.assertIs(watch_index_module.get_watch_index(), first)
+            self.assertEqual(load.call_count, 1)
+
+            generation[0] += 1
+            self.assertIsNot(watch_index_module.get_watch_index(), first)
+            self.assertEqual(load.call_count, 2)
+
+
+class TestSnapshotReloads(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.watch_file = os.path.join(self.tmp_dir.name, "watch_config.json")
+        self.write_config(WATCH_CONFIG)
+        load = lambda: json.load(open(self.watch_file, encoding="utf-8"))
+        for target, value in (("WATCH_FILE", self.watch_file), ("WATCH_INDEX_MTIME_CHECK_INTERVAL", 0),
+                              ("_next_mtime_check", 0.0)):
+            patch = mock.patch.object(watch_index_module, target, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        patch = mock.patch.object(watch_index_module, "load_watch_config", side_effect=load)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def write_config(self, config):
+        with open(self.watch_file, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+
+    def test_version_increases_and_old_snapshot_is_untouched(self):
+        first = watch_index_module.rebuild_watch_index()
+        second = watch_index_module.rebuild_watch_index()
+        self.assertEqual(second.version, first.version + 1)
+        self.assertEqual(len(first), 3)
+
+    def test_external_edit_detected_by_mtime(self):
+        first = watch_index_module.rebuild_watch_index()
+        self.assertIs(watch_index_module.get_watch_index(), first)
+
+        self.write_config({"9": {"w": {"source": "-1009", "dest": "-1001"}}})
+        os.utime(self.watch_file, ns=(first.mtime_ns + 10 ** 9, first.mtime_ns + 10 ** 9))
+        updated = watch_index_module.get_watch_index()
+        self.assertGreater(updated.version, first.version)
+        self.assertIn("-1009", updated)
+        self.assertNotIn(SOURCE, updated)
+        # 旧快照保持不变（copy-on-write）
+        self.assertIn(SOURCE, first)
+
+    def test_flat_lookup_with_thousands_of_watches(self):
+        config = dict((str(user), {"w": {"source": str(-100000 - user), "dest": "-1"}}) for user in range(5000))
+        index = WatchIndex.build(config)
+        self.assertEqual(len(index.routes_for("-104999")), 1)
+        self.assertEqual(len(index), 5000)
+
+
+class TestCompiledRules(unittest.TestCase):
+
+    def test_invalid_regex_never_matches(self):
+        rule = WatchIndex.build({"1": {"w": {"source": "-1", "whitelist_regex": ["(", "ok"]}}}).routes_for("-1")[0].rule
+        self.assertFalse(rule.filter.passes("("))
+        self.assertTrue(rule.filter.passes("ok"))
+        self.assertIs(rule.filter, rule.filter)
+
+
+class TestChainUsesSnapshot(unittest.TestCase):
+
+    def test_chain_hop_routes_from_index(self):
+        calls = []
+
+        class Client:
+            def get_messages(self, chat_id, message_id):
+                chat = SimpleNamespace(id=chat_id, title="Dest", username=None)
+                return SimpleNamespace(id=message_id, chat=chat, media_group_id=None, photo=None, video=None,
+                                       animation=None, document=None)
+
+            def copy_message(self, dest_id, chat_id, message_id):
+                calls.append((dest_id, chat_id, message_id))
+                return SimpleNamespace(id=2)
+
+        chain = {"1": {
+            "hop": {"source": "-1001", "dest": "-1003", "whitelist": ["news"]},
+            "loop": {"source": "-1001", "dest": "-1001"},
+            "filtered": {"source": "-1001", "dest": "-1004", "blacklist": ["news"]},
+        }}
+        worker = MessageWorker(queue.Queue(), Client())
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        with mock.patch.object(message_worker_module, "get_watch_index", return_value=WatchIndex.build(chain)), \
+                mock.patch.object(message_worker_module, "is_dest_cached", return_value=True):
+            worker._trigger_dest_monitoring(-1001, 77, "breaking news")
+        self.assertEqual(calls, [(-1003, -1001, 77)])
+
+
+class TestHandlerUsesSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(auto_forward_module, "get_watch_index", return_value=WatchIndex.build(WATCH_CONFIG))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_handler_enqueues_without_touching_client(self):
+        message_queue = RecordingQueue()
+        handler = auto_forward_module.create_auto_forward_handler(NoNetworkAcc(), message_queue)
+        handler(None, make_message(41001))
+
+        entries = dict((msg_obj.watch_key, (msg_obj, policy)) for msg_obj, policy in message_queue.items)
+        self.assertEqual(sorted(entries), ["forward", "record"])
+        self.assertEqual(entries["forward"][1], "drop_newest")
+        self.assertIsNone(entries["record"][0].dest_chat_id)
+        self.assertIs(entries["forward"][0].rule, WatchIndex.build(WATCH_CONFIG).routes_for(SOURCE)[0].rule)
+
+    def test_unmonitored_source_is_ignored(self):
+        message_queue = RecordingQueue()
+        handler = auto_forward_module.create_auto_forward_handler(NoNetworkAcc(), message_queue)
+        handler(None, make_message(41002, chat_id=-1234))
+        self.assertEqual(message_queue.items, [])
+
+
+class TestVerdictReuse(unittest.TestCase):
+
+    message_ids = iter(range(43001, 44000))
+
+    def enqueue(self, config, text):
+        message_queue = RecordingQueue()
+        with mock.patch.object(auto_forward_module, "get_watch_index", return_value=WatchIndex.build(config)):
+            handler = auto_forward_module.create_auto_forward_handler(NoNetworkAcc(), message_queue)
+            handler(None, make_message(next(self.message_ids), chat_id=-1007, text=text))
+        return [msg_obj for msg_obj, _ in message_queue.items]
+
+    def test_filtered_message_is_not_enqueued(self):
+        config = {"1": {"w": {"source": "-1007", "dest": "-1008", "blacklist": ["spam"]}}}
+        self.assertEqual(self.enqueue(config, "spam offer"), [])
+        (msg_obj,) = self.enqueue(config, "news")
+        self.assertTrue(msg_obj.verdict.passed)
+        self.assertEqual(msg_obj.verdict.version, msg_obj.rule.version_key)
+
+    def test_worker_reuses_verdict_while_rule_unchanged(self):
+        config = {"1": {"w": {"source": "-1007", "dest": "-1008", "whitelist": ["news"]}}}
+        (msg_obj,) = self.enqueue(config, "breaking news")
+        worker = MessageWorker(queue.Queue(), None)
+        with mock.patch.object(message_worker_module, "get_watch_index", return_value=WatchIndex.build(config)), \
+                mock.patch("bot.filters.engine.CompiledFilter.evaluate", side_effect=AssertionError("re-evaluated")):
+            worker._resolve_rule(msg_obj)
+            self.assertTrue(worker._passes_filters(msg_obj))
+
+    def test_worker_recomputes_after_rule_change(self):
+        config = {"1": {"w": {"source": "-1007", "dest": "-1008", "whitelist": ["news"]}}}
+        (msg_obj,) = self.enqueue(config, "breaking news")
+        changed = {"1": {"w": {"source": "-1007", "dest": "-1008", "whitelist": ["news"], "blacklist": ["breaking"]}}}
+        worker = MessageWorker(queue.Queue(), None)
+        with mock.patch.object(message_worker_module, "get_watch_index", return_value=WatchIndex.build(changed)):
+            worker._resolve_rule(msg_obj)
+            self.assertFalse(worker._passes_filters(msg_obj))
+        self.assertEqual((msg_obj.verdict.stage, msg_obj.verdict.matched), ("blacklist", "breaking"))
+
+
+class TestWorkerPeerWarmup(unittest.TestCase):
+
+    def test_peers_resolved_once_per_worker(self):
+        calls = []
+
+        class Client:
+            def get_chat(self, chat_id):
+                calls.append(("get_chat", chat_id))
+                return SimpleNamespace(title="Chat", first_name=None, username=None, is_bot=False)
+
+            def copy_message(self, dest_id, chat_id, message_id):
+                calls.append(("copy_message", message_id))
+                return SimpleNamespace(id=1)
+
+        message_queue = RecordingQueue()
+        with mock.patch.object(auto_forward_module, "get_watch_index",
+                               return_value=WatchIndex.build({"1": {"w": {"source": "-1007", "dest": "-1008"}}})):
+            handler = auto_forward_module.create_auto_forward_handler(NoNetworkAcc(), message_queue)
+            handler(None, make_message(42001, chat_id=-1007))
+            handler(None, make_message(42002, chat_id=-1007))
+
+        worker = MessageWorker(queue.Queue(), Client())
+        worker.rate_limiter = AdaptiveRateLimiter(default_rate=1000, burst=1000, persist=False)
+        for msg_obj, _ in message_queue.items:
+            self.assertEqual(worker.process_message(msg_obj), "success")
+        self.assertEqual(calls, [("get_chat", -1007), ("get_chat", -1008), ("copy_message", 42001), ("copy_message", 42002)])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
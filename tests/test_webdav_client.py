@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for the WebDAV client against a local wsgidav server
+"""
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from cheroot import wsgi
+    from wsgidav.wsgidav_app import WsgiDAVApp
+except ImportError:
+    WsgiDAVApp = None
+
+from bot.storage import webdav_client as webdav_client_module
+from bot.storage.webdav_client import WebDAVClient, StorageManager
+
+USERNAME = "bot"
+PASSWORD = "secret"
+
+
+class RecordingMiddleware:
+    """Records request methods and fails the first ``fail_puts`` PUTs with 503"""
+
+    def __init__(self, app):
+        self.app = app
+        self.methods = []
+        self.fail_puts = 0
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        self.methods.append(method)
+        if method == "PUT" and self.fail_puts:
+            self.fail_puts -= 1
+            environ["wsgi.input"].read()
+            start_response("503 Service Unavailable", [("Content-Length", "0")])
+            return [b""]
+        return self.app(environ, start_response)
+
+
+@unittest.skipIf(WsgiDAVApp is None, "wsgidav / cheroot not installed")
+class TestWebDAVClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        app = WsgiDAVApp({
+            "provider_mapping": {"/": cls.root},
+            "simple_dc": {"user_mapping": {"*": {USERNAME: {"password": PASSWORD}}}},
+            "http_authenticator": {"accept_basic": True, "accept_digest": False, "default_to_digest": False},
+            "verbose": 1,
+            "logging": {"enable": False},
+        })
+        cls.recorder = RecordingMiddleware(app)
+        cls.server = wsgi.Server(("127.0.0.1", 0), cls.recorder)
+        cls.server.prepare()
+        threading.Thread(target=cls.server.serve, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.bind_addr[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        self.recorder.methods.clear()
+        self.recorder.fail_puts = 0
+        patcher = mock.patch.object(webdav_client_module, "WEBDAV_RETRY_BACKOFF", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = WebDAVClient(self.url, USERNAME, PASSWORD, f"/media_{self._testMethodName}")
+        self.addCleanup(self.client.close)
+
+    def tearDown(self):
+        shutil.rmtree(self.local_dir, ignore_errors=True)
+
+    def local_file(self, name, data):
+        path = os.path.join(self.local_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def remote_bytes(self, remote_path):
+        with open(os.path.join(self.root, self.client.base_path, remote_path), 'rb') as f:
+            return f.read()
+
+    def test_connection_creates_base_path(self):
+        self.assertTrue(self.client.test_connection())
+        self.assertTrue(os.path.isdir(os.path.join(self.root, self.client.base_path)))
+        self.assertFalse(WebDAVClient(self.url, USERNAME, "wrong").test_connection())
+
+    def test_streamed_upload_of_large_file(self):
+        data = os.urandom(5 * webdav_client_module.WEBDAV_CHUNK_SIZE + 123)
+        self.assertTrue(self.client.upload_file(self.local_file("big.jpg", data), "blobs/ab/big file.jpg"))
+        self.assertEqual(self.remote_bytes("blobs/ab/big file.jpg"), data)
+
+    def test_known_directories_are_not_recreated(self):
+        for i in range(3):
+            self.assertTrue(self.client.upload_file(self.local_file(f"{i}.jpg", b"x"), f"blobs/cd/{i}.jpg"))
+        # base_path、blobs、blobs/cd 各一次
+        self.assertEqual(self.recorder.methods.count("MKCOL"), 3)
+        self.assertEqual(self.recorder.methods.count("PUT"), 3)
+
+    def test_transient_errors_are_retried(self):
+        self.recorder.fail_puts = 2
+        self.assertTrue(self.client.upload_file(self.local_file("retry.jpg", b"retry"), "retry.jpg"))
+        self.assertEqual(self.recorder.methods.count("PUT"), 3)
+        self.assertEqual(self.remote_bytes("retry.jpg"), b"retry")
+
+    def test_gives_up_after_max_retries(self):
+        self.recorder.fail_puts = webdav_client_module.WEBDAV_MAX_RETRIES + 1
+        self.assertFalse(self.client.upload_file(self.local_file("down.jpg", b"x"), "down.jpg"))
+
+    def test_delete_file(self):
+        self.assertTrue(self.client.upload_file(self.local_file("gone.jpg", b"x"), "blobs/gone.jpg"))
+        self.assertTrue(self.client.delete_file("blobs/gone.jpg"))
+        self.assertFalse(os.path.exists(os.path.join(self.root, self.client.base_path, "blobs/gone.jpg")))
+        # 已不存在的文件视为删除成功
+        self.assertTrue(self.client.delete_file("blobs/gone.jpg"))
+
+    def test_storage_manager_uploads_and_drops_local_copy(self):
+        storage = StorageManager(self.local_dir, self.client)
+        source = self.local_file("1_20240101.jpg", b"photo")
+        self.assertEqual(storage.save_file(source, "blobs/ef/photo.jpg"), (True, "blobs/ef/photo.jpg"))
+        self.assertEqual(self.remote_bytes("blobs/ef/photo.jpg"), b"photo")
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir, "blobs/ef/photo.jpg")))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)